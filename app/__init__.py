@@ -6,8 +6,8 @@ RAG Lite Application
 # 导入操作系统的相关模块
 import os
 
-# 从flask包导入Flask应用对象
-from flask import Flask
+# 从flask包导入Flask应用对象、请求对象和请求上下文全局对象
+from flask import Flask, g, request
 
 # 导入Flask跨域资源共享支持
 from flask_cors import CORS
@@ -23,8 +23,11 @@ from app.utils.logger import get_logger
 # 导入数据库初始化函数
 from app.utils.db import init_db
 
-# 导入蓝图模块
-from app.blueprints import auth, knowledgebase, settings, document, chat
+# 导入链路追踪工具
+from app.utils.tracing import begin_span, end_span
+
+# 导入采样分析器
+from app.utils.profiler import profiler, start_from_config
 
 
 # 定义创建 Flask 应用的工厂函数
@@ -45,6 +48,9 @@ def create_app(config_class=Config):
         # 输出警告日志，提示检查数据库是否已存在，并建议手动创建数据表
         logger.warning("请确认数据库已存在，或手动创建数据表")
         pass
+    # 导入蓝图模块（放在数据库初始化之后，各服务单例在导入时会读取设置表）
+    from app.blueprints import auth, knowledgebase, settings, document, chat, metrics, admin
+
     # 创建Flask 应用对象， 并指定模板和静态文件目录
     base_dir = os.path.abspath(os.path.dirname(__file__))
     print("app的__name__", __name__)
@@ -61,6 +67,36 @@ def create_app(config_class=Config):
     def inject_user():
         return dict(current_user=get_current_user())
 
+    # 每个请求开启一个根 span，trace_id 优先使用客户端传入的 X-Request-ID
+    @app.before_request
+    def start_request_trace():
+        g.trace_span = begin_span(
+            "http.request",
+            trace_id=request.headers.get("X-Request-ID") or None,
+            method=request.method,
+            path=request.path,
+            endpoint=request.endpoint,
+        )
+        # 采样分析器按路由规则筛选需要采样的请求
+        profiler.on_request_start(request.url_rule.rule if request.url_rule else None)
+
+    # 在响应头中返回 trace_id，便于根据用户反馈定位慢请求
+    @app.after_request
+    def add_request_id_header(response):
+        trace_span = g.get("trace_span")
+        if trace_span is not None:
+            response.headers["X-Request-ID"] = trace_span.trace_id
+            trace_span.set("status_code", response.status_code)
+        return response
+
+    # 请求结束时关闭根 span（流式响应在生成器结束后才会执行）
+    @app.teardown_request
+    def end_request_trace(error=None):
+        trace_span = g.pop("trace_span", None)
+        if trace_span is not None:
+            end_span(trace_span, error)
+        profiler.on_request_end()
+
     # 从给定配置类加载配置信息到应用
     app.config.from_object(config_class)
     # 启用跨域请求支持
@@ -77,5 +113,11 @@ def create_app(config_class=Config):
     app.register_blueprint(document.bp)
     # 注册聊天蓝图
     app.register_blueprint(chat.bp)
+    # 注册监控指标蓝图
+    app.register_blueprint(metrics.bp)
+    # 注册管理员蓝图
+    app.register_blueprint(admin.bp)
+    # 如果通过环境变量配置了采样分析器，则开始采样
+    start_from_config()
     # 返回已配置的 Flask 应用对象
     return app
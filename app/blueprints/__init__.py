@@ -2,6 +2,6 @@
 蓝图模块
 """
 
-from app.blueprints import auth, knowledgebase, settings, document, chat
+from app.blueprints import auth, knowledgebase, settings, document, chat, metrics, admin
 
-__all__ = ["auth", "knowledgebase", "settings", "document", "chat"]
+__all__ = ["auth", "knowledgebase", "settings", "document", "chat", "metrics", "admin"]
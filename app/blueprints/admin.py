@@ -0,0 +1,125 @@
+"""
+管理员运维路由
+提供采样分析器的开关与状态查询、LLM 提供商的健康状态，以及 Embedding 模型迁移的进度与控制
+"""
+
+from flask import Blueprint, request
+import logging
+
+# 导入标准化响应和错误处理装饰器
+from app.blueprints.utils import success_response, error_response, handle_api_error
+
+# 导入管理员认证装饰器
+from app.utils.auth import api_admin_required
+
+# 导入采样分析器
+from app.utils.profiler import profiler
+
+# 导入 LLM 提供商健康状态
+from app.utils.llm_failover import health_snapshot, provider_chain
+
+# 导入设置服务
+from app.services.settings_service import settings_service
+
+# 导入 Embedding 模型迁移服务
+from app.services.embedding_migration import embedding_migration_service
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint("admin", __name__)
+
+
+# 获取采样分析器状态
+@bp.route("/api/v1/admin/profiler", methods=["GET"])
+@api_admin_required
+@handle_api_error
+def api_profiler_status():
+    """获取采样分析器状态（仅当前 worker 进程）"""
+    return success_response(profiler.status())
+
+
+# 开启采样分析器
+@bp.route("/api/v1/admin/profiler", methods=["POST"])
+@api_admin_required
+@handle_api_error
+def api_profiler_start():
+    """
+    开启采样分析器
+    请求体示例:
+        {"duration": 30}
+        {"route": "/api/v1/documents/<doc_id>/process", "requests": 5, "interval_ms": 5}
+    """
+    data = request.get_json(silent=True) or {}
+    duration = data.get("duration")
+    requests = data.get("requests")
+    interval_ms = data.get("interval_ms")
+    status = profiler.start(
+        duration=float(duration) if duration is not None else None,
+        route=data.get("route") or None,
+        requests=int(requests) if requests is not None else None,
+        interval_ms=float(interval_ms) if interval_ms is not None else None,
+    )
+    return success_response(status, "Profiler started")
+
+
+# 停止采样分析器
+@bp.route("/api/v1/admin/profiler", methods=["DELETE"])
+@api_admin_required
+@handle_api_error
+def api_profiler_stop():
+    """停止采样分析器并返回输出文件路径"""
+    output = profiler.stop()
+    return success_response(output, "Profiler stopped")
+
+
+# 获取 LLM 提供商健康状态
+@bp.route("/api/v1/admin/llm/health", methods=["GET"])
+@api_admin_required
+@handle_api_error
+def api_llm_health():
+    """获取提供商链与各提供商的熔断状态（仅当前 worker 进程）"""
+    chain = [s["llm_provider"] for s in provider_chain(settings_service.get())]
+    return success_response({"chain": chain, "providers": health_snapshot()})
+
+
+# 获取 Embedding 模型迁移进度
+@bp.route("/api/v1/admin/embedding-migrations", methods=["GET"])
+@api_admin_required
+@handle_api_error
+def api_embedding_migrations():
+    """获取当前模型和各知识库的迁移进度，可按 kb_id 过滤"""
+    return success_response(
+        embedding_migration_service.list(kb_id=request.args.get("kb_id") or None)
+    )
+
+
+# 开始 Embedding 模型迁移
+@bp.route("/api/v1/admin/embedding-migrations", methods=["POST"])
+@api_admin_required
+@handle_api_error
+def api_embedding_migrations_start():
+    """
+    开始等待中的迁移（EMBEDDING_MIGRATION_AUTO_START 关闭时，或迁移取消后重新开始）
+    请求体示例:
+        {}
+        {"kb_ids": ["<知识库ID>"]}
+    """
+    data = request.get_json(silent=True) or {}
+    migrations = embedding_migration_service.start(data.get("kb_ids") or None)
+    return success_response(migrations, "Embedding migrations started")
+
+
+# 暂停、继续或取消 Embedding 模型迁移
+@bp.route("/api/v1/admin/embedding-migrations/<migration_id>/<action>", methods=["POST"])
+@api_admin_required
+@handle_api_error
+def api_embedding_migration_action(migration_id, action):
+    """action 为 pause、resume 或 cancel"""
+    handlers = {
+        "pause": embedding_migration_service.pause,
+        "resume": embedding_migration_service.resume,
+        "cancel": embedding_migration_service.cancel,
+    }
+    if action not in handlers:
+        return error_response(f"不支持的操作: {action}", 404)
+    return success_response(handlers[action](migration_id))
@@ -5,8 +5,8 @@
 from pickle import FALSE
 
 # 导入 Flask 的 Blueprint 和模板渲染函数
-from flask import Blueprint, render_template, request, stream_with_context, Response
-import json
+from flask import Blueprint, render_template, request
+from datetime import datetime
 
 from app.blueprints.utils import (
     handle_api_error,
@@ -26,6 +26,21 @@ from app.services.chat_service import chat_service
 # 导入聊天会话服务
 from app.services.chat_session_service import session_service
 
+# 导入 RAG 服务，用于知识库问答
+from app.services.rag_service import rag_service
+
+# 导入对话历史服务，用于读取历史与异步更新摘要
+from app.services.history_service import history_service
+
+# 导入元数据过滤条件，用于校验问答接口的 filter 参数
+from app.services.vectordb import filters
+
+# 导入 SSE 输出工具（合并内容块、心跳和可选压缩）
+from app.utils.sse import DONE, sse_response
+
+# 导入生成取消登记表
+from app.utils.cancellation import cancellations
+
 # 导入登录保护装饰器和获取当前用户辅助方法
 from app.utils.auth import login_required, get_current_user, api_login_required
 
@@ -39,6 +54,27 @@ logger = logging.getLogger(__name__)
 bp = Blueprint("chat", __name__)
 
 
+# 保存一轮问答
+def _record_turn(
+    session_id, question, answer, sources=None, asked_at=None, truncated=False
+):
+    """在流结束时保存问题和回复，并在有回复时异步更新滚动摘要（不向客户端抛出异常）"""
+    try:
+        session_service.record_turn(
+            session_id,
+            question,
+            answer or None,
+            sources,
+            asked_at=asked_at,
+            truncated=truncated,
+        )
+        if answer:
+            # 异步更新滚动摘要，不占用请求路径
+            history_service.schedule_summary(session_id)
+    except Exception as e:
+        logger.error(f"保存对话记录失败: 会话 {session_id}, 错误: {e}", exc_info=True)
+
+
 # 注册 /chat 路由，访问该路由需要先登录
 @bp.route("/chat")
 @login_required
@@ -82,17 +118,19 @@ def api_chat():
 
     # 从请求数据中获取'stream'字段，默认为True，表示启用流式输出
     stream = data.get("stream", True)
-    # 初始化历史消息为None
+    # 初始化历史消息和摘要为None
     history = None
+    summary = None
     # 如果请求中带有session_id 说明有现有会话
     if session_id:
-        # 根据session_id和当前用户ID获取历史消息列表
-        history_messages = session_service.get_message(session_id, current_user["id"])
-        # 将历史消息转换为对话格式，仅保留最近10条
+        # 读取会话摘要和最近的历史消息（数据库层面 LIMIT）
+        loaded = history_service.load(session_id, current_user["id"])
+        # 将历史消息转换为对话格式
         history = [
             {"role": msg.get("role"), "content": msg.get("content")}
-            for msg in history_messages[-10:]
+            for msg in loaded["messages"]
         ]
+        summary = loaded["summary"]
 
     # 如果请求中没有session_id，说明是新对话，需要新建会话
     if not session_id:
@@ -101,52 +139,58 @@ def api_chat():
         # 使用新创建会话的ID作为本次会话
         session_id = chat_session["id"]
 
-    # 将用户的问题消息保存到当前会话中
-    session_service.add_message(session_id, "user", question)
+    # 记录提问时间，问题与回答在流结束时一起写入
+    asked_at = datetime.now()
+    # 登记取消令牌：客户端断开或调用取消接口时停止生成
+    cancel_token = cancellations.register(session_id)
 
-    # 声明用于流式输出的生成器
-    @stream_with_context
+    # 声明用于流式输出的生成器，产生数据块，由 sse_response 编码为 SSE 帧
     def generate():
+        # 用于缓存完整答案内容
+        full_answer = ""
+        # 收到完整的 done 数据块之前都视为回答不完整
+        truncated = True
         try:
-            # 用于缓存完整答案内容
-            full_answer = ""
             # 调用服务进行流式对话
             for chunk in chat_service.chat_stream(
                 question=question,
                 temperature=None,
                 max_tokens=max_tokens,
                 history=history,
+                summary=summary,
+                cancel_token=cancel_token,
+                user_id=current_user["id"],
             ):
                 # 如果是内容块，则拼接内容到full_answer
                 if chunk.get("type") == "content":
                     full_answer += chunk.get("content", "")
-                # 以 SSE 协议格式输出数据
-                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                # done 数据块标记回答是否因取消而提前结束
+                elif chunk.get("type") == "done":
+                    truncated = bool(chunk["metadata"].get("truncated"))
+                # 输出数据块
+                yield chunk
             # 输出对话完成信号
-            yield "data: [DONE]\n\n"
-            # 保存助手回复
-            if full_answer:
-                session_service.add_message(session_id, "assistant", full_answer)
+            yield DONE
         except Exception as e:
             # 发生异常记录日志
             logger.error(f"流式输出时出错: {e}")
             # 构造错误数据块
             error_chunk = {"type": "error", "content": str(e)}
             # 输出错误数据块
-            yield f"data: {json.dumps(error_chunk, ensure_ascii=False)}\n\n"
-
-    # 创建 Response 对象，设置必要的 SSE 响应头部
-    response = Response(
-        generate(),
-        mimetype="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-            "Content-Type": "text/event-stream;charset=utf-8",
-        },
-    )
-    return response
+            yield error_chunk
+        finally:
+            cancellations.release(session_id, cancel_token)
+            # 流结束（包括出错和客户端断开）时在一个事务中保存问题和已生成的回复
+            _record_turn(
+                session_id,
+                question,
+                full_answer,
+                asked_at=asked_at,
+                truncated=truncated,
+            )
+
+    # 构造 SSE 响应（内容块合并、心跳和可选压缩），客户端断开时触发取消
+    return sse_response(generate(), cancel_token=cancel_token)
 
 
 # 路由装饰器，定义 GET 方法获取会话列表的接口
@@ -196,7 +240,13 @@ def api_create_session():
 @api_login_required
 @handle_api_error
 def api_get_session(session_id):
-    """获取会话详情和消息"""
+    """
+    获取会话详情和消息
+    查询参数:
+        limit: 每页消息数量（默认 100，最大 500）
+        before: 上一页返回的 next_cursor，用于加载更早的消息
+        hydrate: 是否回填引用的分块内容（默认 true，为 false 时只返回分块引用）
+    """
     current_user, err = get_current_user_or_error()
     if err:
         return err
@@ -206,10 +256,25 @@ def api_get_session(session_id):
     if not session_obj:
         return error_response("Session not found", 404)
 
-    # 获取该会话下的所有消息
-    message = session_service.get_message(session_id, current_user["id"])
+    # 获取分页参数，每页最多 500 条
+    limit = max(1, min(int(request.args.get("limit", 100)), 500))
+    before = request.args.get("before") or None
+    # 按游标分页获取该会话下的消息（从最新消息往前）
+    page = session_service.list_messages(
+        session_id, current_user["id"], limit=limit, before=before
+    )
+    # 消息中的引用只保存了分块ID，按需批量从向量库回填分块内容
+    if request.args.get("hydrate", "true").lower() != "false":
+        rag_service.hydrate_sources(page["items"])
     # 返回会话详情及消息列表
-    return success_response({"session": session_obj, "messages": message})
+    return success_response(
+        {
+            "session": session_obj,
+            "messages": page["items"],
+            "next_cursor": page["next_cursor"],
+            "has_more": page["has_more"],
+        }
+    )
 
 
 # 路由装饰器，定义 DELETE 方法删除单个会话接口
@@ -231,6 +296,23 @@ def api_delete_session(session_id):
         return error_response("Session not found", 404)
 
 
+# 路由装饰器，定义 POST 方法停止会话上正在进行的生成
+@bp.route("/api/v1/sessions/<session_id>/cancel", methods=["POST"])
+@api_login_required
+@handle_api_error
+def api_cancel_session(session_id):
+    """停止会话上正在进行的回答生成（前端的停止按钮），已生成的部分会标记为不完整后保存"""
+    current_user, err = get_current_user_or_error()
+    if err:
+        return err
+    # 校验会话归属当前用户
+    if not session_service.get_session_by_id(session_id, current_user["id"]):
+        return error_response("Session not found", 404)
+    # 取消本进程中的生成；多 worker 时通过 CANCEL_SIGNAL_DIR 通知其他 worker
+    cancelled = cancellations.cancel(session_id, reason="user")
+    return success_response({"cancelled": cancelled})
+
+
 # 路由装饰器，定义 DELETE 方法清空所有会话的接口
 @bp.route("/api/v1/sessions", methods=["DELETE"])
 @api_login_required
@@ -271,12 +353,25 @@ def api_ask(kb_id):
     # 获取并去除问题字符串首尾空白
     question = data["question"].strip()
 
+    # 元数据过滤条件（可选），在开始流式输出前校验，不合法时返回 400
+    search_filter = filters.normalize(data.get("filter"))
+
     # 从请求数据获取session_id,如果没有则为None
     session_id = data.get("session_id")
     # 获取最大token数，默认为1000
     max_tokens = int(data.get("max_tokens", 1000))
     # 限制max_tokens在1到10000之间
     max_tokens = max(1, min(max_tokens, 10000))
+    # 已有会话时读取摘要和最近的历史消息
+    history = None
+    summary = None
+    if session_id:
+        loaded = history_service.load(session_id, current_user["id"])
+        history = [
+            {"role": msg.get("role"), "content": msg.get("content")}
+            for msg in loaded["messages"]
+        ]
+        summary = loaded["summary"]
     # 如果没有提供session_id，则为用户和知识库创建一个新会话
     if not session_id:
         chat_session = session_service.create_session(
@@ -284,48 +379,60 @@ def api_ask(kb_id):
         )
         # 获取新会话的会话ID
         session_id = chat_session["id"]
-    # 保存用户输入的问题到消息列表
-    session_service.add_message(session_id, "user", question)
+    # 记录提问时间，问题与回答在流结束时一起写入
+    asked_at = datetime.now()
+    # 登记取消令牌：客户端断开或调用取消接口时停止检索和生成
+    cancel_token = cancellations.register(session_id)
 
-    # 内部函数：生成流式响应内容
-    @stream_with_context
+    # 内部函数：生成流式响应的数据块
     def generate():
+        # 初始化完整回复内容
+        full_answer = ""
+        # 初始化引用信息
+        sources = None
+        # 收到完整的 done 数据块之前都视为回答不完整
+        truncated = True
         try:
-            # 初始化完整回复内容
-            full_answer = ""
-            # 初始化引用信息
-            source = None
-            # 迭代 chat_service.ask_stream的每个数据块
-            for chunk in chat_service.ask_stream(kb_id=kb_id, question=question):
+            # 迭代 rag_service.ask_stream的每个数据块
+            for chunk in rag_service.ask_stream(
+                kb_id=kb_id,
+                question=question,
+                history=history,
+                summary=summary,
+                cancel_token=cancel_token,
+                user_id=current_user["id"],
+                filter=search_filter,
+                max_tokens=max_tokens,
+            ):
                 # 如果块类型为内容，则将内容追加到full_answer
                 if chunk.get("type") == "content":
                     full_answer += chunk.get("content", "")
-                # 如果块类型为done，则获取sources
+                # 如果块类型为done，则获取sources和是否提前结束
                 elif chunk.get("type") == "done":
                     sources = chunk.get("sources")
-                # 以SSE格式输出该块内容
-                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    truncated = bool(chunk["metadata"].get("truncated"))
+                # 输出该数据块
+                yield chunk
             # 所有内容输出后发送结束标志
-            yield "data: [DONE]\n\n"
-            # 如果有回复内容，则保存机器人助手的回复和引用
-            session_service.add_message(session_id, "assistant", full_answer)
+            yield DONE
         except Exception as e:
             # 如果流式输出出错，在日志中记录错误信息
             logger.error(f"流式输出时出错：{e}")
             # 构造错误信息块
             error_chunk = {"type": "error", "content": str(e)}
-            # 以SSE格式输出错误信息
-            yield f"data: {json.dumps(error_chunk, ensure_ascii=False)}\n\n"
-
-    # 构造SSE（服务端事件）响应对象，携带合适的头部信息
-    response = Response(
-        generate(),
-        mimetype="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-            "Content-Type": "text/event-stream;charset=utf-8",
-        },
-    )
-    return response
+            # 输出错误信息
+            yield error_chunk
+        finally:
+            cancellations.release(session_id, cancel_token)
+            # 流结束时在一个事务中保存问题、回复和引用（引用只保存分块ID，不重复保存分块文本）
+            _record_turn(
+                session_id,
+                question,
+                full_answer,
+                rag_service.compact_sources(sources, kb_id),
+                asked_at=asked_at,
+                truncated=truncated,
+            )
+
+    # 构造SSE（服务端事件）响应对象，客户端断开时触发取消
+    return sse_response(generate(), cancel_token=cancel_token)
@@ -93,8 +93,10 @@ def api_upload(kb_id):
     # 校验最终文件名是否包含扩展名
     if "." not in filename:
         return error_response("Filename must have an extension", 400)
+    # 文档标签（可选，逗号分隔），用于问答时按标签过滤
+    tags = request.form.get("tags", "").split(",")
     # 调用文档服务上传，返回文档信息字典
-    doc_dict = document_service.upload(kb_id, file_data, filename)
+    doc_dict = document_service.upload(kb_id, file_data, filename, tags=tags)
     # 返回成功响应及新文档信息
     return success_response(doc_dict)
 
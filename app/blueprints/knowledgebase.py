@@ -13,6 +13,7 @@ from flask import (
     flash,
     abort,
     send_file,
+    Response,
 )
 
 from io import BytesIO
@@ -26,6 +27,9 @@ import mimetypes
 # 导入os模块用于路径操作
 import os
 
+# 导入临时文件模块，用于暂存导出的归档
+import tempfile
+
 # 导入认证工具函数：登录认证装饰器、获取当前用户、API登录认证装饰器
 from app.utils.auth import login_required, api_login_required, get_current_user
 
@@ -48,6 +52,9 @@ from app.services.storage_service import storage_service
 # 导入文档服务
 from app.services.document_service import document_service
 
+# 导入知识库归档服务
+from app.services.kb_archive_service import kb_archive_service
+
 # 配置logger
 logger = logging.getLogger(__name__)
 # 创建Blueprint实例，注册在Flask应用下
@@ -83,6 +90,10 @@ def api_create():
         chunk_size = int(request.form.get("chunk_size", 512))
         # 获取分块重叠，默认为50
         chunk_overlap = int(request.form.get("chunk_overlap", 50))
+        # 获取向量压缩模式，默认不压缩
+        vector_compression = request.form.get("vector_compression") or None
+        # 获取向量分片模式，默认不分片
+        vector_sharding = request.form.get("vector_sharding") or None
         # 设置封面图片数据变量初值为None
         cover_image_data = None
         # 设置封面图片文件名变量初值为None
@@ -118,6 +129,10 @@ def api_create():
         chunk_size = data.get("chunk_size", 512)
         # 获取分块重叠，默认为50
         chunk_overlap = data.get("chunk_overlap", 50)
+        # 获取向量压缩模式，默认不压缩
+        vector_compression = data.get("vector_compression")
+        # 获取向量分片模式，默认不分片
+        vector_sharding = data.get("vector_sharding")
         # 设置封面图片数据变量初值为None
         cover_image_data = None
         # 设置封面图片文件名变量初值为None
@@ -131,6 +146,8 @@ def api_create():
         chunk_overlap=chunk_overlap,  # 分块重叠
         cover_image_data=cover_image_data,  # 封面图片数据
         cover_image_filename=cover_image_filename,  # 封面图片文件名
+        vector_compression=vector_compression,  # 向量压缩模式
+        vector_sharding=vector_sharding,  # 向量分片模式
     )
 
     return success_response(kb_dict)
@@ -205,6 +222,70 @@ def api_delete(kb_id):
     return success_response("知识库删除成功")
 
 
+# 导出知识库（知识库和文档记录、原始文件、分块与向量）
+@bp.route("/api/v1/kb/<kb_id>/export", methods=["GET"])
+@api_login_required
+@handle_api_error
+def api_export(kb_id):
+    """导出知识库归档，dtype=float16 时向量体积减半"""
+    current_user, err = get_current_user_or_error()
+    if err:
+        return err
+    kb_dict = kb_service.get_by_id(kb_id)
+    if not kb_dict:
+        return error_response("未找到知识库", 404)
+    # 验证用户是否有权限访问该知识库
+    has_permission, err = check_ownership(
+        kb_dict["user_id"], current_user["id"], "knowledgebase"
+    )
+    if not has_permission:
+        return err
+    # 归档可能很大，先写入临时文件，发送时分块读取，发送完毕后删除
+    archive = tempfile.NamedTemporaryFile(prefix="kb_export_", suffix=".tar", delete=False)
+    try:
+        with archive:
+            kb_archive_service.export(
+                kb_id, archive, dtype=request.args.get("dtype", "float32")
+            )
+    except Exception:
+        os.remove(archive.name)
+        raise
+
+    def generate():
+        try:
+            with open(archive.name, "rb") as f:
+                while True:
+                    chunk = f.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    yield chunk
+        finally:
+            os.remove(archive.name)
+
+    response = Response(generate(), mimetype="application/x-tar")
+    response.headers["Content-Length"] = str(os.path.getsize(archive.name))
+    response.headers.set("Content-Disposition", "attachment", filename=f"{kb_dict['name']}.tar")
+    return response
+
+
+# 导入知识库归档（multipart 上传 file 字段，可选 name 指定新名称）
+@bp.route("/api/v1/kb/import", methods=["POST"])
+@api_login_required
+@handle_api_error
+def api_import():
+    """导入知识库归档，向量直接写入向量库，不重新计算 Embedding"""
+    current_user, err = get_current_user_or_error()
+    if err:
+        return err
+    archive = request.files.get("file")
+    if not archive or not archive.filename:
+        return error_response("file is required", 400)
+    kb_dict = kb_archive_service.import_archive(
+        archive.stream, current_user["id"], name=request.form.get("name") or None
+    )
+    return success_response(kb_dict)
+
+
 # 更新知识库
 # 注册PUT方法的API路由，用于更新知识库
 @bp.route("/api/v1/kb/<kb_id>", methods=["PUT"])
@@ -267,6 +348,9 @@ def api_update(kb_id):
             update_data["chunk_size"] = chunk_size
         if chunk_overlap:
             update_data["chunk_overlap"] = chunk_overlap
+        # 表单中出现该字段即更新，空值表示关闭压缩
+        if "vector_compression" in request.form:
+            update_data["vector_compression"] = request.form.get("vector_compression")
     else:
         # 如果不是form-data，则按JSON方式解析提交内容
         data = request.get_json()
@@ -281,6 +365,8 @@ def api_update(kb_id):
             update_data["chunk_size"] = data["chunk_size"]
         if "chunk_overlap" in data:
             update_data["chunk_overlap"] = data["chunk_overlap"]
+        if "vector_compression" in data:
+            update_data["vector_compression"] = data["vector_compression"]
         # JSON请求时，cover_image相关变量置空
         cover_image_data = None
         cover_image_filename = None
@@ -0,0 +1,18 @@
+"""
+监控指标路由
+以 Prometheus 文本格式输出应用指标
+"""
+
+from flask import Blueprint, Response
+
+# 导入指标输出工具
+from app.utils.metrics import render_metrics
+
+bp = Blueprint("metrics", __name__)
+
+
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus 指标抓取接口"""
+    data, content_type = render_metrics()
+    return Response(data, content_type=content_type)
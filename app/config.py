@@ -66,6 +66,8 @@ class Config:
     DB_NAME = os.environ.get("DB_NAME", "rag-lite")
     # 数据库字符集，默认为 'utf8mb4'
     DB_CHARSET = os.environ.get("DB_CHARSET", "utf8mb4")
+    # 完整数据库连接串（可选），设置后优先于上面的 MySQL 配置，例如 sqlite:///./rag_lite.db
+    DATABASE_URL = os.environ.get("DATABASE_URL", "")
 
     # 存储配置
     STORAGE_TYPE = os.environ.get("STORAGE_TYPE", "local")  # 'local' 或 'minio'
@@ -85,6 +87,237 @@ class Config:
     MILVUS_HOST=  os.environ.get("MILVUS_HOST","49.235.139.52")
     MILVUS_PORT= os.environ.get("MILVUS_PORT",19530)
     MILVUS_DB_NAME = os.environ.get("MILVUS_DB_NAME", "default")
+    # Chroma 按条件删除时每批读取并删除的 ID 数量（只读取 ID，不读取文本和元数据）
+    CHROMA_DELETE_BATCH_SIZE = int(os.environ.get("CHROMA_DELETE_BATCH_SIZE", 5000))
+    # 删除文档时是否把向量删除交给后台任务（待删除的文档在检索中立即不可见）
+    CHROMA_DEFER_DELETE = os.environ.get("CHROMA_DEFER_DELETE", "true").lower() == "true"
+    # 后台删除任务的执行间隔（秒）
+    CHROMA_DELETE_INTERVAL = float(os.environ.get("CHROMA_DELETE_INTERVAL", 2))
+    # 本地向量数据库（VECTORDB_TYPE=local）配置
+    # 数据目录
+    LOCAL_VECTORDB_DIR = os.environ.get("LOCAL_VECTORDB_DIR", "./local_vectordb")
+    # 向量存储类型：float32 或 float16（占用减半，相似度计算时转换为 float32）
+    LOCAL_VECTORDB_DTYPE = os.environ.get("LOCAL_VECTORDB_DTYPE", "float32")
+    # 活跃段写满多少行后封存
+    LOCAL_VECTORDB_SEGMENT_ROWS = int(os.environ.get("LOCAL_VECTORDB_SEGMENT_ROWS", 50000))
+    # 有效向量达到该数量后构建 HNSW 索引（需要安装 hnswlib），过滤后少于该数量时直接精确检索
+    LOCAL_VECTORDB_HNSW_THRESHOLD = int(os.environ.get("LOCAL_VECTORDB_HNSW_THRESHOLD", 20000))
+    # HNSW 图的参数
+    LOCAL_VECTORDB_HNSW_M = int(os.environ.get("LOCAL_VECTORDB_HNSW_M", 16))
+    LOCAL_VECTORDB_HNSW_EF_CONSTRUCTION = int(os.environ.get("LOCAL_VECTORDB_HNSW_EF_CONSTRUCTION", 200))
+    LOCAL_VECTORDB_HNSW_EF_SEARCH = int(os.environ.get("LOCAL_VECTORDB_HNSW_EF_SEARCH", 64))
+    # 段中已删除行的比例达到该值时重写该段（HNSW 索引同理重建）
+    LOCAL_VECTORDB_COMPACT_RATIO = float(os.environ.get("LOCAL_VECTORDB_COMPACT_RATIO", 0.3))
+    # 后台整理的间隔（秒），期间的多次写入合并为一次整理
+    LOCAL_VECTORDB_COMPACT_INTERVAL = float(os.environ.get("LOCAL_VECTORDB_COMPACT_INTERVAL", 5))
+    # 向量压缩索引目录（按知识库保存压缩编码和全精度向量）
+    VECTOR_COMPRESSION_DIR = os.environ.get("VECTOR_COMPRESSION_DIR", "./vector_compression")
+    # 压缩检索的候选倍数：先按压缩分数取 k×倍数 个候选，再用全精度向量重排
+    VECTOR_COMPRESSION_RESCORE_FACTOR = int(os.environ.get("VECTOR_COMPRESSION_RESCORE_FACTOR", 4))
+    # 训练 PCA / 量化参数所需的最少向量数，不足时直接用全精度向量精确检索
+    VECTOR_COMPRESSION_MIN_TRAIN = int(os.environ.get("VECTOR_COMPRESSION_MIN_TRAIN", 256))
+    # 分片知识库的布局缓存时间（秒），重平衡修改布局后等待该时间让各进程读到新布局
+    VECTOR_SHARD_LAYOUT_TTL = float(os.environ.get("VECTOR_SHARD_LAYOUT_TTL", 10))
+    # 并行查询分片的线程数
+    VECTOR_SHARD_WORKERS = int(os.environ.get("VECTOR_SHARD_WORKERS", 8))
+    # 重平衡搬迁分块时每批写入的数量
+    VECTOR_SHARD_COPY_BATCH = int(os.environ.get("VECTOR_SHARD_COPY_BATCH", 1000))
+    # 知识库归档中每批分块的数量（每批一个向量矩阵和一个文本文件）
+    KB_ARCHIVE_PART_ROWS = int(os.environ.get("KB_ARCHIVE_PART_ROWS", 20000))
+    # 导入知识库归档时每次写入向量库的分块数量
+    KB_ARCHIVE_WRITE_BATCH = int(os.environ.get("KB_ARCHIVE_WRITE_BATCH", 2000))
+    # Embedding 模型迁移的工作目录（保存后台迁移任务的进程锁）
+    EMBEDDING_MIGRATION_DIR = os.environ.get("EMBEDDING_MIGRATION_DIR", "./embedding_migration")
+    # 修改 Embedding 模型后是否自动开始迁移已有知识库，关闭时由管理员通过接口开始
+    EMBEDDING_MIGRATION_AUTO_START = (
+        os.environ.get("EMBEDDING_MIGRATION_AUTO_START", "true").lower() == "true"
+    )
+    # 迁移时每批重新向量化的分块数量
+    EMBEDDING_MIGRATION_BATCH = int(os.environ.get("EMBEDDING_MIGRATION_BATCH", 64))
+    # 迁移的限速（每秒最多重新向量化的分块数），0 表示不限速
+    EMBEDDING_MIGRATION_RATE = float(os.environ.get("EMBEDDING_MIGRATION_RATE", 50))
+    # 其他进程持有迁移任务锁时，检查是否还有未完成迁移的间隔（秒）
+    EMBEDDING_MIGRATION_POLL_INTERVAL = float(os.environ.get("EMBEDDING_MIGRATION_POLL_INTERVAL", 30))
     DEEPSEEK_CHAT_MODEL = os.environ.get("DEEPSEEK_CHAT_MODEL", "deepseek-chat")
     DEEPSEEK_API_KEY = os.environ.get("DEEPSEEK_API_KEY") or os.getenv("OPENAI_API_KEY_DEEP")
-    DEEPSEEK_BASE_URL = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
\ No newline at end of file
+    DEEPSEEK_BASE_URL = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+    # 监控指标配置
+    # Prometheus 多进程指标目录（gunicorn 多 worker 部署时设置，需在启动前清空）
+    PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+
+    # 链路追踪配置
+    # 是否启用链路追踪，默认 True
+    TRACE_ENABLED = os.environ.get("TRACE_ENABLED", "true").lower() == "true"
+    # 是否将 span 写入 LOG_DIR 下的 JSONL 文件，默认 True
+    TRACE_ENABLE_FILE = os.environ.get("TRACE_ENABLE_FILE", "true").lower() == "true"
+    # span 文件名，默认 'traces.jsonl'
+    TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+    # 是否同时上报到 OpenTelemetry（需安装 opentelemetry-api/sdk 并配置导出器），默认 False
+    TRACE_OTEL_ENABLED = os.environ.get("TRACE_OTEL_ENABLED", "false").lower() == "true"
+
+    # 管理员配置
+    # 管理员用户名列表（逗号分隔），可访问 /api/v1/admin 下的运维接口
+    ADMIN_USERNAMES = {
+        name.strip()
+        for name in os.environ.get("ADMIN_USERNAMES", "").split(",")
+        if name.strip()
+    }
+
+    # 采样分析器配置
+    # 采样间隔（毫秒），默认 10
+    PROFILER_INTERVAL_MS = float(os.environ.get("PROFILER_INTERVAL_MS", 10))
+    # 启动时开启采样：只采样匹配该路由规则的请求，如 /api/v1/knowledgebases/<kb_id>/chat
+    PROFILER_ROUTE = os.environ.get("PROFILER_ROUTE", "")
+    # 启动时开启采样：匹配路由的请求数量，达到后停止，默认 1
+    PROFILER_REQUESTS = int(os.environ.get("PROFILER_REQUESTS", 1))
+    # 启动时开启采样：采样时间窗口（秒），0 表示不限制（仅在指定路由时有效）
+    PROFILER_DURATION = float(os.environ.get("PROFILER_DURATION", 0))
+
+    # 对话历史配置
+    # 每次问答最多读取的最近消息数量，更早的消息由滚动摘要覆盖，默认 20
+    HISTORY_MAX_MESSAGES = int(os.environ.get("HISTORY_MAX_MESSAGES", 20))
+    # 放入提示词的历史消息 token 预算（估算值），默认 1500
+    HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", 1500))
+    # 有消息滑出历史窗口时触发摘要，每次至少摘要的消息数量（保留最后一轮问答），默认 6
+    HISTORY_SUMMARY_BATCH = int(os.environ.get("HISTORY_SUMMARY_BATCH", 6))
+    # 摘要最大生成 token 数，默认 400
+    HISTORY_SUMMARY_MAX_TOKENS = int(os.environ.get("HISTORY_SUMMARY_MAX_TOKENS", 400))
+
+    # 查询改写配置（多轮对话中把追问改写为独立的检索问题）
+    # 是否启用查询改写，默认 False
+    QUERY_REWRITE_ENABLED = os.environ.get("QUERY_REWRITE_ENABLED", "false").lower() == "true"
+    # 改写使用的 LLM 提供商，为空时与回答使用的提供商相同
+    QUERY_REWRITE_PROVIDER = os.environ.get("QUERY_REWRITE_PROVIDER", "")
+    # 改写使用的模型名称（建议使用小模型），为空时与回答使用的模型相同
+    QUERY_REWRITE_MODEL = os.environ.get("QUERY_REWRITE_MODEL", "")
+    # 改写模型的 Base URL 和 API Key，为空时沿用回答模型的配置
+    QUERY_REWRITE_BASE_URL = os.environ.get("QUERY_REWRITE_BASE_URL", "")
+    QUERY_REWRITE_API_KEY = os.environ.get("QUERY_REWRITE_API_KEY", "")
+    # 改写的延迟预算（毫秒），超时则使用原问题检索，默认 800
+    QUERY_REWRITE_TIMEOUT_MS = int(os.environ.get("QUERY_REWRITE_TIMEOUT_MS", 800))
+    # 同时进行的改写调用上限，已满时新的请求不排队、直接使用原问题，默认 4
+    QUERY_REWRITE_MAX_IN_FLIGHT = int(os.environ.get("QUERY_REWRITE_MAX_IN_FLIGHT", 4))
+    # 改写参考的最近消息数量，默认 6
+    QUERY_REWRITE_HISTORY_MESSAGES = int(os.environ.get("QUERY_REWRITE_HISTORY_MESSAGES", 6))
+    # 改写结果缓存条数，默认 1024
+    QUERY_REWRITE_CACHE_SIZE = int(os.environ.get("QUERY_REWRITE_CACHE_SIZE", 1024))
+
+    # 聊天记录写入配置
+    # 是否启用写缓冲：问答结束后的消息先进入内存队列，由后台线程按间隔批量写入，默认 False
+    CHAT_WRITE_BEHIND_ENABLED = (
+        os.environ.get("CHAT_WRITE_BEHIND_ENABLED", "false").lower() == "true"
+    )
+    # 写缓冲的刷新间隔（毫秒），默认 50
+    CHAT_WRITE_BEHIND_INTERVAL_MS = int(os.environ.get("CHAT_WRITE_BEHIND_INTERVAL_MS", 50))
+    # 单次批量写入的最大对话轮数，默认 200
+    CHAT_WRITE_BEHIND_MAX_BATCH = int(os.environ.get("CHAT_WRITE_BEHIND_MAX_BATCH", 200))
+
+    # 引用来源配置
+    # 引用片段长度（字符），保存引用时只记录片段在分块中的起止位置，默认 200
+    SOURCE_SNIPPET_CHARS = int(os.environ.get("SOURCE_SNIPPET_CHARS", 200))
+
+    # SSE 流式输出配置
+    # 内容块合并窗口（毫秒），窗口内的内容块合并为一帧输出，0 表示逐块输出，默认 20
+    SSE_COALESCE_MS = float(os.environ.get("SSE_COALESCE_MS", 20))
+    # 合并内容达到该字节数时立即输出，默认 1024
+    SSE_COALESCE_BYTES = int(os.environ.get("SSE_COALESCE_BYTES", 1024))
+    # 没有数据时发送心跳注释帧的间隔（秒），0 表示不发送，默认 10
+    SSE_HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", 10))
+    # 是否对直连（未经过代理）且接受 gzip 的客户端压缩 SSE 响应，默认 False
+    SSE_GZIP_ENABLED = os.environ.get("SSE_GZIP_ENABLED", "false").lower() == "true"
+
+    # 生成取消配置
+    # 多 worker 部署时各 worker 共享的取消标记目录，为空时取消只在处理该请求的 worker 内生效
+    CANCEL_SIGNAL_DIR = os.environ.get("CANCEL_SIGNAL_DIR", "")
+
+    # LLM 限流配置（按提供商，限额按进程计算，多 worker 部署时请按 worker 数均分服务商配额）
+    # 每个提供商的最大并发流式调用数，默认 8
+    LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 8))
+    # 每个提供商每分钟的 token 配额（提示词 + 输出的估算值），0 表示不限制，默认 0
+    LLM_TOKENS_PER_MINUTE = int(os.environ.get("LLM_TOKENS_PER_MINUTE", 0))
+    # 单独设置某些提供商的限额，格式 "deepseek=16:200000,openai=8:90000"（并发:每分钟 token）
+    LLM_LIMITS = {
+        name.strip().lower(): tuple(int(v) for v in limit.split(":", 1))
+        for name, limit in (
+            item.split("=", 1)
+            for item in os.environ.get("LLM_LIMITS", "").split(",")
+            if "=" in item and ":" in item
+        )
+    }
+    # 排队等待的最长时间（秒），超时返回服务繁忙，默认 30
+    LLM_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("LLM_QUEUE_TIMEOUT_SECONDS", 30))
+    # 收到 429 限流响应时的最大重试次数（只在输出第一个内容块之前重试），默认 3
+    LLM_RATE_LIMIT_RETRIES = int(os.environ.get("LLM_RATE_LIMIT_RETRIES", 3))
+    # 429 重试的初始退避时间（秒），响应带 Retry-After 时以其为准，默认 1
+    LLM_RATE_LIMIT_BACKOFF_SECONDS = float(os.environ.get("LLM_RATE_LIMIT_BACKOFF_SECONDS", 1))
+
+    # LLM 故障转移配置
+    # 主提供商（系统设置中的 llm_provider）之后依次尝试的备用提供商，逗号分隔，如 "openai,ollama"
+    LLM_FALLBACK_PROVIDERS = [
+        name.strip().lower()
+        for name in os.environ.get("LLM_FALLBACK_PROVIDERS", "").split(",")
+        if name.strip()
+    ]
+    # 各备用提供商的模型、API Key 和 Base URL：LLM_FALLBACK_<提供商>_MODEL / _API_KEY / _BASE_URL
+    LLM_FALLBACK_SETTINGS = {
+        name: {
+            "llm_model_name": os.environ.get(f"LLM_FALLBACK_{name.upper()}_MODEL", ""),
+            "llm_api_key": os.environ.get(f"LLM_FALLBACK_{name.upper()}_API_KEY", ""),
+            "llm_base_url": os.environ.get(f"LLM_FALLBACK_{name.upper()}_BASE_URL", ""),
+        }
+        for name in LLM_FALLBACK_PROVIDERS
+    }
+    # 连续失败多少次后熔断该提供商，默认 3
+    LLM_CIRCUIT_FAILURES = int(os.environ.get("LLM_CIRCUIT_FAILURES", 3))
+    # 熔断持续时间（秒），到期后放行一个探测请求，默认 30
+    LLM_CIRCUIT_OPEN_SECONDS = float(os.environ.get("LLM_CIRCUIT_OPEN_SECONDS", 30))
+    # 是否启用对冲请求：首字超时后同时向下一个提供商发起请求，先出字的胜出，默认 False
+    LLM_HEDGE_ENABLED = os.environ.get("LLM_HEDGE_ENABLED", "false").lower() == "true"
+    # 对冲请求的首字等待时间（毫秒），默认 2500
+    LLM_HEDGE_TTFT_MS = int(os.environ.get("LLM_HEDGE_TTFT_MS", 2500))
+
+    # 远程 Embedding 执行配置（embedding_provider 为 openai / ollama 时生效）
+    # 初始批大小（每次请求的文本数），默认 64
+    EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 64))
+    # 自适应调整时的批大小下限与上限，默认 8 / 512
+    EMBEDDING_MIN_BATCH_SIZE = int(os.environ.get("EMBEDDING_MIN_BATCH_SIZE", 8))
+    EMBEDDING_MAX_BATCH_SIZE = int(os.environ.get("EMBEDDING_MAX_BATCH_SIZE", 512))
+    # 同时进行的请求数，默认 4
+    EMBEDDING_MAX_IN_FLIGHT = int(os.environ.get("EMBEDDING_MAX_IN_FLIGHT", 4))
+    # 单批请求的目标耗时（毫秒），快于一半时增大批大小，慢于目标时减小，0 表示不自适应，默认 2000
+    EMBEDDING_TARGET_BATCH_MS = float(os.environ.get("EMBEDDING_TARGET_BATCH_MS", 2000))
+    # 遇到 429 / 5xx / 连接错误时的最大重试次数，默认 4
+    EMBEDDING_RETRIES = int(os.environ.get("EMBEDDING_RETRIES", 4))
+    # 重试的初始退避时间（秒），按指数增长，响应带 Retry-After 时以其为准，默认 0.5
+    EMBEDDING_BACKOFF_SECONDS = float(os.environ.get("EMBEDDING_BACKOFF_SECONDS", 0.5))
+
+    # ONNX Embedding 配置（embedding_provider 为 onnx 时生效）
+    # 导出模型的根目录，模型位于 <根目录>/<模型名称>，默认 models/onnx
+    EMBEDDING_ONNX_MODEL_DIR = os.environ.get("EMBEDDING_ONNX_MODEL_DIR", "models/onnx")
+    # 是否优先使用 int8 量化模型（model_quantized.onnx），默认 True
+    EMBEDDING_ONNX_QUANTIZED = os.environ.get("EMBEDDING_ONNX_QUANTIZED", "true").lower() == "true"
+    # 推理线程数，0 表示由 ONNX Runtime 决定，默认 0
+    EMBEDDING_ONNX_THREADS = int(os.environ.get("EMBEDDING_ONNX_THREADS", 0))
+    # 每批文本数，默认 32
+    EMBEDDING_ONNX_BATCH_SIZE = int(os.environ.get("EMBEDDING_ONNX_BATCH_SIZE", 32))
+    # 模型目录中没有 sentence-transformers 配置时使用的池化方式（mean / cls）与最大长度
+    EMBEDDING_ONNX_POOLING = os.environ.get("EMBEDDING_ONNX_POOLING", "mean").lower()
+    EMBEDDING_ONNX_MAX_LENGTH = int(os.environ.get("EMBEDDING_ONNX_MAX_LENGTH", 256))
+    # 是否在创建时与同名 PyTorch 模型比较向量一致性，低于阈值时改用 PyTorch 模型，默认 False
+    EMBEDDING_ONNX_PARITY_CHECK = (
+        os.environ.get("EMBEDDING_ONNX_PARITY_CHECK", "false").lower() == "true"
+    )
+    # 一致性检查要求的最小余弦相似度，默认 0.99
+    EMBEDDING_ONNX_PARITY_MIN_COSINE = float(
+        os.environ.get("EMBEDDING_ONNX_PARITY_MIN_COSINE", 0.99)
+    )
+
+    # 查询向量微批处理配置（本地 HuggingFace / ONNX 模型生效）
+    # 是否合并并发的查询向量化请求，默认 True
+    EMBEDDING_QUERY_BATCHING_ENABLED = (
+        os.environ.get("EMBEDDING_QUERY_BATCHING_ENABLED", "true").lower() == "true"
+    )
+    # 单批最多查询数，默认 32
+    EMBEDDING_QUERY_MAX_BATCH = int(os.environ.get("EMBEDDING_QUERY_MAX_BATCH", 32))
+    # 第一条查询入队后等待更多查询的最长时间（毫秒），默认 3
+    EMBEDDING_QUERY_MAX_WAIT_MS = float(os.environ.get("EMBEDDING_QUERY_MAX_WAIT_MS", 3))
@@ -7,6 +7,20 @@ from app.models.base import Base, BaseModel
 from app.models.knowledgebase import Knowledgebase
 from app.models.user import User
 from app.models.settings import Settings
+from app.models.document import Document
+from app.models.chat_session import ChatSession
+from app.models.chat_message import ChatMessage
+from app.models.embedding_migration import EmbeddingMigration
 
 # 定义当前模块对外可用的成员列表
-__all__ = ["Base", "BaseModel", "Knowledgebase", "User", "Settings"]
+__all__ = [
+    "Base",
+    "BaseModel",
+    "Knowledgebase",
+    "User",
+    "Settings",
+    "Document",
+    "ChatSession",
+    "ChatMessage",
+    "EmbeddingMigration",
+]
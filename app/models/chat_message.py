@@ -1,7 +1,9 @@
-from sqlalchemy import Column, String, DateTime, Boolean, ForeignKey, JSON, Text
+from sqlalchemy import Column, String, DateTime, Boolean, ForeignKey, JSON, Text, Index
+from sqlalchemy.dialects.mysql import DATETIME as MYSQL_DATETIME
 from sqlalchemy.sql import func
 from sqlalchemy.orm import Mapped, mapped_column
 import uuid
+from datetime import datetime
 from app.models.base import BaseModel
 
 
@@ -10,6 +12,10 @@ class ChatMessage(BaseModel):
     __tablename__ = "chat_message"
     # 指定__repr__显示的字段
     __repr_fields__ = ["id", "session_id", "role"]
+    # 复合索引：按会话取最近 N 条消息和游标分页都只扫描索引的一段
+    __table_args__ = (
+        Index("ix_chat_message_session_created", "session_id", "created_at", "id"),
+    )
     id = Column(String(32), primary_key=True, default=lambda: uuid.uuid4().hex[:32])
     # 此消息是属于哪个会话
     session_id = Column(
@@ -24,7 +30,13 @@ class ChatMessage(BaseModel):
     content = Column(Text, nullable=True)
     # 定义引的来源,JSON类型 当使用知识回答的时候,会把引用的知识库的文本片段放在sources里
     sources = Column(JSON, nullable=True)
-    # 创建时间 默认为当前时间 创建索引
-    created_at = Column(DateTime, default=func.now(), index=True)
+    # 回答是否不完整（生成过程中客户端断开或用户停止）
+    truncated = Column(Boolean, nullable=True, default=False)
+    # 创建时间 默认为当前时间 创建索引（MySQL 下保留微秒，保证同一秒内的消息顺序）
+    created_at = Column(
+        DateTime().with_variant(MYSQL_DATETIME(fsp=6), "mysql"),
+        default=datetime.now,
+        index=True,
+    )
     # 更新时间 默认为当前时间，在数据更新的自动更新为当前最新的时间
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
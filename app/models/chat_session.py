@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, String, DateTime, Boolean, ForeignKey, Text, Integer
 from sqlalchemy.sql import func
 from sqlalchemy.orm import Mapped, mapped_column
 import uuid
@@ -27,6 +27,12 @@ class ChatSession(BaseModel):
     )
     # 会话的标题
     title = Column(String(128), nullable=True)
+    # 较早对话的滚动摘要，每次回答后异步更新
+    summary = Column(Text, nullable=True)
+    # 已被合并进摘要的最早消息数量（消息只追加，按时间顺序计数）
+    summarized_count = Column(Integer, nullable=True, default=0)
+    # 会话的消息总数，写入消息时在同一事务中累加；为空表示旧会话尚未统计
+    message_count = Column(Integer, nullable=True, default=0)
     # 创建时间 默认为当前时间 创建索引
     created_at = Column(DateTime, default=func.now(), index=True)
     # 更新时间 默认为当前时间，在数据更新的自动更新为当前最新的时间
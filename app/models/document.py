@@ -31,6 +31,8 @@ class Document(BaseModel):
     chunk_count = Column(Integer, nullable=True)
     # 处理错误消息
     error_message = Column(Text, nullable=True)
+    # 文档标签，逗号分隔，处理时写入分块元数据用于过滤检索
+    tags = Column(String(512), nullable=True)
     # 创建时间 默认为当前时间 创建索引
     created_at = Column(DateTime, default=func.now(), index=True)
     # 更新时间 默认为当前时间，在数据更新的自动更新为当前最新的时间
@@ -0,0 +1,89 @@
+"""
+Embedding 模型迁移模型
+"""
+
+# 导入 JSON 模块，用于解析模型配置
+import json
+
+# 导入SQLAlchemy的字段类型和相关功能
+from sqlalchemy import Column, String, Text, Integer, DateTime, ForeignKey
+
+# 导入SQLAlchemy的SQL函数
+from sqlalchemy.sql import func
+
+# 导入uuid模块用于生成唯一ID
+import uuid
+
+# 导入基础模型类
+from app.models.base import BaseModel
+
+
+# 定义 Embedding 模型迁移记录，每个知识库每次切换模型一条
+class EmbeddingMigration(BaseModel):
+    # 指定模型对应的表名称
+    __tablename__ = "embedding_migration"
+    # 指定 __repr__ 方法显示的字段
+    __repr_fields__ = ["id", "kb_id", "status"]
+    # 主键id字段
+    id = Column(String(32), primary_key=True, default=lambda: uuid.uuid4().hex[:32])
+    # 知识库的主键，删除知识库时级联删除
+    kb_id = Column(
+        String(32),
+        ForeignKey("knowledgebase.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    # 原模型标识，例如 "huggingface:sentence-transformers/all-MiniLM-L6-v2"
+    source_model = Column(String(255), nullable=False)
+    # 目标模型标识
+    target_model = Column(String(255), nullable=False)
+    # 原模型配置（JSON：提供商、模型名称、API Key、Base URL），切换设置后仍可用原模型向量化查询
+    source_spec = Column(Text, nullable=True)
+    # 目标模型配置（JSON）
+    target_spec = Column(Text, nullable=True)
+    # 状态：pending 等待执行、running 执行中、paused 已暂停、cancelling 取消中、
+    # cancelled 已取消、failed 失败、completed 已完成
+    status = Column(String(32), nullable=False, default="pending", index=True)
+    # 当前阶段：prepare 准备影子集合、copy 复制、catchup 追平、cutover 切换、cleanup 清理旧集合
+    phase = Column(String(32), nullable=True)
+    # 需要复制的文档数
+    total_docs = Column(Integer, nullable=False, default=0)
+    # 已复制的文档数
+    done_docs = Column(Integer, nullable=False, default=0)
+    # 已重新向量化的分块数
+    done_chunks = Column(Integer, nullable=False, default=0)
+    # 断点：最后一个已复制的文档ID（按文档ID顺序复制）
+    checkpoint = Column(String(32), nullable=True)
+    # 追平水位（数据库时间）：影子集合开始接收双写的时间，追平阶段重新复制此后更新过的文档并推进水位
+    synced_at = Column(DateTime, nullable=True)
+    # 切换前的分片集合（JSON 列表），清理阶段删除
+    old_collections = Column(Text, nullable=True)
+    # 失败原因
+    error_message = Column(Text, nullable=True)
+    # 开始执行时间
+    started_at = Column(DateTime, nullable=True)
+    # 结束时间
+    finished_at = Column(DateTime, nullable=True)
+    # 创建时间
+    created_at = Column(DateTime, default=func.now(), index=True)
+    # 更新时间
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    # 转换为字典，不返回包含 API Key 的模型配置
+    def to_dict(self, **kwargs):
+        """
+        转换为字典
+        模型配置中可能包含 API Key，不返回；附带进度百分比
+        Returns:
+            字典格式的数据
+        """
+        result = super().to_dict(**kwargs)
+        result.pop("source_spec", None)
+        result.pop("target_spec", None)
+        result["old_collections"] = json.loads(self.old_collections) if self.old_collections else []
+        result["progress"] = (
+            round(self.done_docs * 100.0 / self.total_docs, 1)
+            if self.total_docs
+            else (100.0 if self.status == "completed" else 0.0)
+        )
+        return result
@@ -2,6 +2,9 @@
 知识库模型
 """
 
+# 导入 JSON 模块，用于解析分片布局
+import json
+
 # 导入SQLAlchemy的字段类型和相关功能
 from sqlalchemy import Column, String, Text, Integer, DateTime, ForeignKey
 
@@ -44,7 +47,30 @@ class Knowledgebase(BaseModel):
     chunk_size = Column(Integer, nullable=False, default=512)
     # 分块重叠大小字段，类型为整数，不能为空，默认值微50
     chunk_overlap = Column(Integer, nullable=False, default=50)
+    # 向量压缩模式字段，例如 "pca:128+int8"、"mrl:256+binary"，为空表示不压缩
+    vector_compression = Column(String(64), nullable=True, comment="向量压缩模式")
+    # 向量分片布局字段（JSON），为空表示不分片，格式见 app.services.vectordb.sharded
+    vector_sharding = Column(Text, nullable=True, comment="向量分片布局")
     # 创建时间字段，类型为DateTime，默认为当前时间，并建立索引
     created_at = Column(DateTime, default=func.now(), index=True)
     # 更新时间字段，类型为DateTime，默认为当前时间，更新时自动变为当前时间
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    # 转换为字典，分片布局只返回 "策略:分片数" 形式的摘要
+    def to_dict(self, **kwargs):
+        """
+        转换为字典
+        分片布局可能包含大量文档的分片记录，只返回 "hash:8" 形式的摘要（只有一个分片时为 None）
+        Returns:
+            字典格式的数据
+        """
+        result = super().to_dict(**kwargs)
+        layout = json.loads(self.vector_sharding) if self.vector_sharding else None
+        result["vector_sharding"] = (
+            f"{layout['strategy']}:{len(layout['shards'])}"
+            if layout and len(layout["shards"]) > 1
+            else None
+        )
+        # 向量所属的 Embedding 模型，未记录时为当前设置的模型
+        result["embedding_model"] = (layout or {}).get("embedding_model")
+        return result
@@ -15,9 +15,27 @@ from app.utils.llm_factory import LLMFactory
 # 导入 LangChain 的对话模板
 from langchain_core.prompts import ChatPromptTemplate
 
+# 导入 LangChain 消息类型
+from langchain_core.messages import HumanMessage, SystemMessage
+
 # 导入设置服务，用于获取当前系统设置
 from app.services.settings_service import settings_service
 
+# 导入 LLM 流式输出计量器
+from app.utils.metrics import StreamMeter
+
+# 导入链路追踪工具
+from app.utils.tracing import current_trace_id, span
+
+# 导入历史消息构造工具与 token 估算工具
+from app.utils.history import build_history_messages, estimate_tokens
+
+# 导入取消令牌
+from app.utils.cancellation import CancelToken, GenerationCancelled
+
+# 导入 LLM 故障转移工具（内部经过限流）
+from app.utils.llm_failover import FailoverStream
+
 
 # 初始化日志记录器
 logger = logging.getLogger(__name__)
@@ -36,6 +54,9 @@ class ChatService:
         temperature: Optional[float] = None,
         max_tokens: int = 1000,
         history: Optional[list] = None,
+        summary: Optional[str] = None,
+        cancel_token: Optional[CancelToken] = None,
+        user_id: Optional[str] = None,
     ) -> Iterator[dict]:
         """
         流式普通聊天接口（不使用知识库）
@@ -43,7 +64,10 @@ class ChatService:
             question: 问题
             temperature: LLM 温度参数（如果为 None，则从设置中读取）
             max_tokens: 最大生成 token 数
-            history: 历史对话记录（可选）
+            history: 历史对话记录（可选），按 token 预算从最近的消息开始放入提示词
+            summary: 更早对话的摘要（可选）
+            cancel_token: 取消令牌（可选），取消后停止生成，done 数据块的 metadata.truncated 为 True
+            user_id: 用户ID（可选），用于 LLM 限流的公平排队
 
         Returns:
             流式数据块
@@ -58,45 +82,89 @@ class ChatService:
         # 如果系统提示词不存在，则使用默认的提示词
         if not chat_prompt_text:
             chat_prompt_text = "你是一个专业的AI助手。请友好、准确地回答用户的问题。"
-        # 创建支持流式输出的 LLM 实例
-        llm = LLMFactory.create_llm(
-            self.settings,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            streaming=True,
-        )
-        # 构造单轮对话消息格式，包含 system 提示和用户问题
-        messages = [("system", chat_prompt_text), ("human", question)]
+        # 构造对话消息：system 提示、摘要与历史窗口、用户问题
+        # 使用消息对象而不是 (角色, 文本) 元组，避免内容中的花括号被当作模板变量
+        messages = [
+            SystemMessage(content=chat_prompt_text),
+            *build_history_messages(history, summary),
+            HumanMessage(content=question),
+        ]
         # 从消息创建对话提示模板
         prompt = ChatPromptTemplate.from_messages(messages)
-        # 组装 prompt 和 llm，形成链式调用
-        chain = prompt | llm
+
+        # 按提供商设置创建 LLM 并发起流式调用（故障转移时会用备用提供商的设置调用）
+        def make_stream(provider_settings: dict):
+            llm = LLMFactory.create_llm(
+                provider_settings,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                streaming=True,
+            )
+            return (prompt | llm).stream({})
 
         # 发送流式开头信号
         yield {"type": "start", "content": ""}
         # 初始化完整答案内容
         full_answer = ""
-        try:
-            # 遍历模型生成的每一段内容
-            for chunk in chain.stream({}):
-                # 如果chunk有内容，提取内容并累加到full_answer
-                if hasattr(chunk, "content") and chunk.content:
-                    content = chunk.content
-                    full_answer += content
-                    # 输出内容块
-                    yield {"type": "content", "content": content}
-        # 捕获生成过程中的异常，记录日志并产出错误类型的数据块
-        except Exception as e:
-            logger.error(f"流式生成时出错: {e}")
-            yield {"type": "error", "content": f"生成答案时出错: {str(e)}"}
-            return
+        # 记录首字延迟与生成速度
+        meter = StreamMeter(self.settings.get("llm_provider"), "chat")
+        # 是否因取消而提前结束
+        truncated = False
+        with span("llm.stream", endpoint="chat") as llm_span:
+            # 在提供商的并发与配额限制内调用，主提供商不可用时切换到备用提供商
+            stream = FailoverStream(
+                self.settings,
+                make_stream,
+                user_id=user_id,
+                prompt_tokens=sum(estimate_tokens(str(m.content)) for m in messages),
+                max_tokens=max_tokens,
+                cancel_token=cancel_token,
+            )
+            try:
+                # 遍历模型生成的每一段内容
+                for chunk in stream:
+                    # 已取消（客户端断开或用户停止）时不再读取后续内容
+                    if cancel_token is not None and cancel_token.cancelled:
+                        truncated = True
+                        break
+                    # 如果chunk有内容，提取内容并累加到full_answer
+                    if hasattr(chunk, "content") and chunk.content:
+                        meter.on_token(stream.provider)
+                        content = chunk.content
+                        full_answer += content
+                        # 输出内容块
+                        yield {"type": "content", "content": content}
+            # 排队或退避期间被取消
+            except GenerationCancelled:
+                truncated = True
+            # 捕获生成过程中的异常，记录日志并产出错误类型的数据块
+            except Exception as e:
+                logger.error(f"流式生成时出错: {e}")
+                meter.finish(error=True)
+                llm_span.set("error", str(e)[:200])
+                yield {"type": "error", "content": f"生成答案时出错: {str(e)}"}
+                return
+            finally:
+                # 关闭上游流，提前结束时立即断开与 LLM 的连接
+                stream.close()
+            meter.finish()
+            llm_span.set("ttft_ms", meter.ttft_ms).set("chunks", meter.tokens)
+            llm_span.set("truncated", truncated).set("provider", stream.provider)
 
         # 发送流式结束信号，附带元数据（此处无知识库相关内容）
         yield {
             "type": "done",
             "content": "",
             "sources": [],
-            "metadata": {"question": question, "retrieved_chunks": 0, "used_chunks": 0},
+            "metadata": {
+                "question": question,
+                "retrieved_chunks": 0,
+                "used_chunks": 0,
+                "truncated": truncated,
+                "cancel_reason": cancel_token.reason if truncated else None,
+                "provider": stream.provider,
+                "trace_id": current_trace_id(),
+            },
         }
 
 
@@ -1,9 +1,22 @@
-# 导入倒序排序工具
-from langchain_classic.chains.question_answering.map_reduce_prompt import messages
-from sqlalchemy import desc
+# 导入 base64 和 json，用于编码分页游标
+import base64
+import json
+
+# 导入退出钩子和线程模块，用于写缓冲
+import atexit
+import threading
+
+# 导入日志模块
+import logging
+
+# 导入倒序排序工具、逻辑组合工具、条件表达式和批量插入
+from sqlalchemy import and_, case, desc, insert, or_
 
 # 导入日期时间
-from datetime import datetime
+from datetime import datetime, timedelta
+
+# 导入类型注解
+from typing import Callable, List, Optional
 
 # 导入聊天会话ORM模型
 from app.models.chat_session import ChatSession
@@ -14,12 +27,149 @@ from app.models.chat_message import ChatMessage
 # 导入基础服务类
 from app.services.base_service import BaseService
 
+# 导入配置
+from app.config import Config
+
+# 导入写缓冲批量大小指标
+from app.utils.metrics import CHAT_WRITE_BATCH_TURNS
+
+# 导入链路追踪装饰器
+from app.utils.tracing import traced
+
+# 获取当前模块的日志记录器
+logger = logging.getLogger(__name__)
+
+# 新会话的默认标题
+DEFAULT_TITLE = "新对话"
+
+
+# 根据用户的提问生成会话标题
+def _title_from(question: str) -> str:
+    """会话标题截取前30字符，超长加省略号"""
+    return question[:30] + ("..." if len(question) > 30 else "")
+
+
+# 消息写缓冲
+class MessageWriteBuffer:
+    """
+    跨请求合并对话记录的写缓冲
+    record_turn 把一轮问答放入内存队列后立即返回，后台线程每隔 interval_ms 把队列中
+    所有请求的消息在一个事务里批量写入；读取某个会话的消息前会先同步刷新该会话的待写记录
+    注意：进程异常退出时队列中尚未写入的记录会丢失
+    """
+
+    def __init__(self, writer: Callable[[list], None], interval_ms: int, max_batch: int):
+        """
+        Args:
+            writer: 批量写入函数，参数为对话轮列表
+            interval_ms: 刷新间隔（毫秒）
+            max_batch: 单次写入的最大对话轮数，队列达到该数量时立即刷新
+        """
+        self._writer = writer
+        self._interval = max(1, interval_ms) / 1000
+        self._max_batch = max(1, max_batch)
+        # 待写入的对话轮
+        self._turns: list = []
+        # 每个会话待写入（含正在写入）的对话轮数
+        self._pending: dict = {}
+        # 保护队列的锁，以及保证同一时间只有一个批次在写入的锁
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # 放入一轮问答
+    def put(self, turn: dict):
+        """将一轮问答放入队列"""
+        with self._lock:
+            self._turns.append(turn)
+            self._pending[turn["session_id"]] = self._pending.get(turn["session_id"], 0) + 1
+            if len(self._turns) >= self._max_batch:
+                self._wakeup.set()
+            # 后台线程在第一次写入时启动（gunicorn 在导入后 fork，导入时启动的线程不会被继承）
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="chat-write-behind", daemon=True
+                )
+                self._thread.start()
+
+    # 会话是否有待写入的记录
+    def has_pending(self, session_id: str) -> bool:
+        """判断指定会话是否还有未写入数据库的记录"""
+        with self._lock:
+            return self._pending.get(session_id, 0) > 0
+
+    # 立即写入队列中的所有记录
+    def flush(self) -> int:
+        """
+        同步写入当前队列中的所有记录
+        Returns:
+            写入的对话轮数
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = self._turns[: self._max_batch]
+                self._turns = self._turns[self._max_batch :]
+                if self._turns:
+                    self._wakeup.set()
+            if not batch:
+                return 0
+            try:
+                self._write(batch)
+            finally:
+                with self._lock:
+                    for turn in batch:
+                        count = self._pending.get(turn["session_id"], 0) - 1
+                        if count > 0:
+                            self._pending[turn["session_id"]] = count
+                        else:
+                            self._pending.pop(turn["session_id"], None)
+            return len(batch)
+
+    # 写入一个批次，失败时逐轮重试，避免一条坏记录拖累整个批次
+    def _write(self, batch: list):
+        CHAT_WRITE_BATCH_TURNS.observe(len(batch))
+        try:
+            self._writer(batch)
+            return
+        except Exception as e:
+            logger.error(f"批量写入对话记录失败，改为逐条写入: {e}", exc_info=True)
+        for turn in batch:
+            try:
+                self._writer([turn])
+            except Exception as e:
+                logger.error(f"写入对话记录失败，已丢弃: 会话 {turn['session_id']}, 错误: {e}")
+
+    # 后台线程主循环
+    def _run(self):
+        while True:
+            self._wakeup.wait(self._interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"写缓冲刷新失败: {e}", exc_info=True)
+
 
 # 聊天会话服务类，继承自基础服务
 class ChatSessionService(BaseService[ChatSession]):
     """聊天会话服务"""
 
+    def __init__(self):
+        """初始化服务，按配置创建写缓冲"""
+        super().__init__()
+        self.write_buffer: Optional[MessageWriteBuffer] = None
+        if Config.CHAT_WRITE_BEHIND_ENABLED:
+            self.write_buffer = MessageWriteBuffer(
+                self._write_turns,
+                Config.CHAT_WRITE_BEHIND_INTERVAL_MS,
+                Config.CHAT_WRITE_BEHIND_MAX_BATCH,
+            )
+            # 进程正常退出前写入剩余记录
+            atexit.register(self.flush_pending)
+
     # 创建新的聊天会话
+    @traced("session.create_session")
     def create_session(
         self, user_id: str, kb_id: str = None, title: str = None
     ) -> dict:
@@ -40,7 +190,7 @@ class ChatSessionService(BaseService[ChatSession]):
             if not title:
                 title = "新对话"
             # 构造会话对象
-            chat_session = ChatSession(user_id=user_id, title=title)
+            chat_session = ChatSession(user_id=user_id, kb_id=kb_id, title=title)
             # 新会话入库
             session.add(chat_session)
             # 刷新以拿到自增ID
@@ -53,6 +203,7 @@ class ChatSessionService(BaseService[ChatSession]):
             return chat_session.to_dict()
 
     # 根据ID获取会话
+    @traced("session.get_session_by_id")
     def get_session_by_id(self, session_id: str, user_id: str = None) -> dict:
         """
         根据ID获取会话
@@ -63,6 +214,8 @@ class ChatSessionService(BaseService[ChatSession]):
         Returns:
             会话信息字典，如果不存在或无权访问则返回 None
         """
+        # 该会话在写缓冲中还有记录时先写入，保证读到最新的标题和更新时间
+        self.flush_pending(session_id)
         # 打开数据库只读session
         with self.session() as session:
             # 查询指定ID的会话
@@ -78,6 +231,7 @@ class ChatSessionService(BaseService[ChatSession]):
             return None
 
     # 获取用户的所有会话列表（分页）
+    @traced("session.list_sessions")
     def list_sessions(self, user_id: str, page: int = 1, page_size: int = 1000) -> dict:
         """
         获取用户的会话列表
@@ -142,6 +296,8 @@ class ChatSessionService(BaseService[ChatSession]):
         Returns:
             是否删除成功
         """
+        # 先写入该会话缓冲中的记录，避免删除后再插入孤立消息
+        self.flush_pending(session_id)
         # 开启数据事务
         with self.transaction() as session:
             # 查询该用户的指定会话
@@ -171,6 +327,8 @@ class ChatSessionService(BaseService[ChatSession]):
         Returns:
             删除的会话数量
         """
+        # 先写入缓冲中的记录
+        self.flush_pending()
         # 开启数据库事务
         with self.transaction() as session:
             # 批量删除本用户所有会话
@@ -181,6 +339,7 @@ class ChatSessionService(BaseService[ChatSession]):
             return count
 
     # 添加消息到会话
+    @traced("session.add_message")
     def add_message(self, session_id: str, role: str, content: str) -> dict:
         """
         添加消息到会话
@@ -198,19 +357,10 @@ class ChatSessionService(BaseService[ChatSession]):
             message = ChatMessage(session_id=session_id, role=role, content=content)
             # 添加消息到数据库
             session.add(message)
-            # 查询会话对象，用于更新时间/自动生成标题
-            chat_session = session.query(ChatSession).filter_by(id=session_id).first()
-            # 如果存在会话对象
-            if chat_session:
-                # 更新会话更新时间
-                chat_session.updated_at = datetime.now()
-                # 如果使用户发的第一条消息，并且还没有标题，则用内容自动命名
-                if role == "user" and (
-                    not chat_session.title or chat_session.title == "新对话"
-                ):
-                    # 会话标题截取前30字符，超长加省略号
-                    title = content[:30] + ("..." if len(content) > 30 else "")
-                    chat_session.title = title
+            # 更新会话时间和消息数，用户的第一条消息同时作为标题（单条 UPDATE，不先查询会话）
+            self._touch_session(
+                session, session_id, question=content if role == "user" else None, added=1
+            )
 
             # 刷新确保message有ID
             session.flush()
@@ -218,10 +368,151 @@ class ChatSessionService(BaseService[ChatSession]):
             session.refresh(message)
             return message.to_dict()
 
+    # 更新会话的更新时间和默认标题
+    @staticmethod
+    def _touch_session(
+        session,
+        session_id: str,
+        question: str = None,
+        updated_at: datetime = None,
+        added: int = 0,
+    ):
+        """
+        用一条 UPDATE 语句更新会话的更新时间和消息数；提供 question 且会话仍是默认标题时，用问题生成标题
+        Args:
+            session: 数据库会话
+            session_id: 会话ID
+            question: 本轮用户的问题（可选）
+            updated_at: 更新时间，默认当前时间
+            added: 本次写入的消息条数
+        """
+        values = {ChatSession.updated_at: updated_at or datetime.now()}
+        # 旧会话的消息数为空时保持为空，由读取方统计一次后写回
+        if added:
+            values[ChatSession.message_count] = ChatSession.message_count + added
+        if question:
+            values[ChatSession.title] = case(
+                (
+                    or_(
+                        ChatSession.title.is_(None),
+                        ChatSession.title == "",
+                        ChatSession.title == DEFAULT_TITLE,
+                    ),
+                    _title_from(question),
+                ),
+                else_=ChatSession.title,
+            )
+        session.query(ChatSession).filter(ChatSession.id == session_id).update(
+            values, synchronize_session=False
+        )
+
+    # 记录一轮问答
+    @traced("session.record_turn")
+    def record_turn(
+        self,
+        session_id: str,
+        question: str,
+        answer: str = None,
+        sources: list = None,
+        asked_at: datetime = None,
+        truncated: bool = False,
+    ):
+        """
+        在一个事务中写入用户问题、助手回答（含引用）并更新会话，用于流式回答结束时
+        启用写缓冲（CHAT_WRITE_BEHIND_ENABLED）时放入队列，由后台线程与其他请求的记录批量写入
+        Args:
+            session_id: 会话ID
+            question: 用户问题
+            answer: 助手回答，为空时只记录问题（如生成失败或客户端断开）
+            sources: 回答引用的来源（可选）
+            asked_at: 提问时间，默认当前时间；回答时间总是晚于提问时间，保证消息顺序
+            truncated: 回答是否因取消或客户端断开而不完整
+        """
+        asked_at = asked_at or datetime.now()
+        rows = [
+            {
+                "session_id": session_id,
+                "role": "user",
+                "content": question,
+                "sources": None,
+                "truncated": False,
+                "created_at": asked_at,
+            }
+        ]
+        if answer:
+            rows.append(
+                {
+                    "session_id": session_id,
+                    "role": "assistant",
+                    "content": answer,
+                    "sources": sources,
+                    "truncated": bool(truncated),
+                    "created_at": max(datetime.now(), asked_at + timedelta(microseconds=1)),
+                }
+            )
+        turn = {"session_id": session_id, "question": question, "rows": rows}
+        if self.write_buffer is not None:
+            self.write_buffer.put(turn)
+        else:
+            self._write_turns([turn])
+
+    # 批量写入对话轮
+    def _write_turns(self, turns: List[dict]):
+        """在一个事务中批量插入多轮问答的消息，并对每个会话执行一次更新"""
+        rows = [row for turn in turns for row in turn["rows"]]
+        # 每个会话只更新一次：更新时间取最后一条消息，标题取第一个问题，消息数累加
+        touched = {}
+        for turn in turns:
+            first_question, _, added = touched.get(turn["session_id"], (turn["question"], None, 0))
+            touched[turn["session_id"]] = (
+                first_question,
+                turn["rows"][-1]["created_at"],
+                added + len(turn["rows"]),
+            )
+        with self.transaction() as session:
+            # 一条多行 INSERT 写入所有消息
+            session.execute(insert(ChatMessage), rows)
+            for session_id, (question, updated_at, added) in touched.items():
+                self._touch_session(
+                    session, session_id, question=question, updated_at=updated_at, added=added
+                )
+
+    # 写入缓冲中的记录
+    def flush_pending(self, session_id: str = None):
+        """
+        同步写入写缓冲中的记录（未启用写缓冲时不做处理）
+        Args:
+            session_id: 只在该会话有待写记录时才刷新，为空时总是刷新
+        """
+        buffer = self.write_buffer
+        if buffer is None:
+            return
+        if session_id is not None:
+            # 读到自己刚写入的记录：该会话还有未写入的记录时先刷新
+            while buffer.has_pending(session_id):
+                if not buffer.flush():
+                    break
+        else:
+            while buffer.flush():
+                pass
+
+    # 构造会话消息查询，指定 user_id 时通过关联会话表校验归属（一次查询完成）
+    @staticmethod
+    def _message_query(session, session_id: str, user_id: str = None):
+        """构造指定会话的消息查询"""
+        query = session.query(ChatMessage).filter(ChatMessage.session_id == session_id)
+        if user_id:
+            query = query.join(ChatSession, ChatSession.id == ChatMessage.session_id).filter(
+                ChatSession.user_id == user_id
+            )
+        return query
+
     # 获取会话的全部消息
+    @traced("session.get_message")
     def get_message(self, session_id: str, user_id: str = None) -> list:
         """
         获取会话的所有消息
+        会话较长时请使用 get_recent_messages 或 list_messages
         Args:
             session_id:会话ID
             user_id:用户ID（可选，用于验证权限）
@@ -229,28 +520,116 @@ class ChatSessionService(BaseService[ChatSession]):
         Returns:
             消息列表
         """
+        self.flush_pending(session_id)
         # 打开只读session
         with self.session() as session:
-            # 如指定user_id，须先验证此会话是否属于该用户，不属则不给查
-            if user_id:
-                chat_session = (
-                    session.query(ChatSession)
-                    .filter_by(id=session_id, user_id=user_id)
-                    .first()
-                )
-                # 如果会话不存在则返回空列表
-                if not chat_session:
-                    return []
-            # 查询该会话下所有消息，按创建时间升序排序
+            # 查询该会话下所有消息，按创建时间升序排序（不属于该用户时结果为空）
             messages = (
-                session.query(ChatMessage)
-                .filter_by(session_id=session_id)
-                .order_by(ChatMessage.created_at)
+                self._message_query(session, session_id, user_id)
+                .order_by(ChatMessage.created_at, ChatMessage.id)
                 .all()
             )
             # 返回所有消息的字典列表
             return [m.to_dict() for m in messages]
 
+    # 获取会话最近的 N 条消息
+    @traced("session.get_recent_messages")
+    def get_recent_messages(
+        self, session_id: str, user_id: str = None, limit: int = 10
+    ) -> list:
+        """
+        获取会话最近的 limit 条消息（ORDER BY created_at DESC LIMIT N，命中复合索引）
+        Args:
+            session_id:会话ID
+            user_id:用户ID（可选，用于验证权限）
+            limit:消息数量
+
+        Returns:
+            按时间升序排列的消息列表
+        """
+        self.flush_pending(session_id)
+        with self.session() as session:
+            messages = (
+                self._message_query(session, session_id, user_id)
+                .order_by(desc(ChatMessage.created_at), desc(ChatMessage.id))
+                .limit(limit)
+                .all()
+            )
+            # 倒序取出后翻转为时间升序
+            return [m.to_dict() for m in reversed(messages)]
+
+    # 游标分页获取会话消息
+    @traced("session.list_messages")
+    def list_messages(
+        self,
+        session_id: str,
+        user_id: str = None,
+        limit: int = 50,
+        before: str = None,
+    ) -> dict:
+        """
+        按游标（keyset）从新到旧分页获取会话消息，每页查询代价与会话长度无关
+        Args:
+            session_id:会话ID
+            user_id:用户ID（可选，用于验证权限）
+            limit:每页消息数量
+            before:上一页返回的 next_cursor，为空时从最新消息开始
+
+        Returns:
+            {"items": 按时间升序的消息列表, "next_cursor": 更早一页的游标, "has_more": 是否还有更早的消息}
+        """
+        self.flush_pending(session_id)
+        with self.session() as session:
+            query = self._message_query(session, session_id, user_id)
+            # 只取游标位置之前的消息：(created_at, id) < (游标时间, 游标ID)
+            if before:
+                cursor_time, cursor_id = _decode_cursor(before)
+                query = query.filter(
+                    or_(
+                        ChatMessage.created_at < cursor_time,
+                        and_(
+                            ChatMessage.created_at == cursor_time,
+                            ChatMessage.id < cursor_id,
+                        ),
+                    )
+                )
+            # 多取一条用于判断是否还有更早的消息
+            messages = (
+                query.order_by(desc(ChatMessage.created_at), desc(ChatMessage.id))
+                .limit(limit + 1)
+                .all()
+            )
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+            next_cursor = (
+                _encode_cursor(messages[-1].created_at, messages[-1].id)
+                if has_more
+                else None
+            )
+            return {
+                "items": [m.to_dict() for m in reversed(messages)],
+                "next_cursor": next_cursor,
+                "has_more": has_more,
+            }
+
+
+# 编码分页游标
+def _encode_cursor(created_at: datetime, message_id: str) -> str:
+    """将 (created_at, id) 编码为 URL 安全的游标字符串"""
+    payload = json.dumps([created_at.isoformat(), message_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+# 解码分页游标
+def _decode_cursor(cursor: str):
+    """将游标字符串解码为 (created_at, id)，格式错误时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, message_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), str(message_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
 
 # 单例: 聊天会话服务对象
 session_service = ChatSessionService()
@@ -10,6 +10,9 @@ from typing import List, Optional, Dict
 # 导入线程池，用于异步处理文档
 from concurrent.futures import ThreadPoolExecutor
 
+# 导入上下文复制工具，用于把当前请求的 trace 带入线程池
+import contextvars
+
 # 导入BaseService基类
 from app.services.base_service import BaseService
 
@@ -31,12 +34,47 @@ from app.config import Config
 # 导入文本分割器
 from app.utils.text_splitter import TextSplitter
 
-# 导入LangChain文档对象
-from langchain_core.documents import Document
-
 # 导入向量数据库服务
 from app.services.vector_service import vector_service
 
+# 导入向量压缩服务
+from app.services.vector_compression import vector_compression_service
+
+# 导入阶段计时工具
+from app.utils.timing import stage_timer
+
+# 导入入库指标
+from app.utils.metrics import INGESTION_DOCUMENTS, INGESTION_STAGE_SECONDS
+
+# 导入链路追踪工具
+from app.utils.tracing import current_span, traced
+
+# 导入采样分析器的包装函数，后台处理线程随请求一起采样
+from app.utils.profiler import profiled
+
+
+# 规范化文档标签
+def _join_tags(tags: Optional[List[str]]) -> Optional[str]:
+    """
+    去掉空白和重复的标签，拼接为逗号分隔的字符串保存
+    Args:
+        tags: 标签列表（单个标签中的逗号视为分隔符）
+
+    Returns:
+        逗号分隔的标签，没有标签时返回 None
+    """
+    cleaned = []
+    for tag in tags or []:
+        for part in str(tag).split(","):
+            part = part.strip()
+            if part and part not in cleaned:
+                cleaned.append(part)
+    joined = ",".join(cleaned)
+    if len(joined) > 512:
+        raise ValueError("文档标签总长度不能超过 512 个字符")
+    return joined or None
+
+
 # 定义DocumentService服务类，继承自BaseService
 
 
@@ -49,12 +87,21 @@ class DocumentService(BaseService[DocumentModel]):
         self.executor = ThreadPoolExecutor(max_workers=4)
 
     # 上传文档方法
-    def upload(self, kb_id: str, file_data: bytes, filename: str) -> dict:
+    def upload(
+        self,
+        kb_id: str,
+        file_data: bytes,
+        filename: str,
+        stage_timings: Optional[Dict[str, float]] = None,
+        tags: Optional[List[str]] = None,
+    ) -> dict:
         """
         上传文档
         :param kb_id:知识库ID
         :param file_data:文件数据
         :param filename:文件名
+        :param stage_timings:各阶段耗时（秒）的记录字典（可选）
+        :param tags:文档标签（可选），写入分块元数据，可在问答时按标签过滤
         :return: 创建的文档字典
         """
         # 初始化变量，标识文件是否已经上传
@@ -94,14 +141,15 @@ class DocumentService(BaseService[DocumentModel]):
             file_path = f"documents/{kb_id}/{doc_id}/{filename}"
             # 优先将文件上传到本地/云存储，保证文件存在再创建记录
             try:
-                storage_service.upload_file(file_path, file_data)
+                with stage_timer(stage_timings, "storage_write"):
+                    storage_service.upload_file(file_path, file_data)
                 file_uploaded = True
             except Exception as storage_error:
                 # 上传存储失败时写入日志并抛出异常
                 self.logger.error(f"上传文件到存储时发生错误: {storage_error}")
                 raise ValueError(f"文件上传失败: {str(storage_error)}")
             # 在数据库中创建文档记录
-            with self.transaction() as session:
+            with stage_timer(stage_timings, "db"), self.transaction() as session:
                 doc = DocumentModel(
                     id=doc_id,
                     kb_id=kb_id,
@@ -110,6 +158,7 @@ class DocumentService(BaseService[DocumentModel]):
                     file_type=file_ext,
                     file_size=len(file_data),
                     status="pending",
+                    tags=_join_tags(tags),
                 )
                 # 添加文档记录到会话
                 session.add(doc)
@@ -176,8 +225,10 @@ class DocumentService(BaseService[DocumentModel]):
                 raise ValueError(f"Document {doc_id} not found")
         # 记录已经提交文档处理任务的日志
         self.logger.info(f"提交文档处理任务: {doc_id}")
-        # 在线程池中异步提交处理任务
-        future = self.executor.submit(self._process_document, doc_id)
+        # 在线程池中异步提交处理任务，复制当前上下文使处理过程的 span 归属于本次请求的 trace
+        future = self.executor.submit(
+            contextvars.copy_context().run, profiled(self._process_document), doc_id
+        )
 
         # 定义异常回调函数，用于捕获子线程中的异常
         def exception_callback(future):
@@ -194,20 +245,30 @@ class DocumentService(BaseService[DocumentModel]):
         future.add_done_callback(exception_callback)
 
     # 文档实际处理方法（在子线程中执行，异步）
-    def _process_document(self, doc_id: str):
+    @traced("ingest.process_document")
+    def _process_document(
+        self, doc_id: str, stage_timings: Optional[Dict[str, float]] = None
+    ):
         """
         处理文档（异步）
         Args:
             doc_id: 文档ID
+            stage_timings: 各阶段耗时（秒）的记录字典（可选），
+                阶段包括 db / vector_cleanup / storage_read / parse / split / embed / vector_insert
 
         Returns:
 
         """
+        # 本次处理的阶段耗时，结束时写入指标并合并到调用方的记录字典
+        timings: Dict[str, float] = {}
+        # 处理结果，用于指标统计
+        outcome = "missing"
+        current_span().set("doc_id", doc_id)
         try:
             # 日志：文档处理任务开始
             self.logger.info(f"开始处理文档：{doc_id}")
             # 首先开启事务，获取文档信息和知识库配置并更新文档初始状态
-            with self.transaction() as session:
+            with stage_timer(timings, "db"), self.transaction() as session:
                 # 查询文档对象
                 doc: DocumentModel = (
                     session.query(DocumentModel)
@@ -220,6 +281,9 @@ class DocumentService(BaseService[DocumentModel]):
                     return
                 # 若文档已被处理过（完成或失败），则需重置状态
                 need_cleanup = doc.status in ["completed", "failed"]
+                # 上次处理成功时已知旧分块数：新分块按相同ID覆盖写入，只需删除多出的尾部分块；
+                # 上次处理失败时向量库中的内容未知，仍在处理前按 doc_id 整体删除
+                previous_chunk_count = doc.chunk_count if doc.status == "completed" else None
                 if need_cleanup:
                     # 重置状态为待处理，分块数归零、错误信息清除
                     doc.status = "pending"
@@ -244,17 +308,22 @@ class DocumentService(BaseService[DocumentModel]):
                 # 未找到知识库抛出异常
                 if not kb:
                     raise ValueError(f"知识库 {kb_id} 未找到")
+                # 写入分块元数据的文档属性，用于过滤检索
+                doc_file_type = file_type
+                doc_created_at = int(doc.created_at.timestamp()) if doc.created_at else 0
+                doc_tags = [tag for tag in (doc.tags or "").split(",") if tag]
                 # 获取知识库分块参数
                 kb_chunk_size = kb.chunk_size
                 kb_chunk_overlap = kb.chunk_overlap
 
-            # 如果需要清理旧分块和向量，则在事务作用域外先进行删除，避免占用数据库连接
-            if need_cleanup:
+            # 如果需要整体清理旧分块和向量，则在事务作用域外先进行删除，避免占用数据库连接
+            if need_cleanup and previous_chunk_count is None:
                 try:
                     # 调用向量服务，则删除指定集合、指定文档ID下的所有向量数据
-                    vector_service.delete_documents(
-                        collection_name=collection_name, filter={"doc_id": doc_id}
-                    )
+                    with stage_timer(timings, "vector_cleanup"):
+                        vector_service.delete_documents(
+                            collection_name=collection_name, filter={"doc_id": doc_id}
+                        )
                     # 输出信息日志，标明文档的旧向量已被删除
                     self.logger.info(f"已删除文档 {doc_id} 的旧向量")
                 except Exception as e:
@@ -264,9 +333,11 @@ class DocumentService(BaseService[DocumentModel]):
             # 日志：文档已标记为处理中
             self.logger.info(f"文档 {doc_id} 状态已更新为 processing（处理中）")
             # 从存储中下载文件内容
-            file_data = storage_service.download_file(file_path)
+            with stage_timer(timings, "storage_read"):
+                file_data = storage_service.download_file(file_path)
             # 解析文件，根据类型抽取原始文本内容
-            langchain_docs = parser_service.parse(file_data, file_type)
+            with stage_timer(timings, "parse"):
+                langchain_docs = parser_service.parse(file_data, file_type)
             # 若抽取出的文本为空，则抛出异常
             if not langchain_docs:
                 raise ValueError(f"未能抽取到任何文本内容")
@@ -275,37 +346,59 @@ class DocumentService(BaseService[DocumentModel]):
                 chunk_size=kb_chunk_size, chunk_overlap=kb_chunk_overlap
             )
             # 将文档内容分块
-            chunks = splitter.split_documents(langchain_docs, doc_id=doc_id)
+            with stage_timer(timings, "split"):
+                chunks = splitter.split_documents(langchain_docs, doc_id=doc_id)
             # 如果分块失败，抛出异常
             if not chunks:
                 raise ValueError("文档未能成功分块")
-            # 初始化一个列表用于存放转换后的 LangChain Document 对象
-            documents = []
-            # 遍历所有分块，将每个分块转换为 LangChain Document 对象
-            for chunk in chunks:
-                # 创建一个 LangChain Document，包含文本内容和相关元数据
-                doc_obj = Document(
-                    page_content=chunk["text"],
-                    metadata={
-                        "doc_id": doc_id,
-                        "doc_name": doc_name,
-                        "chunk_index": chunk["chunk_index"],
-                        "id": chunk["id"],
-                        "chunk_id": chunk["id"],
-                    },
-                )
-                # 将生成的 Document 对象加入到 documents 列表
-                documents.append(doc_obj)
+            # 提取所有分块的文本
+            texts = [chunk["text"] for chunk in chunks]
+            # 构造每个分块的元数据
+            metadatas = [
+                {
+                    "doc_id": doc_id,
+                    "doc_name": doc_name,
+                    "chunk_index": chunk["chunk_index"],
+                    "id": chunk["id"],
+                    "chunk_id": chunk["id"],
+                    "file_type": doc_file_type,
+                    "created_at": doc_created_at,
+                    "tags": doc_tags,
+                }
+                for chunk in chunks
+            ]
             # 构造向量库集合名称，格式为 kb_知识库ID
             collection_name = f"kb_{kb_id}"
             # 提取所有分块的ID,用于向量存储
             ids = [chunk["id"] for chunk in chunks]
-            # 调用向量服务，将分块后的文档写入向量库
-            vector_service.add_documents(
-                collection_name=collection_name, documents=documents, ids=ids
-            )
+            # 先批量计算分块向量
+            with stage_timer(timings, "embed"):
+                embeddings = vector_service.embeddings_for(collection_name).embed_documents(texts)
+            # 再将分块文本、向量和元数据写入向量库
+            with stage_timer(timings, "vector_insert"):
+                vector_service.add_embeddings(
+                    collection_name=collection_name,
+                    texts=texts,
+                    embeddings=embeddings,
+                    metadatas=metadatas,
+                    ids=ids,
+                )
+                # 知识库开启了向量压缩时同步写入压缩索引（重新处理时先移除旧向量）
+                if need_cleanup:
+                    vector_compression_service.delete_doc(kb_id, doc_id)
+                vector_compression_service.add(kb_id, ids, metadatas, embeddings)
+            # 重新处理后分块变少时，删除上次处理留下的尾部分块（分块ID为 文档ID_序号）
+            if previous_chunk_count and previous_chunk_count > len(chunks):
+                try:
+                    with stage_timer(timings, "vector_cleanup"):
+                        vector_service.delete_documents(
+                            collection_name=collection_name,
+                            ids=[f"{doc_id}_{i}" for i in range(len(chunks), previous_chunk_count)],
+                        )
+                except Exception as e:
+                    self.logger.warning(f"删除文档 {doc_id} 多余的旧分块时出错: {e}")
             # 再次开启事务，更新文档状态为完成，记录分块数
-            with self.transaction() as session:
+            with stage_timer(timings, "db"), self.transaction() as session:
                 doc = (
                     session.query(DocumentModel)
                     .filter(DocumentModel.id == doc_id)
@@ -314,9 +407,11 @@ class DocumentService(BaseService[DocumentModel]):
                 if doc:
                     doc.status = "completed"  # 完成状态
                     doc.chunk_count = len(chunks)  # 分块数
+                    outcome = "completed"
             # 日志：处理完成，输出分块数
             self.logger.info(f"文档处理完成: {doc_id}, 分块数量: {len(chunks)}")
         except Exception as e:
+            outcome = "failed"
             # 捕获异常后，更新文档状态为失败，并记录错误信息（限长）
             with self.transaction() as session:
                 # 查询文档对象
@@ -331,6 +426,14 @@ class DocumentService(BaseService[DocumentModel]):
                     doc.error_message = str(e)[:500]
             # 记录处理失败的日志
             self.logger.error(f"处理文档 {doc_id} 时发生错误: {e}")
+        finally:
+            # 记录各阶段耗时和处理结果指标
+            for stage, seconds in timings.items():
+                INGESTION_STAGE_SECONDS.labels(stage=stage).observe(seconds)
+                if stage_timings is not None:
+                    stage_timings[stage] = stage_timings.get(stage, 0.0) + seconds
+            INGESTION_DOCUMENTS.labels(status=outcome).inc()
+            current_span().set("outcome", outcome)
 
     def delete(self, doc_id):
         """
@@ -353,11 +456,12 @@ class DocumentService(BaseService[DocumentModel]):
             kb_id = doc.kb_id
             file_path = doc.file_path
             collection_name = f"kb_{kb_id}"
-        # 1. 删除向量数据库中的相关向量数据
+        # 1. 删除向量数据库中的相关向量数据（后端支持时交给后台任务，不等待删除完成）
         try:
-            vector_service.delete_documents(
+            vector_service.delete_documents_later(
                 collection_name=collection_name, filter={"doc_id": doc_id}
             )
+            vector_compression_service.delete_doc(kb_id, doc_id)
             self.logger.info(f"已删除文档{doc_id}的向量数据")
         except Exception as e:
             self.logger.warning(f"删除向量数据失败：{e}")
@@ -0,0 +1,854 @@
+"""
+Embedding 模型迁移服务
+不同 Embedding 模型的向量不能互相比较，修改设置中的模型后，已有知识库的向量必须用新模型重新生成。
+每个知识库的分片布局记录了向量所属的模型（embedding_model），检索和写入始终使用该模型向量化，
+因此修改设置不会影响已有知识库；本服务在后台把知识库逐个迁移到新模型：
+
+    prepare   为每个分片建立影子集合，写入布局的 shadow / shadow_model，新写入的分块同时写入影子集合
+    copy      按文档ID顺序读取已完成文档的分块，用新模型重新向量化后写入影子集合（限速、定期保存断点）
+    catchup   重新复制准备之后更新过的文档，补齐双写失败或准备生效之前写入的分块
+    cutover   一个事务内把布局的分片切换为影子集合、模型切换为新模型，此前检索一直使用旧集合和旧模型
+    cleanup   重建向量压缩索引，删除旧集合中的分块
+
+迁移任务在后台线程中执行，同一时间只有一个进程执行（文件锁），进程退出后由下次请求发现并从断点继续。
+迁移进度通过 /api/v1/admin/embedding-migrations 查看，也可以暂停、继续和取消。
+
+命令行（使用当前配置 .env）：
+    python -m app.services.embedding_migration status
+    python -m app.services.embedding_migration start [知识库ID ...]
+    python -m app.services.embedding_migration run
+"""
+
+# 导入命令行参数解析模块
+import argparse
+
+# 导入 JSON 模块
+import json
+
+# 导入日志模块
+import logging
+
+# 导入操作系统模块
+import os
+
+# 导入线程模块
+import threading
+
+# 导入时间模块
+import time
+
+# 导入上下文管理器装饰器
+from contextlib import contextmanager
+
+# 导入时间间隔
+from datetime import timedelta
+
+# 导入类型注解
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 导入文件锁模块（仅 Unix 可用，Windows 下单进程运行不需要跨进程互斥）
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+# 导入 Embeddings 基类
+from langchain_core.embeddings import Embeddings
+
+# 导入SQLAlchemy的SQL函数
+from sqlalchemy.sql import func
+
+# 导入配置
+from app.config import Config
+
+# 导入文档模型
+from app.models.document import Document as DocumentModel
+
+# 导入迁移记录模型
+from app.models.embedding_migration import EmbeddingMigration
+
+# 导入知识库模型
+from app.models.knowledgebase import Knowledgebase
+
+# 导入基础服务类
+from app.services.base_service import BaseService
+
+# 导入设置服务
+from app.services.settings_service import settings_service
+
+# 导入向量压缩服务
+from app.services.vector_compression import vector_compression_service
+
+# 导入向量分片服务
+from app.services.vector_sharding import vector_sharding_service
+
+# 导入分片路由工具
+from app.services.vectordb.sharded import all_shards, place, shard_name
+
+# 导入 Embedding 工厂和模型标识
+from app.utils.embedding_factory import EmbeddingFactory, embedding_model_key
+
+# 获取当前模块的日志记录器
+logger = logging.getLogger(__name__)
+
+# 模型配置中保存的设置字段
+_SPEC_FIELDS = ("embedding_provider", "embedding_model_name", "embedding_api_key", "embedding_base_url")
+# 迁移阶段（按执行顺序）
+PHASES = ("prepare", "copy", "catchup", "cutover", "cleanup")
+# 未结束的状态
+_UNFINISHED = ("pending", "queued", "running", "paused", "cancelling")
+# 后台任务需要处理的状态
+_ACTIVE = ("queued", "running", "cancelling")
+# 已切换到新模型、不能再取消的阶段
+_SWITCHED = ("cutover", "cleanup")
+# 复制时每次查询的文档数
+_DOC_PAGE = 100
+# 追平阶段的最多轮数
+_CATCHUP_ROUNDS = 5
+
+
+# 从设置中提取模型配置
+def _spec_of(settings: dict) -> dict:
+    return {field: settings.get(field) for field in _SPEC_FIELDS}
+
+
+# 知识库布局中记录的模型
+def _kb_model(kb: Knowledgebase) -> Optional[str]:
+    layout = json.loads(kb.vector_sharding) if kb.vector_sharding else None
+    return (layout or {}).get("embedding_model")
+
+
+# 按速率限制等待
+def _throttle(started: float, done: int):
+    """本次执行已向量化 done 个分块，超过 EMBEDDING_MIGRATION_RATE 时等待"""
+    rate = Config.EMBEDDING_MIGRATION_RATE
+    if rate > 0:
+        delay = started + done / rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Embedding 模型迁移服务
+class EmbeddingMigrationService(BaseService[EmbeddingMigration]):
+    """按模型标识提供 Embeddings，并在后台把知识库迁移到当前设置的模型"""
+
+    def __init__(self):
+        super().__init__()
+        # 模型标识 -> Embeddings
+        self._embeddings: Dict[str, Embeddings] = {}
+        # 当前设置的模型标识缓存：(过期时间, 模型标识)
+        self._current: Tuple[float, Optional[str]] = (0.0, None)
+        # 保护缓存和后台线程的锁
+        self._lock = threading.Lock()
+        # 创建模型较慢，同一时间只创建一个
+        self._create_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    # 当前设置的模型标识
+    def current_model_key(self) -> str:
+        """返回当前设置的模型标识，缓存 VECTOR_SHARD_LAYOUT_TTL 秒"""
+        now = time.monotonic()
+        with self._lock:
+            expires, key = self._current
+        if key is not None and expires > now:
+            return key
+        key = embedding_model_key(settings_service.get())
+        with self._lock:
+            self._current = (now + Config.VECTOR_SHARD_LAYOUT_TTL, key)
+        # 与 Chroma 的后台删除相同：上次退出时未完成的迁移由本进程的后台任务继续执行
+        if self._has_active():
+            self._ensure_worker()
+        return key
+
+    # 按模型标识获取 Embeddings（ShardedVectorDB 使用）
+    def embeddings(self, model_key: Optional[str] = None) -> Embeddings:
+        """
+        按模型标识获取 Embeddings，同一模型在进程内只创建一次
+        Args:
+            model_key: 模型标识，None 表示当前设置的模型
+
+        Returns:
+            Embeddings 对象；当前设置的模型创建失败时与以前一样回退到默认模型，
+            其他模型（已有集合使用的旧模型、迁移的目标模型）创建失败时抛出异常
+        """
+        current = self.current_model_key()
+        model_key = model_key or current
+        with self._lock:
+            cached = self._embeddings.get(model_key)
+        if cached is not None:
+            return cached
+        with self._create_lock:
+            with self._lock:
+                cached = self._embeddings.get(model_key)
+            if cached is not None:
+                return cached
+            from app.services.vector_service import vector_service
+
+            default = getattr(vector_service, "inner", vector_service).embeddings
+            if getattr(default, "model_key", None) == model_key:
+                embeddings = default
+            else:
+                logger.info(f"创建 Embedding 模型: {model_key}")
+                embeddings = EmbeddingFactory.create_embeddings(
+                    self._spec(model_key), fallback=model_key == current
+                )
+            with self._lock:
+                self._embeddings[model_key] = embeddings
+            return embeddings
+
+    # 查找模型标识对应的配置
+    def _spec(self, model_key: str) -> dict:
+        settings = settings_service.get()
+        if embedding_model_key(settings) == model_key:
+            return _spec_of(settings)
+        # 切换设置后旧模型的配置（API Key 等）只保存在迁移记录中
+        with self.session() as session:
+            row = (
+                session.query(EmbeddingMigration)
+                .filter(
+                    (EmbeddingMigration.source_model == model_key)
+                    | (EmbeddingMigration.target_model == model_key)
+                )
+                .order_by(EmbeddingMigration.created_at.desc())
+                .first()
+            )
+            if row is not None:
+                spec = row.source_spec if row.source_model == model_key else row.target_spec
+                if spec:
+                    return json.loads(spec)
+        # 没有记录时按模型标识推断（本地模型不需要 API Key）
+        provider, _, model_name = model_key.partition(":")
+        return {"embedding_provider": provider, "embedding_model_name": model_name}
+
+    # 修改模型之前：固定已有知识库的模型
+    def prepare_model_change(self, old_settings: dict):
+        """
+        修改设置中的模型之前调用，把还没有记录模型的知识库固定到修改前的模型，
+        修改之后这些知识库仍然使用原模型检索，直到迁移切换
+        Args:
+            old_settings: 修改前的设置
+        """
+        key = embedding_model_key(old_settings)
+        pinned = []
+        with self.transaction() as session:
+            for kb in session.query(Knowledgebase).all():
+                layout = json.loads(kb.vector_sharding) if kb.vector_sharding else None
+                if layout and layout.get("embedding_model"):
+                    continue
+                layout = layout or vector_sharding_service.new_layout(kb.id, "hash", 1)
+                layout["embedding_model"] = key
+                kb.vector_sharding = json.dumps(layout, ensure_ascii=False)
+                pinned.append(kb.id)
+        for kb_id in pinned:
+            vector_sharding_service.invalidate(kb_id)
+        if pinned:
+            logger.info(f"已将 {len(pinned)} 个知识库固定到 Embedding 模型 {key}")
+
+    # 修改模型之后：安排迁移
+    def on_model_change(self, old_settings: dict, new_settings: dict):
+        """
+        修改设置中的模型之后调用：取消目标模型已过时的迁移，为使用其他模型的知识库创建迁移
+        EMBEDDING_MIGRATION_AUTO_START 关闭时迁移处于 pending 状态，等待管理员开始
+        Args:
+            old_settings: 修改前的设置
+            new_settings: 修改后的设置
+        """
+        new_key = embedding_model_key(new_settings)
+        specs = {
+            embedding_model_key(old_settings): _spec_of(old_settings),
+            new_key: _spec_of(new_settings),
+        }
+        with self._lock:
+            self._current = (0.0, None)
+        status = "queued" if Config.EMBEDDING_MIGRATION_AUTO_START else "pending"
+        with self.transaction() as session:
+            for kb in session.query(Knowledgebase).all():
+                keep = False
+                for row in self._unfinished(session, kb.id):
+                    # 已经切换的迁移继续完成，完成后再按当前设置安排下一次迁移
+                    if row.phase in _SWITCHED or (
+                        row.target_model == new_key and row.status != "cancelling"
+                    ):
+                        keep = True
+                    else:
+                        self._cancel_row(row)
+                model = _kb_model(kb) or embedding_model_key(old_settings)
+                if not keep and model != new_key:
+                    session.add(self._new_row(kb.id, model, new_key, specs, status))
+        self._ensure_worker()
+
+    # 知识库未结束的迁移
+    @staticmethod
+    def _unfinished(session, kb_id: str) -> List[EmbeddingMigration]:
+        return (
+            session.query(EmbeddingMigration)
+            .filter(
+                EmbeddingMigration.kb_id == kb_id,
+                EmbeddingMigration.status.in_(_UNFINISHED),
+            )
+            .order_by(EmbeddingMigration.created_at)
+            .all()
+        )
+
+    # 新建迁移记录
+    def _new_row(
+        self, kb_id: str, source: str, target: str, specs: Dict[str, dict], status: str
+    ) -> EmbeddingMigration:
+        return EmbeddingMigration(
+            kb_id=kb_id,
+            source_model=source,
+            target_model=target,
+            source_spec=json.dumps(specs.get(source) or self._spec(source), ensure_ascii=False),
+            target_spec=json.dumps(specs.get(target) or self._spec(target), ensure_ascii=False),
+            status=status,
+        )
+
+    # 取消迁移记录
+    @staticmethod
+    def _cancel_row(row: EmbeddingMigration):
+        """还没有建立影子集合的迁移直接取消，其他迁移由后台任务清理影子集合后取消"""
+        if row.phase is None and row.status != "running":
+            row.status = "cancelled"
+            row.finished_at = func.now()
+        else:
+            row.status = "cancelling"
+
+    # 开始迁移
+    def start(self, kb_ids: Optional[Iterable[str]] = None) -> List[dict]:
+        """
+        开始等待中的迁移，并为模型与当前设置不同、没有进行中迁移的知识库（例如迁移失败后取消的）创建迁移
+        Args:
+            kb_ids: 知识库ID列表，默认全部知识库
+
+        Returns:
+            开始的迁移列表
+        """
+        key = self.current_model_key()
+        specs = {key: _spec_of(settings_service.get())}
+        started = []
+        with self.transaction() as session:
+            query = session.query(Knowledgebase)
+            if kb_ids is not None:
+                query = query.filter(Knowledgebase.id.in_(list(kb_ids)))
+            for kb in query.all():
+                rows = self._unfinished(session, kb.id)
+                pending = [row for row in rows if row.status == "pending"]
+                for row in pending:
+                    row.status = "queued"
+                    started.append(row)
+                model = _kb_model(kb)
+                if not rows and model and model != key:
+                    row = self._new_row(kb.id, model, key, specs, "queued")
+                    session.add(row)
+                    started.append(row)
+            session.flush()
+            result = [row.to_dict() for row in started]
+        self._ensure_worker()
+        return result
+
+    # 修改迁移状态
+    def _transition(self, migration_id: str, allowed: Tuple[str, ...], status: str) -> dict:
+        with self.transaction() as session:
+            row = session.query(EmbeddingMigration).filter(EmbeddingMigration.id == migration_id).first()
+            if not row:
+                raise ValueError(f"迁移 {migration_id} 不存在")
+            if row.status not in allowed:
+                raise ValueError(f"迁移当前状态为 {row.status}，不能执行该操作")
+            if status == "cancelling":
+                if row.phase in _SWITCHED:
+                    raise ValueError("迁移已切换到新模型，不能取消")
+                self._cancel_row(row)
+            else:
+                row.status = status
+                row.error_message = None if status == "queued" else row.error_message
+            session.flush()
+            return row.to_dict()
+
+    # 暂停迁移
+    def pause(self, migration_id: str) -> dict:
+        """暂停迁移，复制和追平阶段在下次保存断点时停止；影子集合继续接收双写"""
+        return self._transition(migration_id, ("pending", "queued", "running"), "paused")
+
+    # 继续迁移
+    def resume(self, migration_id: str) -> dict:
+        """继续已暂停或失败的迁移，从断点开始"""
+        result = self._transition(migration_id, ("paused", "failed"), "queued")
+        self._ensure_worker()
+        return result
+
+    # 取消迁移
+    def cancel(self, migration_id: str) -> dict:
+        """取消迁移，知识库继续使用原模型，影子集合由后台任务删除"""
+        result = self._transition(migration_id, ("pending", "queued", "running", "paused", "failed"), "cancelling")
+        self._ensure_worker()
+        return result
+
+    # 知识库删除时停止迁移
+    def stop_kb(self, kb_id: str) -> int:
+        """
+        把知识库未结束的迁移直接标记为已取消，不经过后台清理：影子集合随知识库的集合一起删除
+        正在复制的后台任务在下次检查状态时停止，并删除停止前可能重新写入的影子集合
+        Args:
+            kb_id: 知识库ID
+
+        Returns:
+            停止的迁移数量
+        """
+        with self.transaction() as session:
+            rows = self._unfinished(session, kb_id)
+            for row in rows:
+                row.status = "cancelled"
+                row.error_message = "知识库已删除"
+                row.finished_at = func.now()
+        if rows:
+            logger.info(f"知识库 {kb_id} 已删除，停止 {len(rows)} 个 Embedding 模型迁移")
+        return len(rows)
+
+    # 迁移列表
+    def list(self, kb_id: Optional[str] = None, limit: int = 100) -> dict:
+        """
+        查询迁移进度
+        Args:
+            kb_id: 知识库ID（可选）
+            limit: 最多返回的记录数
+
+        Returns:
+            {"current_model", "migrations": [迁移字典（附带知识库名称）]}，按创建时间倒序
+        """
+        with self.session() as session:
+            query = session.query(EmbeddingMigration, Knowledgebase.name).join(
+                Knowledgebase, Knowledgebase.id == EmbeddingMigration.kb_id
+            )
+            if kb_id:
+                query = query.filter(EmbeddingMigration.kb_id == kb_id)
+            rows = query.order_by(EmbeddingMigration.created_at.desc()).limit(limit).all()
+            migrations = [dict(row.to_dict(), kb_name=name) for row, name in rows]
+        if any(m["status"] in _ACTIVE for m in migrations):
+            self._ensure_worker()
+        return {"current_model": self.current_model_key(), "migrations": migrations}
+
+    # 是否有需要后台任务处理的迁移
+    def _has_active(self) -> bool:
+        with self.session() as session:
+            return (
+                session.query(EmbeddingMigration.id)
+                .filter(EmbeddingMigration.status.in_(_ACTIVE))
+                .first()
+                is not None
+            )
+
+    # 启动后台迁移任务
+    def _ensure_worker(self):
+        # 后台线程在第一次需要时启动（gunicorn 在导入后 fork，导入时启动的线程不会被继承）
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._run, name="embedding-migration", daemon=True
+                    )
+                    self._thread.start()
+
+    # 后台任务锁：同一时间只允许一个进程执行迁移
+    @contextmanager
+    def _worker_lock(self):
+        if fcntl is None:
+            yield True
+            return
+        os.makedirs(Config.EMBEDDING_MIGRATION_DIR, exist_ok=True)
+        with open(os.path.join(Config.EMBEDDING_MIGRATION_DIR, "worker.lock"), "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    # 后台线程主循环：没有待处理的迁移时退出，下次安排迁移时重新启动
+    def _run(self):
+        while True:
+            try:
+                self.run_pending()
+                if not self._has_active():
+                    return
+            except Exception as e:
+                logger.error(f"Embedding 模型迁移任务出错: {e}", exc_info=True)
+            # 其他进程正在执行迁移，稍后再检查
+            time.sleep(Config.EMBEDDING_MIGRATION_POLL_INTERVAL)
+
+    # 执行全部待处理的迁移
+    def run_pending(self) -> int:
+        """
+        在当前线程中依次执行待处理的迁移（先处理取消，再按创建时间）
+        Returns:
+            处理的迁移数，其他进程正在执行迁移时返回 0
+        """
+        processed = 0
+        with self._worker_lock() as acquired:
+            if not acquired:
+                return 0
+            last = None
+            while True:
+                migration_id = self._next()
+                # 同一迁移连续两次被选中说明状态没有推进，留给下一轮
+                if migration_id is None or migration_id == last:
+                    break
+                self._process(migration_id)
+                processed += 1
+                last = migration_id
+        return processed
+
+    # 下一个待处理的迁移
+    def _next(self) -> Optional[str]:
+        with self.session() as session:
+            for statuses in (("cancelling",), ("running", "queued")):
+                row = (
+                    session.query(EmbeddingMigration.id)
+                    .filter(EmbeddingMigration.status.in_(statuses))
+                    .order_by(EmbeddingMigration.created_at)
+                    .first()
+                )
+                if row is not None:
+                    return row.id
+        return None
+
+    # 读取迁移记录
+    def _row(self, migration_id: str) -> Optional[dict]:
+        with self.session() as session:
+            row = session.query(EmbeddingMigration).filter(EmbeddingMigration.id == migration_id).first()
+            if row is None:
+                return None
+            return {column.name: getattr(row, column.name) for column in EmbeddingMigration.__table__.columns}
+
+    # 更新迁移记录
+    def _update(self, migration_id: str, **fields) -> Optional[str]:
+        """更新字段并返回更新后的状态，记录已删除（知识库被删除）时返回 None"""
+        with self.transaction() as session:
+            row = session.query(EmbeddingMigration).filter(EmbeddingMigration.id == migration_id).first()
+            if row is None:
+                return None
+            for key, value in fields.items():
+                setattr(row, key, value)
+            return row.status
+
+    # 执行一个迁移
+    def _process(self, migration_id: str):
+        row = self._row(migration_id)
+        if row is None:
+            return
+        if row["status"] == "cancelling":
+            self._abort(row)
+            return
+        # 开始执行前确认状态仍然有效（可能刚被暂停或取消）
+        with self.transaction() as session:
+            current = session.query(EmbeddingMigration).filter(EmbeddingMigration.id == migration_id).first()
+            if current is None or current.status not in ("queued", "running"):
+                return
+            current.status = "running"
+            current.started_at = current.started_at or func.now()
+            current.phase = current.phase or PHASES[0]
+            phase = current.phase
+        logger.info(f"开始执行 Embedding 模型迁移 {migration_id}: 知识库 {row['kb_id']}, 阶段 {phase}")
+        handlers = {
+            "prepare": self._prepare,
+            "copy": self._copy,
+            "catchup": self._catch_up,
+            "cutover": self._cutover,
+            "cleanup": self._cleanup,
+        }
+        try:
+            for index in range(PHASES.index(phase), len(PHASES)):
+                # 阶段返回 False 表示迁移已暂停、取消或不需要继续
+                if not handlers[PHASES[index]](migration_id):
+                    return
+                if index + 1 < len(PHASES):
+                    self._update(migration_id, phase=PHASES[index + 1])
+            self._update(migration_id, status="completed", finished_at=func.now())
+            logger.info(f"Embedding 模型迁移 {migration_id} 已完成: 知识库 {row['kb_id']}")
+            # 迁移期间设置可能又被修改，按当前设置安排下一次迁移
+            if Config.EMBEDDING_MIGRATION_AUTO_START:
+                self.start([row["kb_id"]])
+        except Exception as e:
+            # 执行期间知识库被删除（迁移已停止）时不记为失败
+            if self._update(migration_id) in (None, "cancelled"):
+                logger.info(f"Embedding 模型迁移 {migration_id} 已停止: 知识库 {row['kb_id']} 已删除")
+                return
+            logger.error(f"Embedding 模型迁移 {migration_id} 失败: {e}", exc_info=True)
+            self._update(migration_id, status="failed", error_message=str(e)[:2000], finished_at=func.now())
+
+    # 目标模型
+    def _target_embeddings(self, row: dict) -> Embeddings:
+        embeddings = self.embeddings(row["target_model"])
+        # 当前模型创建失败会回退到默认模型，不能用回退的模型生成新向量
+        if getattr(embeddings, "model_key", row["target_model"]) != row["target_model"]:
+            raise ValueError(f"无法加载目标 Embedding 模型 {row['target_model']}")
+        return embeddings
+
+    # 阶段一：建立影子集合
+    def _prepare(self, migration_id: str) -> bool:
+        row = self._row(migration_id)
+        kb_id = row["kb_id"]
+        self._target_embeddings(row)
+        with self.transaction() as session:
+            current = session.query(EmbeddingMigration).filter(EmbeddingMigration.id == migration_id).first()
+            kb = session.query(Knowledgebase).filter(Knowledgebase.id == kb_id).first()
+            if current is None or current.status != "running":
+                return False
+            if kb is None:
+                raise ValueError(f"知识库 {kb_id} 不存在")
+            layout = json.loads(kb.vector_sharding) if kb.vector_sharding else None
+            layout = layout or vector_sharding_service.new_layout(kb_id, "hash", 1)
+            model = layout.get("embedding_model") or row["source_model"]
+            if layout.get("draining"):
+                raise ValueError(f"知识库 {kb_id} 正在重平衡分片，请在重平衡完成后继续迁移")
+            if model == row["target_model"]:
+                # 知识库已经在使用目标模型
+                current.status = "completed"
+                current.finished_at = func.now()
+                return False
+            if model != row["source_model"]:
+                raise ValueError(f"知识库当前的模型 {model} 与迁移的原模型 {row['source_model']} 不一致")
+            base = f"kb_{kb_id}_m{migration_id[:8]}"
+            layout["embedding_model"] = model
+            layout["shadow"] = [shard_name(base, i) for i in range(len(layout["shards"]))]
+            layout["shadow_model"] = row["target_model"]
+            kb.vector_sharding = json.dumps(layout, ensure_ascii=False)
+            # 双写生效的时间，追平阶段重新复制此后更新过的文档
+            current.synced_at = func.now()
+        vector_sharding_service.invalidate(kb_id)
+        # 等待各进程的布局缓存过期，此后写入的分块都会同时写入影子集合
+        time.sleep(Config.VECTOR_SHARD_LAYOUT_TTL)
+        return True
+
+    # 复制一个文档的分块到影子集合
+    def _copy_doc(
+        self, kb_id: str, layout: dict, embeddings: Embeddings, doc_id: str, chunk_count: int, started: float, done: int
+    ) -> int:
+        from app.services.vector_service import vector_service
+
+        inner = getattr(vector_service, "inner", vector_service)
+        ids = [f"{doc_id}_{i}" for i in range(chunk_count or 0)]
+        copied = 0
+        for start in range(0, len(ids), Config.EMBEDDING_MIGRATION_BATCH):
+            # 从当前使用的分片读取文本和元数据
+            documents = vector_service.get_by_ids(f"kb_{kb_id}", ids[start : start + Config.EMBEDDING_MIGRATION_BATCH])
+            if not documents:
+                continue
+            texts = [doc.page_content for doc in documents]
+            metadatas = [dict(doc.metadata or {}) for doc in documents]
+            chunk_ids = [doc.id or metadata.get("id") for doc, metadata in zip(documents, metadatas)]
+            vectors = embeddings.embed_documents(texts)
+            index = place(layout, doc_id, metadatas[0].get("created_at"))
+            inner.add_embeddings(layout["shadow"][index], texts, vectors, metadatas, chunk_ids)
+            copied += len(texts)
+            _throttle(started, done + copied)
+        return copied
+
+    # 按顺序复制文档，定期保存断点并检查状态
+    def _copy_docs(self, migration_id: str, docs: Iterable[Tuple[str, int]], checkpoint: bool) -> bool:
+        row = self._row(migration_id)
+        kb_id = row["kb_id"]
+        layout = vector_sharding_service.get_layout(kb_id, fresh=True)
+        embeddings = self._target_embeddings(row)
+        done_docs, done_chunks = row["done_docs"], row["done_chunks"]
+        started, copied = time.monotonic(), 0
+        saved = started
+        last = row["checkpoint"]
+        for doc_id, chunk_count in docs:
+            try:
+                count = self._copy_doc(kb_id, layout, embeddings, doc_id, chunk_count, started, copied)
+            except Exception:
+                # 知识库在复制过程中被删除时集合会被删除，写入可能出错
+                status = self._update(migration_id)
+                if status in (None, "cancelled"):
+                    self._drop_if_deleted(status, layout)
+                    return False
+                raise
+            copied += count
+            done_chunks += count
+            if checkpoint:
+                done_docs += 1
+                last = doc_id
+            if time.monotonic() - saved >= 1:
+                saved = time.monotonic()
+                status = self._update(
+                    migration_id, done_docs=done_docs, done_chunks=done_chunks, checkpoint=last
+                )
+                if status != "running":
+                    self._drop_if_deleted(status, layout)
+                    return False
+        status = self._update(migration_id, done_docs=done_docs, done_chunks=done_chunks, checkpoint=last)
+        if status != "running":
+            self._drop_if_deleted(status, layout)
+            return False
+        return True
+
+    # 知识库已删除时删除复制过程中重新创建的集合
+    def _drop_if_deleted(self, status: Optional[str], layout: dict):
+        """
+        直接取消（stop_kb）或记录已不存在说明知识库已被删除：删除知识库时正在复制的批次
+        可能在集合删除后读写分片和影子集合而重新创建它们，停止复制后再删除一次
+        """
+        if status in (None, "cancelled") and layout:
+            self._drop_collections(all_shards(layout) + list(layout.get("shadow") or []))
+
+    # 阶段二：复制已完成的文档
+    def _copy(self, migration_id: str) -> bool:
+        row = self._row(migration_id)
+        kb_id = row["kb_id"]
+        with self.session() as session:
+            total = (
+                session.query(func.count(DocumentModel.id))
+                .filter(DocumentModel.kb_id == kb_id, DocumentModel.status == "completed")
+                .scalar()
+            )
+        self._update(migration_id, total_docs=max(total or 0, row["done_docs"]))
+
+        def pages():
+            # 按文档ID顺序分页，断点之后的文档才需要复制
+            last = row["checkpoint"]
+            while True:
+                with self.session() as session:
+                    query = session.query(DocumentModel.id, DocumentModel.chunk_count).filter(
+                        DocumentModel.kb_id == kb_id, DocumentModel.status == "completed"
+                    )
+                    if last:
+                        query = query.filter(DocumentModel.id > last)
+                    page = query.order_by(DocumentModel.id).limit(_DOC_PAGE).all()
+                if not page:
+                    return
+                for doc_id, chunk_count in page:
+                    yield doc_id, chunk_count
+                last = page[-1][0]
+
+        return self._copy_docs(migration_id, pages(), checkpoint=True)
+
+    # 阶段三：追平
+    def _catch_up(self, migration_id: str) -> bool:
+        for _ in range(_CATCHUP_ROUNDS):
+            row = self._row(migration_id)
+            # 先推进水位再查询，查询期间更新的文档会在下一轮再复制一次
+            self._update(migration_id, synced_at=func.now())
+            since = row["synced_at"] - timedelta(seconds=1)
+            with self.session() as session:
+                docs = (
+                    session.query(DocumentModel.id, DocumentModel.chunk_count)
+                    .filter(
+                        DocumentModel.kb_id == row["kb_id"],
+                        DocumentModel.status == "completed",
+                        DocumentModel.updated_at >= since,
+                    )
+                    .order_by(DocumentModel.id)
+                    .all()
+                )
+            if not docs:
+                break
+            logger.info(f"Embedding 模型迁移 {migration_id} 追平: 重新复制 {len(docs)} 个文档")
+            if not self._copy_docs(migration_id, [(d.id, d.chunk_count) for d in docs], checkpoint=False):
+                return False
+        return True
+
+    # 阶段四：切换到影子集合和新模型
+    def _cutover(self, migration_id: str) -> bool:
+        row = self._row(migration_id)
+        kb_id = row["kb_id"]
+        with self.session() as session:
+            compression = (
+                session.query(Knowledgebase.vector_compression).filter(Knowledgebase.id == kb_id).scalar()
+            )
+        # 压缩索引保存的是旧模型的向量，切换前关闭，检索临时回到向量库
+        if compression:
+            vector_compression_service.disable(kb_id)
+        with self.transaction() as session:
+            current = session.query(EmbeddingMigration).filter(EmbeddingMigration.id == migration_id).first()
+            kb = session.query(Knowledgebase).filter(Knowledgebase.id == kb_id).first()
+            if current is None or current.status != "running":
+                return False
+            if kb is None:
+                raise ValueError(f"知识库 {kb_id} 不存在")
+            layout = json.loads(kb.vector_sharding)
+            current.old_collections = json.dumps(all_shards(layout))
+            layout["shards"] = layout.pop("shadow")
+            layout["embedding_model"] = layout.pop("shadow_model")
+            kb.vector_sharding = json.dumps(layout, ensure_ascii=False)
+            current.phase = "cleanup"
+        vector_sharding_service.invalidate(kb_id)
+        logger.info(f"知识库 {kb_id} 已切换到 Embedding 模型 {row['target_model']}")
+        # 等待各进程的布局缓存过期，之后旧集合不再被读取
+        time.sleep(Config.VECTOR_SHARD_LAYOUT_TTL)
+        return True
+
+    # 删除整个集合
+    def _drop_collections(self, names: List[str]):
+        """
+        删除集合本身而不只是其中的分块：集合的向量维度在首次写入时固定，
+        留下空集合会导致之后同名分片（例如重新分片）无法写入新维度的向量
+        """
+        from app.services.vector_service import vector_service
+
+        inner = getattr(vector_service, "inner", vector_service)
+        for name in names:
+            inner.drop_collection(name)
+
+    # 阶段五：重建压缩索引，删除旧集合
+    def _cleanup(self, migration_id: str) -> bool:
+        row = self._row(migration_id)
+        kb_id = row["kb_id"]
+        with self.session() as session:
+            compression = (
+                session.query(Knowledgebase.vector_compression).filter(Knowledgebase.id == kb_id).scalar()
+            )
+        if compression and vector_compression_service.get_index(kb_id) is None:
+            vector_compression_service.enable(kb_id, compression)
+        self._drop_collections(json.loads(row["old_collections"] or "[]"))
+        return True
+
+    # 取消：移除影子集合
+    def _abort(self, row: dict):
+        kb_id = row["kb_id"]
+        shadow = None
+        with self.transaction() as session:
+            kb = session.query(Knowledgebase).filter(Knowledgebase.id == kb_id).first()
+            layout = json.loads(kb.vector_sharding) if kb and kb.vector_sharding else None
+            if layout and layout.get("shadow_model") == row["target_model"]:
+                shadow = layout.pop("shadow", None)
+                layout.pop("shadow_model", None)
+                kb.vector_sharding = json.dumps(layout, ensure_ascii=False)
+        vector_sharding_service.invalidate(kb_id)
+        if shadow:
+            # 等待各进程停止双写后再删除影子集合
+            time.sleep(Config.VECTOR_SHARD_LAYOUT_TTL)
+            self._drop_collections(shadow)
+        self._update(row["id"], status="cancelled", finished_at=func.now())
+        logger.info(f"Embedding 模型迁移 {row['id']} 已取消: 知识库 {kb_id}")
+
+
+# 创建全局 Embedding 模型迁移服务实例
+embedding_migration_service = EmbeddingMigrationService()
+
+
+# 命令行入口
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RAG Lite Embedding 模型迁移")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    status = subparsers.add_parser("status", help="查看迁移进度")
+    status.add_argument("--kb-id", help="知识库ID")
+    start = subparsers.add_parser("start", help="开始等待中的迁移")
+    start.add_argument("kb_ids", nargs="*", help="知识库ID（默认全部）")
+    subparsers.add_parser("run", help="在前台执行全部待处理的迁移")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "status":
+        result = embedding_migration_service.list(kb_id=args.kb_id)
+    elif args.command == "start":
+        result = embedding_migration_service.start(args.kb_ids or None)
+    else:
+        result = {"processed": embedding_migration_service.run_pending()}
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
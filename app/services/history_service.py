@@ -0,0 +1,250 @@
+"""
+对话历史服务
+为问答读取会话的滚动摘要和最近消息，并在回答完成后异步更新摘要
+"""
+
+# 导入上下文复制工具，用于把当前请求的 trace 带入线程池
+import contextvars
+
+# 导入线程模块
+import threading
+
+# 导入线程池，用于异步更新摘要
+from concurrent.futures import ThreadPoolExecutor
+
+# 导入类型注解
+from typing import Optional
+
+# 导入 LangChain 消息类型
+from langchain_core.messages import HumanMessage, SystemMessage
+
+# 导入 SQL 查询构造工具，用于一次性统计旧会话的消息数
+from sqlalchemy import func, select
+
+# 导入基础服务类
+from app.services.base_service import BaseService
+
+# 导入聊天会话服务
+from app.services.chat_session_service import session_service
+
+# 导入设置服务
+from app.services.settings_service import settings_service
+
+# 导入聊天会话与消息模型
+from app.models.chat_session import ChatSession
+from app.models.chat_message import ChatMessage
+
+# 导入 LLM 工厂
+from app.utils.llm_factory import LLMFactory
+
+# 导入配置
+from app.config import Config
+
+# 导入链路追踪装饰器
+from app.utils.tracing import traced
+
+# 导入历史窗口规则，摘要范围与问答时放入提示词的窗口保持一致
+from app.utils.history import count_window_messages
+
+# 摘要使用的系统提示词
+SUMMARY_SYSTEM_PROMPT = (
+    "你负责压缩对话历史。请把已有摘要和新的对话合并成一份简洁的中文摘要，"
+    "保留用户的目标、已确认的事实、约定和未解决的问题，省略寒暄，不要编造内容。"
+)
+
+
+class HistoryService(BaseService[ChatSession]):
+    """对话历史服务"""
+
+    def __init__(self):
+        """初始化服务"""
+        super().__init__()
+        # 摘要任务在后台线程中执行，不占用请求路径
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        # 正在更新摘要的会话，避免同一会话重复提交任务
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    # 读取问答所需的历史
+    @traced("history.load")
+    def load(self, session_id: str, user_id: str = None) -> dict:
+        """
+        读取会话摘要和最近的、尚未摘要的消息（已摘要的消息由摘要覆盖，不重复读取）
+        Args:
+            session_id: 会话ID
+            user_id: 用户ID（可选，用于验证权限）
+
+        Returns:
+            {"summary": 摘要或 None, "messages": 按时间升序的最近消息}
+        """
+        chat_session = session_service.get_session_by_id(session_id, user_id)
+        if not chat_session:
+            return {"summary": None, "messages": []}
+        messages = session_service.get_recent_messages(
+            session_id, user_id, limit=Config.HISTORY_MAX_MESSAGES
+        )
+        counts = self._counts(session_id)
+        if counts is None:
+            return {"summary": None, "messages": []}
+        total, summarized = counts
+        unsummarized = max(total - summarized, 0)
+        if unsummarized < len(messages):
+            messages = messages[len(messages) - unsummarized :]
+        return {"summary": chat_session.get("summary"), "messages": messages}
+
+    # 读取会话的消息总数和已摘要消息数
+    def _counts(self, session_id: str) -> Optional[tuple]:
+        """
+        按主键读取会话的消息总数和已摘要消息数，代价与会话长度无关；
+        旧会话的消息总数为空时统计一次并写回，之后由写入消息的事务累加
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            (消息总数, 已摘要消息数)，会话不存在时返回 None
+        """
+        with self.session() as session:
+            row = (
+                session.query(ChatSession.message_count, ChatSession.summarized_count)
+                .filter_by(id=session_id)
+                .first()
+            )
+        if row is None:
+            return None
+        total, summarized = row
+        if total is None:
+            with self.transaction() as session:
+                # 单条 UPDATE 完成统计和写回，只在仍为空时写入，避免覆盖并发写入后的累加结果
+                session.query(ChatSession).filter(
+                    ChatSession.id == session_id, ChatSession.message_count.is_(None)
+                ).update(
+                    {
+                        ChatSession.message_count: select(func.count(ChatMessage.id))
+                        .where(ChatMessage.session_id == session_id)
+                        .scalar_subquery()
+                    },
+                    synchronize_session=False,
+                )
+                total = (
+                    session.query(ChatSession.message_count).filter_by(id=session_id).scalar()
+                )
+        return total or 0, summarized or 0
+
+    # 提交异步摘要任务
+    def schedule_summary(self, session_id: str):
+        """在后台线程中检查并更新会话摘要"""
+        with self._lock:
+            if session_id in self._pending:
+                return
+            self._pending.add(session_id)
+        future = self.executor.submit(
+            contextvars.copy_context().run, self._summarize_task, session_id
+        )
+        future.add_done_callback(lambda f: self._pending.discard(session_id))
+
+    # 摘要任务入口，捕获所有异常避免影响线程池
+    def _summarize_task(self, session_id: str):
+        try:
+            self.summarize(session_id)
+        except Exception as e:
+            self.logger.error(f"更新会话摘要失败: {session_id}, 错误: {e}", exc_info=True)
+
+    # 更新会话摘要
+    @traced("history.summarize")
+    def summarize(self, session_id: str) -> Optional[str]:
+        """
+        把已滑出历史窗口（最近 HISTORY_MAX_MESSAGES 条未摘要消息中 token 预算能容纳的部分）的消息合并进会话摘要
+        有消息滑出窗口时立即摘要，并一次至少摘要 HISTORY_SUMMARY_BATCH 条（保留最后一轮问答），
+        腾出预算，避免之后每轮都触发摘要
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            更新后的摘要，未更新时返回 None
+        """
+        # 先写入写缓冲中该会话的记录，保证计数包含最新的问答
+        session_service.flush_pending(session_id)
+        counts = self._counts(session_id)
+        if counts is None:
+            return None
+        total, _ = counts
+        with self.session() as session:
+            chat_session = session.query(ChatSession).filter_by(id=session_id).first()
+            if not chat_session:
+                return None
+            summary = chat_session.summary
+            summarized = chat_session.summarized_count or 0
+            unsummarized = total - summarized
+            if unsummarized <= 0:
+                return None
+            # 最近的未摘要消息中，问答时能放进历史窗口的条数
+            recent = (
+                session.query(ChatMessage.role, ChatMessage.content)
+                .filter_by(session_id=session_id)
+                .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+                .limit(min(unsummarized, Config.HISTORY_MAX_MESSAGES))
+                .all()
+            )
+            kept = count_window_messages(
+                [{"role": role, "content": content} for role, content in reversed(recent)]
+            )
+            # 已滑出窗口、还未摘要的消息数量
+            pending = unsummarized - kept
+            if pending <= 0:
+                return None
+            messages = (
+                session.query(ChatMessage)
+                .filter_by(session_id=session_id)
+                .order_by(ChatMessage.created_at, ChatMessage.id)
+                .offset(summarized)
+                .limit(max(pending, min(Config.HISTORY_SUMMARY_BATCH, unsummarized - 2)))
+                .all()
+            )
+            transcript = "\n".join(
+                f"{'助手' if m.role == 'assistant' else '用户'}：{m.content or ''}"
+                for m in messages
+            )
+
+        # 在数据库会话之外调用 LLM，避免长时间占用连接
+        llm = LLMFactory.create_llm(
+            settings_service.get(),
+            temperature=0.2,
+            max_tokens=Config.HISTORY_SUMMARY_MAX_TOKENS,
+        )
+        prompt = f"已有摘要：\n{summary or '（无）'}\n\n新的对话：\n{transcript}\n\n请输出更新后的摘要。"
+        result = llm.invoke([SystemMessage(content=SUMMARY_SYSTEM_PROMPT), HumanMessage(content=prompt)])
+        new_summary = (getattr(result, "content", None) or str(result)).strip()
+        if not new_summary:
+            return None
+
+        # 只有摘要进度未被其他任务推进时才写入（比较并设置）
+        with self.transaction() as session:
+            updated = (
+                session.query(ChatSession)
+                .filter(ChatSession.id == session_id)
+                .filter(
+                    (ChatSession.summarized_count == summarized)
+                    if summarized
+                    else (
+                        (ChatSession.summarized_count == 0)
+                        | (ChatSession.summarized_count.is_(None))
+                    )
+                )
+                .update(
+                    {
+                        ChatSession.summary: new_summary,
+                        ChatSession.summarized_count: summarized + len(messages),
+                    },
+                    synchronize_session=False,
+                )
+            )
+        if updated:
+            self.logger.info(
+                f"已更新会话摘要: {session_id}, 新增摘要消息 {len(messages)} 条"
+            )
+            return new_summary
+        return None
+
+
+# 单例: 对话历史服务对象
+history_service = HistoryService()
@@ -0,0 +1,484 @@
+"""
+知识库导出与导入
+把整个知识库（知识库和文档记录、存储中的原始文件、分块文本、元数据和向量）打包为一个 tar 归档，
+在另一个环境中导入时直接把向量批量写入向量库，不重新解析文档、不重新计算 Embedding
+
+归档格式（未压缩的 tar，按顺序流式写入和读取，不需要随机访问）：
+    manifest.json            格式版本、知识库记录、文档记录、Embedding 模型、向量类型、分片布局
+    cover/<文件名>            知识库封面图片（可选）
+    files/<doc_id>/<文件名>   文档的原始文件
+    chunks/<序号>.npy         一批分块的向量矩阵（float32 或 float16）
+    chunks/<序号>.jsonl       同一批分块的 {"id", "text", "metadata"}，行顺序与向量矩阵一致
+导入时为知识库和文档生成新的ID（分块ID和元数据随之改写），同一个归档可以重复导入
+
+命令行（使用当前配置 .env）：
+    python -m app.services.kb_archive_service export <知识库ID> kb.tar [--dtype float16]
+    python -m app.services.kb_archive_service import kb.tar --user-id <用户ID> [--name 新名称]
+"""
+
+# 导入命令行参数解析模块
+import argparse
+
+# 导入内存字节流
+import io
+
+# 导入 JSON 模块
+import json
+
+# 导入路径处理模块
+import os
+
+# 导入 tar 归档模块
+import tarfile
+
+# 导入时间模块
+import time
+
+# 导入 uuid 模块，用于生成新的ID
+import uuid
+
+# 导入日期时间模块
+from datetime import datetime
+
+# 导入类型注解
+from typing import BinaryIO, Dict, List, Optional
+
+# 导入数值计算库
+import numpy as np
+
+# 导入配置
+from app.config import Config
+
+# 导入知识库和文档模型
+from app.models.knowledgebase import Knowledgebase
+from app.models.document import Document as DocumentModel
+
+# 导入基础服务类
+from app.services.base_service import BaseService
+
+# 导入知识库服务（导入失败时清理半成品知识库）
+from app.services.knowledgebase_service import kb_service
+
+# 导入设置服务，用于记录 Embedding 模型
+from app.services.settings_service import settings_service
+
+# 导入存储服务
+from app.services.storage_service import storage_service
+
+# 导入向量压缩服务
+from app.services.vector_compression import vector_compression_service
+
+# 导入向量服务
+from app.services.vector_service import vector_service
+
+# 导入向量分片服务
+from app.services.vector_sharding import vector_sharding_service
+
+# 导入分片集合名工具
+from app.services.vectordb.sharded import shard_name
+
+# 导入 Embedding 模型迁移服务，用于读取当前模型标识
+from app.services.embedding_migration import embedding_migration_service
+
+# 导入 Embedding 模型标识
+from app.utils.embedding_factory import embedding_model_key
+
+# 归档格式版本
+FORMAT_VERSION = 1
+# 支持的向量存储类型
+DTYPES = ("float32", "float16")
+# 导出时保留的文档字段
+_DOCUMENT_FIELDS = (
+    "id", "name", "file_type", "file_size", "status", "chunk_count", "error_message", "tags", "created_at",
+)
+
+
+# 知识库导出导入服务
+class KnowledgebaseArchiveService(BaseService[Knowledgebase]):
+    """知识库归档的导出与导入"""
+
+    # 导出知识库
+    def export(self, kb_id: str, fileobj: BinaryIO, dtype: str = "float32") -> dict:
+        """
+        把知识库导出为归档，按顺序写入 fileobj（可以是不支持 seek 的流）
+        Args:
+            kb_id: 知识库ID
+            fileobj: 可写的二进制文件对象
+            dtype: 向量存储类型，float16 体积减半（检索精度几乎不受影响）
+
+        Returns:
+            导出统计：文档数、文件数、分块数、分块批数
+        """
+        if dtype not in DTYPES:
+            raise ValueError(f"不支持的向量类型: {dtype}（可选 {', '.join(DTYPES)}）")
+        with self.session() as session:
+            kb = session.query(Knowledgebase).filter(Knowledgebase.id == kb_id).first()
+            if not kb:
+                raise ValueError(f"知识库{kb_id}不存在")
+            kb_dict = kb.to_dict()
+            layout = json.loads(kb.vector_sharding) if kb.vector_sharding else None
+            documents = (
+                session.query(DocumentModel)
+                .filter(DocumentModel.kb_id == kb_id)
+                .order_by(DocumentModel.created_at)
+                .all()
+            )
+            doc_rows = [{k: v for k, v in doc.to_dict().items() if k in _DOCUMENT_FIELDS} for doc in documents]
+            file_paths = {doc.id: doc.file_path for doc in documents}
+
+        # 记录向量实际所属的模型（迁移切换之前与当前设置不同）
+        model_key = (layout or {}).get("embedding_model") or embedding_model_key(settings_service.get())
+        provider, _, model_name = model_key.partition(":")
+        manifest = {
+            "format": "rag-lite-kb",
+            "version": FORMAT_VERSION,
+            "exported_at": int(time.time()),
+            "knowledgebase": {
+                key: kb_dict.get(key)
+                for key in ("id", "name", "description", "chunk_size", "chunk_overlap", "vector_compression")
+            },
+            "cover_image": os.path.basename(kb_dict["cover_image"]) if kb_dict.get("cover_image") else None,
+            "sharding": layout,
+            "documents": doc_rows,
+            "embedding": {"provider": provider, "model_name": model_name},
+            "dtype": dtype,
+        }
+        stats = {"documents": len(doc_rows), "files": 0, "chunks": 0, "parts": 0}
+        with tarfile.open(fileobj=fileobj, mode="w|") as tar:
+            _add_member(tar, "manifest.json", json.dumps(manifest, ensure_ascii=False).encode("utf-8"))
+            # 封面和原始文件
+            if manifest["cover_image"]:
+                data = self._download(kb_dict["cover_image"])
+                if data is not None:
+                    _add_member(tar, f"cover/{manifest['cover_image']}", data)
+            for row in doc_rows:
+                data = self._download(file_paths[row["id"]])
+                if data is not None:
+                    _add_member(tar, f"files/{row['id']}/{row['name']}", data)
+                    stats["files"] += 1
+            # 分块按批写入，每批一个向量矩阵和一个文本文件
+            collection_name = f"kb_{kb_id}"
+            part: Dict[str, list] = {"vectors": [], "rows": []}
+            for ids, embeddings, metadatas in vector_service.iter_embeddings(collection_name):
+                # iter_embeddings 不返回文本，按ID批量读取
+                texts = {doc.id: doc.page_content for doc in vector_service.get_by_ids(collection_name, ids)}
+                keep = [i for i, chunk_id in enumerate(ids) if chunk_id in texts]
+                # 向量按批转换为紧凑的数组，避免大量 Python 浮点对象占用内存
+                part["vectors"].append(np.asarray(embeddings, dtype=dtype)[keep])
+                part["rows"].extend(
+                    {"id": ids[i], "text": texts[ids[i]], "metadata": _clean_metadata(metadatas[i])} for i in keep
+                )
+                if len(part["rows"]) >= Config.KB_ARCHIVE_PART_ROWS:
+                    self._write_part(tar, stats, part, dtype)
+            if part["rows"]:
+                self._write_part(tar, stats, part, dtype)
+        self.logger.info(
+            f"已导出知识库 {kb_id}: 文档 {stats['documents']} 个, 文件 {stats['files']} 个, 分块 {stats['chunks']} 个"
+        )
+        return stats
+
+    # 写入一批分块
+    @staticmethod
+    def _write_part(tar: tarfile.TarFile, stats: dict, part: Dict[str, list], dtype: str):
+        buffer = io.BytesIO()
+        np.save(buffer, np.concatenate(part["vectors"]).astype(dtype, copy=False))
+        name = f"chunks/{stats['parts']:06d}"
+        _add_member(tar, f"{name}.npy", buffer.getvalue())
+        lines = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in part["rows"])
+        _add_member(tar, f"{name}.jsonl", lines.encode("utf-8"))
+        stats["parts"] += 1
+        stats["chunks"] += len(part["rows"])
+        part["vectors"].clear()
+        part["rows"].clear()
+
+    # 从存储读取文件，读取失败时只记录警告
+    def _download(self, file_path: Optional[str]) -> Optional[bytes]:
+        if not file_path:
+            return None
+        try:
+            return storage_service.download_file(file_path)
+        except Exception as e:
+            self.logger.warning(f"导出时读取文件失败: {file_path}, 错误: {e}")
+            return None
+
+    # 导入知识库
+    def import_archive(self, fileobj: BinaryIO, user_id: str, name: Optional[str] = None) -> dict:
+        """
+        从归档导入知识库（按顺序读取 fileobj，可以是上传文件的流）
+        知识库和文档使用新的ID，向量直接写入向量库，不重新计算 Embedding
+        Args:
+            fileobj: 可读的二进制文件对象
+            user_id: 导入后知识库的所有者
+            name: 新知识库名称（默认沿用归档中的名称）
+
+        Returns:
+            新知识库的字典
+        """
+        kb_id = None
+        try:
+            with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+                members = iter(tar)
+                member = next(members, None)
+                if member is None or member.name != "manifest.json":
+                    raise ValueError("归档的第一个文件必须是 manifest.json")
+                manifest = self._check_manifest(json.loads(_read_member(tar, member)))
+                kb_id, doc_map = self._create_records(manifest, user_id, name)
+                doc_names = {row["id"]: row["name"] for row in manifest["documents"]}
+                stats = {"files": 0, "chunks": 0}
+                vectors = None
+                for member in members:
+                    if not member.isfile():
+                        continue
+                    data = _read_member(tar, member)
+                    if member.name.startswith("cover/"):
+                        self._restore_cover(kb_id, member.name[len("cover/"):], data)
+                    elif member.name.startswith("files/"):
+                        # 文件名必须与清单中的文档名称一致（清单中的名称已校验不含路径），不能写到文档目录之外
+                        _, old_doc_id, filename = (member.name.split("/", 2) + ["", ""])[:3]
+                        if doc_names.get(old_doc_id) != filename:
+                            raise ValueError(f"归档中的文件 {member.name} 与清单中的文档不一致")
+                        storage_service.upload_file(f"documents/{kb_id}/{doc_map[old_doc_id]}/{filename}", data)
+                        stats["files"] += 1
+                    elif member.name.endswith(".npy"):
+                        vectors = np.load(io.BytesIO(data), allow_pickle=False)
+                    elif member.name.endswith(".jsonl"):
+                        if vectors is None:
+                            raise ValueError(f"{member.name} 缺少对应的向量文件")
+                        stats["chunks"] += self._load_part(kb_id, doc_map, vectors, data)
+                        vectors = None
+        except Exception as error:
+            # 导入失败时删除已创建的知识库（包括已写入的文件和向量）
+            if kb_id:
+                try:
+                    kb_service.delete(kb_id)
+                except Exception as e:
+                    self.logger.warning(f"清理导入失败的知识库 {kb_id} 时出错: {e}")
+            if isinstance(error, (tarfile.TarError, json.JSONDecodeError)):
+                raise ValueError(f"归档文件不完整或已损坏: {error}") from error
+            raise
+        # 全部写入后文档才可用
+        with self.transaction() as session:
+            session.query(DocumentModel).filter(
+                DocumentModel.kb_id == kb_id, DocumentModel.status == "processing"
+            ).update({"status": "completed"}, synchronize_session=False)
+        # 压缩索引从导入的向量构建
+        if manifest["knowledgebase"].get("vector_compression"):
+            vector_compression_service.enable(kb_id, manifest["knowledgebase"]["vector_compression"])
+        self.logger.info(f"已导入知识库 {kb_id}: 文档 {len(doc_map)} 个, 文件 {stats['files']} 个, 分块 {stats['chunks']} 个")
+        return kb_service.get_by_id(kb_id)
+
+    # 校验归档清单
+    @staticmethod
+    def _check_manifest(manifest: dict) -> dict:
+        if not isinstance(manifest, dict) or manifest.get("format") != "rag-lite-kb":
+            raise ValueError("不是知识库归档文件")
+        version = manifest.get("version", 0)
+        if not isinstance(version, int):
+            raise ValueError(f"归档清单不完整或已损坏: version={version!r}")
+        if version > FORMAT_VERSION:
+            raise ValueError(f"归档格式版本 {version} 高于当前支持的版本 {FORMAT_VERSION}")
+        # 导入时直接读取的字段必须存在且类型正确，被截断或手工修改的清单按无效归档处理
+        source = manifest.get("knowledgebase")
+        if not isinstance(source, dict) or not isinstance(source.get("name"), str):
+            raise ValueError("归档清单不完整或已损坏: knowledgebase")
+        if not isinstance(manifest.get("embedding"), dict):
+            raise ValueError("归档清单不完整或已损坏: embedding")
+        sharding = manifest.get("sharding")
+        if sharding is not None and not (
+            isinstance(sharding, dict)
+            and isinstance(sharding.get("shards"), list)
+            and isinstance(sharding.get("assignments") or {}, dict)
+        ):
+            raise ValueError("归档清单不完整或已损坏: sharding")
+        documents = manifest.get("documents")
+        if not isinstance(documents, list) or not all(isinstance(row, dict) for row in documents):
+            raise ValueError("归档清单不完整或已损坏: documents")
+        doc_ids = set()
+        for row in documents:
+            if not isinstance(row.get("id"), str) or row["id"] in doc_ids:
+                raise ValueError(f"归档中的文档ID不合法或重复: {row.get('id')!r}")
+            doc_ids.add(row["id"])
+            if not isinstance(row.get("file_type"), str):
+                raise ValueError(f"归档中的文档 {row['id']} 缺少文件类型")
+            if row.get("created_at") is not None and not isinstance(row["created_at"], str):
+                raise ValueError(f"归档中的文档 {row['id']} 创建时间不合法")
+            # 文档名称用于拼接存储路径，不能包含路径
+            if not _is_plain_filename(row.get("name")):
+                raise ValueError(f"归档中的文档名称不合法: {row.get('name')!r}")
+        # 向量只在同一个 Embedding 模型下可用
+        current = embedding_migration_service.current_model_key()
+        exported = embedding_model_key(
+            {
+                "embedding_provider": manifest["embedding"].get("provider"),
+                "embedding_model_name": manifest["embedding"].get("model_name"),
+            }
+        )
+        if exported != current:
+            raise ValueError(
+                f"归档的 Embedding 模型 {exported} 与当前配置 {current} 不一致，"
+                f"请先切换到相同的模型再导入"
+            )
+        return manifest
+
+    # 创建知识库和文档记录
+    def _create_records(self, manifest: dict, user_id: str, name: Optional[str]):
+        source = manifest["knowledgebase"]
+        kb_id = uuid.uuid4().hex[:32]
+        doc_map = {row["id"]: uuid.uuid4().hex[:32] for row in manifest["documents"]}
+        with self.transaction() as session:
+            session.add(
+                Knowledgebase(
+                    id=kb_id,
+                    user_id=user_id,
+                    name=name or source["name"],
+                    description=source.get("description"),
+                    chunk_size=source.get("chunk_size") or 512,
+                    chunk_overlap=source.get("chunk_overlap") if source.get("chunk_overlap") is not None else 50,
+                    vector_compression=source.get("vector_compression"),
+                    vector_sharding=self._remap_sharding(manifest.get("sharding"), kb_id, doc_map),
+                )
+            )
+            session.flush()
+            for row in manifest["documents"]:
+                doc_id = doc_map[row["id"]]
+                # 已完成的文档在向量写入后才标记为完成，其他状态的文档需要重新处理
+                status = "processing" if row.get("status") == "completed" else "pending"
+                session.add(
+                    DocumentModel(
+                        id=doc_id,
+                        kb_id=kb_id,
+                        name=row["name"],
+                        file_path=f"documents/{kb_id}/{doc_id}/{row['name']}",
+                        file_type=row["file_type"],
+                        file_size=row.get("file_size") or 0,
+                        status=status,
+                        chunk_count=row.get("chunk_count") if status == "processing" else None,
+                        tags=row.get("tags"),
+                        created_at=datetime.fromisoformat(row["created_at"]) if row.get("created_at") else None,
+                    )
+                )
+        return kb_id, doc_map
+
+    # 把分片布局改写到新知识库
+    @staticmethod
+    def _remap_sharding(layout: Optional[dict], kb_id: str, doc_map: Dict[str, str]) -> str:
+        layout = dict(layout or vector_sharding_service.new_layout(kb_id, "hash", 1))
+        layout["shards"] = [shard_name(f"kb_{kb_id}", i) for i in range(len(layout["shards"]))]
+        # 正在清空的分片中的文档按新布局写入，进行中的模型迁移不带到新知识库
+        layout.pop("draining", None)
+        layout.pop("shadow", None)
+        layout.pop("shadow_model", None)
+        # 清单已校验与当前模型一致
+        layout["embedding_model"] = embedding_migration_service.current_model_key()
+        layout["assignments"] = {
+            doc_map[doc_id]: index
+            for doc_id, index in (layout.get("assignments") or {}).items()
+            if doc_id in doc_map and index < len(layout["shards"])
+        }
+        return json.dumps(layout, ensure_ascii=False)
+
+    # 恢复封面图片
+    def _restore_cover(self, kb_id: str, filename: str, data: bytes):
+        cover_path = f"covers/{kb_id}{os.path.splitext(filename)[1].lower()}"
+        storage_service.upload_file(cover_path, data)
+        with self.transaction() as session:
+            session.query(Knowledgebase).filter(Knowledgebase.id == kb_id).update(
+                {"cover_image": cover_path}, synchronize_session=False
+            )
+
+    # 写入一批分块
+    @staticmethod
+    def _load_part(kb_id: str, doc_map: Dict[str, str], vectors: np.ndarray, data: bytes) -> int:
+        rows = [json.loads(line) for line in data.decode("utf-8").splitlines() if line]
+        if len(rows) != len(vectors):
+            raise ValueError(f"分块数 {len(rows)} 与向量数 {len(vectors)} 不一致")
+        ids: List[str] = []
+        texts: List[str] = []
+        metadatas: List[dict] = []
+        keep: List[int] = []
+        for i, row in enumerate(rows):
+            metadata = row.get("metadata") or {}
+            old_doc_id = metadata.get("doc_id")
+            # 不属于任何文档记录的分块不导入
+            if old_doc_id not in doc_map:
+                continue
+            # 分块ID为 "<doc_id>_<序号>"，随文档ID一起改写
+            chunk_id = doc_map[old_doc_id] + row["id"][len(old_doc_id):] if row["id"].startswith(old_doc_id) else row["id"]
+            metadata = dict(metadata, doc_id=doc_map[old_doc_id], id=chunk_id, chunk_id=chunk_id)
+            ids.append(chunk_id)
+            texts.append(row["text"])
+            metadatas.append(metadata)
+            keep.append(i)
+        vectors = vectors[keep].astype(np.float32)
+        batch = Config.KB_ARCHIVE_WRITE_BATCH
+        for start in range(0, len(ids), batch):
+            end = start + batch
+            vector_service.add_embeddings(
+                f"kb_{kb_id}", texts[start:end], vectors[start:end].tolist(), metadatas[start:end], ids[start:end]
+            )
+        return len(ids)
+
+
+# 向归档追加一个文件
+def _add_member(tar: tarfile.TarFile, name: str, data: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+# 是否为不含路径的文件名
+def _is_plain_filename(name) -> bool:
+    return (
+        isinstance(name, str)
+        and name not in ("", ".", "..")
+        and os.path.basename(name) == name
+        and not any(char in name for char in ("/", "\\", "\0"))
+    )
+
+
+# 读取归档中的一个文件
+def _read_member(tar: tarfile.TarFile, member: tarfile.TarInfo) -> bytes:
+    handle = tar.extractfile(member)
+    return handle.read() if handle else b""
+
+
+# 元数据中的列表字段还原为列表（Milvus 中保存为 ",a,b," 形式的字符串）
+def _clean_metadata(metadata: Optional[dict]) -> dict:
+    metadata = dict(metadata or {})
+    tags = metadata.get("tags")
+    if isinstance(tags, str):
+        metadata["tags"] = [tag for tag in tags.split(",") if tag]
+    return metadata
+
+
+# 创建全局知识库归档服务实例
+kb_archive_service = KnowledgebaseArchiveService()
+
+
+# 命令行入口
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RAG Lite 知识库导出与导入")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export", help="导出知识库")
+    export.add_argument("kb_id", help="知识库ID")
+    export.add_argument("path", help="归档输出路径")
+    export.add_argument("--dtype", choices=DTYPES, default="float32", help="向量存储类型")
+    restore = subparsers.add_parser("import", help="导入知识库")
+    restore.add_argument("path", help="归档路径")
+    restore.add_argument("--user-id", required=True, help="导入后知识库的所有者")
+    restore.add_argument("--name", help="新知识库名称（默认沿用归档中的名称）")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.command == "export":
+        with open(args.path, "wb") as f:
+            result = kb_archive_service.export(args.kb_id, f, dtype=args.dtype)
+    else:
+        with open(args.path, "rb") as f:
+            result = kb_archive_service.import_archive(f, args.user_id, name=args.name)
+    print(json.dumps({"result": result, "seconds": round(time.perf_counter() - start, 3)}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ from app.models.document import Document as DocumentModel
 from typing import Optional, Dict
 
 import os
+import json
 from app.config import Config
 
 # 导入存储服务
@@ -18,6 +19,15 @@ from app.services.storage_service import storage_service
 # 导入向量服务
 from app.services.vector_service import vector_service
 
+# 导入向量压缩服务
+from app.services.vector_compression import CompressionSpec, vector_compression_service
+
+# 导入向量分片服务
+from app.services.vector_sharding import vector_sharding_service
+
+# 导入 Embedding 模型迁移服务
+from app.services.embedding_migration import embedding_migration_service
+
 from typing import List
 
 # 定义KnowledgebaseService服务类，继承自BaseService，泛型参数为Knowledgebase
@@ -34,6 +44,8 @@ class KnowledgebaseService(BaseService[Knowledgebase]):
         chunk_overlap: int = 50,
         cover_image_data: bytes = None,
         cover_image_filename: str = None,
+        vector_compression: str = None,
+        vector_sharding: str = None,
     ) -> dict:
         """
         创建知识库
@@ -44,6 +56,8 @@ class KnowledgebaseService(BaseService[Knowledgebase]):
         :param chunk_overlap: 分块重叠
         :param cover_image_data: 封面图片数据（可选）
         :param cover_image_filename: 封面图片文件名（可选）
+        :param vector_compression: 向量压缩模式（可选），例如 "pca:128+int8"
+        :param vector_sharding: 向量分片模式（可选），例如 "hash:8"、"time:4"；已有知识库通过重平衡命令修改
         :return:
             创建的知识库字典
 
@@ -51,6 +65,10 @@ class KnowledgebaseService(BaseService[Knowledgebase]):
             cover_image_data:
         """
         cover_image_path = None
+        # 校验并规范化向量压缩模式
+        vector_compression = self._normalize_compression(vector_compression)
+        # 校验向量分片模式
+        sharding = vector_sharding_service.parse(vector_sharding)
         # 处理封面图片上传
         if cover_image_data and cover_image_filename:
             # 验证文件类型
@@ -81,11 +99,17 @@ class KnowledgebaseService(BaseService[Knowledgebase]):
                 description=description,
                 chunk_size=chunk_size,
                 chunk_overlap=chunk_overlap,
+                vector_compression=vector_compression,
             )
             # 将知识库对象添加到session
             session.add(kb)
             # 刷新session，生成知识库ID， 刷新以获取 ID，但不提交
             session.flush()
+            # 新知识库没有向量，直接写入分片布局，并记录向量所属的 Embedding 模型
+            layout = vector_sharding_service.new_layout(kb.id, *(sharding or ("hash", 1)))
+            layout["embedding_model"] = embedding_migration_service.current_model_key()
+            kb.vector_sharding = json.dumps(layout)
+            session.flush()
             # 上传封面图片（如果有）
             if cover_image_data and cover_image_filename:
                 try:
@@ -122,8 +146,19 @@ class KnowledgebaseService(BaseService[Knowledgebase]):
             kb_dict = kb.to_dict()
             # 记录创建知识库的日志
             self.logger.info(f"创建了知识库，ID: {kb.id}")
-            # 返回知识库字典信息
-            return kb_dict
+        # 新知识库还没有向量，建立空的压缩索引，后续写入的分块同步压缩
+        if vector_compression:
+            vector_compression_service.enable(kb_dict["id"], vector_compression)
+        # 返回知识库字典信息
+        return kb_dict
+
+    # 校验并规范化向量压缩模式
+    @staticmethod
+    def _normalize_compression(value: Optional[str]) -> Optional[str]:
+        """空字符串或 "none" 表示不压缩，返回 None；否则返回规范化的压缩模式字符串"""
+        if value is None or str(value).strip().lower() in ("", "none"):
+            return None
+        return str(CompressionSpec.parse(str(value)))
 
     # 定义获取知识库列表的方法
     def list(
@@ -222,25 +257,21 @@ class KnowledgebaseService(BaseService[Knowledgebase]):
             cover_image_path = kb.cover_image if kb.cover_image else None
             # 获取知识库下的所有文档
             documents:List[DocumentModel] = session.query(DocumentModel).filter(DocumentModel.kb_id == kb_id).all()
-            doc_ids = [doc.id for doc in documents]
             doc_file_paths = [doc.file_path for doc in documents if doc.file_path]
 
         collection_name = f"kb_{kb_id}"
-        # 2. 删除向量数据库集合中的所有向量数据
-        if doc_ids:
-            try:
-                # 逐个删除每个文档的向量数据
-                for doc_id in doc_ids:
-                    try:
-                        vector_service.delete_documents(
-                            collection_name=collection_name,
-                            filter={"doc_id":doc_id}
-                        )
-                    except Exception as e:
-                        self.logger.warning(f"删除文档{doc_id}的向量数据失败:{e}")
-                self.logger.info(f"已删除知识库{kb_id}的向量数据")
-            except Exception as e:
-                self.logger.warning(f"删除向量数据失败:{e}")
+        # 停止知识库的 Embedding 模型迁移（影子集合随知识库的集合一起删除）
+        embedding_migration_service.stop_kb(kb_id)
+        # 删除向量压缩索引
+        vector_compression_service.disable(kb_id)
+        # 2. 删除知识库的全部向量集合（所有分片，以及模型迁移中的影子集合）
+        try:
+            # 读取最新的分片布局，不使用缓存
+            vector_sharding_service.invalidate(kb_id)
+            vector_service.drop_collection(collection_name)
+            self.logger.info(f"已删除知识库{kb_id}的向量数据")
+        except Exception as e:
+            self.logger.warning(f"删除向量数据失败:{e}")
         # 3. 删除所有文档的存储文件
         for file_path in doc_file_paths:
             if file_path:
@@ -294,6 +325,9 @@ class KnowledgebaseService(BaseService[Knowledgebase]):
         Returns:
 
         """
+        # 向量压缩模式单独处理：需要重建或删除压缩索引，空值表示关闭压缩
+        compression_changed = "vector_compression" in kwargs
+        vector_compression = self._normalize_compression(kwargs.pop("vector_compression", None))
         # 开启数据库事务
         with self.transaction() as session:
             # 查询指定ID的知识库对象
@@ -301,6 +335,9 @@ class KnowledgebaseService(BaseService[Knowledgebase]):
             # 如果未找到知识库，则返回None
             if not kb:
                 return None
+            # 压缩模式没有变化时不重建索引
+            if compression_changed and vector_compression == kb.vector_compression:
+                compression_changed = False
             # 处理封面图片更新
             old_cover_path = kb.cover_image if kb.cover_image else None
             if delete_cover:
@@ -373,6 +410,13 @@ class KnowledgebaseService(BaseService[Knowledgebase]):
                 if hasattr(kb, key) and (key == "cover_image" or value is not None):
                     # 设置该字段的新值
                     setattr(kb, key, value)
+            if compression_changed:
+                # 先按已有向量重建（或删除）压缩索引，失败时不更新数据库记录
+                if vector_compression:
+                    vector_compression_service.enable(kb_id, vector_compression)
+                else:
+                    vector_compression_service.disable(kb_id)
+                kb.vector_compression = vector_compression
             # 刷新session，保证对象属性为最新状态
             session.flush()
             # 刷新对象，避免未提交前读取到旧数据
@@ -0,0 +1,220 @@
+"""
+查询改写服务
+在知识库检索前，结合最近的对话把追问（如“那第二步呢？”）改写为独立完整的检索问题
+改写使用可单独配置的小模型，结果按 (历史哈希, 问题) 缓存，超出延迟预算时直接使用原问题
+"""
+
+# 导入上下文复制工具，用于把当前请求的 trace 带入线程池
+import contextvars
+
+# 导入哈希模块
+import hashlib
+
+# 导入 JSON 模块
+import json
+
+# 导入日志模块
+import logging
+
+# 导入线程模块
+import threading
+
+# 导入时间模块
+import time
+
+# 导入有序字典，用于实现 LRU 缓存
+from collections import OrderedDict
+
+# 导入线程池与超时异常
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# 导入类型注解
+from typing import List, Optional
+
+# 导入 LangChain 消息类型
+from langchain_core.messages import HumanMessage, SystemMessage
+
+# 导入设置服务
+from app.services.settings_service import settings_service
+
+# 导入 LLM 工厂
+from app.utils.llm_factory import LLMFactory
+
+# 导入配置
+from app.config import Config
+
+# 导入查询改写指标
+from app.utils.metrics import QUERY_REWRITE_SECONDS, QUERY_REWRITE_TOTAL
+
+# 导入链路追踪工具
+from app.utils.tracing import span
+
+# 获取当前模块的日志记录器
+logger = logging.getLogger(__name__)
+
+# 改写使用的系统提示词
+REWRITE_SYSTEM_PROMPT = (
+    "你负责为知识库检索改写问题。根据对话历史，把用户最新的问题改写成一个不依赖上下文、"
+    "语义完整的检索问题，补全其中的指代和省略。只输出改写后的问题，不要回答问题，不要添加解释。"
+    "如果问题本身已经完整，原样输出。"
+)
+
+
+# 线程安全的 LRU 缓存
+class LRUCache:
+    """容量固定的线程安全 LRU 缓存"""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self._data: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，命中时移动到最近使用的位置"""
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: str, value: str):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+
+class QueryRewriteService:
+    """查询改写服务"""
+
+    def __init__(self):
+        """初始化服务"""
+        self.cache = LRUCache(Config.QUERY_REWRITE_CACHE_SIZE)
+        # 改写在独立线程中执行，便于在延迟预算内等待；超时的调用会继续完成并写入缓存
+        self.max_in_flight = max(1, Config.QUERY_REWRITE_MAX_IN_FLIGHT)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_in_flight, thread_name_prefix="query-rewrite"
+        )
+        # 进行中（含已超时但仍在等待 LLM）的调用占用名额，名额用完时不再排队，
+        # 避免超时的调用占满线程后，新的请求都在队列里等到超时
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+
+    # 计算缓存键
+    @staticmethod
+    def cache_key(question: str, history: List[dict], summary: Optional[str] = None) -> str:
+        """按 (历史哈希, 问题) 生成缓存键"""
+        payload = json.dumps(
+            {
+                "summary": summary or "",
+                "history": [[m.get("role"), m.get("content")] for m in history],
+            },
+            ensure_ascii=False,
+        )
+        history_hash = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        return f"{history_hash}:{question.strip()}"
+
+    # 构造改写模型的设置
+    @staticmethod
+    def _rewrite_settings() -> dict:
+        """在当前设置的基础上，用 QUERY_REWRITE_* 配置覆盖提供商和模型"""
+        settings = dict(settings_service.get())
+        if Config.QUERY_REWRITE_PROVIDER:
+            settings["llm_provider"] = Config.QUERY_REWRITE_PROVIDER
+        if Config.QUERY_REWRITE_MODEL:
+            settings["llm_model_name"] = Config.QUERY_REWRITE_MODEL
+        if Config.QUERY_REWRITE_BASE_URL:
+            settings["llm_base_url"] = Config.QUERY_REWRITE_BASE_URL
+        if Config.QUERY_REWRITE_API_KEY:
+            settings["llm_api_key"] = Config.QUERY_REWRITE_API_KEY
+        return settings
+
+    # 调用 LLM 改写并写入缓存
+    def _invoke(self, key: str, question: str, history: List[dict], summary: Optional[str]) -> str:
+        """调用改写模型，返回改写后的问题（结果不可用时返回原问题）"""
+        start = time.perf_counter()
+        llm = LLMFactory.create_llm(self._rewrite_settings(), temperature=0.0, max_tokens=128)
+        transcript = "\n".join(
+            f"{'助手' if m.get('role') == 'assistant' else '用户'}：{m.get('content') or ''}"
+            for m in history
+        )
+        if summary:
+            transcript = f"（较早对话摘要）{summary}\n{transcript}"
+        result = llm.invoke(
+            [
+                SystemMessage(content=REWRITE_SYSTEM_PROMPT),
+                HumanMessage(content=f"对话历史：\n{transcript}\n\n最新问题：{question}\n\n改写后的问题："),
+            ]
+        )
+        QUERY_REWRITE_SECONDS.observe(time.perf_counter() - start)
+        text = (getattr(result, "content", None) or "").strip()
+        # 只取第一行并去掉包裹的引号；结果为空或异常地长时视为不可用
+        rewritten = text.splitlines()[0].strip().strip("\"'“”「」") if text else ""
+        if not rewritten or len(rewritten) > len(question) * 4 + 200:
+            rewritten = question
+        self.cache.put(key, rewritten)
+        return rewritten
+
+    # 改写查询
+    def rewrite(
+        self,
+        question: str,
+        history: Optional[List[dict]] = None,
+        summary: Optional[str] = None,
+    ) -> str:
+        """
+        将追问改写为独立的检索问题
+        Args:
+            question: 用户最新的问题
+            history: 按时间升序的历史消息（只使用最近 QUERY_REWRITE_HISTORY_MESSAGES 条）
+            summary: 更早对话的摘要（可选）
+
+        Returns:
+            用于检索的问题；未启用、无历史、并发已满、超时或出错时返回原问题
+        """
+        history = [m for m in (history or []) if m.get("content")][
+            -Config.QUERY_REWRITE_HISTORY_MESSAGES :
+        ]
+        if not Config.QUERY_REWRITE_ENABLED or not history:
+            QUERY_REWRITE_TOTAL.labels(outcome="skipped").inc()
+            return question
+        key = self.cache_key(question, history, summary)
+        cached = self.cache.get(key)
+        if cached is not None:
+            QUERY_REWRITE_TOTAL.labels(outcome="cache_hit").inc()
+            return cached
+        with span("rag.rewrite") as rewrite_span:
+            if not self._slots.acquire(blocking=False):
+                QUERY_REWRITE_TOTAL.labels(outcome="busy").inc()
+                rewrite_span.set("outcome", "busy")
+                logger.info(f"查询改写并发已满（{self.max_in_flight}），使用原问题")
+                return question
+            try:
+                future = self.executor.submit(
+                    contextvars.copy_context().run, self._invoke, key, question, history, summary
+                )
+            except Exception:
+                self._slots.release()
+                raise
+            # 调用真正结束（而不是调用方等待超时）时才归还名额
+            future.add_done_callback(lambda f: self._slots.release())
+            try:
+                rewritten = future.result(timeout=Config.QUERY_REWRITE_TIMEOUT_MS / 1000)
+            except FutureTimeoutError:
+                QUERY_REWRITE_TOTAL.labels(outcome="timeout").inc()
+                rewrite_span.set("outcome", "timeout")
+                logger.info(f"查询改写超出延迟预算 {Config.QUERY_REWRITE_TIMEOUT_MS}ms，使用原问题")
+                return question
+            except Exception as e:
+                QUERY_REWRITE_TOTAL.labels(outcome="error").inc()
+                rewrite_span.set("outcome", "error")
+                logger.warning(f"查询改写失败，使用原问题: {e}")
+                return question
+            QUERY_REWRITE_TOTAL.labels(outcome="rewritten").inc()
+            rewrite_span.set("outcome", "rewritten")
+            return rewritten
+
+
+# 单例: 查询改写服务对象
+query_rewrite_service = QueryRewriteService()
@@ -5,8 +5,14 @@ RAG 服务
 # 导入日志模块
 import logging
 
+# 导入正则模块，用于关键词切分
+import re
+
+# 导入类型注解
+from typing import List, Dict, Optional
+
 # 导入Langchain的对话提示模板模块
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 # 导入自定义 LLM 工厂
 from app.utils.llm_factory import LLMFactory
@@ -14,9 +20,45 @@ from app.utils.llm_factory import LLMFactory
 # 导入设置服务
 from app.services.settings_service import settings_service
 
+# 导入向量数据库服务
+from app.services.vector_service import vector_service
+
+# 导入向量压缩服务
+from app.services.vector_compression import vector_compression_service
+
+# 导入元数据过滤条件
+from app.services.vectordb import filters
+
+# 导入查询改写服务
+from app.services.query_rewrite_service import query_rewrite_service
+
+# 导入 LLM 流式输出计量器
+from app.utils.metrics import StreamMeter
+
+# 导入链路追踪工具
+from app.utils.tracing import current_trace_id, span, traced
+
+# 导入历史消息构造工具与 token 估算工具
+from app.utils.history import build_history_messages, estimate_tokens
+
+# 导入 LLM 故障转移工具（内部经过限流）
+from app.utils.llm_failover import FailoverStream
+
+# 导入配置
+from app.config import Config
+
+# 导入取消令牌
+from app.utils.cancellation import CancelToken, GenerationCancelled
+
 # 设置日志对象
 logger = logging.getLogger(__name__)
 
+# 关键词切分正则：单个中文字符或连续的英文/数字
+_TOKEN_PATTERN = re.compile(r"[\u4e00-\u9fff]|[a-zA-Z0-9]+")
+
+# RRF 融合常数
+_RRF_K = 60
+
 
 # 定义 RAGService 类
 class RAGService:
@@ -53,56 +95,447 @@ class RAGService:
         if not rag_query_prompt_text:
             rag_query_prompt_text = default_rag_query_prompt
 
-        # 构建 RAG 的提示模板，包含系统消息和用户查询部分
+        # 构建 RAG 的提示模板，包含系统消息、对话历史和用户查询部分
         self.rag_prompt = ChatPromptTemplate.from_messages(
-            [("system", rag_system_prompt_text), ("human", rag_query_prompt_text)]
+            [
+                ("system", rag_system_prompt_text),
+                MessagesPlaceholder("history", optional=True),
+                ("human", rag_query_prompt_text),
+            ]
+        )
+
+    # 读取检索相关设置
+    def _retrieval_settings(self) -> dict:
+        """读取检索模式、阈值、权重和返回数量"""
+        return {
+            "mode": (self.settings.get("retrieval_mode") or "vector").lower(),
+            "vector_threshold": float(self.settings.get("vector_threshold") or 0.0),
+            "keyword_threshold": float(self.settings.get("keyword_threshold") or 0.0),
+            "vector_weight": float(self.settings.get("vector_weight") or 0.7),
+            "top_n": int(
+                self.settings.get("top_n") or self.settings.get("top_k") or 5
+            ),
+        }
+
+    # 检索阶段一：查询向量化
+    @traced("rag.embed_query")
+    def embed_query(self, question: str, kb_id: Optional[str] = None) -> List[float]:
+        """
+        将问题转换为查询向量
+        Args:
+            question: 问题
+            kb_id: 知识库ID（可选），使用该知识库向量所属的 Embedding 模型，切换模型后的迁移期间与当前设置不同
+
+        Returns:
+            查询向量
+        """
+        embeddings = (
+            vector_service.embeddings_for(f"kb_{kb_id}") if kb_id else vector_service.embeddings
         )
+        return embeddings.embed_query(question)
+
+    # 检索阶段二：向量检索
+    @traced("rag.search")
+    def search(
+        self,
+        kb_id: str,
+        query_vector: List[float],
+        k: Optional[int] = None,
+        filter: Optional[Dict] = None,
+    ) -> List[tuple]:
+        """
+        在知识库集合中检索候选分块
+        Args:
+            kb_id: 知识库ID
+            query_vector: 查询向量
+            k: 候选数量，默认为 top_n 的 3 倍，给重排序留出空间
+            filter: 元数据过滤条件（可选，写法见 app.services.vectordb.filters）
+
+        Returns:
+            (Document, 向量相关度) 元组列表
+        """
+        if k is None:
+            k = self._retrieval_settings()["top_n"] * 3
+        filter = filters.normalize(filter)
+        # 开启向量压缩的知识库走压缩索引（压缩编码取候选 + 全精度重排）；
+        # 压缩索引只记录分块所属文档，只按文档过滤时在索引中预过滤，其他过滤条件使用向量库
+        doc_ids = filters.doc_id_restriction(filter)
+        if filter is None or doc_ids is not None:
+            results = vector_compression_service.search(kb_id, query_vector, k, doc_ids)
+            if results is not None:
+                return results
+        return vector_service.similarity_search_by_vector_with_score(
+            collection_name=f"kb_{kb_id}", embedding=query_vector, k=k, filter=filter
+        )
+
+    # 计算关键词得分：问题词项在分块中出现的比例
+    @staticmethod
+    def _keyword_score(question_tokens: set, text: str) -> float:
+        """计算问题词项在分块文本中的覆盖率"""
+        if not question_tokens:
+            return 0.0
+        doc_tokens = set(t.lower() for t in _TOKEN_PATTERN.findall(text))
+        return len(question_tokens & doc_tokens) / len(question_tokens)
+
+    # 检索阶段三：按检索模式过滤、融合与重排序
+    @traced("rag.rerank")
+    def rerank(self, question: str, candidates: List[tuple]) -> List[dict]:
+        """
+        根据检索模式对候选分块打分、过滤并排序
+        Args:
+            question: 问题
+            candidates: (Document, 向量相关度) 元组列表
+
+        Returns:
+            命中列表，每项包含 document 与各项分数，按 rerank_score 降序，最多 top_n 个
+        """
+        cfg = self._retrieval_settings()
+        mode = cfg["mode"]
+        # 问题词项集合
+        question_tokens = set(t.lower() for t in _TOKEN_PATTERN.findall(question))
+        # 为每个候选计算向量分数和关键词分数
+        hits = [
+            {
+                "document": doc,
+                "vector_score": float(score),
+                "keyword_score": self._keyword_score(question_tokens, doc.page_content),
+            }
+            for doc, score in candidates
+        ]
+        if mode == "keyword":
+            # 关键词模式：按关键词分数过滤和排序
+            hits = [h for h in hits if h["keyword_score"] >= cfg["keyword_threshold"]]
+            for h in hits:
+                h["rerank_score"] = h["keyword_score"]
+        elif mode in ("hybrid", "hybird"):
+            # 混合模式：两路各自排名后用加权 RRF 融合
+            weight = cfg["vector_weight"]
+            by_vector = sorted(hits, key=lambda h: h["vector_score"], reverse=True)
+            by_keyword = sorted(hits, key=lambda h: h["keyword_score"], reverse=True)
+            for rank, h in enumerate(by_vector):
+                h["rrf_score"] = weight / (_RRF_K + rank + 1)
+            for rank, h in enumerate(by_keyword):
+                h["rrf_score"] += (1 - weight) / (_RRF_K + rank + 1)
+            hits = [
+                h
+                for h in hits
+                if h["vector_score"] >= cfg["vector_threshold"]
+                or h["keyword_score"] >= cfg["keyword_threshold"]
+            ]
+            for h in hits:
+                h["rerank_score"] = (
+                    weight * h["vector_score"] + (1 - weight) * h["keyword_score"]
+                )
+            hits.sort(key=lambda h: h["rrf_score"], reverse=True)
+            return hits[: cfg["top_n"]]
+        else:
+            # 默认向量模式：按向量分数过滤和排序
+            hits = [h for h in hits if h["vector_score"] >= cfg["vector_threshold"]]
+            for h in hits:
+                h["rerank_score"] = h["vector_score"]
+        hits.sort(key=lambda h: h["rerank_score"], reverse=True)
+        return hits[: cfg["top_n"]]
+
+    # 检索阶段四：构造上下文
+    @staticmethod
+    def build_context(hits: List[dict]) -> str:
+        """将命中分块整合为传给 LLM 的上下文字符串"""
+        return "\n\n".join(
+            [
+                f"文档 {i+1} ({hit['document'].metadata.get('doc_name', '未知')}):\n{hit['document'].page_content}"
+                for i, hit in enumerate(hits)
+            ]
+        )
+
+    # 完整检索流程
+    def retrieve(
+        self,
+        kb_id: str,
+        question: str,
+        filter: Optional[Dict] = None,
+        cancel_token: Optional[CancelToken] = None,
+    ) -> List[dict]:
+        """
+        执行 向量化 -> 检索 -> 重排序 的完整检索流程
+        Args:
+            kb_id: 知识库ID
+            question: 问题
+            filter: 元数据过滤条件（可选）
+            cancel_token: 取消令牌（可选），在各阶段之间检查，已取消时抛出 GenerationCancelled
+
+        Returns:
+            命中列表
+        """
+        with span("rag.retrieve", kb_id=kb_id) as retrieve_span:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            query_vector = self.embed_query(question, kb_id)
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            candidates = self.search(kb_id, query_vector, filter=filter)
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            hits = self.rerank(question, candidates)
+            retrieve_span.set("candidates", len(candidates)).set("hits", len(hits))
+        return hits
+
+    # 计算引用片段在分块中的位置
+    @staticmethod
+    def _snippet_offsets(question_tokens: set, text: str) -> List[int]:
+        """
+        在分块文本中选取包含问题词项最多的窗口作为引用片段
+        Args:
+            question_tokens: 问题词项集合（小写）
+            text: 分块文本
+
+        Returns:
+            [起始位置, 结束位置]，窗口长度为 SOURCE_SNIPPET_CHARS
+        """
+        width = Config.SOURCE_SNIPPET_CHARS
+        if len(text) <= width:
+            return [0, len(text)]
+        # 问题词项在分块中出现的位置
+        positions = [
+            m.start()
+            for m in _TOKEN_PATTERN.finditer(text)
+            if m.group().lower() in question_tokens
+        ]
+        if not positions:
+            return [0, width]
+        # 以每个命中位置作为窗口起点，选覆盖命中最多的窗口（双指针）
+        best_start, best_count, right = positions[0], 0, 0
+        for left, start in enumerate(positions):
+            while right < len(positions) and positions[right] < start + width:
+                right += 1
+            if right - left > best_count:
+                best_start, best_count = start, right - left
+        # 窗口前留出少量上文，且不越过文本末尾
+        start = max(0, min(best_start - width // 10, len(text) - width))
+        return [start, start + width]
+
+    # 将命中转换为前端展示用的引用来源
+    def to_sources(self, hits: List[dict], question: Optional[str] = None) -> List[dict]:
+        """将命中列表转换为引用来源字典列表"""
+        retrieval_type = self._retrieval_settings()["mode"]
+        question_tokens = set(t.lower() for t in _TOKEN_PATTERN.findall(question or ""))
+        sources = []
+        for hit in hits:
+            metadata = hit["document"].metadata
+            sources.append(
+                {
+                    "retrieval_type": retrieval_type,
+                    "chunk_id": metadata.get("chunk_id") or metadata.get("id"),
+                    "doc_id": metadata.get("doc_id"),
+                    "doc_name": metadata.get("doc_name"),
+                    "content": hit["document"].page_content,
+                    "snippet": self._snippet_offsets(
+                        question_tokens, hit["document"].page_content
+                    ),
+                    "vector_score": round(hit["vector_score"], 4),
+                    "keyword_score": round(hit["keyword_score"], 4),
+                    "rrf_score": round(hit.get("rrf_score", 0.0), 6),
+                    "rerank_score": round(hit["rerank_score"], 4),
+                }
+            )
+        return sources
+
+    # 将引用来源压缩为分块引用，用于保存到消息
+    @staticmethod
+    def compact_sources(sources: Optional[List[dict]], kb_id: str) -> Optional[List[dict]]:
+        """
+        只保留分块ID、文档ID、分数和片段位置，不保存分块文本
+        Args:
+            sources: to_sources 返回的引用来源
+            kb_id: 知识库ID（回填时用于定位集合）
+
+        Returns:
+            压缩后的引用列表，没有引用时返回 None
+        """
+        if not sources:
+            return None
+        return [
+            {
+                "kb_id": kb_id,
+                "chunk_id": source.get("chunk_id"),
+                "doc_id": source.get("doc_id"),
+                "retrieval_type": source.get("retrieval_type"),
+                "score": source.get("rerank_score"),
+                "snippet": source.get("snippet"),
+            }
+            for source in sources
+        ]
+
+    # 回填消息引用的分块内容
+    @traced("rag.hydrate_sources")
+    def hydrate_sources(self, messages: List[dict]) -> List[dict]:
+        """
+        为消息中的分块引用回填文档名和分块内容，每个知识库只批量查询一次向量库
+        已包含分块内容的旧格式引用保持不变；分块已被删除时 content 为 None 并标记 missing
+        Args:
+            messages: 消息字典列表（原地修改）
+
+        Returns:
+            messages
+        """
+        # 按知识库收集需要回填的分块ID
+        wanted: Dict[str, set] = {}
+        for message in messages:
+            for ref in message.get("sources") or []:
+                if "content" not in ref and ref.get("kb_id") and ref.get("chunk_id"):
+                    wanted.setdefault(ref["kb_id"], set()).add(ref["chunk_id"])
+        if not wanted:
+            return messages
+        chunks: Dict[tuple, object] = {}
+        for kb_id, chunk_ids in wanted.items():
+            try:
+                documents = vector_service.get_by_ids(f"kb_{kb_id}", sorted(chunk_ids))
+            except Exception as e:
+                logger.warning(f"回填引用分块失败: 知识库 {kb_id}, 错误: {e}")
+                continue
+            for document in documents:
+                chunk_id = document.metadata.get("chunk_id") or document.id
+                chunks[(kb_id, chunk_id)] = document
+        # 展开为与 to_sources 一致的字段，便于前端复用同一套渲染逻辑
+        for message in messages:
+            refs = message.get("sources")
+            if not refs:
+                continue
+            hydrated = []
+            for ref in refs:
+                if "content" in ref:
+                    hydrated.append(ref)
+                    continue
+                document = chunks.get((ref.get("kb_id"), ref.get("chunk_id")))
+                hydrated.append(
+                    {
+                        **ref,
+                        "doc_name": document.metadata.get("doc_name") if document else None,
+                        "content": document.page_content if document else None,
+                        "rerank_score": ref.get("score"),
+                        "missing": document is None,
+                    }
+                )
+            message["sources"] = hydrated
+        return messages
 
     # 定义流式问答接口
-    def ask_stream(self, kb_id: str, question: str):
+    def ask_stream(
+        self,
+        kb_id: str,
+        question: str,
+        history: Optional[list] = None,
+        summary: Optional[str] = None,
+        cancel_token: Optional[CancelToken] = None,
+        user_id: Optional[str] = None,
+        filter: Optional[Dict] = None,
+        max_tokens: int = 1000,
+    ):
         """
         流式问答接口
         Args:
             kb_id:知识库ID
             question:问题
+            history:历史对话记录（可选），按 token 预算从最近的消息开始放入提示词
+            summary:更早对话的摘要（可选）
+            cancel_token:取消令牌（可选），取消后跳过剩余检索、停止生成，done 数据块的 metadata.truncated 为 True
+            user_id:用户ID（可选），用于 LLM 限流的公平排队
+            filter:元数据过滤条件（可选），只在满足条件的分块中检索，例如限定文档、文件类型或上传日期
+            max_tokens:最大输出 token 数，同时用于限流预占配额
 
         Returns:
             流式数据块
         """
-        # 创建带流式输出能力的 LLM 实例
-        llm = LLMFactory.create_llm(self.settings)
-        # 文档过滤后的结果，暂时为空列表
-        filtered_docs = []
         # 发送流式开始信号
         yield {"type": "start", "content": ""}
-        # 构造用于传递给 LLM 的上下文字符串，将所有文档整合为字符串
-        context = "\n\n".join(
-            [
-                f"文档 {i+1} ({doc.metadata.get('doc_name', '未知')}):\n{doc.page_content}"
-                for i, doc in enumerate(filtered_docs)
-            ]
-        )
-        # 创建 Rag Prompt 到 LLM 的处理链
-        chain = self.rag_prompt | llm
+        # 是否因取消而提前结束
+        truncated = False
+        # 结合对话历史把追问改写为独立的检索问题（未启用、超时或出错时为原问题）
+        search_query = query_rewrite_service.rewrite(question, history, summary)
+        # 检索相关分块，取消时跳过剩余阶段，不再调用 LLM
+        try:
+            filtered_docs = self.retrieve(
+                kb_id, search_query, filter=filter, cancel_token=cancel_token
+            )
+        except GenerationCancelled:
+            filtered_docs = []
+            truncated = True
         # 初始化完整答案的字符串
         full_answer = ""
-        # 逐块流式生成答案
-        for chunk in chain.stream({"context": context, "question": question}):
-            # 获取当前输出块内容
-            content = chunk.content
-            # 如果有内容则累加并 yield 输出内容块
-            if content:
-                full_answer += content
-                yield {"type": "content", "content": content}
+        # 实际提供回答的 LLM 提供商
+        provider = None
+        if not truncated:
+            # 构造用于传递给 LLM 的上下文字符串，将所有文档整合为字符串
+            context = self.build_context(filtered_docs)
+            # 记录首字延迟与生成速度
+            meter = StreamMeter(self.settings.get("llm_provider"), "rag")
+            with span("llm.stream", endpoint="rag") as llm_span:
+                inputs = {
+                    "context": context,
+                    "question": question,
+                    "history": build_history_messages(history, summary),
+                }
+
+                # 按提供商设置创建 LLM 并发起流式调用（故障转移时会用备用提供商的设置调用）
+                def make_stream(provider_settings: dict):
+                    llm = LLMFactory.create_llm(
+                        provider_settings, max_tokens=max_tokens, streaming=True
+                    )
+                    return (self.rag_prompt | llm).stream(inputs)
+
+                # 在提供商的并发与配额限制内调用，主提供商不可用时切换到备用提供商
+                stream = FailoverStream(
+                    self.settings,
+                    make_stream,
+                    user_id=user_id,
+                    prompt_tokens=estimate_tokens(context)
+                    + estimate_tokens(question)
+                    + sum(estimate_tokens(str(m.content)) for m in inputs["history"]),
+                    max_tokens=max_tokens,
+                    cancel_token=cancel_token,
+                )
+                try:
+                    # 逐块流式生成答案
+                    for chunk in stream:
+                        # 已取消（客户端断开或用户停止）时不再读取后续内容
+                        if cancel_token is not None and cancel_token.cancelled:
+                            truncated = True
+                            break
+                        # 获取当前输出块内容
+                        content = chunk.content
+                        # 如果有内容则累加并 yield 输出内容块
+                        if content:
+                            meter.on_token(stream.provider)
+                            full_answer += content
+                            yield {"type": "content", "content": content}
+                # 排队或退避期间被取消
+                except GenerationCancelled:
+                    truncated = True
+                except Exception:
+                    meter.finish(error=True)
+                    raise
+                finally:
+                    # 关闭上游流，提前结束时立即断开与 LLM 的连接
+                    stream.close()
+                meter.finish()
+                llm_span.set("ttft_ms", meter.ttft_ms).set("chunks", meter.tokens)
+                llm_span.set("truncated", truncated).set("provider", stream.provider)
+                provider = stream.provider
 
         # 所有内容输出结束后，发送完成信号和相关元数据
         yield {
             "type": "done",
             "content": "",
+            "sources": self.to_sources(filtered_docs, search_query),
             "metadata": {
                 "kb_id": kb_id,
                 "question": question,
+                "search_query": search_query,
                 "retrieved_chunks": len(filtered_docs),
+                "used_chunks": len(filtered_docs),
+                "truncated": truncated,
+                "cancel_reason": cancel_token.reason if truncated else None,
+                "provider": provider,
+                "trace_id": current_trace_id(),
             },
         }
 
@@ -11,6 +11,9 @@ from app.config import Config
 # 导入基础服务类
 from app.services.base_service import BaseService
 
+# 导入链路追踪装饰器
+from app.utils.tracing import traced
+
 # 定义设置服务类，继承基础服务
 
 
@@ -18,6 +21,7 @@ class SettingsService(BaseService):
     """设置服务"""
 
     # 获取设置的方法
+    @traced("settings.get")
     def get(self) -> dict:
         """
         获取设置（单例模式）
@@ -72,6 +76,17 @@ class SettingsService(BaseService):
         Returns:
             更新后的设置
         """
+        # 迁移服务和 Embedding 工厂都依赖本模块，在这里导入避免循环导入
+        from app.services.embedding_migration import embedding_migration_service
+        from app.utils.embedding_factory import embedding_model_key
+
+        # 修改 Embedding 模型时，已有知识库的向量需要迁移到新模型
+        old_settings = self.get()
+        new_settings = dict(old_settings, **{k: v for k, v in data.items() if v is not None})
+        model_changed = embedding_model_key(old_settings) != embedding_model_key(new_settings)
+        if model_changed:
+            # 先把已有知识库固定到原模型，修改后检索仍使用原模型，直到迁移切换
+            embedding_migration_service.prepare_model_change(old_settings)
         # 启动事务会话
         with self.transaction() as session:
             # 查询主键为 global 的设置
@@ -95,8 +110,12 @@ class SettingsService(BaseService):
             session.flush()
             # refresh 保证 settings 对象数据是数据库最新的内容（例如 updated_at 字段）
             session.refresh(settings)
-            # 返回已更新的设置字典
-            return settings.to_dict()
+            result = settings.to_dict()
+        if model_changed:
+            # 为使用原模型的知识库安排后台迁移
+            embedding_migration_service.on_model_change(old_settings, result)
+        # 返回已更新的设置字典
+        return result
 
 
 # 实例化设置服务
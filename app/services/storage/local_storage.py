@@ -13,6 +13,8 @@ from typing import Optional
 from app.services.storage.base import StorageInterface
 # 导入配置信息
 from app.config import Config
+# 导入指标定义与计时装饰器
+from app.utils.metrics import STORAGE_BYTES, STORAGE_SECONDS, timed
 
 # 获取logger实例
 logger = logging.getLogger(__name__)
@@ -54,6 +56,7 @@ class LocalStorage(StorageInterface):
         return self.storage_dir / file_path
 
     # 上传文件到本地存储
+    @timed(STORAGE_SECONDS, backend="local", operation="upload")
     def upload_file(self, file_path: str, file_data: bytes,
                    content_type: str = 'application/octet-stream') -> str:
         """上传文件到本地存储"""
@@ -67,6 +70,8 @@ class LocalStorage(StorageInterface):
             with open(full_path, 'wb') as f:
                 f.write(file_data)
 
+            # 记录上传字节数
+            STORAGE_BYTES.labels(backend="local", operation="upload").inc(len(file_data))
             # 记录日志
             logger.info(f"文件已上传：{file_path}")
             # 返回文件相对路径
@@ -77,6 +82,7 @@ class LocalStorage(StorageInterface):
             raise
 
     # 从本地存储下载文件
+    @timed(STORAGE_SECONDS, backend="local", operation="download")
     def download_file(self, file_path: str) -> bytes:
         """从本地存储下载文件"""
         try:
@@ -90,6 +96,8 @@ class LocalStorage(StorageInterface):
             with open(full_path, 'rb') as f:
                 data = f.read()
 
+            # 记录下载字节数
+            STORAGE_BYTES.labels(backend="local", operation="download").inc(len(data))
             # 记录日志
             logger.info(f"文件已下载：{file_path}")
             # 返回文件数据
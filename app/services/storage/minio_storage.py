@@ -20,6 +20,9 @@ from minio import Minio
 # 导入minio 异常
 from minio.error import S3Error
 
+# 导入指标定义与计时装饰器
+from app.utils.metrics import STORAGE_BYTES, STORAGE_SECONDS, timed
+
 # 获取日志记录器
 logger = logging.getLogger(__name__)
 
@@ -69,6 +72,7 @@ class MinIOStorage(StorageInterface):
         logger.info(f"MinIO 存储初始化完成，桶名：{bucket_name}")
 
     # 上传文件到 MinIO
+    @timed(STORAGE_SECONDS, backend="minio", operation="upload")
     def upload_file(
         self,
         file_path: str,
@@ -87,6 +91,8 @@ class MinIOStorage(StorageInterface):
                 length=len(file_data),
                 content_type=content_type,
             )
+            # 记录上传字节数
+            STORAGE_BYTES.labels(backend="minio", operation="upload").inc(len(file_data))
             # 上传成功，记录日志
             logger.info(f"已上传文件到 MinIO: {file_path}")
             # 返回文件路径
@@ -101,6 +107,7 @@ class MinIOStorage(StorageInterface):
             raise
 
     # 下载文件方法
+    @timed(STORAGE_SECONDS, backend="minio", operation="download")
     def download_file(self, file_path: str) -> bytes:
         """从MinIO下载文件"""
         try:
@@ -112,6 +119,8 @@ class MinIOStorage(StorageInterface):
             response.close()
             # 释放连接
             response.release_conn()
+            # 记录下载字节数
+            STORAGE_BYTES.labels(backend="minio", operation="download").inc(len(data))
             # 记录下载日志
             logger.info(f"已从 MinIO 下载文件: {file_path}")
             # 返回二进制数据
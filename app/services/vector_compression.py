@@ -0,0 +1,875 @@
+"""
+向量压缩存储服务
+大知识库的向量全部以 float32 常驻内存，占用随分块数线性增长。开启压缩的知识库在向量库之外维护一份压缩索引：
+降维（Matryoshka 截断或 PCA 投影）后再做标量量化（int8）或二值量化（binary），内存中只保留压缩编码；
+检索时先用压缩编码取 k×VECTOR_COMPRESSION_RESCORE_FACTOR 个候选，再用磁盘上（内存映射）的全精度向量重排，
+最后按ID从向量库读取分块文本和元数据
+
+压缩模式写法（保存在 Knowledgebase.vector_compression）：
+    "pca:128+int8"   PCA 降到 128 维后 int8 量化
+    "mrl:256+binary" Matryoshka 截断到前 256 维后二值量化（仅适用于 Matryoshka 训练的模型）
+    "int8" / "binary" / "pca:64"  只量化或只降维
+
+索引目录 VECTOR_COMPRESSION_DIR/kb_<知识库ID>/：
+    meta.json  压缩模式、维度、是否已训练
+    codec.npz  PCA 均值与投影矩阵、量化缩放系数与阈值
+    full.f32   归一化后的全精度向量（追加写入，检索时内存映射）
+    codes.bin  压缩编码（训练后追加写入）
+    rows.jsonl 行日志：{"add": [...], "docs": [...]} 追加一批向量，{"del_doc": doc_id} 删除文档的全部行
+行日志最后写入，作为其他文件的提交点（写入前把 full.f32 / codes.bin 截断到行日志记录的行数，
+丢弃崩溃时残留的未提交数据）；多进程部署时写操作持有排它文件锁，重新加载持有共享锁
+
+开启压缩时在 kb_<知识库ID>.building/ 中回填已有向量，回填期间的写入和删除同时记入
+journal.jsonl / journal.f32，回填完成后按顺序重放到新索引再替换旧索引，回填期间写入的分块不会丢失
+"""
+
+# 导入迭代工具
+import itertools
+
+# 导入 JSON 模块
+import json
+
+# 导入日志模块
+import logging
+
+# 导入操作系统模块
+import os
+
+# 导入目录操作模块
+import shutil
+
+# 导入线程模块
+import threading
+
+# 导入上下文管理器工具
+from contextlib import contextmanager
+
+# 导入类型注解
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# 导入数值计算库
+import numpy as np
+
+# 导入配置
+from app.config import Config
+
+# 文件锁仅在 POSIX 平台可用，其他平台只做进程内互斥
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+# 获取当前模块的日志记录器
+logger = logging.getLogger(__name__)
+
+# 支持的降维方式
+REDUCTIONS = ("pca", "mrl")
+# 支持的量化方式
+QUANTIZATIONS = ("int8", "binary")
+# 训练 PCA / 量化参数时最多使用的样本数
+_MAX_TRAIN_SAMPLES = 20000
+# 压缩打分时每块处理的行数，控制临时内存
+_SCORE_BLOCK_ROWS = 65536
+# 每个字节中 1 的个数，用于计算汉明距离
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+# 压缩模式
+class CompressionSpec:
+    """解析和格式化压缩模式字符串"""
+
+    def __init__(
+        self,
+        reduction: Optional[str] = None,
+        dim: Optional[int] = None,
+        quantization: Optional[str] = None,
+    ):
+        self.reduction = reduction
+        self.dim = dim
+        self.quantization = quantization
+
+    # 解析压缩模式字符串
+    @classmethod
+    def parse(cls, value: str) -> "CompressionSpec":
+        """
+        解析压缩模式字符串
+        Args:
+            value: 例如 "pca:128+int8"
+
+        Returns:
+            CompressionSpec 对象，格式不正确时抛出 ValueError
+        """
+        spec = cls()
+        parts = [p.strip().lower() for p in (value or "").split("+") if p.strip()]
+        if not parts:
+            raise ValueError("压缩模式不能为空")
+        for part in parts:
+            name, _, dim = part.partition(":")
+            if name in REDUCTIONS and spec.reduction is None:
+                if not dim.isdigit() or int(dim) <= 0:
+                    raise ValueError(f"降维方式 {name} 需要指定正整数维度，例如 {name}:128")
+                spec.reduction, spec.dim = name, int(dim)
+            elif name in QUANTIZATIONS and not dim and spec.quantization is None:
+                spec.quantization = name
+            else:
+                raise ValueError(
+                    f"无法识别的压缩模式: {value}，"
+                    f"支持 {'/'.join(REDUCTIONS)}:<维度> 与 {'/'.join(QUANTIZATIONS)} 的组合，例如 pca:128+int8"
+                )
+        return spec
+
+    def __str__(self) -> str:
+        parts = []
+        if self.reduction:
+            parts.append(f"{self.reduction}:{self.dim}")
+        if self.quantization:
+            parts.append(self.quantization)
+        return "+".join(parts)
+
+
+# 压缩编解码器
+class Codec:
+    """降维 + 量化，训练参数来自样本向量"""
+
+    def __init__(self, spec: CompressionSpec, dim: int):
+        """
+        Args:
+            spec: 压缩模式
+            dim: 原始向量维度
+        """
+        if spec.dim and spec.dim > dim:
+            raise ValueError(f"降维后的维度 {spec.dim} 不能大于原始维度 {dim}")
+        self.spec = spec
+        self.dim = dim
+        self.code_dim = spec.dim or dim
+        self.mean: Optional[np.ndarray] = None
+        self.components: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+        self.offset: Optional[np.ndarray] = None
+
+    # 每行编码的字节数
+    @property
+    def row_bytes(self) -> int:
+        if self.spec.quantization == "binary":
+            return (self.code_dim + 7) // 8
+        if self.spec.quantization == "int8":
+            return self.code_dim
+        return self.code_dim * 4
+
+    # 编码的数据类型
+    @property
+    def dtype(self):
+        if self.spec.quantization == "int8":
+            return np.int8
+        if self.spec.quantization == "binary":
+            return np.uint8
+        return np.float32
+
+    # 训练降维和量化参数
+    def fit(self, vectors: np.ndarray):
+        """用样本向量训练 PCA 投影、int8 缩放系数和二值化阈值"""
+        if len(vectors) > _MAX_TRAIN_SAMPLES:
+            rng = np.random.default_rng(0)
+            vectors = vectors[rng.choice(len(vectors), _MAX_TRAIN_SAMPLES, replace=False)]
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.spec.reduction == "pca":
+            self.mean = vectors.mean(axis=0)
+            # 协方差矩阵的特征向量即主成分，按特征值从大到小取前 dim 个
+            centered = vectors - self.mean
+            covariance = centered.T @ centered / max(len(vectors) - 1, 1)
+            eigenvalues, eigenvectors = np.linalg.eigh(covariance.astype(np.float64))
+            order = np.argsort(eigenvalues)[::-1][: self.code_dim]
+            self.components = eigenvectors[:, order].T.astype(np.float32)
+        projected = self.project(vectors)
+        if self.spec.quantization == "int8":
+            # 每个维度按最大绝对值缩放到 [-127, 127]
+            self.scale = (127.0 / np.maximum(np.abs(projected).max(axis=0), 1e-6)).astype(np.float32)
+        elif self.spec.quantization == "binary":
+            # 以每个维度的中位数为阈值，使每一位的 0/1 大致均衡
+            self.offset = np.median(projected, axis=0).astype(np.float32)
+
+    # 降维
+    def project(self, vectors: np.ndarray) -> np.ndarray:
+        """将（归一化的）向量投影到压缩维度"""
+        if self.spec.reduction == "pca":
+            return (vectors - self.mean) @ self.components.T
+        if self.spec.reduction == "mrl":
+            # Matryoshka 表示的前缀本身就是有效的低维向量，截断后重新归一化
+            truncated = vectors[:, : self.code_dim]
+            norms = np.linalg.norm(truncated, axis=1, keepdims=True)
+            return truncated / np.maximum(norms, 1e-12)
+        return vectors
+
+    # 编码
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """将向量编码为压缩表示（每行 row_bytes 字节）"""
+        projected = self.project(vectors)
+        if self.spec.quantization == "int8":
+            return np.clip(np.rint(projected * self.scale), -127, 127).astype(np.int8)
+        if self.spec.quantization == "binary":
+            return np.packbits(projected > self.offset, axis=1)
+        return projected.astype(np.float32)
+
+    # 计算查询与一批编码的近似相似度
+    def score(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """
+        计算查询与编码的近似相似度（越大越相似，只用于候选排序）
+        Args:
+            codes: 编码矩阵
+            query: 归一化的查询向量（一维）
+
+        Returns:
+            分数数组
+        """
+        # PCA 的查询同样减去均值：内积中多出的均值项对所有候选相同，不影响排序，且与二值化阈值口径一致
+        projected = self.project(query[None, :])[0]
+        if self.spec.quantization == "int8":
+            # 非对称打分：编码反量化后与全精度查询做内积
+            weights = (projected / self.scale).astype(np.float32)
+            scores = np.empty(len(codes), dtype=np.float32)
+            for start in range(0, len(codes), _SCORE_BLOCK_ROWS):
+                block = codes[start : start + _SCORE_BLOCK_ROWS]
+                scores[start : start + len(block)] = block.astype(np.float32) @ weights
+            return scores
+        if self.spec.quantization == "binary":
+            # 汉明距离越小越相似
+            query_bits = np.packbits(projected > self.offset)
+            distances = np.empty(len(codes), dtype=np.int32)
+            for start in range(0, len(codes), _SCORE_BLOCK_ROWS):
+                block = codes[start : start + _SCORE_BLOCK_ROWS]
+                distances[start : start + len(block)] = _POPCOUNT[block ^ query_bits].sum(
+                    axis=1, dtype=np.int32
+                )
+            return -distances.astype(np.float32)
+        return codes @ projected.astype(np.float32)
+
+    # 保存训练参数
+    def save(self, path: str):
+        arrays = {
+            name: value
+            for name, value in (
+                ("mean", self.mean),
+                ("components", self.components),
+                ("scale", self.scale),
+                ("offset", self.offset),
+            )
+            if value is not None
+        }
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    # 加载训练参数
+    def load(self, path: str):
+        with np.load(path) as data:
+            for name in ("mean", "components", "scale", "offset"):
+                if name in data:
+                    setattr(self, name, data[name])
+
+
+# 跨进程文件锁
+@contextmanager
+def _flock(path: str, exclusive: bool):
+    """对锁文件加 flock（写操作排它，读取共享），不支持 fcntl 的平台不加锁"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# 截断文件
+def _truncate(path: str, size: int):
+    """文件超过指定大小时截断（丢弃未被行日志提交的尾部数据）"""
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        os.truncate(path, size)
+
+
+# 归一化向量
+def _normalize(vectors) -> np.ndarray:
+    """转换为 float32 矩阵并按行做 L2 归一化"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# 原子写入文件
+def _write_atomic(path: str, data: bytes):
+    """先写临时文件再替换，读取方不会看到写了一半的文件"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+# 单个知识库的压缩索引
+class CompressedIndex:
+    """一个知识库的压缩索引：内存中的压缩编码 + 磁盘上的全精度向量"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: 索引目录
+        """
+        self.path = path
+        self._lock = threading.RLock()
+        # 已加载的行日志状态，用于判断是否需要重新加载
+        self._loaded: Optional[Tuple[int, int]] = None
+        self._load()
+
+    # 文件路径
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    # 加锁
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        """进程内互斥 + 跨进程文件锁（写操作排它，读取共享）"""
+        with self._lock, _flock(f"{self.path}.lock", exclusive):
+            yield
+
+    # 从磁盘加载全部状态
+    def _load(self):
+        with open(self._file("meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.spec = CompressionSpec.parse(meta["spec"])
+        self.dim = meta["dim"]
+        self.fitted = meta.get("fitted", False)
+        self.codec = Codec(self.spec, self.dim)
+        if self.fitted:
+            self.codec.load(self._file("codec.npz"))
+        # 行状态：行号对应的分块ID、文档ID、是否有效
+        self.ids: List[str] = []
+        self.doc_ids: List[Optional[str]] = []
+        self.alive = np.zeros(0, dtype=bool)
+        self._row_of: Dict[str, int] = {}
+        self._rows_offset = 0
+        self.codes = np.zeros((0, self.codec.row_bytes), dtype=np.uint8).view(self.codec.dtype)
+        self._read_rows()
+
+    # 读取行日志中新增的部分
+    def _read_rows(self):
+        """从上次读取的位置继续解析行日志，并同步读取新增的编码和全精度向量"""
+        rows_path = self._file("rows.jsonl")
+        old_count = len(self.ids)
+        alive = list(self.alive)
+        with open(rows_path, "rb") as f:
+            f.seek(self._rows_offset)
+            for line in f:
+                # 只处理完整的行，写了一半的行留到下次
+                if not line.endswith(b"\n"):
+                    break
+                self._rows_offset += len(line)
+                event = json.loads(line)
+                if "add" in event:
+                    for chunk_id, doc_id in zip(event["add"], event["docs"]):
+                        # 同一分块重复写入时旧行失效
+                        previous = self._row_of.get(chunk_id)
+                        if previous is not None:
+                            alive[previous] = False
+                        self._row_of[chunk_id] = len(self.ids)
+                        self.ids.append(chunk_id)
+                        self.doc_ids.append(doc_id)
+                        alive.append(True)
+                elif "del_doc" in event:
+                    for row, doc_id in enumerate(self.doc_ids):
+                        if doc_id == event["del_doc"] and alive[row]:
+                            alive[row] = False
+                            self._row_of.pop(self.ids[row], None)
+        self.alive = np.array(alive, dtype=bool)
+        count = len(self.ids)
+        # 全精度向量使用内存映射，只在重排时按需读取
+        self.full = (
+            np.memmap(self._file("full.f32"), dtype=np.float32, mode="r", shape=(count, self.dim))
+            if count
+            else np.zeros((0, self.dim), dtype=np.float32)
+        )
+        if self.fitted and count > old_count:
+            row_bytes = self.codec.row_bytes
+            with open(self._file("codes.bin"), "rb") as f:
+                f.seek(old_count * row_bytes)
+                data = f.read((count - old_count) * row_bytes)
+            new_codes = np.frombuffer(data, dtype=self.codec.dtype).reshape(
+                count - old_count, -1
+            )
+            self.codes = np.concatenate([self.codes, new_codes])
+        stat = os.stat(rows_path)
+        self._loaded = (stat.st_ino, stat.st_size)
+
+    # 其他进程写入后重新加载
+    def refresh(self):
+        """行日志有变化时加载新增部分；文件被整体替换（训练、压缩整理）时完整重新加载"""
+        stat = os.stat(self._file("rows.jsonl"))
+        if self._loaded == (stat.st_ino, stat.st_size):
+            return
+        with self._file_lock(exclusive=False):
+            self._refresh_locked()
+
+    # 重新加载（调用方已持有文件锁）
+    def _refresh_locked(self):
+        stat = os.stat(self._file("rows.jsonl"))
+        if self._loaded == (stat.st_ino, stat.st_size):
+            return
+        if self._loaded and self._loaded[0] == stat.st_ino and stat.st_size >= self._loaded[1]:
+            self._read_rows()
+        else:
+            self._load()
+
+    # 追加一条行日志
+    def _append_event(self, event: dict):
+        with open(self._file("rows.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+    # 写入一批向量
+    def add(self, ids: List[str], doc_ids: List[Optional[str]], embeddings):
+        """
+        写入一批向量（同ID覆盖）
+        Args:
+            ids: 分块ID列表
+            doc_ids: 分块所属文档ID列表
+            embeddings: 向量列表
+        """
+        if not ids:
+            return
+        vectors = _normalize(embeddings)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"向量维度 {vectors.shape[1]} 与压缩索引维度 {self.dim} 不一致")
+        with self._file_lock(exclusive=True):
+            self._refresh_locked()
+            # 上次写入在写行日志前中断时，文件末尾会残留未提交的数据，先截断保证行号与向量一一对应
+            count = len(self.ids)
+            _truncate(self._file("full.f32"), count * self.dim * 4)
+            if self.fitted:
+                _truncate(self._file("codes.bin"), count * self.codec.row_bytes)
+            with open(self._file("full.f32"), "ab") as f:
+                f.write(vectors.tobytes())
+            if self.fitted:
+                with open(self._file("codes.bin"), "ab") as f:
+                    f.write(self.codec.encode(vectors).tobytes())
+            self._append_event({"add": list(ids), "docs": list(doc_ids)})
+            self._read_rows()
+            # 向量数达到训练要求后训练编码参数
+            if not self.fitted and int(self.alive.sum()) >= Config.VECTOR_COMPRESSION_MIN_TRAIN:
+                self._rewrite(train=True)
+
+    # 删除文档的全部向量
+    def delete_doc(self, doc_id: str):
+        """删除文档的全部向量，失效行超过一半时整理文件"""
+        with self._file_lock(exclusive=True):
+            self._refresh_locked()
+            self._append_event({"del_doc": doc_id})
+            self._read_rows()
+            if len(self.ids) >= 1024 and self.alive.sum() * 2 < len(self.ids):
+                self._rewrite(train=False)
+
+    # 重写索引文件
+    def _rewrite(self, train: bool):
+        """
+        只保留有效行重写全部文件（需持有排它锁）
+        Args:
+            train: 是否重新训练编码参数
+        """
+        rows = np.flatnonzero(self.alive)
+        vectors = np.asarray(self.full[rows]) if len(rows) else np.zeros((0, self.dim), np.float32)
+        fitted = self.fitted or train
+        if train:
+            self.codec.fit(vectors)
+            self.codec.save(self._file("codec.npz"))
+        _write_atomic(self._file("full.f32"), vectors.tobytes())
+        if fitted:
+            _write_atomic(self._file("codes.bin"), self.codec.encode(vectors).tobytes())
+        _write_meta(self.path, self.spec, self.dim, fitted)
+        event = {"add": [self.ids[r] for r in rows], "docs": [self.doc_ids[r] for r in rows]}
+        _write_atomic(
+            self._file("rows.jsonl"),
+            (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8") if len(rows) else b"",
+        )
+        self._load()
+        logger.info(f"已重写压缩索引 {self.path}，有效向量 {len(rows)} 条，训练={train}")
+
+    # 检索
+    def search(
+        self, query, k: int, doc_ids: Optional[Set[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        先按压缩编码取候选，再用全精度向量重排
+        Args:
+            query: 查询向量
+            k: 返回数量
+            doc_ids: 只在这些文档的分块中检索（可选）
+
+        Returns:
+            (分块ID, 余弦相似度) 列表，按相似度从高到低排序
+        """
+        self.refresh()
+        # 取当前状态的快照后在锁外计算（加载时整体替换这些对象，不会原地修改已有行）
+        with self._lock:
+            codec, fitted = self.codec, self.fitted
+            codes, alive, full, ids = self.codes, self.alive, self.full, self.ids
+            row_docs = self.doc_ids[: len(alive)]
+        query = _normalize(query)[0]
+        # 按文档预过滤：不在范围内的行视为失效
+        if doc_ids is not None:
+            alive = alive & np.fromiter(
+                (doc_id in doc_ids for doc_id in row_docs), dtype=bool, count=len(alive)
+            )
+        alive_rows = np.flatnonzero(alive)
+        if not len(alive_rows) or k <= 0:
+            return []
+        candidates_count = min(
+            len(alive_rows), k * max(Config.VECTOR_COMPRESSION_RESCORE_FACTOR, 1)
+        )
+        if fitted and candidates_count < len(alive_rows):
+            scores = codec.score(codes, query)
+            scores[~alive] = -np.inf
+            candidates = np.argpartition(-scores, candidates_count - 1)[:candidates_count]
+            candidates = candidates[np.isfinite(scores[candidates])]
+        else:
+            # 尚未训练（向量数很少）或过滤后剩余的行不超过候选数时，直接用全精度向量精确检索
+            candidates = alive_rows
+        # 按行号顺序读取内存映射，减少随机读
+        candidates = np.sort(candidates)
+        exact = np.asarray(full[candidates]) @ query
+        order = np.argsort(-exact)[:k]
+        return [(ids[candidates[i]], float(exact[i])) for i in order]
+
+    # 统计信息
+    def stats(self) -> dict:
+        """返回向量数量和内存占用（压缩编码常驻内存，全精度向量在磁盘上）"""
+        self.refresh()
+        with self._lock:
+            alive = int(self.alive.sum())
+            code_bytes = alive * self.codec.row_bytes if self.fitted else alive * self.dim * 4
+            baseline_bytes = alive * self.dim * 4
+            return {
+                "spec": str(self.spec),
+                "dim": self.dim,
+                "code_dim": self.codec.code_dim,
+                "fitted": self.fitted,
+                "vectors": alive,
+                "memory_bytes": code_bytes,
+                "baseline_bytes": baseline_bytes,
+                "disk_bytes": sum(
+                    os.path.getsize(self._file(name))
+                    for name in ("full.f32", "codes.bin", "codec.npz", "rows.jsonl", "meta.json")
+                    if os.path.exists(self._file(name))
+                ),
+                "compression_ratio": round(baseline_bytes / code_bytes, 2) if code_bytes else None,
+            }
+
+
+# 写入元数据文件
+def _write_meta(path: str, spec: CompressionSpec, dim: int, fitted: bool):
+    _write_atomic(
+        os.path.join(path, "meta.json"),
+        json.dumps({"spec": str(spec), "dim": dim, "fitted": fitted}).encode("utf-8"),
+    )
+
+
+# 向量压缩服务
+class VectorCompressionService:
+    """按知识库管理压缩索引"""
+
+    def __init__(self):
+        self._indexes: Dict[str, CompressedIndex] = {}
+        self._lock = threading.Lock()
+        # 构建目录的进程内互斥（跨进程由文件锁保证）
+        self._building_mutex = threading.Lock()
+
+    # 索引目录
+    @staticmethod
+    def index_path(kb_id: str) -> str:
+        return os.path.join(Config.VECTOR_COMPRESSION_DIR, f"kb_{kb_id}")
+
+    # 构建目录
+    @classmethod
+    def building_path(cls, kb_id: str) -> str:
+        return f"{cls.index_path(kb_id)}.building"
+
+    # 构建目录的锁
+    @contextmanager
+    def _building_lock(self, kb_id: str):
+        """写入或重放构建日志、创建和替换构建目录时持有"""
+        os.makedirs(Config.VECTOR_COMPRESSION_DIR, exist_ok=True)
+        with self._building_mutex, _flock(f"{self.building_path(kb_id)}.lock", True):
+            yield
+
+    # 记入构建日志
+    def _journal(self, kb_id: str, event: dict, embeddings=None):
+        """
+        正在开启压缩（回填已有向量）时把写入或删除记入构建日志，回填完成后重放
+        调用方必须在写入向量库之后调用：日志创建之前的写入由回填从向量库读到
+        Args:
+            kb_id: 知识库ID
+            event: 行日志事件
+            embeddings: 写入的向量（删除事件为 None）
+        """
+        journal = os.path.join(self.building_path(kb_id), "journal.jsonl")
+        if not os.path.exists(journal):
+            return
+        with self._building_lock(kb_id):
+            if not os.path.exists(journal):
+                return
+            if embeddings is not None:
+                with open(os.path.join(self.building_path(kb_id), "journal.f32"), "ab") as f:
+                    # 记录向量在日志文件中的字节偏移，重放时按偏移读取
+                    event = dict(event, offset=f.tell())
+                    f.write(_normalize(embeddings).tobytes())
+            with open(journal, "a", encoding="utf-8") as f:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+    # 重放构建日志
+    @staticmethod
+    def _replay_journal(path: str, dim: int) -> int:
+        """把回填期间记入构建日志的写入和删除按顺序追加到构建目录的索引文件（需持有构建目录的锁）"""
+        with open(os.path.join(path, "journal.jsonl"), "rb") as f:
+            events = [json.loads(line) for line in f if line.endswith(b"\n")]
+        if not events:
+            return 0
+        with open(os.path.join(path, "journal.f32"), "rb") as journal_file, open(
+            os.path.join(path, "full.f32"), "ab"
+        ) as full_file, open(os.path.join(path, "rows.jsonl"), "a", encoding="utf-8") as rows_file:
+            for event in events:
+                if "add" in event:
+                    journal_file.seek(event.pop("offset"))
+                    full_file.write(journal_file.read(len(event["add"]) * dim * 4))
+                rows_file.write(json.dumps(event, ensure_ascii=False) + "\n")
+        return len(events)
+
+    # 获取知识库的压缩索引
+    def get_index(self, kb_id: str) -> Optional[CompressedIndex]:
+        """
+        获取知识库的压缩索引
+        Args:
+            kb_id: 知识库ID
+
+        Returns:
+            CompressedIndex 对象，未开启压缩时返回 None
+        """
+        path = self.index_path(kb_id)
+        # 其他进程关闭了压缩时目录会被删除
+        if not os.path.exists(os.path.join(path, "rows.jsonl")):
+            with self._lock:
+                self._indexes.pop(kb_id, None)
+            return None
+        with self._lock:
+            index = self._indexes.get(kb_id)
+            if index is None:
+                try:
+                    index = CompressedIndex(path)
+                except FileNotFoundError:
+                    return None
+                self._indexes[kb_id] = index
+            return index
+
+    # 开启（或更换）知识库的压缩模式
+    def enable(self, kb_id: str, spec: str) -> dict:
+        """
+        按向量库中已有的向量构建压缩索引
+        Args:
+            kb_id: 知识库ID
+            spec: 压缩模式字符串
+
+        Returns:
+            索引统计信息
+        """
+        from app.services.vector_service import vector_service
+
+        parsed = CompressionSpec.parse(spec)
+        path = self.index_path(kb_id)
+        tmp_path = self.building_path(kb_id)
+        # 先创建构建日志再读取向量库：此后的写入和删除都会记入日志
+        with self._building_lock(kb_id):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+            for name in ("journal.jsonl", "journal.f32"):
+                open(os.path.join(tmp_path, name), "wb").close()
+        try:
+            batches = vector_service.iter_embeddings(f"kb_{kb_id}")
+            first = next(batches, None)
+            # 集合为空时使用集合所属 Embedding 模型的维度
+            dim = (
+                len(first[1][0])
+                if first
+                else len(vector_service.embeddings_for(f"kb_{kb_id}").embed_query("dimension"))
+            )
+            _init_files(tmp_path, parsed, dim)
+            # 先只写全精度向量和行日志，训练在全部读取后进行
+            with open(os.path.join(tmp_path, "full.f32"), "ab") as full_file, open(
+                os.path.join(tmp_path, "rows.jsonl"), "a", encoding="utf-8"
+            ) as rows_file:
+                for ids, embeddings, metadatas in itertools.chain([first] if first else [], batches):
+                    full_file.write(_normalize(embeddings).tobytes())
+                    event = {"add": list(ids), "docs": [(m or {}).get("doc_id") for m in metadatas]}
+                    rows_file.write(json.dumps(event, ensure_ascii=False) + "\n")
+        except Exception:
+            with self._building_lock(kb_id):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        # 持有构建目录的锁重放日志并替换旧索引，期间的写入在替换后直接进入新索引；
+        # 同时持有旧索引的排它锁，避免正在写入旧索引的请求在目录被删除时出错
+        with self._building_lock(kb_id):
+            replayed = self._replay_journal(tmp_path, dim)
+            for name in ("journal.jsonl", "journal.f32"):
+                os.remove(os.path.join(tmp_path, name))
+            with _flock(f"{path}.lock", True):
+                with self._lock:
+                    self._indexes.pop(kb_id, None)
+                shutil.rmtree(path, ignore_errors=True)
+                os.replace(tmp_path, path)
+        if replayed:
+            logger.info(f"知识库 {kb_id} 重放了回填期间的 {replayed} 条写入")
+        index = self.get_index(kb_id)
+        with index._file_lock(exclusive=True):
+            if not index.fitted and int(index.alive.sum()) >= Config.VECTOR_COMPRESSION_MIN_TRAIN:
+                index._rewrite(train=True)
+        stats = index.stats()
+        logger.info(f"知识库 {kb_id} 已开启向量压缩: {stats}")
+        return stats
+
+    # 关闭知识库的压缩模式
+    def disable(self, kb_id: str):
+        """删除知识库的压缩索引（包括未完成的构建目录），检索回到向量库"""
+        with self._building_lock(kb_id):
+            shutil.rmtree(self.building_path(kb_id), ignore_errors=True)
+        with self._lock:
+            self._indexes.pop(kb_id, None)
+            shutil.rmtree(self.index_path(kb_id), ignore_errors=True)
+
+    # 写入向量
+    def add(self, kb_id: str, ids: List[str], metadatas: List[dict], embeddings):
+        """知识库开启压缩时同步写入压缩索引（正在回填时同时记入构建日志）"""
+        doc_ids = [(m or {}).get("doc_id") for m in metadatas]
+        self._journal(kb_id, {"add": list(ids), "docs": doc_ids}, embeddings)
+        index = self.get_index(kb_id)
+        if index is not None:
+            index.add(ids, doc_ids, embeddings)
+
+    # 删除文档
+    def delete_doc(self, kb_id: str, doc_id: str):
+        """知识库开启压缩时同步删除文档的向量（正在回填时同时记入构建日志）"""
+        self._journal(kb_id, {"del_doc": doc_id})
+        index = self.get_index(kb_id)
+        if index is not None:
+            index.delete_doc(doc_id)
+
+    # 检索
+    def search(
+        self, kb_id: str, query_vector, k: int, doc_ids: Optional[Set[str]] = None
+    ) -> Optional[List[tuple]]:
+        """
+        在压缩索引中检索并从向量库读取分块
+        Args:
+            kb_id: 知识库ID
+            query_vector: 查询向量
+            k: 返回数量
+            doc_ids: 只在这些文档的分块中检索（可选）
+
+        Returns:
+            (Document, 余弦相似度) 列表；知识库未开启压缩时返回 None
+        """
+        from app.services.vector_service import vector_service
+
+        index = self.get_index(kb_id)
+        if index is None:
+            return None
+        hits = index.search(query_vector, k, doc_ids)
+        documents = {
+            doc.id: doc
+            for doc in vector_service.get_by_ids(f"kb_{kb_id}", [chunk_id for chunk_id, _ in hits])
+        }
+        return [(documents[chunk_id], score) for chunk_id, score in hits if chunk_id in documents]
+
+
+# 初始化空索引目录
+def _init_files(path: str, spec: CompressionSpec, dim: int):
+    # 校验降维维度
+    Codec(spec, dim)
+    _write_meta(path, spec, dim, False)
+    for name in ("full.f32", "rows.jsonl"):
+        open(os.path.join(path, name), "wb").close()
+
+
+# 评估压缩模式
+def evaluate(
+    vectors,
+    specs: Iterable[str],
+    k: int = 10,
+    queries: int = 200,
+    rescore_factor: Optional[int] = None,
+    seed: int = 0,
+) -> dict:
+    """
+    以全精度精确检索为基准，评估各压缩模式的 recall@k 和内存占用
+    查询取自向量本身（排除自身匹配），候选数与线上检索一致为 k×rescore_factor
+    Args:
+        vectors: 向量矩阵
+        specs: 压缩模式字符串列表
+        k: 评估的返回数量
+        queries: 查询数量
+        rescore_factor: 候选倍数，默认读取 VECTOR_COMPRESSION_RESCORE_FACTOR
+        seed: 随机种子
+
+    Returns:
+        {"vectors", "dim", "k", "queries", "baseline_bytes", "results": [...]}
+    """
+    vectors = _normalize(vectors)
+    count, dim = vectors.shape
+    rescore_factor = rescore_factor or Config.VECTOR_COMPRESSION_RESCORE_FACTOR
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(count, min(queries, count), replace=False)
+    k = min(k, count - 1)
+    # 基准：全精度精确检索（排除查询自身）
+    truth = []
+    for row in query_rows:
+        scores = vectors @ vectors[row]
+        scores[row] = -np.inf
+        truth.append(set(np.argpartition(-scores, k - 1)[:k].tolist()))
+    baseline_bytes = count * dim * 4
+    results = []
+    for spec_text in specs:
+        spec = CompressionSpec.parse(spec_text)
+        codec = Codec(spec, dim)
+        codec.fit(vectors)
+        codes = codec.encode(vectors)
+        candidates_count = min(count - 1, k * rescore_factor)
+        recall_compressed = recall_rescored = 0.0
+        for row, expected in zip(query_rows, truth):
+            scores = codec.score(codes, vectors[row])
+            scores[row] = -np.inf
+            # 仅用压缩分数的前 k 个
+            top = np.argpartition(-scores, k - 1)[:k]
+            recall_compressed += len(expected & set(top.tolist())) / k
+            # 压缩分数取候选，全精度重排
+            candidates = np.argpartition(-scores, candidates_count - 1)[:candidates_count]
+            candidates = candidates[candidates != row]
+            exact = vectors[candidates] @ vectors[row]
+            rescored = candidates[np.argsort(-exact)[:k]]
+            recall_rescored += len(expected & set(rescored.tolist())) / k
+        memory_bytes = codes.nbytes
+        results.append(
+            {
+                "spec": str(spec),
+                "code_dim": codec.code_dim,
+                "memory_bytes": memory_bytes,
+                "compression_ratio": round(baseline_bytes / memory_bytes, 2),
+                f"recall@{k}": round(recall_compressed / len(query_rows), 4),
+                f"recall@{k}_rescored": round(recall_rescored / len(query_rows), 4),
+            }
+        )
+    return {
+        "vectors": count,
+        "dim": dim,
+        "k": k,
+        "queries": len(query_rows),
+        "rescore_factor": rescore_factor,
+        "baseline_bytes": baseline_bytes,
+        "results": results,
+    }
+
+
+# 创建向量压缩服务单例
+vector_compression_service = VectorCompressionService()
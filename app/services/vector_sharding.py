@@ -0,0 +1,518 @@
+"""
+向量分片服务
+维护知识库的分片布局（Knowledgebase.vector_sharding），为 ShardedVectorDB 提供带缓存的布局查询，
+并提供分片统计和重平衡：
+
+    哈希分片   分片数不变时只把过载分片中的部分文档固定（assignments）到最空的分片，直到各分片的分块数
+              不超过平均值的 (1 + tolerance) 倍；分片数变化时按新的分片数重新哈希
+    时间分片   按分块数的分位点重新计算时间边界，使各分片的分块数接近
+
+重平衡先保存过渡布局（待搬迁的文档固定在原分片，新文档已按新布局写入），然后逐个分片读取向量，
+把不在目标分片的分块复制过去，再切换到最终布局，最后删除原分片中的副本。切换之前读写都落在原分片，
+切换之后短暂存在的副本在合并检索结果时按分块ID去重。重平衡期间应避免重新处理该知识库的文档
+
+命令行（使用当前配置 .env）：
+    python -m app.services.vector_sharding status <知识库ID>
+    python -m app.services.vector_sharding rebalance <知识库ID> --strategy hash --shards 8
+    python -m app.services.vector_sharding rebalance <知识库ID> --tolerance 0.1 --dry-run
+"""
+
+# 导入命令行参数解析模块
+import argparse
+
+# 导入二分查找模块
+import bisect
+
+# 导入 JSON 模块
+import json
+
+# 导入日志模块
+import logging
+
+# 导入正则模块，用于解析集合名
+import re
+
+# 导入线程模块
+import threading
+
+# 导入时间模块
+import time
+
+# 导入类型注解
+from typing import Dict, List, Optional, Tuple
+
+# 导入配置
+from app.config import Config
+
+# 导入知识库模型
+from app.models.knowledgebase import Knowledgebase
+
+# 导入数据库会话和事务管理工具
+from app.utils.db import db_session, db_transaction
+
+# 导入分片路由工具
+from app.services.vectordb.sharded import (
+    STRATEGIES,
+    all_shards,
+    doc_id_of,
+    hash_shard,
+    place,
+    shard_name,
+)
+
+# 获取当前模块的日志记录器
+logger = logging.getLogger(__name__)
+
+# 逻辑集合名：kb_<知识库ID>
+_COLLECTION_PATTERN = re.compile(r"^kb_([0-9a-f]{32})$")
+# 分片数上限
+MAX_SHARDS = 256
+# 删除原分片副本时每批的文档数
+_DELETE_BATCH_DOCS = 500
+
+
+# 向量分片服务
+class VectorShardingService:
+    """知识库分片布局的查询、统计和重平衡"""
+
+    def __init__(self):
+        # 布局缓存：知识库ID -> (过期时间, 布局)
+        self._cache: Dict[str, Tuple[float, Optional[dict]]] = {}
+        # 保护缓存的锁
+        self._lock = threading.Lock()
+
+    # 解析分片模式字符串
+    @staticmethod
+    def parse(value: Optional[str]) -> Optional[Tuple[str, int]]:
+        """
+        解析 "hash:8"、"time:4" 形式的分片模式
+        Args:
+            value: 分片模式，空字符串或 "none" 表示不分片
+
+        Returns:
+            (策略, 分片数)，不分片时返回 None
+
+        Raises:
+            ValueError: 分片模式不合法
+        """
+        if value is None or str(value).strip().lower() in ("", "none"):
+            return None
+        strategy, _, count = str(value).strip().lower().partition(":")
+        if strategy not in STRATEGIES or not count.isdigit():
+            raise ValueError(f"不合法的分片模式: {value}（例如 hash:8、time:4）")
+        if not 1 <= int(count) <= MAX_SHARDS:
+            raise ValueError(f"分片数必须在 1 到 {MAX_SHARDS} 之间")
+        return strategy, int(count)
+
+    # 新建的分片布局
+    @staticmethod
+    def new_layout(kb_id: str, strategy: str, count: int) -> dict:
+        """
+        生成空知识库的分片布局
+        时间分片在第一次重平衡之前没有边界，分块全部写入第一个分片
+        """
+        return {
+            "strategy": strategy,
+            "shards": [shard_name(f"kb_{kb_id}", i) for i in range(count)],
+            "boundaries": [],
+            "assignments": {},
+        }
+
+    # 按逻辑集合名查询分片布局（ShardedVectorDB 使用）
+    def layout(self, collection_name: str) -> Optional[dict]:
+        """返回逻辑集合的分片布局，不是知识库集合或未分片时返回 None"""
+        match = _COLLECTION_PATTERN.match(collection_name)
+        if not match:
+            return None
+        return self.get_layout(match.group(1))
+
+    # 查询知识库的分片布局
+    def get_layout(self, kb_id: str, fresh: bool = False) -> Optional[dict]:
+        """
+        查询知识库的分片布局，结果缓存 VECTOR_SHARD_LAYOUT_TTL 秒
+        Args:
+            kb_id: 知识库ID
+            fresh: 是否跳过缓存直接读取数据库
+
+        Returns:
+            分片布局，未分片时返回 None
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(kb_id)
+            if cached and not fresh and cached[0] > now:
+                return cached[1]
+        with db_session() as session:
+            value = (
+                session.query(Knowledgebase.vector_sharding)
+                .filter(Knowledgebase.id == kb_id)
+                .scalar()
+            )
+        layout = json.loads(value) if value else None
+        with self._lock:
+            self._cache[kb_id] = (now + Config.VECTOR_SHARD_LAYOUT_TTL, layout)
+        return layout
+
+    # 保存知识库的分片布局
+    def save_layout(self, kb_id: str, layout: Optional[dict]):
+        """保存分片布局（None 表示不分片），本进程的缓存立即失效"""
+        with db_transaction() as session:
+            kb = session.query(Knowledgebase).filter(Knowledgebase.id == kb_id).first()
+            if not kb:
+                raise ValueError(f"知识库 {kb_id} 不存在")
+            kb.vector_sharding = json.dumps(layout, ensure_ascii=False) if layout else None
+        self.invalidate(kb_id)
+
+    # 使本进程的布局缓存失效
+    def invalidate(self, kb_id: str):
+        """在其他事务中直接修改布局后调用，本进程下次查询时重新读取数据库"""
+        with self._lock:
+            self._cache.pop(kb_id, None)
+
+    # 当前布局，未分片时视为只有一个分片的哈希布局
+    def _current_layout(self, kb_id: str) -> dict:
+        return self.get_layout(kb_id, fresh=True) or self.new_layout(kb_id, "hash", 1)
+
+    # 读取各分片，统计每个文档的分布
+    @staticmethod
+    def _scan(layout: dict) -> Dict[str, dict]:
+        from app.services.vector_service import vector_service
+
+        inner = getattr(vector_service, "inner", vector_service)
+        docs: Dict[str, dict] = {}
+        for index, shard in enumerate(all_shards(layout)):
+            for ids, _, metadatas in inner.iter_embeddings(shard):
+                for chunk_id, metadata in zip(ids, metadatas):
+                    metadata = metadata or {}
+                    doc_id = str(metadata.get("doc_id") or doc_id_of(chunk_id) or chunk_id)
+                    info = docs.setdefault(
+                        doc_id, {"shards": {}, "created_at": metadata.get("created_at") or 0}
+                    )
+                    info["shards"][index] = info["shards"].get(index, 0) + 1
+        for info in docs.values():
+            # 中断的重平衡可能在两个分片留下副本，以分块最多的分片为准
+            info["shard"] = max(info["shards"], key=info["shards"].get)
+            info["chunks"] = info["shards"][info["shard"]]
+        return docs
+
+    # 按文档分布汇总各分片的分块数和文档数
+    @staticmethod
+    def _summarize(names: List[str], docs: Dict[str, dict], placement: Dict[str, int]) -> List[dict]:
+        shards = [{"name": name, "chunks": 0, "documents": 0} for name in names]
+        for doc_id, index in placement.items():
+            shards[index]["chunks"] += docs[doc_id]["chunks"]
+            shards[index]["documents"] += 1
+        return shards
+
+    # 分片统计
+    def stats(self, kb_id: str) -> dict:
+        """
+        统计知识库各分片的分块数和文档数（读取全部向量，适合离线执行）
+        Args:
+            kb_id: 知识库ID
+
+        Returns:
+            {"strategy", "shards": [{"name", "chunks", "documents"}], "imbalance"}
+        """
+        layout = self._current_layout(kb_id)
+        docs = self._scan(layout)
+        shards = self._summarize(
+            all_shards(layout), docs, {doc_id: info["shard"] for doc_id, info in docs.items()}
+        )
+        return {
+            "kb_id": kb_id,
+            "strategy": layout["strategy"],
+            "sharded": len(all_shards(layout)) > 1,
+            "shards": shards,
+            "imbalance": _imbalance(shards[: len(layout["shards"])]),
+        }
+
+    # 按分块数的分位点计算时间边界
+    @staticmethod
+    def _time_boundaries(docs: Dict[str, dict], count: int) -> List[float]:
+        ordered = sorted(docs.values(), key=lambda info: info["created_at"])
+        total = sum(info["chunks"] for info in ordered)
+        boundaries: List[float] = []
+        position, accumulated = 0, 0
+        for i in range(1, count):
+            threshold = total * i / count
+            while position < len(ordered) and accumulated + ordered[position]["chunks"] <= threshold:
+                accumulated += ordered[position]["chunks"]
+                position += 1
+            if position < len(ordered):
+                boundaries.append(ordered[position]["created_at"])
+            else:
+                boundaries.append(ordered[-1]["created_at"] + 1 if ordered else 0)
+        return boundaries
+
+    # 哈希分片：把过载分片中的文档固定到最空的分片
+    @staticmethod
+    def _balance(target: dict, docs: Dict[str, dict], placement: Dict[str, int], tolerance: float):
+        count = len(target["shards"])
+        loads = [0] * count
+        # 每个分片中按分块数排序的 (分块数, 文档ID)
+        members: List[List[tuple]] = [[] for _ in range(count)]
+        for doc_id, index in placement.items():
+            loads[index] += docs[doc_id]["chunks"]
+            members[index].append((docs[doc_id]["chunks"], doc_id))
+        for items in members:
+            items.sort()
+        limit = sum(loads) / count * (1 + tolerance)
+        while True:
+            source = max(range(count), key=loads.__getitem__)
+            dest = min(range(count), key=loads.__getitem__)
+            gap = loads[source] - loads[dest]
+            if loads[source] <= limit or gap <= 0:
+                break
+            # 选分块数最接近差值一半的文档，搬迁后两个分片最接近
+            items = members[source]
+            position = bisect.bisect_left(items, (gap / 2,))
+            candidates = [items[i] for i in (position - 1, position) if 0 <= i < len(items)]
+            candidates = [item for item in candidates if 0 < item[0] < gap]
+            if not candidates:
+                break
+            size, doc_id = max(candidates, key=lambda item: min(item[0], gap - item[0]))
+            items.remove((size, doc_id))
+            bisect.insort(members[dest], (size, doc_id))
+            loads[source] -= size
+            loads[dest] += size
+            placement[doc_id] = dest
+            if dest == hash_shard(doc_id, count):
+                target["assignments"].pop(doc_id, None)
+            else:
+                target["assignments"][doc_id] = dest
+
+    # 计算目标布局
+    def _plan(
+        self,
+        kb_id: str,
+        current: dict,
+        docs: Dict[str, dict],
+        strategy: str,
+        count: int,
+        tolerance: float,
+    ) -> Tuple[dict, Dict[str, int]]:
+        target = self.new_layout(kb_id, strategy, count)
+        if strategy == "time":
+            target["boundaries"] = self._time_boundaries(docs, count)
+            placement = {
+                doc_id: place(target, doc_id, info["created_at"]) for doc_id, info in docs.items()
+            }
+            return target, placement
+        # 分片不变时保留已有的固定分配，只修正失衡，尽量少搬迁
+        if current["strategy"] == "hash" and current["shards"] == target["shards"]:
+            target["assignments"] = {
+                doc_id: index
+                for doc_id, index in (current.get("assignments") or {}).items()
+                if doc_id in docs and index < count
+            }
+        placement = {doc_id: place(target, doc_id) for doc_id in docs}
+        self._balance(target, docs, placement, tolerance)
+        return target, placement
+
+    # 重平衡
+    def rebalance(
+        self,
+        kb_id: str,
+        shards: Optional[int] = None,
+        strategy: Optional[str] = None,
+        tolerance: float = 0.1,
+        dry_run: bool = False,
+    ) -> dict:
+        """
+        重平衡知识库的分片，也用于为已有知识库开启分片或修改分片数和策略
+        Args:
+            kb_id: 知识库ID
+            shards: 目标分片数（默认保持不变）
+            strategy: 目标策略 hash 或 time（默认保持不变）
+            tolerance: 哈希分片允许的失衡比例，分块数超过平均值 (1 + tolerance) 倍的分片会被搬出文档
+            dry_run: 只计算搬迁计划，不修改数据
+
+        Returns:
+            重平衡报告：搬迁前后各分片的分块数、搬迁的文档数和分块数
+        """
+        current = self._current_layout(kb_id)
+        # 影子集合与分片一一对应，迁移 Embedding 模型期间不能修改分片
+        if current.get("shadow"):
+            raise ValueError(f"知识库 {kb_id} 正在迁移 Embedding 模型，请在迁移完成后再重平衡")
+        strategy = strategy or current["strategy"]
+        count = shards or len(current["shards"])
+        self.parse(f"{strategy}:{count}")
+        if tolerance < 0:
+            raise ValueError("tolerance 不能为负数")
+
+        docs = self._scan(current)
+        target, placement = self._plan(kb_id, current, docs, strategy, count, tolerance)
+        # 搬迁只复制已有向量，Embedding 模型不变
+        if current.get("embedding_model"):
+            target["embedding_model"] = current["embedding_model"]
+        current_names = all_shards(current)
+        moves = {
+            doc_id: index
+            for doc_id, index in placement.items()
+            if target["shards"][index] != current_names[docs[doc_id]["shard"]]
+        }
+        report = {
+            "kb_id": kb_id,
+            "strategy": strategy,
+            "dry_run": dry_run,
+            "before": self._summarize(
+                current_names, docs, {doc_id: info["shard"] for doc_id, info in docs.items()}
+            ),
+            "after": self._summarize(target["shards"], docs, placement),
+            "moved_documents": len(moves),
+            "moved_chunks": sum(docs[doc_id]["chunks"] for doc_id in moves),
+        }
+        report["imbalance"] = _imbalance(report["after"])
+        if dry_run:
+            return report
+        final = target if count > 1 or target["assignments"] or target.get("embedding_model") else None
+        # 没有需要搬迁的文档（例如空知识库开启分片）时直接切换布局
+        if not moves and all(name in target["shards"] for name in current_names):
+            self.save_layout(kb_id, final)
+            return report
+
+        # 1. 过渡布局：新文档按目标布局写入，待搬迁的文档固定在原分片，不再使用的分片进入清空状态
+        transition = dict(target)
+        draining = [name for name in current_names if name not in target["shards"]]
+        transition["draining"] = draining
+        names = all_shards(transition)
+        transition["assignments"] = dict(target["assignments"])
+        for doc_id in moves:
+            transition["assignments"][doc_id] = names.index(current_names[docs[doc_id]["shard"]])
+        self.save_layout(kb_id, transition)
+        # 等待各进程的布局缓存过期
+        time.sleep(Config.VECTOR_SHARD_LAYOUT_TTL)
+
+        # 2. 复制：逐个分片读取，不在目标分片的分块复制过去（包括等待期间按旧布局写入的分块）
+        copied = self._copy(names, target)
+
+        # 3. 切换到最终布局，等待缓存过期后删除原分片中的副本，不再使用的分片直接删除集合
+        self.save_layout(kb_id, final)
+        time.sleep(Config.VECTOR_SHARD_LAYOUT_TTL)
+        self._delete_copies(
+            {source: doc_ids for source, doc_ids in copied.items() if source not in draining}
+        )
+        self._drop_shards(draining)
+        logger.info(
+            f"知识库 {kb_id} 分片重平衡完成: {strategy}:{count}, "
+            f"搬迁文档 {report['moved_documents']} 个, 分块 {report['moved_chunks']} 个"
+        )
+        return report
+
+    # 把不在目标分片的分块复制过去
+    @staticmethod
+    def _copy(names: List[str], target: dict) -> Dict[str, set]:
+        """返回 {原分片: 已复制的文档ID集合}"""
+        from app.services.vector_service import vector_service
+
+        inner = getattr(vector_service, "inner", vector_service)
+        copied: Dict[str, set] = {}
+        for source in names:
+            # 目标分片 -> 待写入的 (ids, embeddings, metadatas)
+            pending: Dict[str, tuple] = {}
+
+            def flush(dest: str):
+                ids, embeddings, metadatas = pending.pop(dest)
+                texts = {doc.id: doc.page_content for doc in inner.get_by_ids(source, ids)}
+                # 读取期间已被删除的分块不再复制
+                rows = [i for i, chunk_id in enumerate(ids) if chunk_id in texts]
+                if rows:
+                    inner.add_embeddings(
+                        dest,
+                        [texts[ids[i]] for i in rows],
+                        [embeddings[i] for i in rows],
+                        [metadatas[i] for i in rows],
+                        [ids[i] for i in rows],
+                    )
+
+            for ids, embeddings, metadatas in inner.iter_embeddings(source):
+                for chunk_id, embedding, metadata in zip(ids, embeddings, metadatas):
+                    metadata = metadata or {}
+                    doc_id = metadata.get("doc_id") or doc_id_of(chunk_id)
+                    dest = target["shards"][place(target, doc_id, metadata.get("created_at"))]
+                    if dest == source:
+                        continue
+                    batch = pending.setdefault(dest, ([], [], []))
+                    batch[0].append(chunk_id)
+                    batch[1].append(
+                        embedding.tolist() if hasattr(embedding, "tolist") else list(embedding)
+                    )
+                    batch[2].append(metadata)
+                    copied.setdefault(source, set()).add(str(doc_id))
+                    if len(batch[0]) >= Config.VECTOR_SHARD_COPY_BATCH:
+                        flush(dest)
+            for dest in list(pending):
+                flush(dest)
+        return copied
+
+    # 删除原分片中已复制的文档
+    @staticmethod
+    def _delete_copies(copied: Dict[str, set]):
+        from app.services.vector_service import vector_service
+
+        inner = getattr(vector_service, "inner", vector_service)
+        for source, doc_ids in copied.items():
+            doc_ids = sorted(doc_ids)
+            for start in range(0, len(doc_ids), _DELETE_BATCH_DOCS):
+                inner.delete_documents(
+                    source,
+                    filter={"field": "doc_id", "op": "in", "value": doc_ids[start : start + _DELETE_BATCH_DOCS]},
+                )
+
+    # 删除不再使用的分片集合
+    @staticmethod
+    def _drop_shards(names: List[str]):
+        """删除已清空的分片集合；最终布局已生效，删除失败只记录日志"""
+        from app.services.vector_service import vector_service
+
+        inner = getattr(vector_service, "inner", vector_service)
+        for name in names:
+            try:
+                inner.drop_collection(name)
+            except Exception as e:
+                logger.warning(f"删除已清空的分片 {name} 失败: {e}")
+
+
+# 最大分片与平均值的比值
+def _imbalance(shards: List[dict]) -> float:
+    total = sum(shard["chunks"] for shard in shards)
+    if not shards or total == 0:
+        return 1.0
+    return round(max(shard["chunks"] for shard in shards) * len(shards) / total, 3)
+
+
+# 创建全局向量分片服务实例
+vector_sharding_service = VectorShardingService()
+
+
+# 命令行入口
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RAG Lite 向量分片统计与重平衡")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    status = subparsers.add_parser("status", help="统计各分片的分块数和文档数")
+    status.add_argument("kb_id", help="知识库ID")
+    rebalance = subparsers.add_parser("rebalance", help="重平衡分片，或修改分片数和策略")
+    rebalance.add_argument("kb_id", help="知识库ID")
+    rebalance.add_argument("--shards", type=int, help="目标分片数（默认保持不变）")
+    rebalance.add_argument("--strategy", choices=STRATEGIES, help="目标策略（默认保持不变）")
+    rebalance.add_argument("--tolerance", type=float, default=0.1, help="哈希分片允许的失衡比例")
+    rebalance.add_argument("--dry-run", action="store_true", help="只输出搬迁计划")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "status":
+        result = vector_sharding_service.stats(args.kb_id)
+    else:
+        result = vector_sharding_service.rebalance(
+            args.kb_id,
+            shards=args.shards,
+            strategy=args.strategy,
+            tolerance=args.tolerance,
+            dry_run=args.dry_run,
+        )
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@
 from abc import ABC, abstractmethod
 
 # 导入类型提示：列表、字典、可选和任意类型
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Iterator
 
 # 导入 LangChain 的 Document 类，用于文档对象
 from langchain_core.documents import Document
@@ -53,6 +53,34 @@ class VectorDBInterface(ABC):
         # 子类需要实现具体逻辑
         pass
 
+    # 定义抽象方法：使用预先计算好的向量写入文档
+    @abstractmethod
+    def add_embeddings(
+        self,
+        collection_name: str,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """
+        使用预先计算好的向量写入文档（同 ID 覆盖写入）
+        与 add_documents 的区别在于向量由调用方预先计算，
+        便于把"向量化"和"写入"拆成两个独立阶段，也便于导入已有向量
+
+        Args:
+            collection_name: 集合名称
+            texts: 文本列表
+            embeddings: 与 texts 一一对应的向量列表
+            metadatas: 元数据列表（可选）
+            ids: 文档ID列表（可选）
+
+        Returns:
+            写入的文档ID列表
+        """
+        # 子类需要实现具体逻辑
+        pass
+
     # 定义抽象方法：删除指定的文档
     @abstractmethod
     def delete_documents(
@@ -67,7 +95,78 @@ class VectorDBInterface(ABC):
         Args:
             collection_name: 集合名称
             ids: 要删除的文档ID列表（可选）
-            filter: 过滤条件（可选）
+            filter: 过滤条件（可选，写法见 app.services.vectordb.filters）
+        """
+        # 子类需要实现具体逻辑
+        pass
+
+    # 按条件延后删除文档
+    def delete_documents_later(self, collection_name: str, filter: Dict) -> None:
+        """
+        按过滤条件删除文档，实现可以把删除交给后台任务执行，调用方不等待删除完成
+        默认直接同步删除；延后执行的实现需要保证待删除的文档不再出现在检索结果中
+
+        Args:
+            collection_name: 集合名称
+            filter: 过滤条件，例如 {"doc_id": "xxx"}
+        """
+        self.delete_documents(collection_name, filter=filter)
+
+    # 删除整个集合
+    def drop_collection(self, collection_name: str) -> None:
+        """
+        删除整个集合（包括集合的向量维度等结构），集合不存在时不做任何操作
+        用于切换 Embedding 模型后清理旧集合：只删除文档会留下维度固定的空集合，同名集合无法写入新维度的向量
+
+        Args:
+            collection_name: 集合名称
+        """
+        raise NotImplementedError(f"{type(self).__name__} 不支持删除集合")
+
+    # 集合使用的 Embedding 模型
+    def embeddings_for(self, collection_name: str):
+        """
+        返回集合中向量所属的 Embedding 模型，写入和检索该集合时必须使用同一模型向量化
+        默认所有集合都使用实例的 embeddings；切换模型后需要区分新旧集合的实现覆盖此方法
+
+        Args:
+            collection_name: 集合名称
+
+        Returns:
+            Embeddings 对象
+        """
+        return self.embeddings
+
+    # 定义抽象方法：按ID批量获取文档
+    @abstractmethod
+    def get_by_ids(self, collection_name: str, ids: List[str]) -> List[Document]:
+        """
+        按ID批量获取文档（一次请求），用于根据引用的分块ID回填分块内容
+
+        Args:
+            collection_name: 集合名称
+            ids: 文档ID列表
+
+        Returns:
+            Document 列表（Document.id 为文档ID），不存在的ID会被忽略，顺序不保证与 ids 一致
+        """
+        # 子类需要实现具体逻辑
+        pass
+
+    # 定义抽象方法：分批读取集合中的全部向量
+    @abstractmethod
+    def iter_embeddings(
+        self, collection_name: str, batch_size: int = 1000
+    ) -> Iterator[tuple]:
+        """
+        分批读取集合中的全部向量（不做相似度计算），用于构建压缩索引、导出和迁移
+
+        Args:
+            collection_name: 集合名称
+            batch_size: 每批读取的数量
+
+        Returns:
+            (ids, embeddings, metadatas) 元组的迭代器，集合不存在时不产生任何批次
         """
         # 子类需要实现具体逻辑
         pass
@@ -86,7 +185,7 @@ class VectorDBInterface(ABC):
             collection_name: 集合名称
             query: 查询文本
             k: 返回结果数量
-            filter: 元数据过滤条件
+            filter: 元数据过滤条件（写法见 app.services.vectordb.filters，由实现编译为后端语法并在检索前执行）
 
         Returns:
             检索到的 Document 列表
@@ -106,10 +205,34 @@ class VectorDBInterface(ABC):
             collection_name: 集合名称
             query: 查询文本
             k: 返回结果数量
-            filter: 元数据过滤条件
+            filter: 元数据过滤条件（写法见 app.services.vectordb.filters，由实现编译为后端语法并在检索前执行）
 
         Returns:
             (Document, score) 元组列表
 
         """
         pass
+
+    # 定义抽象方法：基于查询向量的带分数相似度搜索
+    @abstractmethod
+    def similarity_search_by_vector_with_score(
+        self,
+        collection_name: str,
+        embedding: List[float],
+        k: int = 5,
+        filter: Optional[Dict] = None,
+    ) -> List[tuple]:
+        """
+        基于查询向量的相似度搜索（带分数）
+        与 similarity_search_with_score 的区别在于查询向量由调用方预先计算，
+        便于把"向量化"和"检索"拆成两个独立阶段
+        Args:
+            collection_name: 集合名称
+            embedding: 查询向量
+            k: 返回结果数量
+            filter: 元数据过滤条件（写法见 app.services.vectordb.filters，由实现编译为后端语法并在检索前执行）
+
+        Returns:
+            (Document, score) 元组列表，score 为归一化后的相关度（越大越相似）
+        """
+        pass
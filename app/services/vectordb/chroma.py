@@ -2,11 +2,29 @@
 ChromaDB 向量数据库实现
 """
 
+# 导入 JSON 模块，用于读写待删除日志
+import json
+
 # 导入日志模块
 import logging
 
+# 导入操作系统相关模块
+import os
+
+# 导入线程模块，用于后台删除任务
+import threading
+
+# 导入时间模块
+import time
+
+# 导入uuid模块，用于生成文档ID
+import uuid
+
+# 导入上下文管理器装饰器
+from contextlib import contextmanager
+
 # 导入需要的类型提示
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Iterator
 
 # 导入LangChain 的 Chroma类
 from langchain_chroma import Chroma
@@ -17,16 +35,33 @@ from langchain_core.documents import Document
 # 导入向量数据库接口基类
 from app.services.vectordb.base import VectorDBInterface
 
+# 导入元数据过滤条件
+from app.services.vectordb import filters
+
 # 导入全局配置
 from app.config import Config
 
 # 导入嵌入模型工厂
 from app.utils.embedding_factory import EmbeddingFactory
-from test import vectorstore
+
+# 导入指标定义与计时装饰器
+from app.utils.metrics import VECTOR_SEARCH_SECONDS, timed
+
+# 导入链路追踪装饰器
+from app.utils.tracing import traced
+
+# 文件锁仅在 POSIX 平台可用，其他平台只做进程内互斥
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
 
 # 获取日志记录器
 logger = logging.getLogger(__name__)
 
+# 待删除日志文件名（位于持久化目录下，多个进程共享）
+_JOURNAL_FILE = "deferred_deletes.jsonl"
+
 
 # 定义 Chroma 向量数据库实现类
 class ChromaVectorDB(VectorDBInterface):
@@ -44,6 +79,11 @@ class ChromaVectorDB(VectorDBInterface):
         self.persist_directory = persist_directory
         # 动态创建Embedding模型
         self.embeddings = EmbeddingFactory.create_embeddings()
+        # 后台删除任务
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        # 待删除日志的缓存：((修改时间, 大小), {集合名: 待删除的 doc_id 列表})
+        self._pending_cache: tuple = (None, {})
         # 记录 ChromaDB 初始化信息
         logger.info(f"ChromaDB 已初始化, 持久化目录: {persist_directory}")
 
@@ -66,6 +106,13 @@ class ChromaVectorDB(VectorDBInterface):
     ) -> List[str]:
         # 获取集合
         vectorstore = self.get_or_create_collection(collection_name)
+        # Chroma 不接受空列表作为元数据取值
+        documents = [
+            Document(id=doc.id, page_content=doc.page_content, metadata=metadata)
+            for doc, metadata in zip(
+                documents, self._clean_metadatas([doc.metadata for doc in documents])
+            )
+        ]
         # 如果指定了ids
         if ids:
             # # 添加文档，指定 ids
@@ -80,6 +127,36 @@ class ChromaVectorDB(VectorDBInterface):
         # 返回已添加文档的id列表
         return result_ids
 
+    # 使用预先计算好的向量写入文档
+    def add_embeddings(
+        self,
+        collection_name: str,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """使用预先计算好的向量写入文档（upsert，同 ID 覆盖）"""
+        vectorstore = self.get_or_create_collection(collection_name)
+        # 未指定ID时生成随机ID
+        if not ids:
+            ids = [uuid.uuid4().hex for _ in texts]
+        # 直接调用底层集合的 upsert，跳过 LangChain 内部的向量化
+        vectorstore._collection.upsert(
+            ids=ids,
+            embeddings=embeddings,
+            documents=texts,
+            metadatas=self._clean_metadatas(metadatas),
+        )
+        logger.info(f"已向 ChromaDB 集合 {collection_name} 写入 {len(texts)} 个向量")
+        return ids
+
+    # 删除整个集合
+    def drop_collection(self, collection_name: str) -> None:
+        """删除整个集合，集合不存在时不做任何操作"""
+        self.get_or_create_collection(collection_name).delete_collection()
+        logger.info(f"已删除 ChromaDB 集合 {collection_name}")
+
     # 删除文档
     def delete_documents(
         self,
@@ -87,24 +164,20 @@ class ChromaVectorDB(VectorDBInterface):
         ids: Optional[List[str]] = None,
         filter: Optional[Dict] = None,
     ) -> None:
-        vectorstore = self.get_or_create_collection(collection_name)
+        """
+        删除文档（同步执行）
+        按 filter 删除时分批只读取匹配的 ID（include=[]）再删除，不读取文本、元数据和向量，
+        单批数量由 CHROMA_DELETE_BATCH_SIZE 控制，大文档不会一次性占用大量内存
+        """
+        collection = self.get_or_create_collection(collection_name)._collection
         if ids:
-            vectorstore.delete(ids)
+            batch_size = Config.CHROMA_DELETE_BATCH_SIZE
+            for offset in range(0, len(ids), batch_size):
+                collection.delete(ids=list(ids[offset : offset + batch_size]))
         elif filter:
-            # ChromaDB 不支持直接使用 filter 参数删除
-            # 需要先查询出符合条件的文档 IDs，然后删除
             try:
-                collectin = vectorstore._collection
-                # 使用 where 条件查询匹配的文档
-                # filter 格式: {"doc_id": "xxx"}
-                where = filter
-                results = collectin.get(where=where)
-                if results and "ids" in results and results["ids"]:
-                    matched_ids = results["ids"]
-                    vectorstore.delete(ids=matched_ids)
-                    logger.info(f"已通过filter条件删除{len(matched_ids)}个文档")
-                else:
-                    logger.info(f"未找到匹配filter条件的文档，无需删除")
+                deleted = self._delete_where(collection, filters.to_chroma_where(filter))
+                logger.info(f"已通过filter条件删除{deleted}个文档")
             except Exception as e:
                 logger.error(f"使用filter删除文档时出错: {e}", exc_info=True)
                 raise
@@ -112,6 +185,263 @@ class ChromaVectorDB(VectorDBInterface):
             raise ValueError(f"你既没有传ids,也没有传filter")
         logger.info(f"已经从ChromDB集合{collection_name}删除文档")
 
+    # 去掉 Chroma 不接受的空列表元数据
+    @staticmethod
+    def _clean_metadatas(metadatas: Optional[List[dict]]) -> Optional[List[dict]]:
+        """空列表（如没有标签的 tags）不写入元数据，按 contains 过滤时视为不匹配"""
+        if metadatas is None:
+            return None
+        return [
+            {key: value for key, value in metadata.items() if value != []}
+            if metadata
+            else metadata
+            for metadata in metadatas
+        ]
+
+    # 按条件分批删除
+    @staticmethod
+    def _delete_where(collection, where: Dict) -> int:
+        """分批读取匹配条件的 ID 并删除，返回删除数量"""
+        deleted = 0
+        while True:
+            matched = collection.get(
+                where=where, include=[], limit=Config.CHROMA_DELETE_BATCH_SIZE
+            )["ids"]
+            if not matched:
+                return deleted
+            collection.delete(ids=matched)
+            deleted += len(matched)
+
+    # 按条件延后删除文档
+    def delete_documents_later(self, collection_name: str, filter: Dict) -> None:
+        """
+        把删除条件写入待删除日志，由后台任务分批删除，调用方不等待删除完成
+        日志保存在持久化目录下，进程退出后由下一个打开该目录的进程继续执行；
+        待删除的文档（filter 为 {"doc_id": ...}）在检索结果中立即不可见
+        CHROMA_DEFER_DELETE=false 时直接同步删除
+        """
+        if not Config.CHROMA_DEFER_DELETE:
+            self.delete_documents(collection_name, filter=filter)
+            return
+        # 登记前校验过滤条件，避免不合法的条目留在日志中反复失败
+        if filters.normalize(filter) is None:
+            raise ValueError("延后删除必须指定过滤条件")
+        entry = {
+            "id": uuid.uuid4().hex,
+            "collection": collection_name,
+            "filter": filter,
+            "created_at": time.time(),
+        }
+        with self._journal_lock():
+            with open(self._journal_path(), "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._schedule()
+        logger.info(f"已登记ChromDB集合{collection_name}的延后删除: {filter}")
+
+    # 执行待删除日志中的删除
+    def process_deferred_deletes(self) -> int:
+        """
+        执行待删除日志中的全部删除并从日志中移除，返回完成的条数
+        多个进程同时执行时只有一个进程处理，其他进程直接跳过
+        """
+        with self._worker_lock() as acquired:
+            if not acquired:
+                return 0
+            done = []
+            for entry in self._read_journal():
+                try:
+                    collection = self.get_or_create_collection(entry["collection"])._collection
+                    deleted = self._delete_where(
+                        collection, filters.to_chroma_where(entry["filter"])
+                    )
+                    done.append(entry["id"])
+                    logger.info(
+                        f"后台删除完成: 集合 {entry['collection']}, 条件 {entry['filter']}, 删除 {deleted} 个文档"
+                    )
+                except Exception as e:
+                    logger.error(f"后台删除失败，稍后重试: {entry}: {e}", exc_info=True)
+            if done:
+                # 处理期间可能有新的登记，只移除已完成的条目
+                finished = set(done)
+                with self._journal_lock():
+                    remaining = [
+                        entry for entry in self._read_journal(locked=True)
+                        if entry["id"] not in finished
+                    ]
+                    tmp_path = self._journal_path() + ".tmp"
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        for entry in remaining:
+                            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                    os.replace(tmp_path, self._journal_path())
+            return len(done)
+
+    # 待删除日志路径
+    def _journal_path(self) -> str:
+        return os.path.join(self.persist_directory, _JOURNAL_FILE)
+
+    # 待删除日志的读写锁（进程内互斥 + 跨进程文件锁）
+    @contextmanager
+    def _journal_lock(self):
+        os.makedirs(self.persist_directory, exist_ok=True)
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._journal_path() + ".lock", "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    # 后台删除任务锁：同一目录同一时间只允许一个进程执行
+    @contextmanager
+    def _worker_lock(self):
+        if fcntl is None:
+            yield True
+            return
+        os.makedirs(self.persist_directory, exist_ok=True)
+        with open(self._journal_path() + ".worker.lock", "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    # 读取待删除日志
+    def _read_journal(self, locked: bool = False) -> List[dict]:
+        """读取待删除日志；locked 为 True 表示调用方已持有日志锁"""
+        if not os.path.exists(self._journal_path()):
+            return []
+        if not locked:
+            with self._journal_lock():
+                return self._read_journal(locked=True)
+        entries = []
+        with open(self._journal_path(), encoding="utf-8") as f:
+            for line in f:
+                # 跳过进程崩溃时写了一半的行
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        return entries
+
+    # 集合中等待删除的文档ID
+    def _pending_doc_ids(self, collection_name: str) -> List[str]:
+        """返回集合中已登记延后删除、尚未删除完成的 doc_id；日志未变化时使用缓存"""
+        try:
+            stat = os.stat(self._journal_path())
+        except OSError:
+            return []
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached_version, pending = self._pending_cache
+        if version != cached_version:
+            pending = {}
+            for entry in self._read_journal():
+                # 只有按文档ID删除的条目可以在检索时排除
+                try:
+                    doc_ids = filters.doc_id_restriction(entry.get("filter"))
+                except ValueError:
+                    doc_ids = None
+                if doc_ids:
+                    pending.setdefault(entry["collection"], []).extend(sorted(doc_ids))
+            self._pending_cache = (version, pending)
+            # 其他进程登记或上次退出时遗留的删除由本进程的后台任务继续执行
+            if pending:
+                self._schedule()
+        return pending.get(collection_name, [])
+
+    # 编译检索的 where 条件
+    def _build_where(self, collection_name: str, filter: Optional[Dict]) -> Optional[Dict]:
+        """将过滤条件编译为 where 语法，并排除等待后台删除的文档"""
+        where = filters.to_chroma_where(filter)
+        pending = self._pending_doc_ids(collection_name)
+        if not pending:
+            return where
+        exclusion = {"doc_id": {"$nin": pending}}
+        return {"$and": [where, exclusion]} if where else exclusion
+
+    # 启动后台删除任务
+    def _schedule(self):
+        """后台线程每隔 CHROMA_DELETE_INTERVAL 秒执行一次待删除日志"""
+        # 后台线程在第一次需要时启动（gunicorn 在导入后 fork，导入时启动的线程不会被继承）
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._run, name="chroma-deferred-delete", daemon=True
+                    )
+                    self._thread.start()
+
+    # 后台线程主循环：日志清空后退出，下次登记时重新启动
+    def _run(self):
+        while True:
+            time.sleep(Config.CHROMA_DELETE_INTERVAL)
+            try:
+                self.process_deferred_deletes()
+            except Exception as e:
+                logger.error(f"执行后台删除失败: {e}", exc_info=True)
+            # 登记在持有 self._lock 时写入日志，这里在同一把锁内判断，不会漏掉新登记
+            with self._lock:
+                path = self._journal_path()
+                if not os.path.exists(path) or os.path.getsize(path) == 0:
+                    self._thread = None
+                    return
+
+    # 按ID批量获取文档
+    @traced("vectordb.get_by_ids")
+    def get_by_ids(self, collection_name: str, ids: List[str]) -> List[Document]:
+        """按ID批量获取文档"""
+        if not ids:
+            return []
+        vectorstore = self.get_or_create_collection(collection_name)
+        # 直接读取底层集合，不需要向量
+        results = vectorstore._collection.get(
+            ids=list(ids), include=["documents", "metadatas"]
+        )
+        # 等待后台删除的文档视为已删除
+        pending = set(self._pending_doc_ids(collection_name))
+        return [
+            Document(id=doc_id, page_content=text or "", metadata=metadata or {})
+            for doc_id, text, metadata in zip(
+                results["ids"], results["documents"], results["metadatas"]
+            )
+            if (metadata or {}).get("doc_id") not in pending
+        ]
+
+    # 分批读取集合中的全部向量
+    def iter_embeddings(
+        self, collection_name: str, batch_size: int = 1000
+    ) -> Iterator[tuple]:
+        """按写入顺序分批读取 (ids, embeddings, metadatas)，只读元数据段和向量，不加载 HNSW 索引"""
+        collection = self.get_or_create_collection(collection_name)._collection
+        pending = set(self._pending_doc_ids(collection_name))
+        offset = 0
+        while True:
+            results = collection.get(
+                include=["embeddings", "metadatas"], limit=batch_size, offset=offset
+            )
+            ids = results["ids"]
+            if not ids:
+                return
+            offset += len(ids)
+            batch = [
+                (doc_id, list(embedding), metadata)
+                for doc_id, embedding, metadata in zip(
+                    ids, results["embeddings"], results["metadatas"]
+                )
+                # 等待后台删除的文档视为已删除
+                if (metadata or {}).get("doc_id") not in pending
+            ]
+            if batch:
+                yield tuple(list(column) for column in zip(*batch))
+
+    @traced("vectordb.similarity_search")
+    @timed(VECTOR_SEARCH_SECONDS, backend="chroma", method="similarity_search")
     def similarity_search(
         self,
         collection_name: str,
@@ -122,6 +452,8 @@ class ChromaVectorDB(VectorDBInterface):
         """相似度搜索"""
         # 获取或创建集合对应的向量存储对象
         vectorstore = self.get_or_create_collection(collection_name)
+        # 编译过滤条件，并排除等待后台删除的文档
+        filter = self._build_where(collection_name, filter)
         # 如果指定了过滤条件
         if filter:
             # 带过滤条件地执行相似度搜索
@@ -133,6 +465,8 @@ class ChromaVectorDB(VectorDBInterface):
         return results
 
     # 定义带分数地相似度搜索方法
+    @traced("vectordb.similarity_search_with_score")
+    @timed(VECTOR_SEARCH_SECONDS, backend="chroma", method="similarity_search_with_score")
     def similarity_search_with_score(
         self,
         collection_name: str,
@@ -142,6 +476,8 @@ class ChromaVectorDB(VectorDBInterface):
     ) -> List[tuple]:
         """用于执行带分数的相似度搜索"""
         vectorstore = self.get_or_create_collection(collection_name)
+        # 编译过滤条件，并排除等待后台删除的文档
+        filter = self._build_where(collection_name, filter)
         if filter:
             results = vectorstore.similarity_search_with_score(
                 query=query, k=k, filter=filter
@@ -149,3 +485,56 @@ class ChromaVectorDB(VectorDBInterface):
         else:
             results = vectorstore.similarity_search_with_score(query=query, k=k)
         return results
+
+    # 定义基于查询向量的带分数相似度搜索方法
+    @traced("vectordb.similarity_search_by_vector_with_score")
+    @timed(VECTOR_SEARCH_SECONDS, backend="chroma", method="similarity_search_by_vector_with_score")
+    def similarity_search_by_vector_with_score(
+        self,
+        collection_name: str,
+        embedding: List[float],
+        k: int = 5,
+        filter: Optional[Dict] = None,
+    ) -> List[tuple]:
+        """基于查询向量的带分数相似度搜索（分数为相关度，越大越相似）"""
+        vectorstore = self.get_or_create_collection(collection_name)
+        # 编译过滤条件，并排除等待后台删除的文档
+        filter = self._build_where(collection_name, filter)
+        # Chroma 返回的是距离，越小越相似
+        if filter:
+            results = vectorstore.similarity_search_by_vector_with_relevance_scores(
+                embedding=embedding, k=k, filter=filter
+            )
+        else:
+            results = vectorstore.similarity_search_by_vector_with_relevance_scores(
+                embedding=embedding, k=k
+            )
+        # 按集合的距离度量把距离换算成相关度
+        space = self._distance_space(vectorstore)
+        return [
+            (doc, self._distance_to_relevance(space, distance))
+            for doc, distance in results
+        ]
+
+    # 读取集合的距离度量
+    @staticmethod
+    def _distance_space(vectorstore: Chroma) -> str:
+        """读取集合的距离度量（l2 / cosine / ip），默认 l2"""
+        collection = vectorstore._collection
+        try:
+            hnsw_config = (collection.configuration or {}).get("hnsw") or {}
+            space = hnsw_config.get("space")
+        except Exception:
+            space = None
+        return space or (collection.metadata or {}).get("hnsw:space") or "l2"
+
+    # 将距离换算成相关度
+    @staticmethod
+    def _distance_to_relevance(space: str, distance: float) -> float:
+        """
+        将 Chroma 距离换算为余弦相似度口径的相关度
+        Embedding 已做归一化，l2 为平方欧氏距离，满足 d = 2 - 2cos
+        """
+        if space in ("cosine", "ip"):
+            return 1.0 - distance
+        return 1.0 - distance / 2.0
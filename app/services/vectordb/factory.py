@@ -11,6 +11,10 @@ from app.services.vectordb.base import VectorDBInterface
 from app.services.vectordb.chroma import ChromaVectorDB
 # 导入 Milvus 的向量数据库实现
 from app.services.vectordb.milvus import MilvusVectorDB
+# 导入本地向量数据库实现
+from app.services.vectordb.local import LocalVectorDB
+# 导入分片向量数据库（按知识库的分片布局路由到多个集合）
+from app.services.vectordb.sharded import ShardedVectorDB
 # 导入全局配置
 from app.config import Config
 
@@ -32,7 +36,7 @@ class VectorDBFactory:
         """
         创建向量数据库实例
         Args:
-            vectordb_type: 向量数据库类型 ('chroma' 或 'milvus')，如果为None则从配置读取
+            vectordb_type: 向量数据库类型 ('chroma'、'milvus' 或 'local')，如果为None则从配置读取
             **kwargs: 向量数据库的初始化参数
 
         Returns:
@@ -67,6 +71,9 @@ class VectorDBFactory:
                 }
             # 创建 MilvusVectorDB 实例，并传入连接参数
             return MilvusVectorDB(connection_args)
+        elif vectordb_type == "local":
+            # 创建本地向量数据库实例，数据目录可选
+            return LocalVectorDB(persist_directory=kwargs.get("persist_directory"))
         else:
              # 其他类型暂不支持，抛出异常
              raise ValueError(f"Unsupported vector database type: {vectordb_type}")
@@ -76,13 +83,23 @@ class VectorDBFactory:
     def get_instance(cls) -> VectorDBInterface:
         """
         获取单例向量数据库实例（懒加载）
+        实例外层包装 ShardedVectorDB，开启分片的知识库对调用方透明，未分片的集合直接转发；
+        各集合按布局中记录的 Embedding 模型向量化（模型由 Embedding 迁移服务按模型标识提供）
         Returns:
             向量数据库实例
 
         """
         # 如果单例实例为空，则创建
         if cls._instance is None:
-            cls._instance = cls.create_vector_db()
+            # 分片服务和迁移服务依赖数据库模型，在这里导入避免循环导入
+            from app.services.vector_sharding import vector_sharding_service
+            from app.services.embedding_migration import embedding_migration_service
+
+            cls._instance = ShardedVectorDB(
+                cls.create_vector_db(),
+                vector_sharding_service.layout,
+                embeddings_provider=embedding_migration_service.embeddings,
+            )
         return cls._instance
 
 
@@ -0,0 +1,313 @@
+"""
+与后端无关的元数据过滤条件
+过滤条件是可以直接放进 JSON 请求的字典，作用在分块元数据上（doc_id、doc_name、file_type、created_at、tags、chunk_index 等）：
+
+    {"field": "doc_id", "op": "eq", "value": "abc"}
+    {"field": "file_type", "op": "in", "value": ["pdf", "docx"]}
+    {"field": "created_at", "op": "range", "gte": "2024-01-01", "lt": 1735689600}
+    {"field": "tags", "op": "contains", "value": "合同"}
+    {"and": [条件, ...]}、{"or": [条件, ...]}
+
+range 的边界为数字，也可以是 ISO 格式的日期字符串（按本地时间换算为 Unix 时间戳，与 created_at 的取值一致）。
+同时兼容旧的写法：{"doc_id": "abc"}（多个键之间为 and）以及 Chroma 风格的
+{"$and": [...]}、{"file_type": {"$in": [...]}}、{"created_at": {"$gte": ...}}、{"tags": {"$contains": ...}}
+
+各后端通过 to_chroma_where（Chroma、本地向量库）和 to_milvus_expr（Milvus）编译为自身的过滤语法，
+过滤都在向量检索之前执行（预过滤），不会先取大量 top-k 再筛选
+"""
+
+# 导入 JSON 模块，用于构造 Milvus 表达式中的字符串
+import json
+
+# 导入正则模块，用于校验字段名
+import re
+
+# 导入比较运算函数
+import operator
+
+# 导入日期时间模块，用于解析日期边界
+from datetime import datetime
+
+# 导入类型注解
+from typing import Any, Dict, List, Optional, Set
+
+# 字段名只允许标识符，避免拼接 Milvus 表达式时被注入
+_FIELD_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]{0,63}$")
+
+# 范围条件的边界
+_RANGE_BOUNDS = ("gt", "gte", "lt", "lte")
+
+# 范围边界对应的比较符号
+_RANGE_SYMBOLS = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+# 范围边界对应的比较函数
+_COMPARE = {"gt": operator.gt, "gte": operator.ge, "lt": operator.lt, "lte": operator.le}
+
+# 旧写法中 Chroma 风格的操作符
+_LEGACY_RANGE = {"$gt": "gt", "$gte": "gte", "$lt": "lt", "$lte": "lte"}
+
+
+# 规范化过滤条件
+def normalize(filter: Optional[Dict]) -> Optional[Dict]:
+    """
+    校验过滤条件并转换为规范形式，兼容旧的写法
+    Args:
+        filter: 过滤条件，None 或空字典表示不过滤
+
+    Returns:
+        规范形式的过滤条件，不过滤时返回 None
+
+    Raises:
+        ValueError: 过滤条件不合法
+    """
+    if not filter:
+        return None
+    if not isinstance(filter, dict):
+        raise ValueError("过滤条件必须是对象")
+    return _normalize_node(filter)
+
+
+# 规范化一个节点
+def _normalize_node(node: Any) -> Dict:
+    if not isinstance(node, dict) or not node:
+        raise ValueError(f"过滤条件必须是非空对象: {node!r}")
+    # 组合条件
+    for key in ("and", "or", "$and", "$or"):
+        if key in node:
+            if len(node) != 1:
+                raise ValueError(f"{key} 条件不能与其他键并列")
+            clauses = node[key]
+            if not isinstance(clauses, list) or not clauses:
+                raise ValueError(f"{key} 的取值必须是非空列表")
+            return {key.lstrip("$"): [_normalize_node(clause) for clause in clauses]}
+    # 规范写法的单个条件
+    if "field" in node or "op" in node:
+        return _normalize_leaf(node)
+    # 旧写法：{字段: 取值或 Chroma 操作符}，多个键之间为 and
+    clauses = [_normalize_legacy(field, condition) for field, condition in node.items()]
+    return clauses[0] if len(clauses) == 1 else {"and": clauses}
+
+
+# 规范化规范写法的单个条件
+def _normalize_leaf(node: Dict) -> Dict:
+    field = _check_field(node.get("field"))
+    op = node.get("op")
+    if op in ("eq", "contains"):
+        value = _check_scalar(node.get("value"))
+        if op == "contains" and not isinstance(value, str):
+            raise ValueError("contains 条件的取值必须是字符串")
+        if op == "contains" and "," in value:
+            raise ValueError("contains 条件的取值不能包含逗号")
+        return {"field": field, "op": op, "value": value}
+    if op == "in":
+        values = node.get("value")
+        if not isinstance(values, list) or not values:
+            raise ValueError("in 条件的取值必须是非空列表")
+        return {"field": field, "op": "in", "value": [_check_scalar(v) for v in values]}
+    if op == "range":
+        bounds = {bound: _to_number(node[bound]) for bound in _RANGE_BOUNDS if node.get(bound) is not None}
+        if not bounds:
+            raise ValueError("range 条件至少需要一个边界（gt、gte、lt、lte）")
+        return {"field": field, "op": "range", **bounds}
+    raise ValueError(f"不支持的过滤操作: {op!r}（可选 eq、in、range、contains、and、or）")
+
+
+# 规范化旧写法的单个字段
+def _normalize_legacy(field: str, condition: Any) -> Dict:
+    if not isinstance(condition, dict):
+        return _normalize_leaf({"field": field, "op": "eq", "value": condition})
+    clauses = []
+    bounds = {}
+    for op, operand in condition.items():
+        if op == "$eq":
+            clauses.append(_normalize_leaf({"field": field, "op": "eq", "value": operand}))
+        elif op == "$in":
+            clauses.append(_normalize_leaf({"field": field, "op": "in", "value": operand}))
+        elif op == "$contains":
+            clauses.append(_normalize_leaf({"field": field, "op": "contains", "value": operand}))
+        elif op in _LEGACY_RANGE:
+            bounds[_LEGACY_RANGE[op]] = operand
+        else:
+            raise ValueError(f"不支持的过滤操作符: {op}")
+    if bounds:
+        clauses.append(_normalize_leaf({"field": field, "op": "range", **bounds}))
+    if not clauses:
+        raise ValueError(f"字段 {field} 的过滤条件为空")
+    return clauses[0] if len(clauses) == 1 else {"and": clauses}
+
+
+# 校验字段名
+def _check_field(field: Any) -> str:
+    if not isinstance(field, str) or not _FIELD_PATTERN.match(field):
+        raise ValueError(f"不合法的过滤字段: {field!r}")
+    return field
+
+
+# 校验标量取值
+def _check_scalar(value: Any):
+    if isinstance(value, (str, bool, int, float)):
+        return value
+    raise ValueError(f"过滤取值必须是字符串、数字或布尔值: {value!r}")
+
+
+# 范围边界转换为数字
+def _to_number(value: Any) -> float:
+    if isinstance(value, bool):
+        raise ValueError("范围条件的边界不能是布尔值")
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return int(datetime.fromisoformat(value).timestamp())
+        except ValueError:
+            pass
+    raise ValueError(f"范围条件的边界必须是数字或 ISO 日期: {value!r}")
+
+
+# 编译为 Chroma where 语法
+def to_chroma_where(filter: Optional[Dict]) -> Optional[Dict]:
+    """
+    将过滤条件编译为 Chroma 的 where 语法（本地向量库使用同样的语法）
+    Args:
+        filter: 过滤条件（任意支持的写法）
+
+    Returns:
+        where 字典，不过滤时返回 None
+    """
+    node = normalize(filter)
+    return _chroma(node) if node else None
+
+
+def _chroma(node: Dict) -> Dict:
+    for key in ("and", "or"):
+        if key in node:
+            clauses = [_chroma(clause) for clause in node[key]]
+            # Chroma 的 $and / $or 至少需要两个子条件
+            return clauses[0] if len(clauses) == 1 else {f"${key}": clauses}
+    field, op = node["field"], node["op"]
+    if op == "eq":
+        return {field: {"$eq": node["value"]}}
+    if op == "in":
+        return {field: {"$in": node["value"]}}
+    if op == "contains":
+        return {field: {"$contains": node["value"]}}
+    # 范围条件每个边界单独一个子条件
+    clauses = [{field: {f"${bound}": node[bound]}} for bound in _RANGE_BOUNDS if bound in node]
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+# 编译为 Milvus 表达式
+def to_milvus_expr(filter: Optional[Dict]) -> Optional[str]:
+    """
+    将过滤条件编译为 Milvus 布尔表达式
+    列表型元数据（如 tags）在 Milvus 中保存为 ",a,b," 形式的字符串，contains 编译为 like 匹配
+    Args:
+        filter: 过滤条件（任意支持的写法）
+
+    Returns:
+        表达式字符串，不过滤时返回 None
+    """
+    node = normalize(filter)
+    return _milvus(node) if node else None
+
+
+def _milvus(node: Dict) -> str:
+    for key in ("and", "or"):
+        if key in node:
+            return "(" + f" {key} ".join(_milvus(clause) for clause in node[key]) + ")"
+    field, op = node["field"], node["op"]
+    if op == "eq":
+        return f"{field} == {_milvus_literal(node['value'])}"
+    if op == "in":
+        return f"{field} in [{', '.join(_milvus_literal(v) for v in node['value'])}]"
+    if op == "contains":
+        # like 中的 % 和 _ 是通配符，需要转义
+        value = node["value"].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return f"{field} like {json.dumps(f'%,{value},%', ensure_ascii=False)}"
+    parts = [f"{field} {_RANGE_SYMBOLS[bound]} {node[bound]!r}" for bound in _RANGE_BOUNDS if bound in node]
+    return "(" + " and ".join(parts) + ")"
+
+
+# Milvus 表达式中的字面量
+def _milvus_literal(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, str):
+        return json.dumps(value, ensure_ascii=False)
+    return repr(value)
+
+
+# 在内存中判断元数据是否满足过滤条件
+def matches(filter: Optional[Dict], metadata: Optional[Dict]) -> bool:
+    """
+    判断一条元数据是否满足过滤条件（缺失字段或类型不可比较视为不满足）
+    Args:
+        filter: 过滤条件（任意支持的写法）
+        metadata: 分块元数据
+
+    Returns:
+        是否满足
+    """
+    node = normalize(filter)
+    return _matches(node, metadata or {}) if node else True
+
+
+def _matches(node: Dict, metadata: Dict) -> bool:
+    if "and" in node:
+        return all(_matches(clause, metadata) for clause in node["and"])
+    if "or" in node:
+        return any(_matches(clause, metadata) for clause in node["or"])
+    value = metadata.get(node["field"])
+    if value is None:
+        return False
+    op = node["op"]
+    if op == "eq":
+        return value == node["value"]
+    if op == "in":
+        return value in node["value"]
+    if op == "contains":
+        if isinstance(value, str):
+            return f",{node['value']}," in value
+        return isinstance(value, (list, tuple)) and node["value"] in value
+    try:
+        return all(_COMPARE[bound](value, node[bound]) for bound in _RANGE_BOUNDS if bound in node)
+    except TypeError:
+        return False
+
+
+# 过滤条件涉及的字段
+def fields(filter: Optional[Dict]) -> Set[str]:
+    """返回过滤条件引用的全部字段名"""
+    node = normalize(filter)
+    result: Set[str] = set()
+    stack: List[Dict] = [node] if node else []
+    while stack:
+        current = stack.pop()
+        if "field" in current:
+            result.add(current["field"])
+        else:
+            stack.extend(current.get("and") or current.get("or") or [])
+    return result
+
+
+# 只按文档ID过滤时返回文档ID集合
+def doc_id_restriction(filter: Optional[Dict]) -> Optional[Set[str]]:
+    """
+    过滤条件完全由 doc_id 的 eq / in 条件经 and / or 组合而成时，返回满足条件的文档ID集合；
+    包含其他字段或操作时返回 None（调用方需要使用完整的元数据过滤）
+    """
+    node = normalize(filter)
+    return _doc_ids(node) if node else None
+
+
+def _doc_ids(node: Dict) -> Optional[Set[str]]:
+    for key in ("and", "or"):
+        if key in node:
+            sets = [_doc_ids(clause) for clause in node[key]]
+            if any(s is None for s in sets):
+                return None
+            return set.intersection(*sets) if key == "and" else set.union(*sets)
+    if node["field"] != "doc_id" or node["op"] not in ("eq", "in"):
+        return None
+    values = node["value"] if node["op"] == "in" else [node["value"]]
+    return {str(v) for v in values}
@@ -0,0 +1,1108 @@
+"""
+本地向量数据库实现
+不依赖外部服务，适合中小规模知识库：
+- 每个集合一个目录，向量按段（segment）追加写入 float32 / float16 原始文件，检索时内存映射
+- 元数据按列保存（分块ID、文档ID等各占一列），过滤条件直接在列上向量化求值
+- 删除只追加墓碑（tombstone），由后台整理线程重写删除比例较高的段
+- 有效向量少于 LOCAL_VECTORDB_HNSW_THRESHOLD 时矩阵乘法精确检索；
+  超过后后台为已封存的段构建 HNSW 图（需要安装 hnswlib，未安装时始终精确检索）
+
+集合目录 LOCAL_VECTORDB_DIR/<集合名称>/：
+    manifest.json       段列表、各段已提交的行数和日志字节数、墓碑数量、HNSW 索引文件（提交点，原子替换）
+    seg_<n>.vec         向量（行优先）
+    seg_<n>.rows.jsonl  活跃段的行日志 {"seq", "id", "text", "metadata"}
+    seg_<n>.cols.json   封存段的列式元数据 {"seqs", "ids", "text_offsets", "columns"}
+    seg_<n>.text        封存段的分块文本（UTF-8 拼接，按偏移读取）
+    tombstones.bin      已删除行的序号（int64 追加）
+    hnsw_<版本>.bin     HNSW 索引（标签为行序号，只覆盖封存段）
+每行有全局递增的序号 seq，整理段时保持不变，HNSW 标签和墓碑都使用 seq
+多进程部署时写操作持有排它文件锁，其他进程在下一次访问时根据 manifest 的变化增量加载
+"""
+
+# 导入 JSON 模块
+import json
+
+# 导入日志模块
+import logging
+
+# 导入操作系统模块
+import os
+
+# 导入目录删除工具
+import shutil
+
+# 导入线程模块
+import threading
+
+# 导入时间模块
+import time
+
+# 导入uuid模块，用于生成文档ID
+import uuid
+
+# 导入上下文管理器工具
+from contextlib import contextmanager
+
+# 导入需要的类型提示
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# 导入数值计算库
+import numpy as np
+
+# 导入Document类
+from langchain_core.documents import Document
+
+# 导入向量数据库接口基类
+from app.services.vectordb.base import VectorDBInterface
+
+# 导入元数据过滤条件
+from app.services.vectordb import filters
+
+# 导入全局配置
+from app.config import Config
+
+# 导入嵌入模型工厂
+from app.utils.embedding_factory import EmbeddingFactory
+
+# 导入指标定义与计时装饰器
+from app.utils.metrics import VECTOR_SEARCH_SECONDS, timed
+
+# 导入链路追踪装饰器
+from app.utils.tracing import traced
+
+# HNSW 为可选依赖，未安装时只做精确检索
+try:
+    import hnswlib
+except ImportError:  # pragma: no cover - 取决于部署环境
+    hnswlib = None
+
+# 文件锁仅在 POSIX 平台可用，其他平台只做进程内互斥
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+# 精确检索时每块计算的行数，控制 float16 转换的临时内存
+_SCORE_BLOCK_ROWS = 65536
+
+
+# 原子写入文件
+def _write_atomic(path: str, data: bytes):
+    """先写临时文件再替换，读取方不会看到写了一半的文件"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+# 按 Chroma where 语法在列上计算过滤掩码
+def _filter_mask(filter: Dict, column) -> np.ndarray:
+    """
+    计算过滤条件的行掩码
+    Args:
+        filter: Chroma where 语法的过滤条件，例如 {"doc_id": "x"}、{"$and": [...]}、{"chunk_index": {"$gte": 3}}
+        column: 按列名返回该列取值数组（object 数组，缺失为 None）的函数
+
+    Returns:
+        布尔掩码
+    """
+    masks = []
+    for key, condition in filter.items():
+        if key == "$and":
+            masks.append(np.logical_and.reduce([_filter_mask(c, column) for c in condition]))
+        elif key == "$or":
+            masks.append(np.logical_or.reduce([_filter_mask(c, column) for c in condition]))
+        else:
+            values = column(key)
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for op, operand in condition.items():
+                if op == "$eq":
+                    masks.append(values == operand)
+                elif op == "$ne":
+                    masks.append(values != operand)
+                elif op in ("$in", "$nin"):
+                    allowed = set(operand)
+                    mask = np.fromiter(
+                        (_safe_compare(lambda v: v in allowed, v) for v in values),
+                        dtype=bool,
+                        count=len(values),
+                    )
+                    masks.append(mask if op == "$in" else ~mask)
+                elif op == "$contains":
+                    # 列表型元数据（如 tags）包含指定取值
+                    masks.append(
+                        np.fromiter(
+                            (isinstance(v, (list, tuple)) and operand in v for v in values),
+                            dtype=bool,
+                            count=len(values),
+                        )
+                    )
+                elif op in ("$gt", "$gte", "$lt", "$lte"):
+                    compare = {
+                        "$gt": lambda v: v > operand,
+                        "$gte": lambda v: v >= operand,
+                        "$lt": lambda v: v < operand,
+                        "$lte": lambda v: v <= operand,
+                    }[op]
+                    # 缺失值或类型不可比较的行视为不匹配
+                    masks.append(
+                        np.fromiter(
+                            (_safe_compare(compare, v) for v in values), dtype=bool, count=len(values)
+                        )
+                    )
+                else:
+                    raise ValueError(f"不支持的过滤操作符: {op}")
+    if not masks:
+        raise ValueError("过滤条件不能为空")
+    return np.logical_and.reduce(masks)
+
+
+# 比较时忽略类型错误（缺失值、不可比较或不可哈希的取值视为不匹配）
+def _safe_compare(compare, value) -> bool:
+    if value is None:
+        return False
+    try:
+        return bool(compare(value))
+    except TypeError:
+        return False
+
+
+# 一个段：向量文件 + 列式元数据
+class _Segment:
+    """内存中的段：序号、分块ID、元数据列和内存映射的向量"""
+
+    def __init__(self, collection: "_LocalCollection", entry: dict):
+        self.collection = collection
+        self.name = entry["name"]
+        self.sealed = entry["sealed"]
+        self.rows = 0
+        self.log_bytes = 0
+        self.seqs = np.zeros(0, dtype=np.int64)
+        self.ids: List[str] = []
+        # 活跃段的文本保存在内存中，封存段按偏移从文本文件读取
+        self.texts: List[str] = []
+        self.text_offsets: Optional[np.ndarray] = None
+        self.columns: Dict[str, list] = {}
+        self.vectors = np.zeros((0, collection.dim), dtype=collection.dtype)
+        # 过滤用的列数组缓存
+        self._column_cache: Dict[str, np.ndarray] = {}
+        if self.sealed:
+            self._load_sealed()
+        self.sync(entry)
+
+    # 文件路径
+    def file(self, suffix: str) -> str:
+        return os.path.join(self.collection.path, f"{self.name}.{suffix}")
+
+    # 加载封存段的列式元数据
+    def _load_sealed(self):
+        with open(self.file("cols.json"), encoding="utf-8") as f:
+            data = json.load(f)
+        self.seqs = np.asarray(data["seqs"], dtype=np.int64)
+        self.ids = data["ids"]
+        self.text_offsets = np.asarray(data["text_offsets"], dtype=np.int64)
+        self.columns = data["columns"]
+        self.rows = self.log_bytes = len(self.ids)
+
+    # 同步到 manifest 中已提交的行数
+    def sync(self, entry: dict):
+        """活跃段读取行日志中新增的行，然后重新映射向量文件"""
+        if not self.sealed and entry["rows"] > self.rows:
+            seqs = list(self.seqs)
+            with open(self.file("rows.jsonl"), "rb") as f:
+                f.seek(self.log_bytes)
+                data = f.read(entry["log_bytes"] - self.log_bytes)
+            for line in data.splitlines():
+                row = json.loads(line)
+                index = len(self.ids)
+                seqs.append(row["seq"])
+                self.ids.append(row["id"])
+                self.texts.append(row["text"])
+                for key, value in (row.get("metadata") or {}).items():
+                    column = self.columns.setdefault(key, [])
+                    column.extend([None] * (index - len(column)))
+                    column.append(value)
+            self.seqs = np.asarray(seqs, dtype=np.int64)
+            self.rows = entry["rows"]
+            self.log_bytes = entry["log_bytes"]
+            self._column_cache = {}
+        if len(self.vectors) != self.rows:
+            self.vectors = (
+                np.memmap(
+                    self.file("vec"),
+                    dtype=self.collection.dtype,
+                    mode="r",
+                    shape=(self.rows, self.collection.dim),
+                )
+                if self.rows
+                else np.zeros((0, self.collection.dim), dtype=self.collection.dtype)
+            )
+
+    # 过滤用的列数组
+    def column(self, key: str) -> np.ndarray:
+        """返回长度为 rows 的 object 数组，缺失值为 None"""
+        cached = self._column_cache.get(key)
+        if cached is None:
+            if key == "id" and key not in self.columns:
+                values = self.ids
+            else:
+                values = self.columns.get(key, [])
+            cached = np.empty(self.rows, dtype=object)
+            # 逐个赋值，避免列表类型的取值（如 tags）被 numpy 展开
+            for row, value in enumerate(values[: self.rows]):
+                cached[row] = value
+            self._column_cache[key] = cached
+        return cached
+
+    # 读取分块文本
+    def text(self, row: int) -> str:
+        if not self.sealed:
+            return self.texts[row]
+        start, end = self.text_offsets[row], self.text_offsets[row + 1]
+        with open(self.file("text"), "rb") as f:
+            f.seek(int(start))
+            return f.read(int(end - start)).decode("utf-8")
+
+    # 构造 Document
+    def document(self, row: int) -> Document:
+        metadata = {
+            key: values[row]
+            for key, values in self.columns.items()
+            if row < len(values) and values[row] is not None
+        }
+        return Document(id=self.ids[row], page_content=self.text(row), metadata=metadata)
+
+
+# 一个集合
+class _LocalCollection:
+    """集合的内存状态，与磁盘上的 manifest 保持同步"""
+
+    def __init__(self, path: str, dim: Optional[int] = None, dtype: Optional[str] = None):
+        """
+        Args:
+            path: 集合目录
+            dim: 向量维度（新建集合时由第一次写入确定）
+            dtype: 向量存储类型 float32 / float16
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        self.dim = dim
+        self.dtype = np.dtype(dtype or Config.LOCAL_VECTORDB_DTYPE)
+        self.segments: List[_Segment] = []
+        self.manifest: dict = {}
+        self._manifest_stat = None
+        # 行序号 -> (段下标, 段内行号)，以及是否已删除
+        self._loc_segment = np.zeros(0, dtype=np.int32)
+        self._loc_row = np.zeros(0, dtype=np.int64)
+        self.deleted = np.zeros(0, dtype=bool)
+        self._tombstones = 0
+        self._id_to_seq: Dict[str, int] = {}
+        self.hnsw = None
+        self._hnsw_file = None
+        self._hnsw_marked = np.zeros(0, dtype=bool)
+        self.refresh()
+
+    # 文件路径
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    # 跨进程文件锁
+    @contextmanager
+    def file_lock(self, exclusive: bool):
+        """进程内互斥 + 跨进程文件锁（写操作排它，读取共享）"""
+        with self.lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.file("lock"), "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    # 其他进程写入后重新加载
+    def refresh(self):
+        """manifest 变化时增量加载（新增行、新增墓碑、段替换、HNSW 索引更新）"""
+        if self._manifest_changed():
+            with self.file_lock(exclusive=False):
+                self.refresh_locked()
+
+    # manifest 是否变化
+    def _manifest_changed(self) -> bool:
+        try:
+            stat = os.stat(self.file("manifest.json"))
+        except FileNotFoundError:
+            return False
+        return self._manifest_stat != (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    # 重新加载（调用方已持有文件锁）
+    def refresh_locked(self):
+        if not self._manifest_changed():
+            return
+        stat = os.stat(self.file("manifest.json"))
+        with open(self.file("manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.dim = manifest["dim"]
+        self.dtype = np.dtype(manifest["dtype"])
+        existing = {segment.name: segment for segment in self.segments}
+        segments = []
+        # 新加载的行（段内行号区间），用于增量维护分块ID映射
+        added = []
+        for entry in manifest["segments"]:
+            segment = existing.get(entry["name"])
+            # 活跃段封存后文件格式变化，需要重新加载
+            if segment is None or segment.sealed != entry["sealed"]:
+                segment = _Segment(self, entry)
+                added.append((segment, 0))
+            else:
+                old_rows = segment.rows
+                segment.sync(entry)
+                added.append((segment, old_rows))
+            segments.append(segment)
+        self.segments = segments
+        self.manifest = manifest
+        self._rebuild_locations()
+        self._load_tombstones(manifest["tombstones"])
+        # 分块ID -> 最新的有效行序号（同ID只有一行有效）
+        for segment, start in added:
+            for chunk_id, seq in zip(segment.ids[start:], segment.seqs[start:].tolist()):
+                if not self.deleted[seq]:
+                    self._id_to_seq[chunk_id] = seq
+        self._load_hnsw(manifest.get("hnsw"))
+        self._manifest_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    # 重建序号到位置的映射
+    def _rebuild_locations(self):
+        size = self.manifest["next_seq"]
+        self._loc_segment = np.full(size, -1, dtype=np.int32)
+        self._loc_row = np.zeros(size, dtype=np.int64)
+        for index, segment in enumerate(self.segments):
+            self._loc_segment[segment.seqs] = index
+            self._loc_row[segment.seqs] = np.arange(segment.rows)
+        deleted = np.zeros(size, dtype=bool)
+        deleted[: len(self.deleted)] = self.deleted[:size]
+        self.deleted = deleted
+
+    # 读取墓碑
+    def _load_tombstones(self, count: int):
+        """墓碑文件被整理重写时（数量变少）完整读取，否则只读新增部分"""
+        start = self._tombstones if count >= self._tombstones else 0
+        if start == 0:
+            self.deleted[:] = False
+        if count > start:
+            with open(self.file("tombstones.bin"), "rb") as f:
+                f.seek(start * 8)
+                seqs = np.frombuffer(f.read((count - start) * 8), dtype=np.int64)
+            self.deleted[seqs] = True
+            # 已删除的行从分块ID映射中移除（行已被整理掉时位置为 -1）
+            for seq in seqs.tolist():
+                index = self._loc_segment[seq]
+                if index >= 0:
+                    chunk_id = self.segments[index].ids[self._loc_row[seq]]
+                    if self._id_to_seq.get(chunk_id) == seq:
+                        del self._id_to_seq[chunk_id]
+        self._tombstones = count
+
+    # 加载 HNSW 索引
+    def _load_hnsw(self, info: Optional[dict]):
+        if not info or hnswlib is None:
+            self.hnsw, self._hnsw_file = None, None
+            return
+        if info["file"] != self._hnsw_file:
+            index = hnswlib.Index(space="ip", dim=self.dim)
+            index.load_index(self.file(info["file"]), max_elements=info["elements"])
+            self.hnsw, self._hnsw_file = index, info["file"]
+            self._hnsw_marked = np.zeros(info["upto_seq"], dtype=bool)
+        # 已删除或已被整理掉的行在图中标记删除，检索时不再返回
+        invalid = self.invalid_mask(info["upto_seq"])
+        for seq in np.flatnonzero(invalid & ~self._hnsw_marked).tolist():
+            try:
+                self.hnsw.mark_deleted(seq)
+            except RuntimeError:
+                # 构建索引时已跳过的行不在图中
+                pass
+        self._hnsw_marked |= invalid
+
+    # 无效行掩码
+    def invalid_mask(self, upto: int) -> np.ndarray:
+        """序号小于 upto 的行中已删除或已不在任何段中的行"""
+        return (self.deleted[:upto] | (self._loc_segment[:upto] < 0))
+
+    # 有效行数
+    @property
+    def live_rows(self) -> int:
+        return sum(segment.rows for segment in self.segments) - int(
+            self.deleted[self._loc_segment >= 0].sum()
+        )
+
+    # 写入 manifest（提交点）
+    def write_manifest(self):
+        _write_atomic(
+            self.file("manifest.json"),
+            json.dumps(self.manifest, ensure_ascii=False).encode("utf-8"),
+        )
+
+    # 封存写满的活跃段（调用方已持有排它锁并已刷新）
+    def seal_active(self):
+        """把活跃段转换为封存格式（列式元数据 + 拼接文本），之后的写入进入新的活跃段"""
+        segments = self.manifest["segments"]
+        if not segments or segments[-1]["sealed"]:
+            return
+        active = self.segments[-1]
+        _write_sealed_files(active, np.arange(active.rows), active.name)
+        segments[-1] = {"name": active.name, "rows": active.rows, "log_bytes": 0, "sealed": True}
+        self.write_manifest()
+        self.refresh_locked()
+        # manifest 提交后行日志不再使用
+        os.remove(active.file("rows.jsonl"))
+        logger.info(f"本地集合 {self.path} 已封存段 {active.name}（{active.rows} 行）")
+
+    # 当前活跃段的 manifest 条目，不存在时新建
+    def _active_entry(self) -> dict:
+        segments = self.manifest["segments"]
+        if segments and not segments[-1]["sealed"]:
+            if segments[-1]["rows"] < Config.LOCAL_VECTORDB_SEGMENT_ROWS:
+                return segments[-1]
+            self.seal_active()
+            # 封存后 manifest 已重新加载
+            segments = self.manifest["segments"]
+        self.manifest["next_segment"] += 1
+        entry = {
+            "name": f"seg_{self.manifest['next_segment']:06d}",
+            "rows": 0,
+            "log_bytes": 0,
+            "sealed": False,
+        }
+        for suffix in ("vec", "rows.jsonl"):
+            open(os.path.join(self.path, f"{entry['name']}.{suffix}"), "wb").close()
+        segments.append(entry)
+        return entry
+
+    # 追加写入（调用方已持有排它锁并已刷新）
+    def append(self, ids: List[str], texts: List[str], vectors: np.ndarray, metadatas: List[dict]):
+        """追加一批行，同ID的旧行写墓碑（覆盖语义）"""
+        replaced = [self._id_to_seq[i] for i in ids if i in self._id_to_seq]
+        entry = self._active_entry()
+        start_seq = self.manifest["next_seq"]
+        lines = b"".join(
+            (
+                json.dumps(
+                    {"seq": start_seq + n, "id": chunk_id, "text": text, "metadata": metadata or {}},
+                    ensure_ascii=False,
+                )
+                + "\n"
+            ).encode("utf-8")
+            for n, (chunk_id, text, metadata) in enumerate(zip(ids, texts, metadatas))
+        )
+        # 先截断到已提交的长度（丢弃上次异常退出时写了一半的数据），再追加
+        row_bytes = self.dim * self.dtype.itemsize
+        with open(os.path.join(self.path, f"{entry['name']}.vec"), "r+b") as f:
+            f.truncate(entry["rows"] * row_bytes)
+            f.seek(0, os.SEEK_END)
+            f.write(vectors.astype(self.dtype).tobytes())
+        with open(os.path.join(self.path, f"{entry['name']}.rows.jsonl"), "r+b") as f:
+            f.truncate(entry["log_bytes"])
+            f.seek(0, os.SEEK_END)
+            f.write(lines)
+        entry["rows"] += len(ids)
+        entry["log_bytes"] += len(lines)
+        self.manifest["next_seq"] += len(ids)
+        self._append_tombstones(replaced)
+        self.write_manifest()
+        self.refresh_locked()
+
+    # 追加墓碑（调用方负责写 manifest）
+    def _append_tombstones(self, seqs: List[int]):
+        count = self.manifest["tombstones"]
+        with open(self.file("tombstones.bin"), "r+b") as f:
+            f.truncate(count * 8)
+            f.seek(0, os.SEEK_END)
+            f.write(np.asarray(seqs, dtype=np.int64).tobytes())
+        self.manifest["tombstones"] = count + len(seqs)
+
+    # 删除（调用方已持有排它锁并已刷新）
+    def delete_seqs(self, seqs: List[int]):
+        if not seqs:
+            return
+        self._append_tombstones(seqs)
+        self.write_manifest()
+        self.refresh_locked()
+
+    # 按过滤条件匹配的有效行
+    def match(self, filter: Optional[Dict]) -> List[Tuple[_Segment, np.ndarray]]:
+        """返回每个段中满足过滤条件且未删除的行号"""
+        result = []
+        for segment in self.segments:
+            if not segment.rows:
+                continue
+            mask = ~self.deleted[segment.seqs]
+            if filter:
+                mask &= _filter_mask(filter, segment.column)
+            rows = np.flatnonzero(mask)
+            if len(rows):
+                result.append((segment, rows))
+        return result
+
+    # 根据序号取 Document
+    def documents_by_seqs(self, seqs) -> List[Document]:
+        documents = []
+        for seq in seqs:
+            segment = self.segments[self._loc_segment[seq]]
+            documents.append(segment.document(int(self._loc_row[seq])))
+        return documents
+
+    # 精确检索
+    def exact_search(self, query: np.ndarray, k: int, matches) -> List[Tuple[int, float]]:
+        """在给定的行上用矩阵乘法计算相似度，返回 (序号, 相似度) 的前 k 个"""
+        best_seqs, best_scores = [], []
+        for segment, rows in matches:
+            scores = np.empty(len(rows), dtype=np.float32)
+            # 全部行有效时顺序读取内存映射，否则按行号取子集
+            full = len(rows) == segment.rows
+            for start in range(0, len(rows), _SCORE_BLOCK_ROWS):
+                block_rows = rows[start : start + _SCORE_BLOCK_ROWS]
+                block = (
+                    segment.vectors[block_rows[0] : block_rows[-1] + 1]
+                    if full
+                    else segment.vectors[block_rows]
+                )
+                scores[start : start + len(block_rows)] = np.asarray(block, dtype=np.float32) @ query
+            top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+            best_seqs.append(segment.seqs[rows[top]])
+            best_scores.append(scores[top])
+        if not best_seqs:
+            return []
+        seqs = np.concatenate(best_seqs)
+        scores = np.concatenate(best_scores)
+        order = np.argsort(-scores)[:k]
+        return [(int(seqs[i]), float(scores[i])) for i in order]
+
+    # 检索
+    def search(self, query: np.ndarray, k: int, filter: Optional[Dict]) -> List[Tuple[int, float]]:
+        """
+        精确检索或 HNSW + 活跃段精确检索，结果按相似度合并
+        Args:
+            query: 归一化的查询向量
+            k: 返回数量
+            filter: 过滤条件
+
+        Returns:
+            (序号, 相似度) 列表
+        """
+        matches = self.match(filter)
+        candidates = sum(len(rows) for _, rows in matches)
+        if not candidates or k <= 0:
+            return []
+        upto = self.manifest["hnsw"]["upto_seq"] if self.hnsw is not None else 0
+        # 过滤后剩余的行很少时直接精确检索（预过滤），比在图上带过滤搜索更快更准
+        use_hnsw = self.hnsw is not None and (
+            not filter or candidates >= Config.LOCAL_VECTORDB_HNSW_THRESHOLD
+        )
+        if not use_hnsw:
+            return self.exact_search(query, k, matches)
+        # 索引之后写入的行（活跃段）精确检索
+        tail = [
+            (segment, rows[segment.seqs[rows] >= upto])
+            for segment, rows in matches
+            if segment.seqs[-1] >= upto
+        ]
+        results = self.exact_search(query, k, [(s, r) for s, r in tail if len(r)])
+        allowed = None
+        if filter:
+            allowed = np.zeros(len(self.deleted), dtype=bool)
+            for segment, rows in matches:
+                allowed[segment.seqs[rows]] = True
+        try:
+            self.hnsw.set_ef(max(Config.LOCAL_VECTORDB_HNSW_EF_SEARCH, k))
+            labels, distances = self.hnsw.knn_query(
+                query[None, :],
+                k=min(k, candidates),
+                filter=(lambda label: bool(allowed[label])) if allowed is not None else None,
+            )
+        except RuntimeError:
+            # 有效元素不足 k 个时 hnswlib 会报错，回退到精确检索
+            return self.exact_search(query, k, matches)
+        results.extend(
+            (int(label), float(1.0 - distance))
+            for label, distance in zip(labels[0], distances[0])
+            if label < len(self._loc_segment) and self._loc_segment[label] >= 0 and not self.deleted[label]
+        )
+        results.sort(key=lambda item: -item[1])
+        return results[:k]
+
+
+# 定义本地向量数据库实现类
+class LocalVectorDB(VectorDBInterface):
+    """本地向量数据库实现（内存映射向量段 + 列式元数据 + 可选 HNSW）"""
+
+    def __init__(self, persist_directory: Optional[str] = None):
+        """
+        初始化本地向量数据库
+        Args:
+            persist_directory: 数据目录，如果为None则使用 LOCAL_VECTORDB_DIR
+        """
+        self.persist_directory = persist_directory or Config.LOCAL_VECTORDB_DIR
+        os.makedirs(self.persist_directory, exist_ok=True)
+        # 动态创建Embedding模型
+        self.embeddings = EmbeddingFactory.create_embeddings()
+        self._collections: Dict[str, _LocalCollection] = {}
+        self._lock = threading.Lock()
+        # 后台整理：待整理的集合
+        self._pending: set = set()
+        self._thread: Optional[threading.Thread] = None
+        if hnswlib is None:
+            logger.info("未安装 hnswlib，本地向量数据库将只使用精确检索")
+        logger.info(f"本地向量数据库已初始化, 数据目录: {self.persist_directory}")
+
+    # 获取或创建集合
+    def get_or_create_collection(self, collection_name: str) -> _LocalCollection:
+        """获取集合；目录不存在时创建（维度在第一次写入时确定）"""
+        with self._lock:
+            collection = self._collections.get(collection_name)
+            # 其他进程删除了集合时丢弃缓存的集合对象
+            if collection is not None and collection.manifest and not os.path.exists(
+                collection.file("manifest.json")
+            ):
+                collection = None
+            if collection is None:
+                path = os.path.join(self.persist_directory, collection_name)
+                os.makedirs(path, exist_ok=True)
+                collection = _LocalCollection(path)
+                self._collections[collection_name] = collection
+        collection.refresh()
+        return collection
+
+    # 初始化空集合的 manifest（调用方已持有排它锁）
+    @staticmethod
+    def _init_collection(collection: _LocalCollection, dim: int):
+        collection.refresh_locked()
+        if collection.manifest:
+            return
+        open(collection.file("tombstones.bin"), "wb").close()
+        collection.manifest = {
+            "dim": dim,
+            "dtype": collection.dtype.name,
+            "next_seq": 0,
+            "next_segment": 0,
+            "segments": [],
+            "tombstones": 0,
+            "hnsw": None,
+        }
+        collection.write_manifest()
+        collection.refresh_locked()
+
+    # 向集合添加文档
+    def add_documents(
+        self,
+        collection_name: str,
+        documents: List[Document],
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        texts = [document.page_content for document in documents]
+        embeddings = self.embeddings.embed_documents(texts)
+        return self.add_embeddings(
+            collection_name,
+            texts=texts,
+            embeddings=embeddings,
+            metadatas=[document.metadata for document in documents],
+            ids=ids,
+        )
+
+    # 使用预先计算好的向量写入文档
+    def add_embeddings(
+        self,
+        collection_name: str,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """使用预先计算好的向量写入文档（同 ID 覆盖）"""
+        if not texts:
+            return []
+        if not ids:
+            ids = [uuid.uuid4().hex for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        # 归一化后内积即余弦相似度
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        collection = self.get_or_create_collection(collection_name)
+        with collection.file_lock(exclusive=True):
+            self._init_collection(collection, vectors.shape[1])
+            if vectors.shape[1] != collection.dim:
+                raise ValueError(
+                    f"向量维度 {vectors.shape[1]} 与集合 {collection_name} 的维度 {collection.dim} 不一致"
+                )
+            collection.append(list(ids), list(texts), vectors, list(metadatas))
+        self._schedule(collection_name)
+        logger.info(f"已向本地集合 {collection_name} 写入 {len(texts)} 个向量")
+        return list(ids)
+
+    # 删除整个集合
+    def drop_collection(self, collection_name: str) -> None:
+        """删除集合目录，集合不存在时不做任何操作"""
+        path = os.path.join(self.persist_directory, collection_name)
+        if not os.path.isdir(path):
+            return
+        collection = self.get_or_create_collection(collection_name)
+        with collection.file_lock(exclusive=True):
+            shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            self._collections.pop(collection_name, None)
+            self._pending.discard(collection_name)
+        logger.info(f"已删除本地集合 {collection_name}")
+
+    # 删除文档
+    def delete_documents(
+        self,
+        collection_name: str,
+        ids: Optional[List[str]] = None,
+        filter: Optional[Dict] = None,
+    ) -> None:
+        if not ids and not filter:
+            raise ValueError("你既没有传ids,也没有传filter")
+        # 过滤条件编译为 where 语法
+        filter = filters.to_chroma_where(filter)
+        collection = self.get_or_create_collection(collection_name)
+        with collection.file_lock(exclusive=True):
+            collection.refresh_locked()
+            if not collection.manifest:
+                return
+            if ids:
+                seqs = [collection._id_to_seq[i] for i in ids if i in collection._id_to_seq]
+            else:
+                seqs = [
+                    int(seq)
+                    for segment, rows in collection.match(filter)
+                    for seq in segment.seqs[rows]
+                ]
+            collection.delete_seqs(seqs)
+        self._schedule(collection_name)
+        logger.info(f"已从本地集合 {collection_name} 删除 {len(seqs)} 个文档")
+
+    # 按ID批量获取文档
+    @traced("vectordb.get_by_ids")
+    def get_by_ids(self, collection_name: str, ids: List[str]) -> List[Document]:
+        """按ID批量获取文档"""
+        if not ids:
+            return []
+        collection = self.get_or_create_collection(collection_name)
+        with collection.lock:
+            seqs = [collection._id_to_seq[i] for i in ids if i in collection._id_to_seq]
+            return collection.documents_by_seqs(seqs)
+
+    # 分批读取集合中的全部向量
+    def iter_embeddings(
+        self, collection_name: str, batch_size: int = 1000
+    ) -> Iterator[tuple]:
+        """按段顺序分批读取有效行的 (ids, embeddings, metadatas)"""
+        collection = self.get_or_create_collection(collection_name)
+        with collection.lock:
+            matches = collection.match(None)
+        for segment, rows in matches:
+            for start in range(0, len(rows), batch_size):
+                block = rows[start : start + batch_size]
+                vectors = np.asarray(segment.vectors[block], dtype=np.float32)
+                documents = [segment.document(int(row)) for row in block]
+                yield (
+                    [document.id for document in documents],
+                    vectors.tolist(),
+                    [document.metadata for document in documents],
+                )
+
+    # 基于向量检索，返回 (Document, 余弦相似度)
+    def _search(
+        self, collection_name: str, embedding: List[float], k: int, filter: Optional[Dict]
+    ) -> List[tuple]:
+        # 过滤条件编译为 where 语法，过滤后的候选较少时直接精确检索（预过滤）
+        filter = filters.to_chroma_where(filter)
+        collection = self.get_or_create_collection(collection_name)
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        with collection.lock:
+            if not collection.manifest:
+                return []
+            hits = collection.search(query, k, filter)
+            documents = collection.documents_by_seqs([seq for seq, _ in hits])
+        return [(document, score) for document, (_, score) in zip(documents, hits)]
+
+    @traced("vectordb.similarity_search")
+    @timed(VECTOR_SEARCH_SECONDS, backend="local", method="similarity_search")
+    def similarity_search(
+        self,
+        collection_name: str,
+        query: str,
+        k: int = 5,
+        filter: Optional[Dict] = None,
+    ) -> List[Document]:
+        """相似度搜索"""
+        embedding = self.embeddings.embed_query(query)
+        return [doc for doc, _ in self._search(collection_name, embedding, k, filter)]
+
+    # 定义带分数地相似度搜索方法
+    @traced("vectordb.similarity_search_with_score")
+    @timed(VECTOR_SEARCH_SECONDS, backend="local", method="similarity_search_with_score")
+    def similarity_search_with_score(
+        self,
+        collection_name: str,
+        query: str,
+        k: int = 5,
+        filter: Optional[Dict] = None,
+    ) -> List[tuple]:
+        """带分数的相似度搜索，分数为余弦距离（越小越相似，与 Chroma 口径一致）"""
+        embedding = self.embeddings.embed_query(query)
+        return [
+            (doc, 1.0 - score) for doc, score in self._search(collection_name, embedding, k, filter)
+        ]
+
+    # 定义基于查询向量的带分数相似度搜索方法
+    @traced("vectordb.similarity_search_by_vector_with_score")
+    @timed(VECTOR_SEARCH_SECONDS, backend="local", method="similarity_search_by_vector_with_score")
+    def similarity_search_by_vector_with_score(
+        self,
+        collection_name: str,
+        embedding: List[float],
+        k: int = 5,
+        filter: Optional[Dict] = None,
+    ) -> List[tuple]:
+        """基于查询向量的带分数相似度搜索（分数为余弦相似度，越大越相似）"""
+        return self._search(collection_name, embedding, k, filter)
+
+    # 统计信息
+    def stats(self, collection_name: str) -> dict:
+        """返回集合的行数、段数、墓碑数、HNSW 覆盖范围和磁盘占用"""
+        collection = self.get_or_create_collection(collection_name)
+        with collection.lock:
+            manifest = collection.manifest
+            return {
+                "dim": collection.dim,
+                "dtype": collection.dtype.name,
+                "segments": len(collection.segments),
+                "rows": sum(segment.rows for segment in collection.segments),
+                "live_rows": collection.live_rows if manifest else 0,
+                "tombstones": manifest.get("tombstones", 0),
+                "hnsw_upto_seq": (manifest.get("hnsw") or {}).get("upto_seq"),
+                "disk_bytes": sum(
+                    os.path.getsize(os.path.join(collection.path, name))
+                    for name in os.listdir(collection.path)
+                ),
+            }
+
+    # 安排后台整理
+    def _schedule(self, collection_name: str):
+        """记录需要整理的集合，后台线程每隔 LOCAL_VECTORDB_COMPACT_INTERVAL 秒合并处理"""
+        with self._lock:
+            self._pending.add(collection_name)
+            # 后台线程在第一次写入时启动（gunicorn 在导入后 fork，导入时启动的线程不会被继承）
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="local-vectordb-compaction", daemon=True
+                )
+                self._thread.start()
+
+    # 后台线程主循环
+    def _run(self):
+        while True:
+            time.sleep(Config.LOCAL_VECTORDB_COMPACT_INTERVAL)
+            with self._lock:
+                pending, self._pending = self._pending, set()
+            for collection_name in pending:
+                try:
+                    self.compact(collection_name)
+                except Exception as e:
+                    logger.error(f"整理本地集合 {collection_name} 失败: {e}", exc_info=True)
+
+    # 整理集合
+    def compact(self, collection_name: str):
+        """
+        整理集合：重写删除比例较高的封存段、更新 HNSW 索引
+        多个进程同时触发时只有一个进程执行，其他进程直接跳过
+        """
+        # 集合在安排整理后被删除时不重新创建
+        if not os.path.isdir(os.path.join(self.persist_directory, collection_name)):
+            return
+        collection = self.get_or_create_collection(collection_name)
+        if not collection.manifest:
+            return
+        with _maintenance_lock(collection) as acquired:
+            if not acquired:
+                return
+            self._rewrite_segments(collection)
+            self._update_hnsw(collection)
+
+    # 重写删除比例较高的封存段
+    def _rewrite_segments(self, collection: _LocalCollection):
+        with collection.lock:
+            targets = [
+                segment
+                for segment in collection.segments
+                if segment.sealed
+                and segment.rows
+                and collection.deleted[segment.seqs].mean() >= Config.LOCAL_VECTORDB_COMPACT_RATIO
+            ]
+        for segment in targets:
+            # 封存段不可变，在锁外写新文件；期间新增的墓碑按序号生效，不受影响
+            with collection.lock:
+                rows = np.flatnonzero(~collection.deleted[segment.seqs])
+            # 整理后的段使用带随机后缀的新名称，不会与其他进程新建的活跃段冲突
+            name = f"{segment.name.split('.')[0][:10]}_{uuid.uuid4().hex[:6]}"
+            if len(rows):
+                _write_sealed_files(segment, rows, name)
+            with collection.file_lock(exclusive=True):
+                collection.refresh_locked()
+                entries = collection.manifest["segments"]
+                position = next(i for i, e in enumerate(entries) if e["name"] == segment.name)
+                if len(rows):
+                    entries[position] = {"name": name, "rows": len(rows), "log_bytes": 0, "sealed": True}
+                else:
+                    entries.pop(position)
+                # 墓碑只需保留仍在段中的行，已被整理掉的行不再需要
+                present = np.concatenate(
+                    [s.seqs for s in collection.segments if s.name != segment.name] + [segment.seqs[rows]]
+                )
+                alive_tombstones = np.flatnonzero(collection.deleted)
+                alive_tombstones = alive_tombstones[np.isin(alive_tombstones, present)]
+                _write_atomic(collection.file("tombstones.bin"), alive_tombstones.astype(np.int64).tobytes())
+                collection.manifest["tombstones"] = len(alive_tombstones)
+                collection.write_manifest()
+                # 墓碑文件被整体替换，强制完整重新读取
+                collection._tombstones = 0
+                collection.refresh_locked()
+            for suffix in ("vec", "cols.json", "text"):
+                try:
+                    os.remove(segment.file(suffix))
+                except FileNotFoundError:
+                    pass
+            logger.info(f"本地集合 {collection.path} 已整理段 {segment.name}，保留 {len(rows)} 行")
+
+    # 更新 HNSW 索引
+    def _update_hnsw(self, collection: _LocalCollection):
+        """有效行达到阈值后为封存段构建 HNSW；新封存的段增量加入，删除比例过高时重建"""
+        if hnswlib is None:
+            return
+        with collection.lock:
+            info = collection.manifest.get("hnsw")
+            sealed = [s for s in collection.segments if s.sealed and s.rows]
+            live = collection.live_rows
+            upto = info["upto_seq"] if info else 0
+            new_segments = [s for s in sealed if s.seqs[-1] >= upto]
+            # 构建之后新失效（删除或被整理掉）的索引元素数
+            index_deleted = (
+                int(collection.invalid_mask(upto).sum()) - info["invalid_at_build"] if info else 0
+            )
+        if live < Config.LOCAL_VECTORDB_HNSW_THRESHOLD or not sealed:
+            # 行数降到阈值一半以下时删除索引，回到精确检索
+            if info and live < Config.LOCAL_VECTORDB_HNSW_THRESHOLD // 2:
+                self._commit_hnsw(collection, None)
+            return
+        rebuild = info is None or index_deleted >= Config.LOCAL_VECTORDB_COMPACT_RATIO * info["elements"]
+        if not rebuild and not new_segments:
+            return
+        segments = sealed if rebuild else new_segments
+        added = sum(s.rows for s in segments)
+        if rebuild:
+            index = hnswlib.Index(space="ip", dim=collection.dim)
+            index.init_index(
+                max_elements=max(added, 1),
+                M=Config.LOCAL_VECTORDB_HNSW_M,
+                ef_construction=Config.LOCAL_VECTORDB_HNSW_EF_CONSTRUCTION,
+            )
+        else:
+            index = hnswlib.Index(space="ip", dim=collection.dim)
+            index.load_index(collection.file(info["file"]), max_elements=info["elements"] + added)
+        elements = 0 if rebuild else info["elements"]
+        for segment in segments:
+            with collection.lock:
+                rows = np.flatnonzero(~collection.deleted[segment.seqs])
+            if not rebuild:
+                rows = rows[segment.seqs[rows] >= upto]
+            for start in range(0, len(rows), _SCORE_BLOCK_ROWS):
+                block = rows[start : start + _SCORE_BLOCK_ROWS]
+                index.add_items(
+                    np.asarray(segment.vectors[block], dtype=np.float32), segment.seqs[block]
+                )
+                elements += len(block)
+        new_upto = int(max(s.seqs[-1] for s in sealed)) + 1
+        file_name = f"hnsw_{uuid.uuid4().hex[:8]}.bin"
+        index.save_index(collection.file(file_name))
+        with collection.lock:
+            # 构建时已失效的行（未加入索引或已在图中标记删除）
+            invalid_at_build = int(collection.invalid_mask(new_upto).sum())
+        self._commit_hnsw(
+            collection,
+            {
+                "file": file_name,
+                "upto_seq": new_upto,
+                "elements": max(elements, 1),
+                "invalid_at_build": invalid_at_build,
+            },
+        )
+        logger.info(f"本地集合 {collection.path} 已{'重建' if rebuild else '更新'} HNSW 索引，元素 {elements} 个")
+
+    # 提交 HNSW 索引变更
+    @staticmethod
+    def _commit_hnsw(collection: _LocalCollection, info: Optional[dict]):
+        with collection.file_lock(exclusive=True):
+            collection.refresh_locked()
+            old = collection.manifest.get("hnsw")
+            collection.manifest["hnsw"] = info
+            collection.write_manifest()
+            collection.refresh_locked()
+        # 旧索引文件已不再引用（其他进程已加载的索引在内存中，不受影响）
+        if old and (not info or old["file"] != info["file"]):
+            try:
+                os.remove(collection.file(old["file"]))
+            except FileNotFoundError:
+                pass
+
+
+# 整理锁：同一集合同一时间只允许一个进程整理
+@contextmanager
+def _maintenance_lock(collection: _LocalCollection):
+    if fcntl is None:
+        yield True
+        return
+    with open(collection.file("maintenance.lock"), "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# 写入封存段文件
+def _write_sealed_files(segment: _Segment, rows: np.ndarray, name: str):
+    """把段中的指定行写成封存格式（向量、列式元数据、拼接文本）"""
+    path = segment.collection.path
+    texts = [segment.text(int(row)).encode("utf-8") for row in rows]
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(text) for text in texts])
+    columns = {
+        key: [values[row] if row < len(values) else None for row in rows.tolist()]
+        for key, values in segment.columns.items()
+    }
+    _write_atomic(os.path.join(path, f"{name}.text"), b"".join(texts))
+    _write_atomic(
+        os.path.join(path, f"{name}.vec"), np.asarray(segment.vectors[rows]).tobytes()
+    )
+    _write_atomic(
+        os.path.join(path, f"{name}.cols.json"),
+        json.dumps(
+            {
+                "seqs": segment.seqs[rows].tolist(),
+                "ids": [segment.ids[row] for row in rows.tolist()],
+                "text_offsets": offsets.tolist(),
+                "columns": columns,
+            },
+            ensure_ascii=False,
+        ).encode("utf-8"),
+    )
@@ -2,6 +2,9 @@
 """
 Milvus 向量数据库实现
 """
+# 导入 JSON 模块，用于构造查询表达式中的字符串
+import json
+
 # 导入日志模块
 import logging
 
@@ -9,7 +12,7 @@ import logging
 from langchain_milvus import Milvus
 
 # 导入类型提示相关模块
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Iterator
 
 # 导入LangChain的文档类型
 from langchain_core.documents import Document
@@ -17,9 +20,17 @@ from langchain_core.documents import Document
 # 导入向量数据库接口基类
 from app.services.vectordb.base import VectorDBInterface
 
+# 导入元数据过滤条件
+from app.services.vectordb import filters
+
 # 导入Embedding工厂方法
 from app.utils.embedding_factory import EmbeddingFactory
-from test import vectorstore
+
+# 导入指标定义与计时装饰器
+from app.utils.metrics import VECTOR_SEARCH_SECONDS, timed
+
+# 导入链路追踪装饰器
+from app.utils.tracing import traced
 
 # 获取日志记录器
 logger = logging.getLogger(__name__)
@@ -87,6 +98,13 @@ class MilvusVectorDB(VectorDBInterface):
         vectorstore = self.get_or_create_collection(collection_name)
 
         try:
+            # 列表型元数据转换为字符串保存
+            documents = [
+                Document(id=doc.id, page_content=doc.page_content, metadata=metadata)
+                for doc, metadata in zip(
+                    documents, self._encode_metadatas([doc.metadata for doc in documents])
+                )
+            ]
             # 指定了ID则传入，否则直接添加
             if ids:
                 result_ids = vectorstore.add_documents(documents=documents, ids=ids)
@@ -111,6 +129,14 @@ class MilvusVectorDB(VectorDBInterface):
             )
             raise
 
+    # 删除整个集合
+    def drop_collection(self, collection_name: str) -> None:
+        """删除整个集合，集合不存在时不做任何操作"""
+        client = self.get_or_create_collection(collection_name).client
+        if client.has_collection(collection_name):
+            client.drop_collection(collection_name)
+            logger.info(f"已删除 Milvus 集合 {collection_name}")
+
     # 删除文档的方法
     def delete_documents(
         self,
@@ -126,8 +152,8 @@ class MilvusVectorDB(VectorDBInterface):
             vectorstore.delete(ids=ids)
         # 如果传入了filter，根据过滤条件删除文档
         elif filter:
-            # 构造Milvus的表达式字符串，这里只处理doc_id的情况
-            expr = f'doc_id=="{filter["doc_id"]}"'
+            # 编译为Milvus的表达式字符串
+            expr = self._compile_filter(vectorstore, filter)
             vectorstore.delete(expr=expr)
         # ids和filter都未传，抛出异常
         else:
@@ -138,7 +164,69 @@ class MilvusVectorDB(VectorDBInterface):
         # 记录删除操作的日志
         logger.info(f"已经从ChromDB集合{collection_name}删除文档")
 
+    # 按ID批量获取文档
+    @traced("vectordb.get_by_ids")
+    def get_by_ids(self, collection_name: str, ids: List[str]) -> List[Document]:
+        """按主键批量获取文档（一次 query 请求）"""
+        if not ids:
+            return []
+        vectorstore = self.get_or_create_collection(collection_name)
+        # 集合不存在时没有可返回的文档
+        if getattr(vectorstore, "col", None) is None:
+            return []
+        primary_field = vectorstore._primary_field
+        expr = f"{primary_field} in [{', '.join(json.dumps(str(i)) for i in ids)}]"
+        rows = vectorstore.client.query(
+            collection_name, filter=expr, output_fields=["*"]
+        )
+        documents = []
+        for row in rows:
+            doc_id = row.pop(primary_field, None)
+            # 复用 LangChain Milvus 的解析逻辑（去掉向量字段，拆出文本和元数据）
+            document = vectorstore._parse_document(row)
+            document.id = str(doc_id) if doc_id is not None else None
+            documents.append(document)
+        return documents
+
+    # 分批读取集合中的全部向量
+    def iter_embeddings(
+        self, collection_name: str, batch_size: int = 1000
+    ) -> Iterator[tuple]:
+        """使用 query_iterator 分批读取 (ids, embeddings, metadatas)"""
+        vectorstore = self.get_or_create_collection(collection_name)
+        # 集合不存在时没有可返回的数据
+        if getattr(vectorstore, "col", None) is None:
+            return
+        primary_field = vectorstore._primary_field
+        vector_field = vectorstore._vector_field
+        # 新版 LangChain Milvus 支持多向量字段，取第一个（与检索使用的字段一致）
+        if isinstance(vector_field, (list, tuple)):
+            vector_field = vector_field[0]
+        # 通过 MilvusClient 创建迭代器（新版 LangChain Milvus 的 col 不再提供 query_iterator）
+        iterator = vectorstore.client.query_iterator(
+            collection_name,
+            batch_size=batch_size,
+            filter=f"{primary_field} != ''",
+            output_fields=["*"],
+        )
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    return
+                ids, embeddings, metadatas = [], [], []
+                for row in rows:
+                    ids.append(str(row.pop(primary_field)))
+                    embeddings.append([float(v) for v in row[vector_field]])
+                    # 复用 LangChain Milvus 的解析逻辑拆出元数据
+                    metadatas.append(vectorstore._parse_document(row).metadata)
+                yield ids, embeddings, metadatas
+        finally:
+            iterator.close()
+
     # 定义相似度搜索方法
+    @traced("vectordb.similarity_search")
+    @timed(VECTOR_SEARCH_SECONDS, backend="milvus", method="similarity_search")
     def similarity_search(
         self,
         collection_name: str,
@@ -159,7 +247,9 @@ class MilvusVectorDB(VectorDBInterface):
         # 如果指定了过滤条件
         if filter:
             # 使用过滤条件表达式地相似度搜索
-            results = vectorstore.similarity_search(query=query, k=k, expr=filter)
+            results = vectorstore.similarity_search(
+                query=query, k=k, expr=self._compile_filter(vectorstore, filter)
+            )
         else:
             # 不带过滤条件，直接搜索
             results = vectorstore.similarity_search(query=query, k=k)
@@ -167,6 +257,8 @@ class MilvusVectorDB(VectorDBInterface):
         return results
 
     # 定义带分数的相似度搜索方法
+    @traced("vectordb.similarity_search_with_score")
+    @timed(VECTOR_SEARCH_SECONDS, backend="milvus", method="similarity_search_with_score")
     def similarity_search_with_score(
         self,
         collection_name: str,
@@ -186,8 +278,8 @@ class MilvusVectorDB(VectorDBInterface):
                 logger.debug(f"集合可能已加载或加载失败: {e}")
         # 如果传递了过滤条件
         if filter:
-            # 根据过滤条件构造Milvus的过滤表达式，只支持doc_id精准查询
-            expr = f'doc_id == "{filter["doc_id"]}"'
+            # 根据过滤条件构造Milvus的过滤表达式
+            expr = self._compile_filter(vectorstore, filter)
             # 带过滤表达式执行相似度检索，并拿到分数
             results = vectorstore.similarity_search_with_score(
                 query=query, k=k, expr=expr
@@ -197,3 +289,107 @@ class MilvusVectorDB(VectorDBInterface):
             # 如果没有过滤条件，直接执行检索
             results = vectorstore.similarity_search_with_score(query=query, k=k)
         return results
+
+    # 定义基于查询向量的带分数相似度搜索方法
+    @traced("vectordb.similarity_search_by_vector_with_score")
+    @timed(VECTOR_SEARCH_SECONDS, backend="milvus", method="similarity_search_by_vector_with_score")
+    def similarity_search_by_vector_with_score(
+        self,
+        collection_name: str,
+        embedding: List[float],
+        k: int = 5,
+        filter: Optional[Dict] = None,
+    ) -> List[tuple]:
+        """基于查询向量的带分数相似度搜索（分数为相关度，越大越相似）"""
+        vectorstore = self.get_or_create_collection(collection_name)
+        # 如果传递了过滤条件，编译为 Milvus 过滤表达式（在向量检索前执行）
+        expr = self._compile_filter(vectorstore, filter)
+        # Milvus 返回的是原始距离/内积
+        results = vectorstore.similarity_search_with_score_by_vector(
+            embedding=embedding, k=k, expr=expr
+        )
+        # 按集合的度量类型把距离换算成余弦相似度口径的相关度
+        metric_type = self._metric_type(vectorstore)
+        if metric_type in ("IP", "COSINE"):
+            return results
+        # Embedding 已做归一化，L2 为平方欧氏距离，满足 d = 2 - 2cos
+        return [(doc, 1.0 - score / 2.0) for doc, score in results]
+
+    # 编译过滤条件
+    @staticmethod
+    def _compile_filter(vectorstore, filter: Optional[Dict]) -> Optional[str]:
+        """
+        将过滤条件编译为 Milvus 表达式
+        集合的元数据字段在第一次写入时确定，引用集合中不存在的字段时抛出 ValueError
+        """
+        expr = filters.to_milvus_expr(filter)
+        if expr is None:
+            return None
+        known = set(getattr(vectorstore, "fields", None) or [])
+        if known and not getattr(vectorstore, "enable_dynamic_field", False):
+            missing = filters.fields(filter) - known
+            if missing:
+                raise ValueError(
+                    f"集合 {vectorstore.collection_name} 不包含元数据字段: {', '.join(sorted(missing))}"
+                    "（集合创建早于这些字段，需要重建集合后才能按其过滤）"
+                )
+        return expr
+
+    # 列表型元数据转换为字符串
+    @staticmethod
+    def _encode_metadatas(metadatas: Optional[List[dict]]) -> Optional[List[dict]]:
+        """列表型元数据（如 tags）保存为 ",a,b," 形式的字符串，空列表为空字符串，按 like 匹配单个取值"""
+        if metadatas is None:
+            return None
+        return [
+            {
+                key: (f",{','.join(str(v) for v in value)}," if value else "")
+                if isinstance(value, (list, tuple))
+                else value
+                for key, value in (metadata or {}).items()
+            }
+            for metadata in metadatas
+        ]
+
+    # 读取集合的度量类型
+    @staticmethod
+    def _metric_type(vectorstore) -> str:
+        """读取集合索引的度量类型（L2 / IP / COSINE），默认 L2"""
+        index_params = getattr(vectorstore, "index_params", None)
+        if isinstance(index_params, list):
+            index_params = index_params[0] if index_params else None
+        if isinstance(index_params, dict):
+            return str(index_params.get("metric_type", "L2")).upper()
+        return "L2"
+
+    # 使用预先计算好的向量写入文档
+    def add_embeddings(
+        self,
+        collection_name: str,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """使用预先计算好的向量写入文档（同 ID 先删后写，保持覆盖语义）"""
+        vectorstore = self.get_or_create_collection(collection_name)
+        try:
+            # Milvus 不支持 upsert 语义的批量写入，先删除已存在的同 ID 数据
+            if ids and getattr(vectorstore, "col", None) is not None:
+                vectorstore.delete(ids=ids)
+            result_ids = vectorstore.add_embeddings(
+                texts=texts,
+                embeddings=embeddings,
+                metadatas=self._encode_metadatas(metadatas),
+                ids=ids,
+            )
+            # 刷新集合，保证数据落盘
+            if hasattr(vectorstore, "_collection"):
+                vectorstore._collection.flush()
+            logger.info(f"已向 Milvus 集合 {collection_name} 写入 {len(texts)} 个向量")
+            return result_ids
+        except Exception as e:
+            logger.error(
+                f"向 Milvus 集合 {collection_name} 写入向量时出错: {e}", exc_info=True
+            )
+            raise
@@ -0,0 +1,476 @@
+"""
+分片向量数据库
+超大知识库的单个集合会让写入、检索和整理都变慢。开启分片的知识库把分块分散到多个物理集合中，
+对外仍然使用逻辑集合名 kb_<知识库ID>，由本类按分片布局路由读写：
+
+    写入       按分块元数据中的 doc_id（哈希分片）或 created_at（时间分片）落到唯一的分片
+    检索       并行查询全部分片（只按文档过滤时只查询相关分片），合并各分片的 top-k
+    按ID读取   分块ID为 "<doc_id>_<序号>"，能确定文档所在分片时只读取该分片，否则读取全部分片
+    删除       按ID或只按文档过滤时路由到相关分片，其他条件广播到全部分片
+
+分片布局（保存在 Knowledgebase.vector_sharding，JSON）：
+    {
+        "strategy": "hash" 或 "time",
+        "shards": ["kb_<ID>", "kb_<ID>_s1", ...],   第一个分片沿用原集合名，未分片的数据无需迁移
+        "boundaries": [时间戳, ...],                 时间分片的边界（len(shards) - 1 个，升序）
+        "assignments": {doc_id: 分片序号}            固定到指定分片的文档（重平衡修正失衡或搬迁中），优先于策略
+        "draining": ["kb_<ID>_s7", ...]              缩减分片数时正在清空的分片：仍参与读取和删除，不再接收新文档
+        "embedding_model": "huggingface:...",       分片中向量所属的 Embedding 模型（见 embedding_model_key），
+                                                     写入和检索都使用该模型向量化
+        "shadow": ["kb_<ID>_m<迁移ID>", ...],        Embedding 模型迁移中的影子集合，与 shards 一一对应
+        "shadow_model": "openai:..."                 影子集合使用的目标模型
+    }
+分片序号是 shards + draining 中的位置
+迁移期间读取只使用 shards，写入和删除同时作用于影子集合（尽力而为，失败由迁移任务的追平阶段补齐）
+没有布局的集合直接转发给底层向量库（当前模型与底层向量库的模型不同时只替换向量化）
+"""
+
+# 导入二分查找模块，用于时间分片的边界查找
+import bisect
+
+# 导入日志模块
+import logging
+
+# 导入 CRC32 校验函数，用于文档ID的稳定哈希
+import zlib
+
+# 导入线程池，用于并行查询各分片
+from concurrent.futures import ThreadPoolExecutor
+
+# 导入类型注解
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# 导入 LangChain 的 Document 类
+from langchain_core.documents import Document
+
+# 导入 Embeddings 基类
+from langchain_core.embeddings import Embeddings
+
+# 导入配置
+from app.config import Config
+
+# 导入向量数据库接口基类
+from app.services.vectordb.base import VectorDBInterface
+
+# 导入后端无关的过滤条件工具
+from app.services.vectordb import filters
+
+# 获取当前模块的日志记录器
+logger = logging.getLogger(__name__)
+
+# 支持的分片策略
+STRATEGIES = ("hash", "time")
+
+
+# 分片集合名
+def shard_name(collection_name: str, index: int) -> str:
+    """第一个分片沿用逻辑集合名，其余分片追加 _s<序号> 后缀"""
+    return collection_name if index == 0 else f"{collection_name}_s{index}"
+
+
+# 布局中的全部分片（含正在清空的分片）
+def all_shards(layout: Dict) -> List[str]:
+    """返回布局中需要读取的全部分片集合名"""
+    return list(layout["shards"]) + list(layout.get("draining") or [])
+
+
+# 计算文档的哈希分片
+def hash_shard(doc_id: str, count: int) -> int:
+    """按文档ID的 CRC32 取模，结果在进程和机器之间稳定"""
+    return zlib.crc32(str(doc_id).encode("utf-8")) % count
+
+
+# 计算一个分块应写入的分片
+def place(layout: Dict, doc_id: Optional[str], created_at: Any = None) -> int:
+    """
+    按分片布局计算分块所在的分片序号
+    Args:
+        layout: 分片布局
+        doc_id: 分块所属文档ID
+        created_at: 文档创建时间（Unix 时间戳，时间分片使用）
+
+    Returns:
+        分片序号
+    """
+    if doc_id is None:
+        return 0
+    doc_id = str(doc_id)
+    assigned = (layout.get("assignments") or {}).get(doc_id)
+    if assigned is not None:
+        return int(assigned)
+    count = len(layout["shards"])
+    if layout["strategy"] == "time":
+        try:
+            timestamp = float(created_at or 0)
+        except (TypeError, ValueError):
+            timestamp = 0.0
+        return min(bisect.bisect_right(layout.get("boundaries") or [], timestamp), count - 1)
+    return hash_shard(doc_id, count)
+
+
+# 根据分块ID推断文档ID
+def doc_id_of(chunk_id: str) -> Optional[str]:
+    """分块ID为 "<doc_id>_<序号>"，无法解析时返回 None"""
+    doc_id, sep, index = str(chunk_id).rpartition("_")
+    return doc_id if sep and doc_id and index.isdigit() else None
+
+
+# 分片向量数据库
+class ShardedVectorDB(VectorDBInterface):
+    """按知识库的分片布局把逻辑集合路由到多个物理集合，未分片的集合直接转发"""
+
+    def __init__(
+        self,
+        inner: VectorDBInterface,
+        layout_provider: Callable[[str], Optional[Dict]],
+        max_workers: Optional[int] = None,
+        embeddings_provider: Optional[Callable[[Optional[str]], Embeddings]] = None,
+    ):
+        """
+        初始化分片向量数据库
+        Args:
+            inner: 底层向量数据库（保存各物理集合）
+            layout_provider: 根据逻辑集合名返回分片布局的函数，未分片时返回 None
+            max_workers: 并行查询分片的线程数，默认 VECTOR_SHARD_WORKERS
+            embeddings_provider: 根据模型标识返回 Embeddings 的函数，None 表示当前设置的模型；
+                                 不传时所有集合都使用底层向量库的 embeddings
+        """
+        self.inner = inner
+        self._layout_provider = layout_provider
+        self._embeddings_provider = embeddings_provider
+        self._max_workers = max_workers or Config.VECTOR_SHARD_WORKERS
+        # 线程池在第一次并行查询时创建
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    # 其他属性（embeddings、process_deferred_deletes 等）转发给底层向量库
+    def __getattr__(self, name: str):
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    # 读取集合的分片布局
+    def _layout(self, collection_name: str) -> Optional[Dict]:
+        layout = self._layout_provider(collection_name)
+        if not layout or not layout.get("shards"):
+            return None
+        return layout
+
+    # 按模型标识获取 Embeddings
+    def _embeddings(self, model_key: Optional[str]) -> Embeddings:
+        if self._embeddings_provider is None:
+            return self.inner.embeddings
+        return self._embeddings_provider(model_key)
+
+    def embeddings_for(self, collection_name: str) -> Embeddings:
+        """返回集合使用的 Embedding 模型：布局中记录的模型，没有记录时为当前设置的模型"""
+        layout = self._layout(collection_name)
+        return self._embeddings((layout or {}).get("embedding_model"))
+
+    # 影子集合的写入，失败只记录日志
+    def _write_shadow(
+        self,
+        layout: Dict,
+        groups: Dict[int, List[int]],
+        texts: List[str],
+        metadatas: Optional[List[dict]],
+        ids: Optional[List[str]],
+    ):
+        shadow = layout.get("shadow") or []
+        try:
+            vectors = self._embeddings(layout.get("shadow_model")).embed_documents(texts)
+            for index, rows in groups.items():
+                if index >= len(shadow):
+                    continue
+                self.inner.add_embeddings(
+                    shadow[index],
+                    [texts[i] for i in rows],
+                    [vectors[i] for i in rows],
+                    [metadatas[i] for i in rows] if metadatas else None,
+                    [ids[i] for i in rows] if ids else None,
+                )
+        except Exception as e:
+            logger.warning(f"写入影子集合失败（迁移的追平阶段会重新复制）: {e}")
+
+    # 对分片对应的影子集合执行删除，失败只记录日志
+    def _shadow_delete(self, layout: Dict, shard: str, fn: Callable[[str], Any]):
+        mirror = dict(zip(layout["shards"], layout.get("shadow") or [])).get(shard)
+        if mirror is None:
+            return
+        try:
+            fn(mirror)
+        except Exception as e:
+            logger.warning(f"删除影子集合 {mirror} 中的文档失败: {e}")
+
+    # 在全部分片或指定分片上并行执行
+    def _fan_out(self, shards: List[str], fn: Callable[[str], Any]) -> List[Any]:
+        if len(shards) == 1:
+            return [fn(shards[0])]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._max_workers, thread_name_prefix="vector-shard"
+            )
+        return list(self._executor.map(fn, shards))
+
+    # 按文档ID集合确定需要访问的分片
+    @staticmethod
+    def _shards_for_docs(layout: Dict, doc_ids) -> List[str]:
+        shards = all_shards(layout)
+        assignments = layout.get("assignments") or {}
+        # 时间分片无法只凭文档ID定位（除非文档被固定到指定分片）
+        if layout["strategy"] == "time" and any(d not in assignments for d in doc_ids):
+            return shards
+        indexes = sorted({place(layout, doc_id) for doc_id in doc_ids})
+        return [shards[i] for i in indexes]
+
+    # 按过滤条件确定需要访问的分片
+    def _shards_for_filter(self, layout: Dict, filter: Optional[Dict]) -> List[str]:
+        doc_ids = filters.doc_id_restriction(filter)
+        if doc_ids is None:
+            return all_shards(layout)
+        return self._shards_for_docs(layout, doc_ids)
+
+    # 按分块ID分组到分片，无法定位的ID发往全部分片
+    def _group_ids(self, layout: Dict, ids: List[str]) -> Dict[str, List[str]]:
+        groups: Dict[str, List[str]] = {}
+        for chunk_id in ids:
+            doc_id = doc_id_of(chunk_id)
+            targets = (
+                self._shards_for_docs(layout, [doc_id]) if doc_id else all_shards(layout)
+            )
+            for shard in targets:
+                groups.setdefault(shard, []).append(chunk_id)
+        return groups
+
+    # 按元数据把写入的分块分组到分片
+    @staticmethod
+    def _group_rows(layout: Dict, metadatas: List[dict]) -> Dict[int, List[int]]:
+        groups: Dict[int, List[int]] = {}
+        for row, metadata in enumerate(metadatas):
+            metadata = metadata or {}
+            index = place(layout, metadata.get("doc_id"), metadata.get("created_at"))
+            groups.setdefault(index, []).append(row)
+        return groups
+
+    def get_or_create_collection(self, collection_name: str) -> Any:
+        """获取或创建集合，分片集合返回第一个分片的向量存储对象"""
+        layout = self._layout(collection_name)
+        if layout is None:
+            return self.inner.get_or_create_collection(collection_name)
+        return self.inner.get_or_create_collection(layout["shards"][0])
+
+    def add_documents(
+        self,
+        collection_name: str,
+        documents: List[Document],
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """添加文档到向量存储，按集合使用的模型向量化，分片集合按元数据写入各自的分片"""
+        layout = self._layout(collection_name)
+        embeddings = self._embeddings((layout or {}).get("embedding_model"))
+        if layout is None and embeddings is self.inner.embeddings:
+            return self.inner.add_documents(collection_name, documents, ids)
+        texts = [d.page_content for d in documents]
+        return self.add_embeddings(
+            collection_name,
+            texts,
+            embeddings.embed_documents(texts),
+            [d.metadata for d in documents],
+            ids or ([d.id for d in documents] if all(d.id for d in documents) else None),
+        )
+
+    def add_embeddings(
+        self,
+        collection_name: str,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """使用预先计算好的向量写入文档，分片集合按元数据写入各自的分片"""
+        layout = self._layout(collection_name)
+        if layout is None:
+            return self.inner.add_embeddings(collection_name, texts, embeddings, metadatas, ids)
+        result: List[str] = []
+        groups = self._group_rows(layout, metadatas or [{} for _ in texts])
+        for index, rows in groups.items():
+            result.extend(
+                self.inner.add_embeddings(
+                    all_shards(layout)[index],
+                    [texts[i] for i in rows],
+                    [embeddings[i] for i in rows],
+                    [metadatas[i] for i in rows] if metadatas else None,
+                    [ids[i] for i in rows] if ids else None,
+                )
+            )
+        # Embedding 模型迁移期间同时用目标模型写入影子集合
+        if layout.get("shadow"):
+            self._write_shadow(layout, groups, texts, metadatas, ids)
+        return result
+
+    def delete_documents(
+        self,
+        collection_name: str,
+        ids: Optional[List[str]] = None,
+        filter: Optional[Dict] = None,
+    ) -> None:
+        """删除文档，按ID或文档过滤时只删除相关分片（迁移期间同时删除影子集合）"""
+        layout = self._layout(collection_name)
+        if layout is None:
+            self.inner.delete_documents(collection_name, ids=ids, filter=filter)
+            return
+        if ids:
+            for shard, shard_ids in self._group_ids(layout, ids).items():
+                self.inner.delete_documents(shard, ids=shard_ids)
+                self._shadow_delete(
+                    layout, shard, lambda name: self.inner.delete_documents(name, ids=shard_ids)
+                )
+        if filter:
+            for shard in self._shards_for_filter(layout, filter):
+                self.inner.delete_documents(shard, filter=filter)
+                self._shadow_delete(
+                    layout, shard, lambda name: self.inner.delete_documents(name, filter=filter)
+                )
+
+    def drop_collection(self, collection_name: str) -> None:
+        """删除整个集合，分片集合删除全部分片（包括迁移中的影子集合）"""
+        layout = self._layout(collection_name)
+        if layout is None:
+            self.inner.drop_collection(collection_name)
+            return
+        for shard in all_shards(layout) + list(layout.get("shadow") or []):
+            self.inner.drop_collection(shard)
+
+    def delete_documents_later(self, collection_name: str, filter: Dict) -> None:
+        """按过滤条件延后删除文档，路由规则与 delete_documents 相同"""
+        layout = self._layout(collection_name)
+        if layout is None:
+            self.inner.delete_documents_later(collection_name, filter)
+            return
+        for shard in self._shards_for_filter(layout, filter):
+            self.inner.delete_documents_later(shard, filter)
+            self._shadow_delete(
+                layout, shard, lambda name: self.inner.delete_documents_later(name, filter)
+            )
+
+    def get_by_ids(self, collection_name: str, ids: List[str]) -> List[Document]:
+        """按ID批量获取文档，分片集合并行读取相关分片并按ID去重"""
+        layout = self._layout(collection_name)
+        if layout is None:
+            return self.inner.get_by_ids(collection_name, ids)
+        if not ids:
+            return []
+        groups = self._group_ids(layout, ids)
+        batches = self._fan_out(
+            list(groups), lambda shard: self.inner.get_by_ids(shard, groups[shard])
+        )
+        # 重平衡搬迁期间同一分块可能短暂存在于两个分片
+        seen = set()
+        result: List[Document] = []
+        for documents in batches:
+            for document in documents:
+                key = document.id or (document.metadata or {}).get("id")
+                if key in seen:
+                    continue
+                seen.add(key)
+                result.append(document)
+        return result
+
+    def iter_embeddings(
+        self, collection_name: str, batch_size: int = 1000
+    ) -> Iterator[tuple]:
+        """分批读取集合中的全部向量，分片集合依次读取各分片"""
+        layout = self._layout(collection_name)
+        if layout is None:
+            yield from self.inner.iter_embeddings(collection_name, batch_size)
+            return
+        for shard in all_shards(layout):
+            yield from self.inner.iter_embeddings(shard, batch_size)
+
+    def similarity_search(
+        self,
+        collection_name: str,
+        query: str,
+        k: int = 5,
+        filter: Optional[Dict] = None,
+    ) -> List[Document]:
+        """相似度搜索，分片集合向量化一次后并行查询各分片"""
+        layout = self._layout(collection_name)
+        embeddings = self._embeddings((layout or {}).get("embedding_model"))
+        if layout is None and embeddings is self.inner.embeddings:
+            return self.inner.similarity_search(collection_name, query, k, filter)
+        embedding = embeddings.embed_query(query)
+        if layout is None:
+            return [
+                doc
+                for doc, _ in self.inner.similarity_search_by_vector_with_score(
+                    collection_name, embedding, k, filter
+                )
+            ]
+        return [doc for doc, _ in self._search(layout, embedding, k, filter)]
+
+    def similarity_search_with_score(
+        self,
+        collection_name: str,
+        query: str,
+        k: int = 5,
+        filter: Optional[Dict] = None,
+    ) -> List[tuple]:
+        """
+        相似度搜索（带分数）
+        分片集合（或集合的模型与底层向量库不同、改为按向量检索时）返回的分数为 1 - 归一化相关度
+        （越小越相似，与距离的方向一致）
+        """
+        layout = self._layout(collection_name)
+        embeddings = self._embeddings((layout or {}).get("embedding_model"))
+        if layout is None and embeddings is self.inner.embeddings:
+            return self.inner.similarity_search_with_score(collection_name, query, k, filter)
+        embedding = embeddings.embed_query(query)
+        hits = (
+            self.inner.similarity_search_by_vector_with_score(collection_name, embedding, k, filter)
+            if layout is None
+            else self._search(layout, embedding, k, filter)
+        )
+        return [(doc, 1.0 - score) for doc, score in hits]
+
+    def similarity_search_by_vector_with_score(
+        self,
+        collection_name: str,
+        embedding: List[float],
+        k: int = 5,
+        filter: Optional[Dict] = None,
+    ) -> List[tuple]:
+        """基于查询向量的相似度搜索（带分数），分片集合并行查询各分片后合并 top-k"""
+        layout = self._layout(collection_name)
+        if layout is None:
+            return self.inner.similarity_search_by_vector_with_score(
+                collection_name, embedding, k, filter
+            )
+        return self._search(layout, embedding, k, filter)
+
+    # 并行查询分片并合并 top-k
+    def _search(
+        self, layout: Dict, embedding: List[float], k: int, filter: Optional[Dict]
+    ) -> List[tuple]:
+        shards = self._shards_for_filter(layout, filter)
+        # 每个分片都取 k 个，合并后的 top-k 与单集合检索一致
+        batches = self._fan_out(
+            shards,
+            lambda shard: self.inner.similarity_search_by_vector_with_score(
+                shard, embedding, k, filter
+            ),
+        )
+        merged = sorted(
+            (hit for hits in batches for hit in hits), key=lambda hit: hit[1], reverse=True
+        )
+        # 重平衡搬迁期间同一分块可能短暂存在于两个分片，按分块ID去重
+        seen = set()
+        result: List[tuple] = []
+        for doc, score in merged:
+            key = doc.id or (doc.metadata or {}).get("id")
+            if key is not None and key in seen:
+                continue
+            seen.add(key)
+            result.append((doc, score))
+            if len(result) >= k:
+                break
+        return result
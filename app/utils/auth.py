@@ -1,6 +1,7 @@
 from flask import session, g, url_for, redirect, request, jsonify
 from app.utils.logger import get_logger
 from app.services.user_service import user_service
+from app.config import Config
 from functools import wraps
 
 logger = get_logger(__name__)
@@ -51,3 +52,24 @@ def api_login_required(f):
     # 返回包装后的函数
     return decorated_function
 
+
+
+# 定义 API 管理员认证装饰器
+def api_admin_required(f):
+    """
+    API 管理员装饰器
+    要求已登录且用户名在 Config.ADMIN_USERNAMES 中，否则返回 JSON 错误响应
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # 未登录返回 401
+        if "user_id" not in session:
+            return jsonify({"code": 401, "message": "未授权", "data": None}), 401
+        # 非管理员返回 403
+        current_user = get_current_user()
+        if not current_user or current_user.get("username") not in Config.ADMIN_USERNAMES:
+            return jsonify({"code": 403, "message": "需要管理员权限", "data": None}), 403
+        return f(*args, **kwargs)
+
+    return decorated_function
@@ -0,0 +1,161 @@
+"""
+生成取消工具
+流式问答开始时为会话登记一个取消令牌，客户端断开或用户点击停止时触发取消，
+检索和 LLM 流式生成在各阶段之间及每个数据块之后检查令牌，尽早停止上游调用
+
+gunicorn 多 worker 部署时，取消请求可能落到另一个 worker：
+设置 CANCEL_SIGNAL_DIR 指向各 worker 共享的目录后，取消请求会在目录中写入标记文件，
+正在生成的 worker 检查令牌时会发现该标记
+"""
+
+# 导入操作系统模块
+import os
+
+# 导入线程模块
+import threading
+
+# 导入时间模块
+import time
+
+# 导入日志模块
+import logging
+
+# 导入类型注解
+from typing import Dict, Optional
+
+# 导入配置
+from app.config import Config
+
+# 获取当前模块的日志记录器
+logger = logging.getLogger(__name__)
+
+# 检查共享标记文件的最小间隔（秒），避免每个数据块都访问文件系统
+_SIGNAL_CHECK_INTERVAL = 0.25
+
+
+# 生成被取消
+class GenerationCancelled(Exception):
+    """生成已被取消（客户端断开或用户停止）"""
+
+    def __init__(self, reason: Optional[str] = None):
+        super().__init__(reason or "cancelled")
+        self.reason = reason
+
+
+# 取消令牌
+class CancelToken:
+    """一次流式生成的取消令牌"""
+
+    def __init__(self, key: Optional[str] = None):
+        """
+        Args:
+            key: 登记的键（会话ID），用于检查跨进程的取消标记
+        """
+        self.key = key
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._next_signal_check = 0.0
+
+    # 触发取消
+    def cancel(self, reason: str = "cancelled"):
+        """触发取消，只记录第一次的原因"""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    # 是否已取消
+    @property
+    def cancelled(self) -> bool:
+        """是否已被取消（包括其他 worker 写入的取消标记）"""
+        if self._event.is_set():
+            return True
+        if self.key and Config.CANCEL_SIGNAL_DIR:
+            now = time.monotonic()
+            if now >= self._next_signal_check:
+                self._next_signal_check = now + _SIGNAL_CHECK_INTERVAL
+                if os.path.exists(_signal_path(self.key)):
+                    self.cancel("user")
+                    return True
+        return False
+
+    # 已取消时抛出异常
+    def raise_if_cancelled(self):
+        """已取消时抛出 GenerationCancelled"""
+        if self.cancelled:
+            raise GenerationCancelled(self.reason)
+
+
+# 跨进程取消标记文件路径
+def _signal_path(key: str) -> str:
+    # 键来自会话ID（十六进制），去掉路径分隔符防止越出目录
+    safe = key.replace("/", "").replace("\\", "").replace("..", "")
+    return os.path.join(Config.CANCEL_SIGNAL_DIR, f"{safe}.cancel")
+
+
+# 取消令牌登记表
+class CancellationRegistry:
+    """按会话登记正在进行的生成，支持按会话取消"""
+
+    def __init__(self):
+        """初始化登记表"""
+        self._tokens: Dict[str, CancelToken] = {}
+        self._lock = threading.Lock()
+
+    # 登记一次生成
+    def register(self, key: str) -> CancelToken:
+        """
+        为会话登记新的取消令牌，同一会话上仍在进行的生成会被取消（新的提问取代旧的）
+        Args:
+            key: 会话ID
+
+        Returns:
+            取消令牌
+        """
+        token = CancelToken(key)
+        with self._lock:
+            previous = self._tokens.get(key)
+            self._tokens[key] = token
+        if previous is not None:
+            previous.cancel("superseded")
+        # 清除上一次遗留的跨进程取消标记
+        if Config.CANCEL_SIGNAL_DIR:
+            try:
+                os.remove(_signal_path(key))
+            except FileNotFoundError:
+                pass
+        return token
+
+    # 生成结束后注销
+    def release(self, key: str, token: CancelToken):
+        """注销令牌（只在登记的仍是该令牌时移除）"""
+        with self._lock:
+            if self._tokens.get(key) is token:
+                del self._tokens[key]
+
+    # 取消会话上的生成
+    def cancel(self, key: str, reason: str = "user") -> bool:
+        """
+        取消会话上正在进行的生成
+        Args:
+            key: 会话ID
+            reason: 取消原因
+
+        Returns:
+            本进程中是否存在正在进行的生成；启用 CANCEL_SIGNAL_DIR 时还会通知其他 worker
+        """
+        with self._lock:
+            token = self._tokens.get(key)
+        if token is not None:
+            token.cancel(reason)
+        elif Config.CANCEL_SIGNAL_DIR:
+            try:
+                os.makedirs(Config.CANCEL_SIGNAL_DIR, exist_ok=True)
+                with open(_signal_path(key), "w") as f:
+                    f.write(reason)
+            except OSError as e:
+                logger.warning(f"写入取消标记失败: {e}")
+        return token is not None
+
+
+# 模块级别的登记表实例
+cancellations = CancellationRegistry()
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from app.config import Config
 from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker
@@ -7,11 +7,16 @@ from sqlalchemy.exc import SQLAlchemyError
 from app.models import Base
 
 from app.utils.logger import get_logger
+from app.utils.metrics import DB_SESSION_SECONDS, DB_SESSIONS_IN_USE, observe
+from app.utils.tracing import span
 
 logger = get_logger(__name__)
 
 
 def get_database_url():
+    # 如果显式配置了完整连接串（如本地 SQLite），则直接使用
+    if Config.DATABASE_URL:
+        return Config.DATABASE_URL
     return (
         f"mysql+pymysql://{Config.DB_USER}:{Config.DB_PASSWORD}"
         f"@{Config.DB_HOST}:{Config.DB_PORT}/{Config.DB_NAME}?charset={Config.DB_CHARSET}"
@@ -35,43 +40,115 @@ Session = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 
 @contextmanager
 def db_session():
-    # 创建会话的实例
-    session = Session()
-    try:
-        # 将session交给调用方使用
-        yield session
-    except Exception as e:
-        logger.error(f"数据库会话错误:{e}")
-        raise
-    finally:
-        session.close()
+    # 记录会话持有时间和当前打开的会话数
+    with span("db.session"), observe(
+        DB_SESSION_SECONDS, kind="session"
+    ), DB_SESSIONS_IN_USE.labels(
+        kind="session"
+    ).track_inprogress():
+        # 创建会话的实例
+        session = Session()
+        try:
+            # 将session交给调用方使用
+            yield session
+        except Exception as e:
+            logger.error(f"数据库会话错误:{e}")
+            raise
+        finally:
+            session.close()
 
 
 @contextmanager
 def db_transaction():
-    # 创建会话的实例
-    session = Session()
-    try:
-        # 将session交给调用方使用
-        yield session
-        # 事务正常结束可以自动提交
-        session.commit()
-    except SQLAlchemyError as e:
-        session.rollback()
-        logger.error(f"数据库事务错误:{e}")
-        raise
-    except Exception as e:
-        session.rollback()
-        logger.error(f"数据库会话错误:{e}")
-        raise
-    finally:
-        session.close()
+    # 记录事务持有时间和当前打开的事务数
+    with span("db.transaction"), observe(
+        DB_SESSION_SECONDS, kind="transaction"
+    ), DB_SESSIONS_IN_USE.labels(
+        kind="transaction"
+    ).track_inprogress():
+        # 创建会话的实例
+        session = Session()
+        try:
+            # 将session交给调用方使用
+            yield session
+            # 事务正常结束可以自动提交
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"数据库事务错误:{e}")
+            raise
+        except Exception as e:
+            session.rollback()
+            logger.error(f"数据库会话错误:{e}")
+            raise
+        finally:
+            session.close()
+
+
+def _add_missing_columns():
+    """为已存在的表补加后来新增的可空字段（create_all 不会修改已存在的表）"""
+    inspector = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                # 只处理可空字段，非空字段需要人工迁移
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {quote(table.name)} "
+                        f"ADD COLUMN {quote(column.name)} {column_type}"
+                    )
+                )
+                logger.info(f"已为表 {table.name} 补加字段 {column.name}")
+
+
+def _widen_datetime_precision():
+    """MySQL 下把已有表中精度低于模型定义的时间字段改为模型定义的小数秒精度（create_all 不会修改已存在的字段）"""
+    if engine.dialect.name != "mysql":
+        return
+    inspector = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"]: column for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                # 模型中声明的小数秒精度，例如 chat_message.created_at 的 DATETIME(6)
+                fsp = getattr(column.type.dialect_impl(engine.dialect), "fsp", None)
+                if not fsp or column.name not in existing:
+                    continue
+                if (getattr(existing[column.name]["type"], "fsp", None) or 0) >= fsp:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                nullable = "NULL" if column.nullable else "NOT NULL"
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {quote(table.name)} "
+                        f"MODIFY COLUMN {quote(column.name)} {column_type} {nullable}"
+                    )
+                )
+                logger.info(f"已将表 {table.name} 的字段 {column.name} 改为 {column_type}")
 
 
 def init_db():
     try:
         # 使用引擎来创建数据库的表结构
         Base.metadata.create_all(engine)
+        # 为已有表补加新增字段
+        _add_missing_columns()
+        # 已有表的时间字段补足小数秒精度，保证同一秒内写入的消息顺序
+        _widen_datetime_precision()
+        # create_all 不会修改已存在的表，为已有表补建后来新增的索引
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
     except Exception as e:
         logger.error(f"初始化数据库失败:{e}")
         raise
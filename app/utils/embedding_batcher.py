@@ -0,0 +1,174 @@
+"""
+查询向量微批处理
+并发的问答请求各自只向量化一条查询，本地模型（HuggingFace / ONNX）逐条推理时会反复执行批大小为 1 的前向计算并争用 CPU。
+MicroBatchedEmbeddings 把同一进程内并发的 embed_query 调用放入队列：
+后台线程取出第一条后最多再等待 EMBEDDING_QUERY_MAX_WAIT_MS 毫秒收集更多查询（达到 EMBEDDING_QUERY_MAX_BATCH 时立即执行），
+合并为一次 embed_documents 推理，再把结果分发给各个等待的调用方；没有并发时不等待。
+模型推理期间到达的查询自然在队列中累积，下一批会一起执行
+
+只用于本地模型：这类模型的 embed_query 与单条 embed_documents 结果一致
+"""
+
+# 导入线程模块
+import threading
+
+# 导入时间模块
+import time
+
+# 导入日志模块
+import logging
+
+# 导入类型注解
+from typing import List, Optional
+
+# 导入 Embeddings 基类
+from langchain_core.embeddings import Embeddings
+
+# 导入配置
+from app.config import Config
+
+# 导入微批处理指标
+from app.utils.metrics import EMBEDDING_QUERY_BATCH_SIZE, EMBEDDING_QUERY_WAIT_SECONDS
+
+# 获取当前模块的日志记录器
+logger = logging.getLogger(__name__)
+
+
+# 一条等待向量化的查询
+class _Request:
+    def __init__(self, text: str):
+        self.text = text
+        self.enqueued_at = time.perf_counter()
+        self.event = threading.Event()
+        self.vector: Optional[List[float]] = None
+        self.error: Optional[BaseException] = None
+
+
+# 查询微批处理器
+class QueryBatcher:
+    """收集并发的查询并批量推理，结果分发回各个调用方"""
+
+    def __init__(self, embeddings: Embeddings, max_batch: int, max_wait_ms: float):
+        """
+        Args:
+            embeddings: 实际的 Embeddings 对象，批量推理使用其 embed_documents
+            max_batch: 单批最多查询数
+            max_wait_ms: 取出第一条查询后等待更多查询的最长时间（毫秒）
+        """
+        self.embeddings = embeddings
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue: List[_Request] = []
+        # 上一批的大小：上一批只有一条且队列中也只有一条时说明没有并发，不再等待
+        self._last_batch_size = 1
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    # 向量化一条查询（阻塞直到所在批次完成）
+    def embed(self, text: str) -> List[float]:
+        """将查询放入队列并等待结果"""
+        request = _Request(text)
+        with self._condition:
+            self._queue.append(request)
+            self._condition.notify()
+            # 后台线程在第一次调用时启动（gunicorn 在导入后 fork，导入时启动的线程不会被继承）
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="embedding-query-batcher", daemon=True
+                )
+                self._thread.start()
+        request.event.wait()
+        if request.error is not None:
+            raise request.error
+        return request.vector
+
+    # 取出下一批查询
+    def _next_batch(self) -> List[_Request]:
+        with self._condition:
+            while not self._queue:
+                self._condition.wait()
+            # 收集窗口从第一条查询入队时开始计算，已经等待过的查询不再额外等待；
+            # 没有并发时立即执行，单个请求不为等待窗口付出延迟
+            deadline = self._queue[0].enqueued_at + self.max_wait
+            if len(self._queue) == 1 and self._last_batch_size == 1:
+                deadline = 0.0
+            while len(self._queue) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._queue[: self.max_batch]
+            self._queue = self._queue[self.max_batch :]
+            self._last_batch_size = len(batch)
+            return batch
+
+    # 执行一批推理并分发结果
+    def _execute(self, batch: List[_Request]):
+        now = time.perf_counter()
+        for request in batch:
+            EMBEDDING_QUERY_WAIT_SECONDS.observe(now - request.enqueued_at)
+        EMBEDDING_QUERY_BATCH_SIZE.observe(len(batch))
+        # 同一批中相同的查询只推理一次
+        texts = list(dict.fromkeys(request.text for request in batch))
+        try:
+            vectors = dict(zip(texts, self.embeddings.embed_documents(texts)))
+            for request in batch:
+                request.vector = vectors[request.text]
+        except Exception as e:
+            for request in batch:
+                request.error = e
+        finally:
+            for request in batch:
+                request.event.set()
+
+    # 后台线程主循环
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._execute(batch)
+            except BaseException as e:  # pragma: no cover - 防御：保证调用方不会永久等待
+                logger.error(f"查询向量批处理失败: {e}", exc_info=True)
+                for request in batch:
+                    if not request.event.is_set():
+                        request.error = e
+                        request.event.set()
+
+
+# 查询微批处理的 Embeddings 包装类
+class MicroBatchedEmbeddings(Embeddings):
+    """embed_query 经过 QueryBatcher 合并推理，embed_documents 直接调用实际对象"""
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_batch: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+    ):
+        """
+        Args:
+            embeddings: 实际的本地 Embeddings 对象
+            max_batch: 单批最多查询数，默认读取 EMBEDDING_QUERY_MAX_BATCH
+            max_wait_ms: 最长等待时间（毫秒），默认读取 EMBEDDING_QUERY_MAX_WAIT_MS
+        """
+        self.embeddings = embeddings
+        self.batcher = QueryBatcher(
+            embeddings,
+            max_batch or Config.EMBEDDING_QUERY_MAX_BATCH,
+            Config.EMBEDDING_QUERY_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms,
+        )
+
+    # 批量向量化文档
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    # 向量化查询
+    def embed_query(self, text: str) -> List[float]:
+        return self.batcher.embed(text)
+
+    # 其余属性（如 model_name）透传给实际对象
+    def __getattr__(self, name):
+        # 初始化完成前访问时避免递归
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
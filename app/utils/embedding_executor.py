@@ -0,0 +1,238 @@
+"""
+远程 Embedding 执行层
+OpenAI / Ollama 等远程 Embedding 服务按批发送请求，并在以下几方面提升批量入库的吞吐：
+    - 分批：文本按批大小切分，每批一次请求（Ollama 客户端逐条请求，批内仍是串行，并发由下面的多批并行提供）
+    - 并行：同时进行 EMBEDDING_MAX_IN_FLIGHT 个批次请求，同一提供商的所有调用共享该并发上限
+    - 重试：429、5xx 和连接错误按指数退避重试，响应带 Retry-After 时以其为准
+    - 自适应批大小：单批耗时明显低于 EMBEDDING_TARGET_BATCH_MS 时增大批大小，超过时或遇到 429 时减半
+
+使用示例:
+    embeddings = BatchedEmbeddings(OpenAIEmbeddings(...), "openai")
+    vectors = embeddings.embed_documents(texts)
+"""
+
+# 导入上下文复制工具，用于把当前请求的 trace 带入工作线程
+import contextvars
+
+# 导入随机数模块，用于退避抖动
+import random
+
+# 导入正则模块
+import re
+
+# 导入线程模块
+import threading
+
+# 导入时间模块
+import time
+
+# 导入日志模块
+import logging
+
+# 导入线程池
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# 导入类型注解
+from typing import List, Optional
+
+# 导入 Embeddings 基类
+from langchain_core.embeddings import Embeddings
+
+# 导入配置
+from app.config import Config
+
+# 导入限流错误判断工具
+from app.utils.llm_limiter import is_rate_limit_error, retry_after_seconds
+
+# 导入采样分析器的包装函数，并行批次随请求一起采样
+from app.utils.profiler import profiled
+
+# 导入远程 Embedding 指标
+from app.utils.metrics import (
+    EMBEDDING_BATCH_SECONDS,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_RETRIES,
+)
+
+# 获取当前模块的日志记录器
+logger = logging.getLogger(__name__)
+
+# 单次退避的最长时间（秒）
+_MAX_BACKOFF = 30.0
+# 连接类错误的异常类型名（openai / httpx / requests）
+_CONNECTION_ERRORS = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "ConnectionError",
+    "ConnectTimeout",
+    "ReadTimeout",
+    "Timeout",
+}
+# Ollama 客户端把 HTTP 错误和连接错误包装为 ValueError，只能从消息中识别
+_OLLAMA_HTTP_CODE = re.compile(r"HTTP code: (\d{3})")
+_OLLAMA_CONNECTION = "Error raised by inference endpoint"
+
+
+# 判断错误是否可以重试
+def retry_reason(error: BaseException) -> Optional[str]:
+    """
+    判断远程 Embedding 错误是否值得重试
+    Returns:
+        "rate_limited"（429）、"error"（5xx 或连接错误），不可重试时返回 None
+    """
+    if is_rate_limit_error(error):
+        return "rate_limited"
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is None and isinstance(error, ValueError):
+        match = _OLLAMA_HTTP_CODE.search(str(error))
+        if match:
+            status = int(match.group(1))
+        elif str(error).startswith(_OLLAMA_CONNECTION):
+            return "error"
+    if status == 429:
+        return "rate_limited"
+    if isinstance(status, int) and status >= 500:
+        return "error"
+    if type(error).__name__ in _CONNECTION_ERRORS:
+        return "error"
+    return None
+
+
+# 分批并行执行的 Embeddings 包装类
+class BatchedEmbeddings(Embeddings):
+    """将远程 Embeddings 的 embed_documents 分批并行执行，带重试和自适应批大小"""
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        provider: str,
+        batch_size: Optional[int] = None,
+        max_in_flight: Optional[int] = None,
+    ):
+        """
+        Args:
+            embeddings: 实际的远程 Embeddings 对象
+            provider: 提供商名称，作为指标标签
+            batch_size: 初始批大小，默认读取 EMBEDDING_BATCH_SIZE
+            max_in_flight: 同时进行的请求数，默认读取 EMBEDDING_MAX_IN_FLIGHT
+        """
+        self.embeddings = embeddings
+        self.provider = provider
+        self.min_batch = max(1, Config.EMBEDDING_MIN_BATCH_SIZE)
+        self.max_batch = max(self.min_batch, Config.EMBEDDING_MAX_BATCH_SIZE)
+        self._batch_size = min(
+            self.max_batch,
+            max(self.min_batch, batch_size or Config.EMBEDDING_BATCH_SIZE),
+        )
+        self.max_in_flight = max(1, max_in_flight or Config.EMBEDDING_MAX_IN_FLIGHT)
+        # 所有 embed_documents 调用共享的线程池，限制对该提供商的总并发
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_in_flight, thread_name_prefix=f"embed-{provider}"
+        )
+        self._lock = threading.Lock()
+        EMBEDDING_BATCH_SIZE.labels(provider=provider).set(self._batch_size)
+
+    # 当前批大小
+    @property
+    def batch_size(self) -> int:
+        """自适应调整后的当前批大小"""
+        return self._batch_size
+
+    # 按耗时调整批大小
+    def _adapt(self, size: int, seconds: float, rate_limited: bool = False):
+        """根据一批请求的结果调整批大小：限流或过慢时减半，明显快于目标时增大一半"""
+        target = Config.EMBEDDING_TARGET_BATCH_MS / 1000
+        with self._lock:
+            current = self._batch_size
+            if rate_limited:
+                current = max(self.min_batch, current // 2)
+            elif target > 0:
+                # 只根据满批的耗时放大，避免最后一小批把批大小拉高
+                if seconds > target:
+                    current = max(self.min_batch, current // 2)
+                elif seconds < target / 2 and size >= current:
+                    current = min(self.max_batch, current + max(1, current // 2))
+            if current != self._batch_size:
+                logger.debug(
+                    f"Embedding 批大小调整 {self.provider}: {self._batch_size} -> {current}"
+                )
+                self._batch_size = current
+                EMBEDDING_BATCH_SIZE.labels(provider=self.provider).set(current)
+
+    # 执行一批请求（带重试）
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """向量化一批文本，可重试的错误按指数退避重试"""
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+            except Exception as e:
+                reason = retry_reason(e)
+                if reason is None or attempt >= Config.EMBEDDING_RETRIES:
+                    raise
+                if reason == "rate_limited":
+                    self._adapt(len(texts), 0.0, rate_limited=True)
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = Config.EMBEDDING_BACKOFF_SECONDS * (2**attempt)
+                delay = min(_MAX_BACKOFF, delay) * random.uniform(1.0, 1.2)
+                EMBEDDING_RETRIES.labels(provider=self.provider, reason=reason).inc()
+                logger.warning(
+                    f"Embedding 请求失败（{self.provider}，第 {attempt + 1} 次，{len(texts)} 条），"
+                    f"{delay:.1f}s 后重试: {e}"
+                )
+                time.sleep(delay)
+                attempt += 1
+                continue
+            seconds = time.perf_counter() - start
+            EMBEDDING_BATCH_SECONDS.labels(provider=self.provider).observe(seconds)
+            self._adapt(len(texts), seconds)
+            return vectors
+
+    # 批量向量化文档
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """分批并行向量化文本，返回顺序与输入一致"""
+        texts = list(texts)
+        if not texts:
+            return []
+        # 只有一批时直接在当前线程执行
+        if len(texts) <= self._batch_size:
+            return self._embed_batch(texts)
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        offset = 0
+        running = {}
+        try:
+            while offset < len(texts) or running:
+                # 补足并行批次，每批按提交时的批大小切分，自适应调整对后续批次生效
+                while offset < len(texts) and len(running) < self.max_in_flight:
+                    batch = texts[offset : offset + self._batch_size]
+                    context = contextvars.copy_context()
+                    future = self._executor.submit(
+                        context.run, profiled(self._embed_batch), batch
+                    )
+                    running[future] = offset
+                    offset += len(batch)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start = running.pop(future)
+                    vectors = future.result()
+                    results[start : start + len(vectors)] = vectors
+        finally:
+            # 出错时取消尚未开始的批次
+            for future in running:
+                future.cancel()
+        return results
+
+    # 向量化查询（单条请求，不分批）
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    # 其余属性（如 model_name）透传给实际对象
+    def __getattr__(self, name):
+        # 初始化完成前访问时避免递归
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
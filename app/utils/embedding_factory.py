@@ -4,6 +4,10 @@ Embedding 模型工厂
 """
 # 导入日志模块
 import logging
+# 导入类型注解
+from typing import List, Optional
+# 导入 Embeddings 基类
+from langchain_core.embeddings import Embeddings
 # 导入 Huggingface Embeddings 类
 from langchain_huggingface import HuggingFaceEmbeddings
 # 导入Open AI Embeddings 类
@@ -14,9 +18,75 @@ from openai import embeddings
 
 # 导入全局设置服务
 from app.services.settings_service import  settings_service
+# 导入指标定义与计时工具
+from app.utils.metrics import EMBEDDING_SECONDS, EMBEDDING_TEXTS, observe
+# 导入链路追踪工具
+from app.utils.tracing import span
+# 导入远程 Embedding 分批并行执行层
+from app.utils.embedding_executor import BatchedEmbeddings
+# 导入配置
+from app.config import Config
+# 导入查询向量微批处理
+from app.utils.embedding_batcher import MicroBatchedEmbeddings
+# 导入 ONNX Runtime Embeddings 与一致性检查
+from app.utils.onnx_embeddings import OnnxEmbeddings, parity_check, resolve_model_dir
 # 获取logger对象
 logger = logging.getLogger(__name__)
 
+
+# 带指标记录的 Embeddings 包装类
+class InstrumentedEmbeddings(Embeddings):
+    """包装任意 Embeddings 对象，记录每次调用的耗时和文本数"""
+
+    def __init__(self, embeddings: Embeddings, provider: str, model_key: Optional[str] = None):
+        """
+        Args:
+            embeddings: 实际的 Embeddings 对象
+            provider: 提供商名称，作为指标标签
+            model_key: 模型标识（见 embedding_model_key），向量只能和同一模型标识的向量比较
+        """
+        self.embeddings = embeddings
+        self.provider = provider
+        self.model_key = model_key
+
+    # 批量向量化文档
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with span("embedding.documents", texts=len(texts)), observe(
+            EMBEDDING_SECONDS, provider=self.provider, operation="documents"
+        ):
+            vectors = self.embeddings.embed_documents(texts)
+        EMBEDDING_TEXTS.labels(provider=self.provider, operation="documents").inc(len(texts))
+        return vectors
+
+    # 向量化查询
+    def embed_query(self, text: str) -> List[float]:
+        with span("embedding.query"), observe(
+            EMBEDDING_SECONDS, provider=self.provider, operation="query"
+        ):
+            vector = self.embeddings.embed_query(text)
+        EMBEDDING_TEXTS.labels(provider=self.provider, operation="query").inc()
+        return vector
+
+    # 其余属性（如 model_name）透传给实际对象
+    def __getattr__(self, name):
+        # 初始化完成前访问时避免递归
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+
+# 计算 Embedding 模型标识
+def embedding_model_key(settings: dict) -> str:
+    """
+    由设置中的提供商和模型名称计算模型标识，例如 "huggingface:BAAI/bge-small-zh-v1.5"
+    ONNX 模型与同名 HuggingFace 模型的向量可以混用，使用相同的标识
+    """
+    provider = settings.get("embedding_provider") or "huggingface"
+    if provider == "onnx":
+        provider = "huggingface"
+    return f"{provider}:{settings.get('embedding_model_name')}"
+
+
 # 定义 Embedding 工厂类
 class EmbeddingFactory:
     """Embedding 模型工厂"""
@@ -24,14 +94,20 @@ class EmbeddingFactory:
     DEFAULT_MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
     # 定义静态方法，用于创建 embedding 对象
     @staticmethod
-    def create_embeddings():
+    def create_embeddings(settings: Optional[dict] = None, fallback: bool = True):
         """
         创建 Embedding 模型
+        Args:
+            settings: Embedding 设置（提供商、模型名称、API Key、Base URL），默认读取全局设置
+            fallback: 创建失败时是否回退到默认模型；为 False 时抛出异常，
+                      用于已有向量的集合（换成其他模型的查询向量无法与已有向量比较）
+
         Returns:
             Embeddings 对象
         """
-        # 从 settings_service 获取嵌入设置
-        settings = settings_service.get()
+        # 未指定时从 settings_service 获取嵌入设置
+        if settings is None:
+            settings = settings_service.get()
         # 获取 embedding 提供商，默认为 huggingface
         provider = settings.get("embedding_provider", "huggingface")
         # 获取embedding 模型名称
@@ -57,9 +133,15 @@ class EmbeddingFactory:
                 if not api_key:
                     raise ValueError("OpenAI Embeddings 需要 API Key")
                 # 创建 OpenAI Embeddings 对象
-                embeddings = OpenAIEmbeddings(
-                    model=model_name,
-                    openai_api_key=api_key
+                # 分批、并发和重试由 BatchedEmbeddings 负责，客户端不再二次切分和重试
+                embeddings = BatchedEmbeddings(
+                    OpenAIEmbeddings(
+                        model=model_name,
+                        openai_api_key=api_key,
+                        chunk_size=Config.EMBEDDING_MAX_BATCH_SIZE,
+                        max_retries=0,
+                    ),
+                    provider,
                 )
                 # 记录日志
                 logger.info(f"创建 OpenAI Embeddings: {model_name}")
@@ -68,12 +150,37 @@ class EmbeddingFactory:
                 if not base_url:
                     raise ValueError(f"Ollama Embeddings 需要 Base URL")
                 # 创建 Ollama Embeddings对象
-                embeddings = OllamaEmbeddings(
-                    model=model_name,
-                    base_url=base_url
+                embeddings = BatchedEmbeddings(
+                    OllamaEmbeddings(
+                        model=model_name,
+                        base_url=base_url
+                    ),
+                    provider,
                 )
                 # 记录日志
                 logger.info(f"创建 Ollama Embeddings: {model_name}, base_url: {base_url}")
+            elif provider == "onnx":
+                # 创建 ONNX Runtime Embeddings 对象，模型名称与 HuggingFace 一致，向量可与已有集合混用
+                embeddings = OnnxEmbeddings(resolve_model_dir(model_name))
+                # 可选：与同名 PyTorch 模型比较，一致性不足时改用 PyTorch 模型
+                if Config.EMBEDDING_ONNX_PARITY_CHECK:
+                    reference = HuggingFaceEmbeddings(
+                        model_name=model_name,
+                        model_kwargs={"device": "cpu"},
+                        encode_kwargs={"normalize_embeddings": True}
+                    )
+                    report = parity_check(embeddings, reference)
+                    logger.info(f"ONNX Embeddings 一致性检查: {report}")
+                    if report["min_cosine"] < Config.EMBEDDING_ONNX_PARITY_MIN_COSINE:
+                        logger.error(
+                            f"ONNX Embeddings 与 PyTorch 模型不一致（最小余弦相似度 {report['min_cosine']}），"
+                            f"改用 HuggingFace: {model_name}"
+                        )
+                        embeddings, provider = reference, "huggingface"
+                # 记录日志
+                logger.info(f"创建 ONNX Embeddings: {model_name}")
+            elif not fallback:
+                raise ValueError(f"未知的 Embedding 提供商: {provider}")
             else:
                 # 未知的提供商，警告日志，使用默认 huggingface
                 logger.warning(f"未知的 Embedding 提供商: {provider}，使用默认的 HuggingFace")
@@ -82,14 +189,30 @@ class EmbeddingFactory:
                     model_kwargs={"device": "cpu"},
                     encode_kwargs={"normalize_embeddings": True}
                 )
-            return embeddings
+                provider = "huggingface"
+                settings = {"embedding_model_name": EmbeddingFactory.DEFAULT_MODEL_NAME}
+            return EmbeddingFactory._wrap(embeddings, provider, embedding_model_key(settings))
         except Exception as e:
             # 出现异常时记录错误日志
             logger.error(f"创建 Embedding 模型失败: {e}", exc_info=True)
+            if not fallback:
+                raise
             # 失败时回退到默认模型并记录警告
             logger.warning(f"回退到默认 HuggingFace 模型: {EmbeddingFactory.DEFAULT_MODEL_NAME}")
-            return HuggingFaceEmbeddings(
-                model_name=EmbeddingFactory.DEFAULT_MODEL_NAME,
-                model_kwargs={"device":"cpu"},
-                encode_kwargs={"normalize_embeddings": True}
-            )
\ No newline at end of file
+            return EmbeddingFactory._wrap(
+                HuggingFaceEmbeddings(
+                    model_name=EmbeddingFactory.DEFAULT_MODEL_NAME,
+                    model_kwargs={"device":"cpu"},
+                    encode_kwargs={"normalize_embeddings": True}
+                ),
+                "huggingface",
+                embedding_model_key({"embedding_model_name": EmbeddingFactory.DEFAULT_MODEL_NAME}),
+            )
+
+    # 包装 Embeddings 对象
+    @staticmethod
+    def _wrap(embeddings: Embeddings, provider: str, model_key: str) -> Embeddings:
+        """本地模型合并并发的查询向量化请求，再统一加上指标记录和模型标识"""
+        if provider in ("huggingface", "onnx") and Config.EMBEDDING_QUERY_BATCHING_ENABLED:
+            embeddings = MicroBatchedEmbeddings(embeddings)
+        return InstrumentedEmbeddings(embeddings, provider, model_key)
\ No newline at end of file
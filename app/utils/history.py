@@ -0,0 +1,99 @@
+"""
+对话历史工具
+估算 token 数，并在 token 预算内把摘要和最近的对话转换为 LangChain 消息
+"""
+
+# 导入正则模块
+import re
+
+# 导入类型注解
+from typing import List, Optional
+
+# 导入 LangChain 消息类型（消息对象不会被当作模板解析，内容中的花括号不受影响）
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+# 导入配置
+from app.config import Config
+
+# 中日韩字符：约 1 个字符 1 个 token
+_CJK_PATTERN = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]")
+
+
+# 估算文本 token 数
+def estimate_tokens(text: Optional[str]) -> int:
+    """
+    粗略估算 token 数：中日韩字符按 1 个 token，其余字符按 4 个字符 1 个 token
+    Args:
+        text: 文本
+
+    Returns:
+        估算的 token 数
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+# 计算在 token 预算内保留的最近消息条数
+def count_window_messages(history: Optional[List[dict]], budget: Optional[int] = None) -> int:
+    """
+    从最新的消息开始向前累计，直到用完 token 预算；窗口以助手消息开头时去掉该消息，保证对话从用户提问开始
+    问答时按此窗口放入提示词，摘要任务据此判断哪些消息已滑出窗口，两处规则一致，消息不会既不在窗口也不在摘要中
+    Args:
+        history: 按时间升序的历史消息 [{"role": "user"/"assistant", "content": ...}]
+        budget: 历史消息的 token 预算，默认读取 HISTORY_TOKEN_BUDGET
+
+    Returns:
+        保留的消息条数（从末尾算起，包括没有内容的消息）
+    """
+    if budget is None:
+        budget = Config.HISTORY_TOKEN_BUDGET
+    history = history or []
+    kept = 0
+    used = 0
+    for message in reversed(history):
+        content = message.get("content") or ""
+        cost = estimate_tokens(content) + 4 if content else 0
+        if used + cost > budget:
+            break
+        used += cost
+        kept += 1
+    # 窗口以助手消息（或空消息）开头时丢弃
+    while kept and (
+        history[-kept].get("role") == "assistant" or not history[-kept].get("content")
+    ):
+        kept -= 1
+    return kept
+
+
+# 构造历史消息
+def build_history_messages(
+    history: Optional[List[dict]],
+    summary: Optional[str] = None,
+    budget: Optional[int] = None,
+) -> List[BaseMessage]:
+    """
+    按 count_window_messages 的规则选取最近的消息，按时间顺序返回
+    Args:
+        history: 按时间升序的历史消息 [{"role": "user"/"assistant", "content": ...}]
+        summary: 更早对话的摘要（可选），作为一条系统消息放在最前面
+        budget: 历史消息的 token 预算，默认读取 HISTORY_TOKEN_BUDGET
+
+    Returns:
+        LangChain 消息列表
+    """
+    history = history or []
+    kept = count_window_messages(history, budget)
+    selected: List[BaseMessage] = []
+    for message in history[len(history) - kept :]:
+        content = message.get("content") or ""
+        if not content:
+            continue
+        if message.get("role") == "assistant":
+            selected.append(AIMessage(content=content))
+        else:
+            selected.append(HumanMessage(content=content))
+    if summary:
+        selected.insert(0, SystemMessage(content=f"以下是本次会话较早内容的摘要：\n{summary}"))
+    return selected
@@ -15,6 +15,12 @@ from app.services.settings_service import settings_service
 # 导入配置类
 from app.config import Config
 
+# 导入指标定义与计时工具
+from app.utils.metrics import LLM_CREATE_SECONDS, observe
+
+# 导入链路追踪工具
+from app.utils.tracing import span
+
 # 获取当前模块的日志记录器
 logger = logging.getLogger(__name__)
 
@@ -68,6 +74,23 @@ class LLMFactory:
             settings = settings_service.get()
         # 获取llm_provider的名称(默认为deepseek)
         provider = settings.get("llm_provider", "deepseek").lower()
+        # 记录创建耗时
+        with span("llm.create", provider=provider), observe(
+            LLM_CREATE_SECONDS, provider=provider
+        ):
+            return cls._dispatch(provider, settings, temperature, max_tokens, streaming)
+
+    # 按提供商名称分发创建逻辑
+    @classmethod
+    def _dispatch(
+        cls,
+        provider: str,
+        settings: dict,
+        temperature: float,
+        max_tokens: int,
+        streaming: bool,
+    ):
+        """根据提供商名称调用对应的创建函数"""
         # 优先检查是否用户注册的 Provider
         if provider in cls._providers:
             # 使用自定义注册的Provider创建llm对象
@@ -0,0 +1,465 @@
+"""
+LLM 故障转移工具
+按 主提供商 -> LLM_FALLBACK_PROVIDERS 的顺序尝试流式调用：
+    - 熔断：每个提供商连续失败 LLM_CIRCUIT_FAILURES 次后熔断 LLM_CIRCUIT_OPEN_SECONDS 秒，
+      期间跳过该提供商，到期后放行一个探测请求，成功则恢复
+    - 转移：输出第一个内容块之前出错时切换到下一个可用的提供商（已输出内容后出错直接抛出，避免重复输出）
+    - 对冲（LLM_HEDGE_ENABLED）：LLM_HEDGE_TTFT_MS 内没有首字时同时向下一个提供商发起请求，
+      先出字的胜出，其余请求被取消
+
+每次调用仍经过 llm_limiter 的并发与配额限制
+
+使用示例:
+    def make_stream(provider_settings):
+        llm = LLMFactory.create_llm(provider_settings, streaming=True)
+        return (prompt | llm).stream(inputs)
+
+    stream = FailoverStream(settings, make_stream, user_id=user_id)
+    for chunk in stream:
+        ...
+    stream.provider  # 实际提供回答的提供商
+"""
+
+# 导入上下文复制工具，用于把当前请求的 trace 带入对冲线程
+import contextvars
+
+# 导入队列模块
+import queue
+
+# 导入线程模块
+import threading
+
+# 导入时间模块
+import time
+
+# 导入日志模块
+import logging
+
+# 导入类型注解
+from typing import Callable, Dict, Iterator, List, Optional
+
+# 导入配置
+from app.config import Config
+
+# 导入取消令牌
+from app.utils.cancellation import CancelToken, GenerationCancelled
+
+# 导入 LLM 限流工具
+from app.utils.llm_limiter import limited_stream
+
+# 导入故障转移指标
+from app.utils.metrics import LLM_CIRCUIT_STATE, LLM_FAILOVERS
+
+# 导入采样分析器的包装函数，备用线程随请求一起采样
+from app.utils.profiler import profiled
+
+# 获取当前模块的日志记录器
+logger = logging.getLogger(__name__)
+
+# 熔断状态与指标值
+_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+# 等待对冲结果时检查取消状态的间隔（秒）
+_POLL_INTERVAL = 0.25
+
+
+# 熔断器
+class CircuitBreaker:
+    """单个提供商的熔断器，同时记录健康统计"""
+
+    def __init__(self, provider: str, failure_threshold: int, open_seconds: float):
+        """
+        Args:
+            provider: 提供商名称
+            failure_threshold: 连续失败多少次后熔断
+            open_seconds: 熔断持续时间（秒）
+        """
+        self.provider = provider
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.successes = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        # 首字延迟的指数移动平均（毫秒）
+        self.ttft_ms: Optional[float] = None
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    # 设置状态并更新指标
+    def _set_state(self, state: str):
+        self.state = state
+        LLM_CIRCUIT_STATE.labels(provider=self.provider).set(_STATE_VALUES[state])
+
+    # 是否允许发起调用
+    def allow(self) -> bool:
+        """熔断期间返回 False；熔断到期后只放行一个探测请求"""
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    return False
+                self._set_state("half_open")
+                self._probing = False
+            if self.state == "half_open":
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    # 记录成功
+    def record_success(self, ttft_ms: Optional[float] = None):
+        """收到首字即视为成功，恢复为正常状态"""
+        with self._lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            self._probing = False
+            if ttft_ms is not None:
+                self.ttft_ms = (
+                    ttft_ms if self.ttft_ms is None else 0.8 * self.ttft_ms + 0.2 * ttft_ms
+                )
+            if self.state != "closed":
+                logger.info(f"LLM 提供商 {self.provider} 已恢复")
+                self._set_state("closed")
+
+    # 记录失败
+    def record_failure(self, error: Optional[BaseException] = None):
+        """记录失败，达到阈值或探测失败时熔断"""
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self._probing = False
+            if error is not None:
+                self.last_error = f"{type(error).__name__}: {error}"[:300]
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(
+                        f"LLM 提供商 {self.provider} 已熔断 {self.open_seconds:.0f}s: {self.last_error}"
+                    )
+                self._opened_at = time.monotonic()
+                self._set_state("open")
+
+    # 释放未完成的探测（调用被取消，既不算成功也不算失败）
+    def release_probe(self):
+        """探测请求被取消时允许下一个请求继续探测"""
+        with self._lock:
+            self._probing = False
+
+    # 健康状态
+    def snapshot(self) -> dict:
+        """返回提供商的健康统计"""
+        with self._lock:
+            open_left = (
+                max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+                if self.state == "open"
+                else 0.0
+            )
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "successes": self.successes,
+                "failures": self.failures,
+                "ttft_ms": round(self.ttft_ms, 1) if self.ttft_ms is not None else None,
+                "open_seconds_left": round(open_left, 1),
+                "last_error": self.last_error,
+            }
+
+
+# 各提供商的熔断器
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+# 获取提供商的熔断器
+def get_breaker(provider: str) -> CircuitBreaker:
+    """获取（或创建）提供商的熔断器"""
+    provider = provider.lower()
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(
+                provider,
+                CircuitBreaker(
+                    provider, Config.LLM_CIRCUIT_FAILURES, Config.LLM_CIRCUIT_OPEN_SECONDS
+                ),
+            )
+    return breaker
+
+
+# 所有提供商的健康状态
+def health_snapshot() -> Dict[str, dict]:
+    """返回本进程内各提供商的熔断状态与健康统计"""
+    return {name: breaker.snapshot() for name, breaker in sorted(_breakers.items())}
+
+
+# 构造提供商链
+def provider_chain(settings: dict) -> List[dict]:
+    """
+    按顺序返回各提供商的设置：主提供商使用系统设置，备用提供商使用 LLM_FALLBACK_<提供商>_* 配置
+    Args:
+        settings: 系统设置
+
+    Returns:
+        设置字典列表（去重，保持顺序）
+    """
+    primary = (settings.get("llm_provider") or "deepseek").lower()
+    chain = [dict(settings, llm_provider=primary)]
+    for name in Config.LLM_FALLBACK_PROVIDERS:
+        if name == primary or any(s["llm_provider"] == name for s in chain):
+            continue
+        overrides = Config.LLM_FALLBACK_SETTINGS.get(name, {})
+        # 未配置的字段留空，由 LLMFactory 使用该提供商的默认值
+        chain.append(
+            dict(
+                settings,
+                llm_provider=name,
+                llm_model_name=overrides.get("llm_model_name") or None,
+                llm_api_key=overrides.get("llm_api_key") or None,
+                llm_base_url=overrides.get("llm_base_url") or None,
+            )
+        )
+    return chain
+
+
+# 一次对冲调用
+class _Attempt:
+    """在后台线程中执行一个提供商的流式调用，数据块放入共享队列"""
+
+    def __init__(self, index: int, provider_settings: dict, events: "queue.Queue"):
+        self.index = index
+        self.settings = provider_settings
+        self.provider = provider_settings["llm_provider"]
+        self.events = events
+        self.cancel_token = CancelToken()
+        self.started_at = time.monotonic()
+        # 是否以错误结束
+        self.failed = False
+
+    # 启动后台线程
+    def start(self, make_stream: Callable[[dict], Iterator], limiter_kwargs: dict):
+        context = contextvars.copy_context()
+        threading.Thread(
+            target=context.run,
+            args=(profiled(self._run), make_stream, limiter_kwargs),
+            name=f"llm-hedge-{self.provider}",
+            daemon=True,
+        ).start()
+
+    def _run(self, make_stream: Callable[[dict], Iterator], limiter_kwargs: dict):
+        try:
+            stream = limited_stream(
+                self.provider,
+                lambda: make_stream(self.settings),
+                cancel_token=self.cancel_token,
+                **limiter_kwargs,
+            )
+            try:
+                for chunk in stream:
+                    self.events.put((self, "chunk", chunk))
+                    # 落败或被取消后在下一个数据块处停止，关闭上游连接
+                    if self.cancel_token.cancelled:
+                        break
+            finally:
+                stream.close()
+        except BaseException as e:
+            self.failed = True
+            self.events.put((self, "error", e))
+        self.events.put((self, "end", None))
+
+
+# 带故障转移的流式调用
+class FailoverStream:
+    """按提供商链执行流式调用，支持熔断、出错转移和对冲请求"""
+
+    def __init__(
+        self,
+        settings: dict,
+        make_stream: Callable[[dict], Iterator],
+        user_id: Optional[str] = None,
+        prompt_tokens: int = 0,
+        max_tokens: int = 0,
+        cancel_token: Optional[CancelToken] = None,
+        hedge: Optional[bool] = None,
+    ):
+        """
+        Args:
+            settings: 系统设置（主提供商）
+            make_stream: 根据提供商设置发起流式调用的函数
+            user_id: 用户ID，用于限流的公平排队
+            prompt_tokens: 提示词 token 估算值
+            max_tokens: 最大输出 token 数
+            cancel_token: 取消令牌（可选）
+            hedge: 是否启用对冲请求，默认读取 LLM_HEDGE_ENABLED
+        """
+        self.chain = provider_chain(settings)
+        self.make_stream = make_stream
+        self.cancel_token = cancel_token
+        self.hedge = Config.LLM_HEDGE_ENABLED if hedge is None else hedge
+        self.limiter_kwargs = {
+            "user_id": user_id,
+            "prompt_tokens": prompt_tokens,
+            "max_tokens": max_tokens,
+        }
+        # 实际提供回答的提供商（收到首字后确定）
+        self.provider: Optional[str] = None
+        self._iterator: Optional[Iterator] = None
+
+    # 可用的提供商（熔断的跳过；全部熔断时仍尝试主提供商，避免完全不可用）
+    def _candidates(self) -> Iterator[dict]:
+        tried = False
+        for provider_settings in self.chain:
+            if get_breaker(provider_settings["llm_provider"]).allow():
+                tried = True
+                yield provider_settings
+        if not tried:
+            logger.warning("所有 LLM 提供商均已熔断，尝试主提供商")
+            yield self.chain[0]
+
+    def __iter__(self):
+        if self._iterator is None:
+            self._iterator = self._hedged() if self.hedge else self._sequential()
+        return self._iterator
+
+    def __next__(self):
+        return next(iter(self))
+
+    # 关闭流
+    def close(self):
+        """关闭流，停止上游调用"""
+        if self._iterator is not None:
+            self._iterator.close()
+
+    # 依次尝试各提供商
+    def _sequential(self) -> Iterator:
+        last_error: Optional[BaseException] = None
+        for provider_settings in self._candidates():
+            provider = provider_settings["llm_provider"]
+            breaker = get_breaker(provider)
+            started_at = time.monotonic()
+            started = False
+            stream = limited_stream(
+                provider,
+                lambda: self.make_stream(provider_settings),
+                cancel_token=self.cancel_token,
+                **self.limiter_kwargs,
+            )
+            try:
+                for chunk in stream:
+                    if not started:
+                        started = True
+                        self.provider = provider
+                        breaker.record_success((time.monotonic() - started_at) * 1000)
+                    yield chunk
+                if not started:
+                    # 没有输出任何内容也算成功完成
+                    self.provider = provider
+                    breaker.record_success()
+                return
+            except GenerationCancelled:
+                breaker.release_probe()
+                raise
+            except Exception as e:
+                breaker.record_failure(e)
+                # 已输出内容后出错不能切换（会重复输出）
+                if started:
+                    raise
+                last_error = e
+                LLM_FAILOVERS.labels(provider=provider, reason="error").inc()
+                logger.warning(f"LLM 提供商 {provider} 调用失败，尝试下一个: {e}")
+            finally:
+                stream.close()
+        raise last_error or RuntimeError("没有可用的 LLM 提供商")
+
+    # 对冲模式
+    def _hedged(self) -> Iterator:
+        events: "queue.Queue" = queue.Queue()
+        candidates = self._candidates()
+        attempts: List[_Attempt] = []
+        deadline_seconds = Config.LLM_HEDGE_TTFT_MS / 1000
+        winner: Optional[_Attempt] = None
+        last_error: Optional[BaseException] = None
+        running = 0
+
+        def launch(reason: Optional[str] = None) -> bool:
+            nonlocal running
+            provider_settings = next(candidates, None)
+            if provider_settings is None:
+                return False
+            if reason and attempts:
+                LLM_FAILOVERS.labels(provider=attempts[-1].provider, reason=reason).inc()
+            attempt = _Attempt(len(attempts), provider_settings, events)
+            attempts.append(attempt)
+            attempt.start(self.make_stream, self.limiter_kwargs)
+            running += 1
+            return True
+
+        try:
+            if not launch():
+                raise RuntimeError("没有可用的 LLM 提供商")
+            hedge_at = time.monotonic() + deadline_seconds
+            while True:
+                if self.cancel_token is not None and self.cancel_token.cancelled:
+                    raise GenerationCancelled(self.cancel_token.reason)
+                # 还没有胜出者时，到达首字期限就向下一个提供商发起对冲
+                if winner is None and time.monotonic() >= hedge_at:
+                    if launch("hedge"):
+                        logger.info(
+                            f"LLM 提供商 {attempts[-2].provider} 首字超过 "
+                            f"{Config.LLM_HEDGE_TTFT_MS}ms，对冲请求 {attempts[-1].provider}"
+                        )
+                        hedge_at = time.monotonic() + deadline_seconds
+                    else:
+                        hedge_at = float("inf")
+                timeout = _POLL_INTERVAL
+                if winner is None:
+                    timeout = max(0.0, min(_POLL_INTERVAL, hedge_at - time.monotonic()))
+                try:
+                    attempt, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                breaker = get_breaker(attempt.provider)
+                # 落败者的后续数据全部忽略
+                if winner is not None and attempt is not winner:
+                    continue
+                if kind == "chunk":
+                    if winner is None:
+                        winner = attempt
+                        self.provider = attempt.provider
+                        breaker.record_success((time.monotonic() - attempt.started_at) * 1000)
+                        # 取消其他仍在等待首字的请求
+                        for other in attempts:
+                            if other is not winner:
+                                other.cancel_token.cancel("hedge_lost")
+                                get_breaker(other.provider).release_probe()
+                    yield payload
+                elif kind == "error":
+                    if isinstance(payload, GenerationCancelled):
+                        continue
+                    breaker.record_failure(payload)
+                    if winner is not None:
+                        raise payload
+                    last_error = payload
+                    logger.warning(f"LLM 提供商 {attempt.provider} 调用失败: {payload}")
+                    # 出错后立即尝试下一个提供商，并重新计算对冲期限
+                    if launch("error"):
+                        hedge_at = time.monotonic() + deadline_seconds
+                elif kind == "end":
+                    running -= 1
+                    if winner is attempt:
+                        return
+                    if not attempt.failed:
+                        # 没有输出任何内容就正常结束，也算成功
+                        self.provider = attempt.provider
+                        breaker.record_success()
+                        return
+                    if running == 0:
+                        raise last_error or RuntimeError("没有可用的 LLM 提供商")
+        finally:
+            for attempt in attempts:
+                attempt.cancel_token.cancel("closed")
+
+
+# 带故障转移的流式调用（函数形式）
+def failover_stream(settings: dict, make_stream: Callable[[dict], Iterator], **kwargs) -> FailoverStream:
+    """创建 FailoverStream，参数同 FailoverStream"""
+    return FailoverStream(settings, make_stream, **kwargs)
@@ -0,0 +1,342 @@
+"""
+LLM 限流工具
+按提供商限制并发的流式调用数和每分钟 token 用量，超出时排队等待而不是直接失败：
+    - 公平排队：等待的请求按用户分组轮转放行，单个用户的突发请求不会占满整个队列
+    - token 配额：放行时按 提示词 + max_tokens 预占配额，结束后按实际输出归还差额
+    - 429 退避：输出第一个内容块之前收到限流响应时，按 Retry-After（或指数退避）暂停该提供商并重试
+
+排队期间 SSE 输出器会持续发送心跳帧，客户端连接不会因等待而超时
+
+使用示例:
+    stream = limited_stream(
+        provider, lambda: chain.stream(inputs), user_id=user_id,
+        prompt_tokens=1200, max_tokens=1000, cancel_token=cancel_token,
+    )
+    for chunk in stream:
+        ...
+"""
+
+# 导入随机数模块，用于退避抖动
+import random
+
+# 导入线程模块
+import threading
+
+# 导入时间模块
+import time
+
+# 导入日志模块
+import logging
+
+# 导入有序字典和双端队列
+from collections import OrderedDict, deque
+
+# 导入类型注解
+from typing import Callable, Dict, Iterator, Optional
+
+# 导入配置
+from app.config import Config
+
+# 导入取消令牌
+from app.utils.cancellation import CancelToken, GenerationCancelled
+
+# 导入 token 估算工具
+from app.utils.history import estimate_tokens
+
+# 导入限流指标
+from app.utils.metrics import (
+    LLM_IN_FLIGHT,
+    LLM_LIMITER_EVENTS,
+    LLM_QUEUE_DEPTH,
+    LLM_QUEUE_WAIT_SECONDS,
+)
+
+# 获取当前模块的日志记录器
+logger = logging.getLogger(__name__)
+
+# 排队时重新检查配额和取消状态的间隔（秒）
+_POLL_INTERVAL = 0.25
+# 单次退避的最长时间（秒）
+_MAX_BACKOFF = 30.0
+
+
+# 排队超时
+class LLMQueueTimeout(Exception):
+    """等待 LLM 限流许可超时"""
+
+
+# 判断是否为限流错误
+def is_rate_limit_error(error: BaseException) -> bool:
+    """判断异常是否为服务商返回的 429 限流错误"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or type(error).__name__ == "RateLimitError"
+
+
+# 读取 Retry-After
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """从限流错误的响应头读取建议的重试等待时间（秒），没有时返回 None"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+# 排队中的请求
+class _Waiter:
+    def __init__(self, user_id: str, tokens: int):
+        self.user_id = user_id
+        self.tokens = tokens
+        self.event = threading.Event()
+        self.granted = False
+
+
+# 单个提供商的限流器
+class ProviderLimiter:
+    """单个提供商的并发与 token 配额限流器"""
+
+    def __init__(self, provider: str, max_concurrency: int, tokens_per_minute: int = 0):
+        """
+        Args:
+            provider: 提供商名称
+            max_concurrency: 最大并发调用数
+            tokens_per_minute: 每分钟 token 配额，0 表示不限制
+        """
+        self.provider = provider
+        self.max_concurrency = max(1, max_concurrency)
+        self.tokens_per_minute = max(0, tokens_per_minute)
+        self._lock = threading.Lock()
+        # 按用户分组的等待队列，字典顺序即轮转顺序
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._in_flight = 0
+        # token 桶：容量为一分钟的配额，按时间连续补充
+        self._tokens = float(self.tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        # 收到 429 后暂停放行直到该时间
+        self._paused_until = 0.0
+
+    # 当前排队数量
+    @property
+    def queue_depth(self) -> int:
+        """等待许可的请求数"""
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    # 补充 token 桶
+    def _refill(self, now: float):
+        if not self.tokens_per_minute:
+            return
+        self._tokens = min(
+            float(self.tokens_per_minute),
+            self._tokens + (now - self._refilled_at) * self.tokens_per_minute / 60,
+        )
+        self._refilled_at = now
+
+    # 按轮转顺序放行（需持有锁）
+    def _dispatch(self):
+        now = time.monotonic()
+        self._refill(now)
+        while self._queues and self._in_flight < self.max_concurrency:
+            if now < self._paused_until:
+                return
+            user_id, waiters = next(iter(self._queues.items()))
+            waiter = waiters[0]
+            # 单个请求的预占量超过整桶时按整桶计算，避免永远无法放行
+            need = min(waiter.tokens, self.tokens_per_minute)
+            if self.tokens_per_minute and self._tokens < need:
+                return
+            waiters.popleft()
+            # 该用户移到队尾，下一次放行其他用户
+            del self._queues[user_id]
+            if waiters:
+                self._queues[user_id] = waiters
+            self._in_flight += 1
+            if self.tokens_per_minute:
+                self._tokens -= need
+            waiter.granted = True
+            waiter.event.set()
+            LLM_QUEUE_DEPTH.labels(provider=self.provider).dec()
+            LLM_IN_FLIGHT.labels(provider=self.provider).inc()
+
+    # 申请许可
+    def acquire(
+        self,
+        user_id: Optional[str] = None,
+        tokens: int = 0,
+        cancel_token: Optional[CancelToken] = None,
+        timeout: Optional[float] = None,
+    ) -> int:
+        """
+        排队等待一个调用许可
+        Args:
+            user_id: 用户ID，用于公平排队
+            tokens: 预占的 token 数（提示词 + max_tokens）
+            cancel_token: 取消令牌（可选），排队期间被取消时抛出 GenerationCancelled
+            timeout: 最长等待时间（秒），默认读取 LLM_QUEUE_TIMEOUT_SECONDS
+
+        Returns:
+            实际预占的 token 数，调用结束后传给 release
+        """
+        waiter = _Waiter(user_id or "-", max(0, int(tokens)))
+        start = time.monotonic()
+        deadline = start + (Config.LLM_QUEUE_TIMEOUT_SECONDS if timeout is None else timeout)
+        with self._lock:
+            self._queues.setdefault(waiter.user_id, deque()).append(waiter)
+            LLM_QUEUE_DEPTH.labels(provider=self.provider).inc()
+            self._dispatch()
+        while not waiter.event.wait(_POLL_INTERVAL):
+            error = None
+            if cancel_token is not None and cancel_token.cancelled:
+                error = GenerationCancelled(cancel_token.reason)
+            elif time.monotonic() >= deadline:
+                LLM_LIMITER_EVENTS.labels(provider=self.provider, event="timeout").inc()
+                error = LLMQueueTimeout(f"LLM 服务繁忙（{self.provider}），请稍后重试")
+            with self._lock:
+                if waiter.granted:
+                    break
+                if error is not None:
+                    self._remove(waiter)
+                    raise error
+                # 配额随时间补充、暂停到期后需要重新尝试放行
+                self._dispatch()
+        LLM_QUEUE_WAIT_SECONDS.labels(provider=self.provider).observe(time.monotonic() - start)
+        return min(waiter.tokens, self.tokens_per_minute) if self.tokens_per_minute else 0
+
+    # 从队列中移除等待者（需持有锁）
+    def _remove(self, waiter: _Waiter):
+        waiters = self._queues.get(waiter.user_id)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            return
+        if not waiters:
+            del self._queues[waiter.user_id]
+        LLM_QUEUE_DEPTH.labels(provider=self.provider).dec()
+
+    # 归还许可
+    def release(self, reserved: int = 0, used: int = 0):
+        """
+        调用结束后归还许可，并按实际用量修正 token 桶
+        Args:
+            reserved: acquire 返回的预占 token 数
+            used: 实际使用的 token 数（提示词 + 输出的估算值）
+        """
+        with self._lock:
+            self._in_flight -= 1
+            LLM_IN_FLIGHT.labels(provider=self.provider).dec()
+            if self.tokens_per_minute:
+                self._refill(time.monotonic())
+                self._tokens = min(
+                    float(self.tokens_per_minute), self._tokens + reserved - used
+                )
+            self._dispatch()
+
+    # 收到限流响应
+    def on_rate_limited(self, delay: float):
+        """暂停放行新的调用 delay 秒，让服务商配额恢复"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        LLM_LIMITER_EVENTS.labels(provider=self.provider, event="rate_limited").inc()
+
+
+# 各提供商的限流器
+_limiters: Dict[str, ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+# 获取提供商的限流器
+def get_limiter(provider: str) -> ProviderLimiter:
+    """获取（或按配置创建）提供商的限流器"""
+    provider = (provider or "default").lower()
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(provider)
+            if limiter is None:
+                concurrency, tokens_per_minute = Config.LLM_LIMITS.get(
+                    provider, (Config.LLM_MAX_CONCURRENCY, Config.LLM_TOKENS_PER_MINUTE)
+                )
+                limiter = ProviderLimiter(provider, concurrency, tokens_per_minute)
+                _limiters[provider] = limiter
+    return limiter
+
+
+# 可被取消的等待
+def _sleep(seconds: float, cancel_token: Optional[CancelToken]):
+    deadline = time.monotonic() + seconds
+    while True:
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(_POLL_INTERVAL, remaining))
+
+
+# 限流的流式调用
+def limited_stream(
+    provider: str,
+    start_stream: Callable[[], Iterator],
+    user_id: Optional[str] = None,
+    prompt_tokens: int = 0,
+    max_tokens: int = 0,
+    cancel_token: Optional[CancelToken] = None,
+) -> Iterator:
+    """
+    在提供商限流许可内执行流式调用，输出第一个内容块之前遇到 429 时退避重试
+    Args:
+        provider: 提供商名称
+        start_stream: 发起流式调用的函数，如 lambda: chain.stream(inputs)
+        user_id: 用户ID，用于公平排队
+        prompt_tokens: 提示词 token 估算值
+        max_tokens: 最大输出 token 数
+        cancel_token: 取消令牌（可选）
+
+    Returns:
+        流式数据块迭代器
+    """
+    limiter = get_limiter(provider)
+    reserved = limiter.acquire(user_id, prompt_tokens + max_tokens, cancel_token)
+    output_tokens = 0
+    try:
+        attempt = 0
+        while True:
+            stream = start_stream()
+            started = False
+            try:
+                for chunk in stream:
+                    started = True
+                    output_tokens += estimate_tokens(getattr(chunk, "content", None) or "")
+                    yield chunk
+                return
+            except Exception as e:
+                # 已经输出内容后不能重试（会重复输出），非限流错误直接抛出
+                if started or not is_rate_limit_error(e) or attempt >= Config.LLM_RATE_LIMIT_RETRIES:
+                    raise
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = Config.LLM_RATE_LIMIT_BACKOFF_SECONDS * (2**attempt)
+                delay = min(_MAX_BACKOFF, delay) * random.uniform(1.0, 1.2)
+                limiter.on_rate_limited(delay)
+                logger.warning(
+                    f"LLM 提供商 {provider} 返回限流（第 {attempt + 1} 次），{delay:.1f}s 后重试"
+                )
+                _sleep(delay, cancel_token)
+                LLM_LIMITER_EVENTS.labels(provider=limiter.provider, event="retried").inc()
+                attempt += 1
+            finally:
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    close()
+    finally:
+        limiter.release(reserved, prompt_tokens + output_tokens)
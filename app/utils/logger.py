@@ -20,6 +20,9 @@ from pathlib import Path
 # 导入用用配置类
 from app.config import Config
 
+# 导入 trace_id 日志过滤器
+from app.utils.tracing import TraceIdFilter
+
 
 # 日志管理器类
 class LoggerManager:
@@ -27,7 +30,7 @@ class LoggerManager:
 
     # 日志格式字符串
     FORMAT_STRING = (
-        "%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s"
+        "%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] - %(filename)s:%(lineno)d - %(message)s"
     )
     # 最大日志文件大小(10MB)
     MAX_BYTES = 10 * 1024 * 1024
@@ -58,6 +61,8 @@ class LoggerManager:
         root_logger.setLevel(self.level)
         # 创建日志格式器
         formatter = logging.Formatter(self.FORMAT_STRING)
+        # 创建 trace_id 过滤器，为每条日志注入当前请求的 trace_id
+        trace_filter = TraceIdFilter()
         # 如果启用控制台日志，则创建并添加控制台日志处理器
         if self.enable_console:
             # 创建控制台日志处理器
@@ -66,6 +71,8 @@ class LoggerManager:
             console_handler.setLevel(self.level)
             # 设置日志格式
             console_handler.setFormatter(formatter)
+            # 注入 trace_id
+            console_handler.addFilter(trace_filter)
             # 添加控制台日志处理器到根日志记录器
             root_logger.addHandler(console_handler)
         # 如果启用文件日志，则创建文件日志处理器，支持轮转
@@ -87,6 +94,8 @@ class LoggerManager:
             file_handler.setLevel(self.level)
             # 设置日志格式
             file_handler.setFormatter(formatter)
+            # 注入 trace_id
+            file_handler.addFilter(trace_filter)
             # 添加文件日志处理器到根日志记录器
             root_logger.addHandler(file_handler)
         # 捕获 warnings 模块的警告作为日志
@@ -0,0 +1,329 @@
+"""
+指标工具模块
+基于 prometheus_client 定义计数器、直方图和仪表盘，并提供计时辅助方法
+
+多进程部署（gunicorn）时需要设置环境变量 PROMETHEUS_MULTIPROC_DIR 指向一个
+每次启动前清空的目录，各 worker 的指标写入该目录，由 /metrics 接口聚合输出
+"""
+
+# 导入时间模块
+import time
+
+# 导入上下文管理器装饰器
+from contextlib import contextmanager
+
+# 导入装饰器工具
+from functools import wraps
+
+# 导入类型注解
+from typing import Tuple
+
+# 导入 prometheus_client 的指标类型与输出工具
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# 导入配置
+from app.config import Config
+
+# 低延迟操作（向量检索、数据库、存储）使用的直方图分桶（秒）
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# LLM 相关操作使用的直方图分桶（秒）
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 21, 34, 60)
+# 生成速度使用的直方图分桶（tokens/s）
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300)
+
+# LLM 实例创建耗时
+LLM_CREATE_SECONDS = Histogram(
+    "rag_llm_create_seconds",
+    "LLMFactory.create_llm 创建 LLM 实例的耗时",
+    ["provider"],
+    buckets=FAST_BUCKETS,
+)
+# LLM 首字延迟
+LLM_TTFT_SECONDS = Histogram(
+    "rag_llm_time_to_first_token_seconds",
+    "从发起流式调用到收到第一个内容块的耗时",
+    ["provider", "endpoint"],
+    buckets=SLOW_BUCKETS,
+)
+# LLM 生成速度
+LLM_TOKENS_PER_SECOND = Histogram(
+    "rag_llm_tokens_per_second",
+    "首个内容块之后的生成速度（以流式内容块近似 token）",
+    ["provider", "endpoint"],
+    buckets=RATE_BUCKETS,
+)
+# LLM 输出内容块总数
+LLM_OUTPUT_TOKENS = Counter(
+    "rag_llm_output_tokens_total",
+    "LLM 输出的流式内容块总数",
+    ["provider", "endpoint"],
+)
+# LLM 流式调用失败次数
+LLM_ERRORS = Counter(
+    "rag_llm_errors_total", "LLM 流式调用失败次数", ["provider", "endpoint"]
+)
+# 等待 LLM 限流许可的请求数（多进程下对存活进程求和）
+LLM_QUEUE_DEPTH = Gauge(
+    "rag_llm_queue_depth",
+    "等待 LLM 并发/配额许可的请求数",
+    ["provider"],
+    multiprocess_mode="livesum",
+)
+# 正在进行的 LLM 流式调用数
+LLM_IN_FLIGHT = Gauge(
+    "rag_llm_in_flight",
+    "已获得许可、正在进行的 LLM 流式调用数",
+    ["provider"],
+    multiprocess_mode="livesum",
+)
+# 等待 LLM 限流许可的耗时
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    "rag_llm_queue_wait_seconds",
+    "从排队到获得 LLM 限流许可的耗时",
+    ["provider"],
+    buckets=FAST_BUCKETS,
+)
+# LLM 限流结果计数
+LLM_LIMITER_EVENTS = Counter(
+    "rag_llm_limiter_events_total",
+    "LLM 限流事件（rate_limited 为收到 429，retried 为退避后重试，timeout 为排队超时）",
+    ["provider", "event"],
+)
+# LLM 提供商熔断状态
+LLM_CIRCUIT_STATE = Gauge(
+    "rag_llm_circuit_state",
+    "LLM 提供商熔断状态（0 正常，1 半开探测，2 熔断）",
+    ["provider"],
+    multiprocess_mode="max",
+)
+# LLM 故障转移次数
+LLM_FAILOVERS = Counter(
+    "rag_llm_failovers_total",
+    "切换到下一个提供商的次数（error 为出错转移，hedge 为首字超时发起对冲）",
+    ["provider", "reason"],
+)
+# Embedding 调用耗时
+EMBEDDING_SECONDS = Histogram(
+    "rag_embedding_seconds",
+    "Embedding 调用耗时",
+    ["provider", "operation"],
+    buckets=FAST_BUCKETS,
+)
+# Embedding 文本数
+EMBEDDING_TEXTS = Counter(
+    "rag_embedding_texts_total", "Embedding 处理的文本数", ["provider", "operation"]
+)
+# 远程 Embedding 单批请求耗时
+EMBEDDING_BATCH_SECONDS = Histogram(
+    "rag_embedding_batch_seconds",
+    "远程 Embedding 单批请求耗时（含重试）",
+    ["provider"],
+    buckets=FAST_BUCKETS,
+)
+# 远程 Embedding 当前批大小
+EMBEDDING_BATCH_SIZE = Gauge(
+    "rag_embedding_batch_size",
+    "远程 Embedding 自适应调整后的批大小",
+    ["provider"],
+    multiprocess_mode="max",
+)
+# 远程 Embedding 重试次数
+EMBEDDING_RETRIES = Counter(
+    "rag_embedding_retries_total",
+    "远程 Embedding 请求重试次数（rate_limited 为 429，error 为 5xx 或连接错误）",
+    ["provider", "reason"],
+)
+# 查询向量微批处理的批大小
+EMBEDDING_QUERY_BATCH_SIZE = Histogram(
+    "rag_embedding_query_batch_size",
+    "合并推理的查询向量批大小",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+# 查询在微批队列中的等待时间
+EMBEDDING_QUERY_WAIT_SECONDS = Histogram(
+    "rag_embedding_query_wait_seconds",
+    "查询从入队到所在批次开始推理的等待时间",
+    buckets=FAST_BUCKETS,
+)
+# 向量检索耗时
+VECTOR_SEARCH_SECONDS = Histogram(
+    "rag_vector_search_seconds",
+    "向量数据库 similarity_search* 的耗时",
+    ["backend", "method"],
+    buckets=FAST_BUCKETS,
+)
+# 存储操作耗时
+STORAGE_SECONDS = Histogram(
+    "rag_storage_seconds",
+    "存储上传/下载耗时",
+    ["backend", "operation"],
+    buckets=FAST_BUCKETS,
+)
+# 存储传输字节数
+STORAGE_BYTES = Counter(
+    "rag_storage_bytes_total", "存储上传/下载的字节数", ["backend", "operation"]
+)
+# 数据库会话持有时间
+DB_SESSION_SECONDS = Histogram(
+    "rag_db_session_seconds",
+    "db_session / db_transaction 从打开到关闭的耗时",
+    ["kind"],
+    buckets=FAST_BUCKETS,
+)
+# 正在使用的数据库会话数（多进程下对存活进程求和）
+DB_SESSIONS_IN_USE = Gauge(
+    "rag_db_sessions_in_use",
+    "当前打开的数据库会话数",
+    ["kind"],
+    multiprocess_mode="livesum",
+)
+# 查询改写结果计数
+QUERY_REWRITE_TOTAL = Counter(
+    "rag_query_rewrite_total",
+    "查询改写结果（cache_hit / rewritten / timeout / busy / error / skipped）",
+    ["outcome"],
+)
+# 查询改写耗时（不含缓存命中）
+QUERY_REWRITE_SECONDS = Histogram(
+    "rag_query_rewrite_seconds", "查询改写 LLM 调用耗时", buckets=SLOW_BUCKETS
+)
+# 聊天记录写缓冲每次批量写入的对话轮数
+CHAT_WRITE_BATCH_TURNS = Histogram(
+    "rag_chat_write_batch_turns",
+    "写缓冲每次批量写入的对话轮数",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+# SSE 写出次数
+SSE_WRITES = Counter(
+    "rag_sse_writes_total",
+    "SSE 响应写出的帧数（content 为合并后的内容帧，event 为其他数据块，heartbeat 为心跳）",
+    ["kind"],
+)
+# 文档入库各阶段耗时
+INGESTION_STAGE_SECONDS = Histogram(
+    "rag_ingestion_stage_seconds",
+    "_process_document 各阶段耗时",
+    ["stage"],
+    buckets=SLOW_BUCKETS,
+)
+# 文档入库结果计数
+INGESTION_DOCUMENTS = Counter(
+    "rag_ingestion_documents_total", "处理完成的文档数", ["status"]
+)
+
+
+# 计时上下文管理器
+@contextmanager
+def observe(histogram: Histogram, **labels):
+    """
+    记录代码块耗时到直方图
+    使用示例:
+        with observe(STORAGE_SECONDS, backend="local", operation="upload"):
+            ...
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+
+# 计时装饰器
+def timed(histogram: Histogram, **labels):
+    """记录函数耗时到直方图的装饰器"""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with observe(histogram, **labels):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# LLM 流式输出计量器
+class StreamMeter:
+    """记录一次 LLM 流式调用的首字延迟和生成速度"""
+
+    def __init__(self, provider: str, endpoint: str):
+        """
+        Args:
+            provider: LLM 提供商
+            endpoint: 调用入口（chat / rag 等）
+        """
+        self.labels = {"provider": provider or "unknown", "endpoint": endpoint}
+        # 发起调用的时间
+        self.start = time.perf_counter()
+        # 收到第一个内容块的时间
+        self.first_token_at = None
+        # 内容块计数
+        self.tokens = 0
+
+    # 每收到一个内容块调用一次
+    def on_token(self, provider: str = None):
+        """记录一个内容块，provider 为实际提供回答的提供商（发生故障转移时与初始值不同）"""
+        if self.first_token_at is None:
+            if provider:
+                self.labels["provider"] = provider
+            self.first_token_at = time.perf_counter()
+            LLM_TTFT_SECONDS.labels(**self.labels).observe(
+                self.first_token_at - self.start
+            )
+        self.tokens += 1
+
+    # 首字延迟（毫秒），尚未收到内容时为 None
+    @property
+    def ttft_ms(self):
+        """首字延迟（毫秒）"""
+        if self.first_token_at is None:
+            return None
+        return round((self.first_token_at - self.start) * 1000, 3)
+
+    # 调用结束时调用
+    def finish(self, error: bool = False):
+        """记录生成速度与总内容块数"""
+        if error:
+            LLM_ERRORS.labels(**self.labels).inc()
+        if self.tokens:
+            LLM_OUTPUT_TOKENS.labels(**self.labels).inc(self.tokens)
+        if self.first_token_at is not None and self.tokens > 1:
+            elapsed = time.perf_counter() - self.first_token_at
+            if elapsed > 0:
+                LLM_TOKENS_PER_SECOND.labels(**self.labels).observe(
+                    (self.tokens - 1) / elapsed
+                )
+
+
+# 输出 Prometheus 文本格式的指标
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    生成 Prometheus 文本格式的指标
+    多进程模式下聚合 PROMETHEUS_MULTIPROC_DIR 中所有进程的指标
+
+    Returns:
+        (指标文本, Content-Type)
+    """
+    if Config.PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+# 多进程模式下清理已退出 worker 的指标文件
+def mark_process_dead(pid: int):
+    """在 gunicorn 的 child_exit 钩子中调用，清理已退出 worker 的 livesum 仪表盘数据"""
+    if Config.PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid, Config.PROMETHEUS_MULTIPROC_DIR)
@@ -85,6 +85,34 @@ EMBEDDING_MODELS = {
         ],
         'requires_api_key': False,
         'requires_base_url': True
+    },
+    # 本地 ONNX Runtime 嵌入模型（需先导出到 EMBEDDING_ONNX_MODEL_DIR）
+    'onnx': {
+        'name': 'ONNX Runtime Embeddings',
+        'description': 'CPU 上运行导出/量化的 HuggingFace 模型，向量与同名 HuggingFace 模型兼容',
+        # 可用模型（与 HuggingFace 模型同名）
+        'models': [
+            {
+                'name': 'sentence-transformers/all-MiniLM-L6-v2',
+                'path': 'sentence-transformers/all-MiniLM-L6-v2',
+                'dimension': '384',
+                'description': '轻量级多语言模型，速度快'
+            },
+            {
+                'name': 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2',
+                'path': 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2',
+                'dimension': '384',
+                'description': '多语言模型，支持中文'
+            },
+            {
+                'name': 'BAAI/bge-small-zh-v1.5',
+                'path': 'BAAI/bge-small-zh-v1.5',
+                'dimension': '512',
+                'description': '中文优化模型'
+            }
+        ],
+        'requires_api_key': False,
+        'requires_base_url': False
     }
 }
 
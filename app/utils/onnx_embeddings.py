@@ -0,0 +1,285 @@
+"""
+ONNX Runtime Embeddings
+在只有 CPU 的节点上用 ONNX Runtime 运行导出（可 int8 量化）的 sentence-transformers 模型，代替 PyTorch 推理：
+    - 线程数：EMBEDDING_ONNX_THREADS 控制单次推理使用的线程数
+    - 动态批处理：文本按分词长度排序后分批，每批只填充到批内最长的长度，减少无效计算
+    - 兼容性：池化方式（mean / cls）、最大长度和归一化与 sentence-transformers 配置一致，
+      生成的向量可以直接与 HuggingFace 提供商写入的集合混用
+
+模型目录结构（export_model 生成）:
+    model.onnx             导出的模型
+    model_quantized.onnx   int8 动态量化后的模型（可选）
+    tokenizer.json         分词器
+    1_Pooling/config.json  池化配置（可选，缺省为 mean）
+    sentence_bert_config.json  最大长度（可选）
+
+依赖 onnxruntime 和 tokenizers（可选依赖 onnx）；导出模型还需要 optimum-onnx
+
+使用示例:
+    export_model("sentence-transformers/all-MiniLM-L6-v2", "models/onnx/sentence-transformers/all-MiniLM-L6-v2")
+    embeddings = OnnxEmbeddings("models/onnx/sentence-transformers/all-MiniLM-L6-v2")
+    report = parity_check(embeddings, HuggingFaceEmbeddings(...))
+"""
+
+# 导入 JSON 模块
+import json
+
+# 导入操作系统模块
+import os
+
+# 导入日志模块
+import logging
+
+# 导入类型注解
+from typing import List, Optional
+
+# 导入 numpy
+import numpy as np
+
+# 导入 Embeddings 基类
+from langchain_core.embeddings import Embeddings
+
+# 导入配置
+from app.config import Config
+
+# 可选：ONNX Runtime 与 tokenizers
+try:
+    import onnxruntime as ort
+    from tokenizers import Tokenizer
+except ImportError:  # pragma: no cover - 取决于部署环境
+    ort = None
+    Tokenizer = None
+
+# 获取当前模块的日志记录器
+logger = logging.getLogger(__name__)
+
+# 量化模型与原始模型的文件名
+QUANTIZED_FILE = "model_quantized.onnx"
+MODEL_FILE = "model.onnx"
+
+# 一致性检查使用的样例文本（中英文、长短不一）
+PARITY_TEXTS = [
+    "什么是检索增强生成？",
+    "知识库中的文档会被切分为多个分块，并分别计算向量。",
+    "How do I reset my password if I no longer have access to my email?",
+    "The quarterly capacity review is based on the previous peak traffic and "
+    "covers storage, compute and network budgets for every production service.",
+    "向量数据库支持按元数据过滤，并返回相似度最高的若干个分块。",
+    "ok",
+]
+
+
+# 解析模型目录
+def resolve_model_dir(model_name: str) -> str:
+    """
+    根据设置中的模型名称定位 ONNX 模型目录
+    Args:
+        model_name: 模型名称（如 sentence-transformers/all-MiniLM-L6-v2）或本地目录
+
+    Returns:
+        模型目录：model_name 本身是目录时直接使用，否则为 EMBEDDING_ONNX_MODEL_DIR/<model_name>
+    """
+    if model_name and os.path.isdir(model_name):
+        return model_name
+    return os.path.join(Config.EMBEDDING_ONNX_MODEL_DIR, model_name or "")
+
+
+# 读取 sentence-transformers 的池化与长度配置
+def _read_model_config(model_dir: str) -> dict:
+    config = {"pooling": Config.EMBEDDING_ONNX_POOLING, "max_length": Config.EMBEDDING_ONNX_MAX_LENGTH}
+    pooling_path = os.path.join(model_dir, "1_Pooling", "config.json")
+    if os.path.exists(pooling_path):
+        with open(pooling_path, encoding="utf-8") as f:
+            pooling = json.load(f)
+        if pooling.get("pooling_mode_cls_token"):
+            config["pooling"] = "cls"
+        elif pooling.get("pooling_mode_mean_tokens"):
+            config["pooling"] = "mean"
+    bert_config_path = os.path.join(model_dir, "sentence_bert_config.json")
+    if os.path.exists(bert_config_path):
+        with open(bert_config_path, encoding="utf-8") as f:
+            max_length = json.load(f).get("max_seq_length")
+        if max_length:
+            config["max_length"] = int(max_length)
+    return config
+
+
+# ONNX Runtime Embeddings
+class OnnxEmbeddings(Embeddings):
+    """用 ONNX Runtime 在 CPU 上运行 sentence-transformers 模型"""
+
+    def __init__(
+        self,
+        model_dir: str,
+        threads: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        quantized: Optional[bool] = None,
+    ):
+        """
+        Args:
+            model_dir: 模型目录
+            threads: 推理线程数，0 表示由 ONNX Runtime 决定，默认读取 EMBEDDING_ONNX_THREADS
+            batch_size: 每批文本数，默认读取 EMBEDDING_ONNX_BATCH_SIZE
+            quantized: 是否优先使用 int8 量化模型，默认读取 EMBEDDING_ONNX_QUANTIZED
+        """
+        if ort is None or Tokenizer is None:
+            raise ImportError("ONNX Embeddings 需要安装 onnxruntime 和 tokenizers（pip install rag-lite[onnx]）")
+        quantized = Config.EMBEDDING_ONNX_QUANTIZED if quantized is None else quantized
+        model_path = os.path.join(model_dir, QUANTIZED_FILE if quantized else MODEL_FILE)
+        if quantized and not os.path.exists(model_path):
+            logger.warning(f"未找到量化模型 {model_path}，使用未量化模型")
+            model_path = os.path.join(model_dir, MODEL_FILE)
+        if not os.path.exists(model_path):
+            raise ValueError(f"ONNX 模型不存在: {model_path}，请先导出模型")
+        self.model_dir = model_dir
+        self.model_path = model_path
+        self.batch_size = max(1, batch_size or Config.EMBEDDING_ONNX_BATCH_SIZE)
+        model_config = _read_model_config(model_dir)
+        self.pooling = model_config["pooling"]
+        self.max_length = model_config["max_length"]
+
+        # 创建推理会话：单个请求内并行，多个请求之间由调用方并发
+        options = ort.SessionOptions()
+        threads = Config.EMBEDDING_ONNX_THREADS if threads is None else threads
+        if threads:
+            options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        # 分词器：截断到模型最大长度，按批内最长文本动态填充
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_length)
+        padding = self.tokenizer.padding or {}
+        pad_token = padding.get("pad_token", "[PAD]")
+        pad_id = padding.get("pad_id", self.tokenizer.token_to_id(pad_token) or 0)
+        self.tokenizer.enable_padding(pad_id=pad_id, pad_token=pad_token)
+        logger.info(
+            f"加载 ONNX Embeddings: {model_path}, 池化: {self.pooling}, "
+            f"最大长度: {self.max_length}, 线程数: {threads or 'auto'}"
+        )
+
+    # 推理一批文本
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """分词、推理、池化并 L2 归一化一批文本"""
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        output = self.session.run(None, feeds)[0]
+        # 导出时已包含池化层的模型直接输出句向量
+        if output.ndim == 2:
+            vectors = output
+        elif self.pooling == "cls":
+            vectors = output[:, 0]
+        else:
+            mask = attention_mask[..., None].astype(output.dtype)
+            vectors = (output * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.clip(norms, 1e-12, None)
+
+    # 批量向量化文档
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """按长度排序后分批推理，返回顺序与输入一致"""
+        texts = [t.replace("\n", " ") for t in texts]
+        if not texts:
+            return []
+        # 按字符长度排序近似按分词长度排序，相近长度的文本在同一批，填充最少
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            indexes = order[start : start + self.batch_size]
+            vectors = self._embed_batch([texts[i] for i in indexes])
+            for i, vector in zip(indexes, vectors):
+                results[i] = vector.tolist()
+        return results
+
+    # 向量化查询
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([text.replace("\n", " ")])[0].tolist()
+
+
+# 与参考模型比较
+def parity_check(
+    embeddings: Embeddings, reference: Embeddings, texts: Optional[List[str]] = None
+) -> dict:
+    """
+    比较两个 Embeddings 对同一批文本生成的向量
+    Args:
+        embeddings: 待检查的 Embeddings（如 OnnxEmbeddings）
+        reference: 参考 Embeddings（如同一模型的 HuggingFaceEmbeddings）
+        texts: 样例文本，默认使用 PARITY_TEXTS
+
+    Returns:
+        {"texts", "dimension", "min_cosine", "mean_cosine"}
+    """
+    texts = texts or PARITY_TEXTS
+    actual = np.array(embeddings.embed_documents(texts), dtype=np.float64)
+    expected = np.array(reference.embed_documents(texts), dtype=np.float64)
+    if actual.shape != expected.shape:
+        raise ValueError(f"向量维度不一致: {actual.shape} != {expected.shape}")
+    cosine = (actual * expected).sum(axis=1) / (
+        np.linalg.norm(actual, axis=1) * np.linalg.norm(expected, axis=1)
+    )
+    return {
+        "texts": len(texts),
+        "dimension": int(actual.shape[1]),
+        "min_cosine": round(float(cosine.min()), 6),
+        "mean_cosine": round(float(cosine.mean()), 6),
+    }
+
+
+# 导出模型
+def export_model(model_name: str, output_dir: Optional[str] = None, quantize: bool = True) -> str:
+    """
+    将 HuggingFace 上的 sentence-transformers 模型导出为 ONNX，并可选生成 int8 动态量化模型
+    Args:
+        model_name: 模型名称或本地路径
+        output_dir: 输出目录，默认为 resolve_model_dir(model_name)
+        quantize: 是否生成 model_quantized.onnx
+
+    Returns:
+        输出目录
+    """
+    # 导出依赖 optimum 和 PyTorch，只在导出时需要
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoTokenizer
+
+    output_dir = output_dir or resolve_model_dir(model_name)
+    os.makedirs(output_dir, exist_ok=True)
+    ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(output_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(output_dir)
+    # 复制 sentence-transformers 的池化和长度配置，保证与 PyTorch 模型输出一致
+    for filename in ("1_Pooling/config.json", "sentence_bert_config.json"):
+        try:
+            if os.path.isdir(model_name):
+                source = os.path.join(model_name, filename)
+            else:
+                from huggingface_hub import hf_hub_download
+
+                source = hf_hub_download(model_name, filename)
+            target = os.path.join(output_dir, filename)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(source, "rb") as src, open(target, "wb") as dst:
+                dst.write(src.read())
+        except Exception as e:
+            logger.warning(f"未能复制 {filename}，将使用默认配置: {e}")
+    if quantize:
+        quantize_model(output_dir)
+    logger.info(f"ONNX 模型已导出: {output_dir}")
+    return output_dir
+
+
+# 量化模型
+def quantize_model(model_dir: str) -> str:
+    """对 model.onnx 做 int8 动态量化，生成 model_quantized.onnx，返回量化模型路径"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    target = os.path.join(model_dir, QUANTIZED_FILE)
+    quantize_dynamic(os.path.join(model_dir, MODEL_FILE), target, weight_type=QuantType.QInt8)
+    return target
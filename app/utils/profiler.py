@@ -0,0 +1,376 @@
+"""
+采样分析器
+在后台线程中按固定间隔采集 Python 线程栈（sys._current_frames），
+汇总为 collapsed stack 格式，并生成 SVG 火焰图，输出到 LOG_DIR
+
+两种采样范围：
+    - 时间窗口：采样进程内所有线程，持续指定秒数
+    - 路由：只采样正在处理匹配路由请求的线程，完成指定数量的请求后停止；
+      请求交给线程池或后台线程执行的工作（文档解析、SSE 生成等）用 profiled() 包装后一并采样
+
+注意：分析器按进程工作，gunicorn 多 worker 部署时通过管理接口开启只影响处理该请求的 worker，
+通过环境变量 PROFILER_* 开启则每个 worker 各自采样并输出文件（文件名包含进程号）
+"""
+
+# 导入操作系统模块
+import os
+
+# 导入系统模块，用于读取线程栈
+import sys
+
+# 导入线程模块
+import threading
+
+# 导入时间模块
+import time
+
+# 导入日志模块
+import logging
+
+# 导入 zlib，用于按名称生成稳定的颜色
+import zlib
+
+# 导入 functools，用于包装后台线程执行的函数
+import functools
+
+# 导入上下文变量，标记属于被采样请求的上下文
+from contextvars import ContextVar
+
+# 导入 HTML 转义工具，用于 SVG 文本
+from html import escape
+
+# 导入Path，用于文件/目录路径处理
+from pathlib import Path
+
+# 导入类型注解
+from typing import Dict, List, Optional
+
+# 导入配置
+from app.config import Config
+
+# 获取当前模块的日志记录器
+logger = logging.getLogger(__name__)
+
+# 当前上下文所属的采样会话：匹配路由的请求开始时设置，
+# 线程池和后台线程通过 contextvars.copy_context() 继承，据此判断工作线程是否需要采样
+_profiled_session: ContextVar[Optional[object]] = ContextVar(
+    "profiled_session", default=None
+)
+
+
+# 将栈帧转换为 collapsed stack 的一行（根在前，用分号分隔）
+def _collapse_frame(frame) -> str:
+    """将线程栈转换为 'a (file);b (file)' 形式，不带行号，同一函数的样本合并到一个节点"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+# 生成 SVG 火焰图
+def render_flamegraph(stacks: Dict[str, int], title: str = "Flame Graph", width: int = 1200) -> str:
+    """
+    根据 collapsed stack 计数生成 SVG 火焰图
+    Args:
+        stacks: {collapsed stack: 采样次数}
+        title: 图表标题
+        width: 图像宽度（像素）
+
+    Returns:
+        SVG 文本
+    """
+    # 构造调用树：每个节点为 [计数, {子节点名: 子节点}]
+    root = [0, {}]
+    for stack, count in stacks.items():
+        root[0] += count
+        node = root
+        for name in stack.split(";"):
+            child = node[1].setdefault(name, [0, {}])
+            child[0] += count
+            node = child
+
+    frame_height = 16
+    top_margin = 30
+    total = root[0] or 1
+    rects: List[str] = []
+    max_depth = 0
+
+    # 深度优先遍历，按宽度比例绘制每个节点
+    def walk(node, x: float, depth: int):
+        nonlocal max_depth
+        for name, child in sorted(node[1].items()):
+            w = child[0] / total * width
+            if w >= 0.5:
+                max_depth = max(max_depth, depth)
+                y = top_margin + depth * frame_height
+                # 按名称生成稳定的暖色调
+                hue = 10 + (zlib.crc32(name.encode("utf-8")) % 40)
+                label = escape(name)
+                text = label if w > 7 * len(name) else ""
+                if not text and w > 40:
+                    text = escape(name[: int(w // 7) - 2]) + ".."
+                rects.append(
+                    f'<g><title>{label} ({child[0]} samples, {child[0] / total:.2%})</title>'
+                    f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{frame_height - 1}" '
+                    f'fill="hsl({hue},90%,60%)" rx="2"/>'
+                    f'<text x="{x + 3:.1f}" y="{y + 11}">{text}</text></g>'
+                )
+                walk(child, x, depth + 1)
+            x += w
+
+    walk(root, 0.0, 0)
+    height = top_margin + (max_depth + 1) * frame_height + 10
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="monospace" font-size="11">'
+        f'<rect width="100%" height="100%" fill="#fafafa"/>'
+        f'<text x="{width / 2}" y="18" text-anchor="middle" font-size="14">'
+        f"{escape(title)} ({root[0]} samples)</text>" + "".join(rects) + "</svg>"
+    )
+
+
+# 采样分析器
+class SamplingProfiler:
+    """低开销采样分析器，同一时间只运行一个采样会话"""
+
+    def __init__(self):
+        """初始化分析器"""
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        # 采样结果：{collapsed stack: 次数}
+        self._stacks: Dict[str, int] = {}
+        # 会话参数
+        self._route: Optional[str] = None
+        self._remaining_requests: Optional[int] = None
+        self._deadline: Optional[float] = None
+        self._interval = Config.PROFILER_INTERVAL_MS / 1000
+        self._started_at: Optional[float] = None
+        # 当前采样会话的标记，写入被采样请求的上下文
+        self._session: Optional[object] = None
+        # 正在处理匹配路由请求的线程ID -> 登记次数（请求线程和执行其后台工作的线程）
+        self._active_threads: Dict[int, int] = {}
+        self._threads_lock = threading.Lock()
+        # 最近一次会话的输出文件
+        self.last_output: Optional[dict] = None
+
+    # 是否正在采样
+    @property
+    def running(self) -> bool:
+        """是否有正在运行的采样会话"""
+        return self._thread is not None and self._thread.is_alive()
+
+    # 开始采样会话
+    def start(
+        self,
+        duration: Optional[float] = None,
+        route: Optional[str] = None,
+        requests: Optional[int] = None,
+        interval_ms: Optional[float] = None,
+    ) -> dict:
+        """
+        开始采样
+        Args:
+            duration: 采样时间窗口（秒），与 route 同时指定时作为最长采样时间
+            route: 只采样匹配该路由规则的请求，如 /api/v1/knowledgebases/<kb_id>/chat
+            requests: 指定 route 时，完成多少个匹配请求后停止（默认 1）
+            interval_ms: 采样间隔（毫秒），默认读取 PROFILER_INTERVAL_MS
+
+        Returns:
+            会话状态字典
+        """
+        if duration is None and route is None:
+            raise ValueError("必须指定 duration 或 route")
+        if duration is not None and duration <= 0:
+            raise ValueError("duration 必须大于 0")
+        with self._lock:
+            if self.running:
+                raise ValueError("已有正在运行的采样会话")
+            self._stacks = {}
+            self._route = route
+            self._remaining_requests = max(1, int(requests or 1)) if route else None
+            self._deadline = time.monotonic() + duration if duration else None
+            self._interval = max(1.0, interval_ms or Config.PROFILER_INTERVAL_MS) / 1000
+            self._session = object()
+            self._active_threads = {}
+            self._started_at = time.time()
+            self._stop_event.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="sampling-profiler", daemon=True
+            )
+            self._thread.start()
+        logger.info(
+            f"采样分析器已启动: route={route}, requests={self._remaining_requests}, "
+            f"duration={duration}, interval={self._interval * 1000:.0f}ms"
+        )
+        return self.status()
+
+    # 停止采样会话
+    def stop(self) -> Optional[dict]:
+        """停止采样并等待输出文件写入，返回输出文件信息"""
+        thread = self._thread
+        if thread is None:
+            return self.last_output
+        self._stop_event.set()
+        if thread is not threading.current_thread():
+            thread.join()
+        return self.last_output
+
+    # 会话状态
+    def status(self) -> dict:
+        """返回当前会话状态"""
+        return {
+            "running": self.running,
+            "route": self._route,
+            "remaining_requests": self._remaining_requests,
+            "seconds_left": (
+                round(max(0.0, self._deadline - time.monotonic()), 1)
+                if self._deadline and self.running
+                else None
+            ),
+            "interval_ms": round(self._interval * 1000, 1),
+            "samples": sum(dict(self._stacks).values()),
+            "last_output": self.last_output,
+        }
+
+    # 登记当前线程为采样线程
+    def _enter_thread(self, session: object):
+        with self._threads_lock:
+            if session is self._session:
+                ident = threading.get_ident()
+                self._active_threads[ident] = self._active_threads.get(ident, 0) + 1
+
+    # 取消登记当前线程
+    def _leave_thread(self, session: object):
+        with self._threads_lock:
+            if session is not self._session:
+                return
+            ident = threading.get_ident()
+            count = self._active_threads.get(ident, 0) - 1
+            if count > 0:
+                self._active_threads[ident] = count
+            else:
+                self._active_threads.pop(ident, None)
+
+    # 请求开始时调用
+    def on_request_start(self, rule: Optional[str]):
+        """记录正在处理匹配路由请求的线程，并在请求上下文中写入采样标记"""
+        # 线程复用时清除上一个请求留下的标记
+        _profiled_session.set(None)
+        if self._route and rule == self._route and self.running:
+            _profiled_session.set(self._session)
+            self._enter_thread(self._session)
+
+    # 请求结束时调用
+    def on_request_end(self):
+        """请求结束，计数并在达到请求数量后停止"""
+        session = _profiled_session.get()
+        if session is None:
+            return
+        _profiled_session.set(None)
+        if session is not self._session:
+            return
+        self._leave_thread(session)
+        with self._lock:
+            if self._remaining_requests is not None:
+                self._remaining_requests -= 1
+                if self._remaining_requests <= 0:
+                    self._stop_event.set()
+
+    # 采样线程主循环
+    def _run(self):
+        """按间隔采样，结束后写出结果"""
+        own_ident = threading.get_ident()
+        try:
+            while not self._stop_event.wait(self._interval):
+                if self._deadline is not None and time.monotonic() >= self._deadline:
+                    break
+                frames = sys._current_frames()
+                if self._route:
+                    idents = [i for i in list(self._active_threads) if i in frames]
+                else:
+                    idents = [i for i in frames if i != own_ident]
+                for ident in idents:
+                    stack = _collapse_frame(frames[ident])
+                    self._stacks[stack] = self._stacks.get(stack, 0) + 1
+                # 释放对栈帧的引用
+                del frames
+        finally:
+            self._write_output()
+
+    # 写出 collapsed stack 和火焰图
+    def _write_output(self):
+        """将采样结果写入 LOG_DIR"""
+        if not self._stacks:
+            logger.info("采样分析器已停止，没有采集到样本")
+            self.last_output = {"samples": 0, "collapsed": None, "flamegraph": None}
+            return
+        log_dir = Path(Config.LOG_DIR)
+        log_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self._started_at))
+        millis = int(self._started_at * 1000) % 1000
+        base = f"profile-{stamp}.{millis:03d}-{os.getpid()}"
+        collapsed_path = log_dir / f"{base}.collapsed"
+        svg_path = log_dir / f"{base}.svg"
+        # collapsed 格式可直接交给 flamegraph.pl / speedscope 等工具
+        with open(collapsed_path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self._stacks.items()):
+                f.write(f"{stack} {count}\n")
+        title = f"rag-lite pid {os.getpid()} {self._route or 'all threads'}"
+        with open(svg_path, "w", encoding="utf-8") as f:
+            f.write(render_flamegraph(self._stacks, title=title))
+        samples = sum(self._stacks.values())
+        self.last_output = {
+            "samples": samples,
+            "collapsed": str(collapsed_path),
+            "flamegraph": str(svg_path),
+        }
+        logger.info(f"采样分析结果已写入: {collapsed_path}, {svg_path}（{samples} 个样本）")
+
+
+# 模块级别的分析器实例
+profiler = SamplingProfiler()
+
+
+# 包装在线程池或后台线程中执行的函数
+def profiled(fn):
+    """
+    包装交给线程池或后台线程执行的函数（需在复制的上下文中调用，如 context.run(profiled(fn), ...)）：
+    上下文带有当前采样会话的标记时，函数执行期间一并采样所在线程
+    Args:
+        fn: 要执行的函数
+
+    Returns:
+        包装后的函数
+    """
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        session = _profiled_session.get()
+        if session is None or session is not profiler._session:
+            return fn(*args, **kwargs)
+        profiler._enter_thread(session)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler._leave_thread(session)
+
+    return wrapper
+
+
+# 按环境变量配置在启动时开启采样
+def start_from_config():
+    """如果设置了 PROFILER_ROUTE 或 PROFILER_DURATION，则在应用启动时开启采样"""
+    if not (Config.PROFILER_ROUTE or Config.PROFILER_DURATION):
+        return
+    try:
+        profiler.start(
+            duration=Config.PROFILER_DURATION or None,
+            route=Config.PROFILER_ROUTE or None,
+            requests=Config.PROFILER_REQUESTS,
+        )
+    except ValueError as e:
+        logger.warning(f"采样分析器启动失败: {e}")
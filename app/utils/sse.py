@@ -0,0 +1,283 @@
+"""
+SSE 输出工具
+把问答服务产生的数据块编码为 SSE 帧，并在输出前做三项优化：
+    - 合并：相邻的内容块在 SSE_COALESCE_MS / SSE_COALESCE_BYTES 窗口内合并为一帧，减少写次数
+    - 心跳：长时间没有数据（如检索、首字较慢）时发送 SSE 注释帧，避免代理空闲超时
+    - 压缩：客户端支持且未经过代理时可选 gzip，每帧同步刷新，保证流式可见
+
+JSON 编码优先使用 orjson（可选依赖），未安装时回退到标准库 json
+
+使用示例:
+    def events():
+        for chunk in chat_service.chat_stream(...):
+            yield chunk
+        yield DONE
+
+    return sse_response(events())
+"""
+
+# 导入上下文复制工具，用于把当前请求的 trace 带入生产者线程
+import contextvars
+
+# 导入 JSON 模块
+import json
+
+# 导入日志模块
+import logging
+
+# 导入队列模块
+import queue
+
+# 导入线程模块
+import threading
+
+# 导入时间模块
+import time
+
+# 导入 zlib，用于流式 gzip 压缩
+import zlib
+
+# 导入类型注解
+from typing import Iterable, Iterator, Optional, Union
+
+# 导入 Flask 的响应对象和请求对象
+from flask import Response, request, stream_with_context
+
+# 导入配置
+from app.config import Config
+
+# 导入取消令牌
+from app.utils.cancellation import CancelToken
+
+# 导入 SSE 输出指标
+from app.utils.metrics import SSE_WRITES
+
+# 导入采样分析器的包装函数，生产者线程随请求一起采样
+from app.utils.profiler import profiled
+
+# 可选：更快的 JSON 编码器
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 取决于部署环境
+    orjson = None
+
+# 获取当前模块的日志记录器
+logger = logging.getLogger(__name__)
+
+# 流结束标志，作为 data: [DONE] 输出
+DONE = "[DONE]"
+
+# 心跳帧（SSE 注释行，浏览器 EventSource 和前端解析都会忽略）
+HEARTBEAT = b": ping\n\n"
+
+# 生产者线程结束标志
+_END = object()
+
+
+# 生产者线程中的异常，转交给输出线程重新抛出
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+# 编码 JSON
+def dumps(obj) -> str:
+    """将对象编码为 JSON 字符串（保留非 ASCII 字符），优先使用 orjson"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+# 编码一个 SSE 事件
+def encode_event(data: Union[dict, str]) -> bytes:
+    """将数据块（字典）或原始字符串（如 DONE）编码为一个 SSE data 帧"""
+    text = data if isinstance(data, str) else dumps(data)
+    return f"data: {text}\n\n".encode("utf-8")
+
+
+# SSE 输出器
+class SSEWriter:
+    """将数据块迭代器转换为 SSE 字节流，按配置合并内容块、发送心跳"""
+
+    def __init__(
+        self,
+        events: Iterable[Union[dict, str]],
+        coalesce_ms: Optional[float] = None,
+        coalesce_bytes: Optional[int] = None,
+        heartbeat_seconds: Optional[float] = None,
+        cancel_token: Optional[CancelToken] = None,
+    ):
+        """
+        Args:
+            events: 数据块迭代器，元素为字典（JSON 编码）或字符串（原样输出，如 DONE）
+            coalesce_ms: 内容块合并窗口（毫秒），0 表示不合并，默认读取 SSE_COALESCE_MS
+            coalesce_bytes: 合并内容达到该字节数时立即输出，默认读取 SSE_COALESCE_BYTES
+            heartbeat_seconds: 心跳间隔（秒），0 表示不发送，默认读取 SSE_HEARTBEAT_SECONDS
+            cancel_token: 取消令牌（可选），数据块未输出完时响应被关闭（客户端断开）则触发取消
+        """
+        self.events = events
+        self.window = (
+            Config.SSE_COALESCE_MS if coalesce_ms is None else coalesce_ms
+        ) / 1000
+        self.max_bytes = (
+            Config.SSE_COALESCE_BYTES if coalesce_bytes is None else coalesce_bytes
+        )
+        self.heartbeat = (
+            Config.SSE_HEARTBEAT_SECONDS if heartbeat_seconds is None else heartbeat_seconds
+        )
+        self.cancel_token = cancel_token
+        self._stop = threading.Event()
+
+    def __iter__(self) -> Iterator[bytes]:
+        completed = False
+        try:
+            # 不合并也不发心跳时直接逐块编码，不需要额外线程
+            if self.window <= 0 and self.heartbeat <= 0:
+                for event in self.events:
+                    SSE_WRITES.labels(kind="event").inc()
+                    yield encode_event(event)
+            else:
+                yield from self._iter_buffered()
+            completed = True
+        finally:
+            # 响应在数据块输出完之前被关闭，说明客户端已断开，取消上游的检索和生成
+            if not completed and self.cancel_token is not None:
+                self.cancel_token.cancel("disconnect")
+
+    # 生产者线程：从数据块迭代器读取并放入队列
+    def _produce(self, buffer: "queue.Queue"):
+        iterator = iter(self.events)
+        try:
+            for event in iterator:
+                buffer.put(event)
+                # 客户端已断开时停止生成（LLM 调用在下一个数据块后结束）
+                if self._stop.is_set():
+                    break
+        except BaseException as e:
+            buffer.put(_Failure(e))
+        finally:
+            # 在生产者线程中关闭生成器，执行其 finally（如保存对话记录）
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except Exception as e:
+                    logger.warning(f"关闭 SSE 数据源时出错: {e}")
+            buffer.put(_END)
+
+    # 带合并和心跳的输出
+    def _iter_buffered(self) -> Iterator[bytes]:
+        buffer: "queue.Queue" = queue.Queue()
+        # 复制当前上下文，生产者线程中的 span 仍属于本次请求的 trace
+        context = contextvars.copy_context()
+        threading.Thread(
+            target=context.run,
+            args=(profiled(self._produce), buffer),
+            name="sse-producer",
+            daemon=True,
+        ).start()
+        # 待合并的内容文本，以及第一段内容进入缓冲的时间
+        pending = []
+        pending_bytes = 0
+        pending_since = 0.0
+
+        def take_pending() -> bytes:
+            nonlocal pending, pending_bytes
+            frame = encode_event({"type": "content", "content": "".join(pending)})
+            pending, pending_bytes = [], 0
+            return frame
+
+        try:
+            while True:
+                if pending:
+                    timeout = max(0.0, pending_since + self.window - time.monotonic())
+                else:
+                    timeout = self.heartbeat if self.heartbeat > 0 else None
+                try:
+                    item = buffer.get(timeout=timeout)
+                except queue.Empty:
+                    if pending:
+                        SSE_WRITES.labels(kind="content").inc()
+                        yield take_pending()
+                    else:
+                        SSE_WRITES.labels(kind="heartbeat").inc()
+                        yield HEARTBEAT
+                    continue
+                if item is _END:
+                    break
+                if isinstance(item, _Failure):
+                    if pending:
+                        yield take_pending()
+                    raise item.error
+                # 内容块进入合并缓冲
+                if (
+                    self.window > 0
+                    and isinstance(item, dict)
+                    and item.get("type") == "content"
+                ):
+                    text = item.get("content") or ""
+                    if not pending:
+                        pending_since = time.monotonic()
+                    pending.append(text)
+                    pending_bytes += len(text.encode("utf-8"))
+                    if pending_bytes >= self.max_bytes:
+                        SSE_WRITES.labels(kind="content").inc()
+                        yield take_pending()
+                    continue
+                # 其他数据块：先输出缓冲的内容，再与其合并为一次写入
+                frame = take_pending() if pending else b""
+                SSE_WRITES.labels(kind="event").inc()
+                yield frame + encode_event(item)
+            if pending:
+                SSE_WRITES.labels(kind="content").inc()
+                yield take_pending()
+        finally:
+            self._stop.set()
+
+
+# 流式 gzip 压缩
+def gzip_stream(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """对字节流做 gzip 压缩，每个输入块后同步刷新，客户端可以立即解压看到内容"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+# 判断是否对当前请求使用 gzip
+def should_gzip() -> bool:
+    """已启用 SSE_GZIP_ENABLED、客户端接受 gzip 且请求未经过代理时返回 True"""
+    if not Config.SSE_GZIP_ENABLED:
+        return False
+    if "gzip" not in (request.headers.get("Accept-Encoding") or "").lower():
+        return False
+    # 经过反向代理时由代理负责压缩，部分代理会缓冲压缩流导致无法逐帧推送
+    return not (request.headers.get("X-Forwarded-For") or request.headers.get("Via"))
+
+
+# 构造 SSE 响应
+def sse_response(events: Iterable[Union[dict, str]], **writer_options) -> Response:
+    """
+    将数据块迭代器包装为 SSE 响应
+    Args:
+        events: 数据块迭代器
+        **writer_options: 传给 SSEWriter 的参数（coalesce_ms / coalesce_bytes / heartbeat_seconds / cancel_token）
+
+    Returns:
+        Flask Response
+    """
+    headers = {
+        "Cache-Control": "no-cache",
+        "Connection": "keep-alive",
+        "X-Accel-Buffering": "no",
+    }
+    body: Iterable[bytes] = SSEWriter(events, **writer_options)
+    if should_gzip():
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    return Response(
+        stream_with_context(iter(body)),
+        content_type="text/event-stream; charset=utf-8",
+        headers=headers,
+    )
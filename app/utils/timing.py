@@ -0,0 +1,41 @@
+"""
+阶段计时工具
+为处理流程中的各个阶段记录耗时
+"""
+
+# 导入时间模块
+import time
+
+# 导入上下文管理器装饰器
+from contextlib import contextmanager
+
+# 导入类型注解
+from typing import Dict, Optional
+
+# 导入链路追踪工具
+from app.utils.tracing import span
+
+
+# 阶段计时上下文管理器
+@contextmanager
+def stage_timer(timings: Optional[Dict[str, float]], stage: str):
+    """
+    记录一个阶段的耗时（秒），同名阶段多次出现时累加，同时记录名为 stage.<阶段> 的 span
+    Args:
+        timings: 保存耗时的字典，为 None 时不记录
+        stage: 阶段名称
+
+    使用示例:
+        timings = {}
+        with stage_timer(timings, "parse"):
+            docs = parser_service.parse(data, "pdf")
+    """
+    # 记录开始时间
+    start = time.perf_counter()
+    try:
+        with span(f"stage.{stage}"):
+            yield
+    finally:
+        # 累加阶段耗时
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
@@ -0,0 +1,290 @@
+"""
+请求链路追踪工具
+基于 contextvars 记录嵌套的计时 span，同一请求内的 span 共享 trace_id，
+结束的 span 以 JSONL 格式写入本地文件，可选同步到 OpenTelemetry
+
+使用示例:
+    with start_trace("http.request", trace_id=request_id, path="/api/v1/chat"):
+        with span("rag.retrieve", kb_id=kb_id):
+            ...
+"""
+
+# 导入 JSON 模块
+import json
+
+# 导入日志模块
+import logging
+
+# 导入时间模块
+import time
+
+# 导入 uuid，用于生成 trace_id 和 span_id
+import uuid
+
+# 导入上下文变量
+from contextvars import ContextVar
+
+# 导入上下文管理器装饰器
+from contextlib import contextmanager
+
+# 导入装饰器工具
+from functools import wraps
+
+# 导入轮转文件处理器
+from logging.handlers import RotatingFileHandler
+
+# 导入Path，用于文件/目录路径处理
+from pathlib import Path
+
+# 导入类型注解
+from typing import Any, Dict, Optional
+
+# 导入配置
+from app.config import Config
+
+# 当前正在执行的 span
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+# span 对象
+class Span:
+    """一个计时 span，记录名称、起止时间、属性和所属 trace"""
+
+    def __init__(self, name: str, trace_id: str, parent: Optional["Span"] = None):
+        """
+        Args:
+            name: span 名称，如 rag.retrieve
+            trace_id: 所属 trace 的ID
+            parent: 父 span，根 span 为 None
+        """
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        # 结束后需要恢复的父 span
+        self._parent = parent
+        # 墙钟开始时间（用于展示）与单调时钟开始时间（用于计时）
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.attributes: Dict[str, Any] = {}
+        self.status = "ok"
+        self.error: Optional[str] = None
+        # 对应的 OpenTelemetry span（未启用时为 None）
+        self.otel_span = None
+
+    # 设置属性
+    def set(self, key: str, value: Any):
+        """设置 span 属性"""
+        self.attributes[key] = value
+        return self
+
+    # 结束 span
+    def finish(self, error: Optional[BaseException] = None):
+        """记录耗时和错误信息"""
+        self.duration_ms = round((time.perf_counter() - self._start) * 1000, 3)
+        if error is not None:
+            self.status = "error"
+            self.error = f"{type(error).__name__}: {error}"[:500]
+
+    # 转换为字典
+    def to_dict(self) -> dict:
+        """转换为可序列化的字典"""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_time,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+# span 输出器
+class SpanExporter:
+    """将结束的 span 写入 JSONL 文件，并可选同步到 OpenTelemetry"""
+
+    # 单个 trace 文件最大大小(10MB)
+    MAX_BYTES = 10 * 1024 * 1024
+    # trace 文件保留份数
+    BACKUP_COUNT = 5
+
+    def __init__(self):
+        """初始化输出器"""
+        self.enabled = Config.TRACE_ENABLED
+        self._file_logger: Optional[logging.Logger] = None
+        self._tracer = None
+        if not self.enabled:
+            return
+        # 使用独立的日志记录器写 JSONL，复用日志模块的文件轮转和线程安全
+        if Config.TRACE_ENABLE_FILE:
+            Path(Config.LOG_DIR).mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(
+                str(Path(Config.LOG_DIR) / Config.TRACE_FILE),
+                maxBytes=self.MAX_BYTES,
+                backupCount=self.BACKUP_COUNT,
+                encoding="utf-8",
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._file_logger = logging.getLogger("rag_lite.trace")
+            self._file_logger.handlers.clear()
+            self._file_logger.addHandler(handler)
+            self._file_logger.setLevel(logging.INFO)
+            # 不向根日志记录器传播，避免 span 出现在普通日志中
+            self._file_logger.propagate = False
+        # 可选：OpenTelemetry（导出器由部署环境的 SDK 配置决定）
+        if Config.TRACE_OTEL_ENABLED:
+            try:
+                from opentelemetry import trace as otel_trace
+
+                self._tracer = otel_trace.get_tracer("rag_lite")
+            except ImportError:
+                logging.getLogger(__name__).warning(
+                    "TRACE_OTEL_ENABLED 已开启，但未安装 opentelemetry-api，仅写入本地文件"
+                )
+
+    # span 开始时调用
+    def on_start(self, span_obj: Span, parent: Optional[Span]):
+        """创建对应的 OpenTelemetry span"""
+        if self._tracer is None:
+            return
+        from opentelemetry import trace as otel_trace
+
+        context = None
+        if parent is not None and parent.otel_span is not None:
+            context = otel_trace.set_span_in_context(parent.otel_span)
+        span_obj.otel_span = self._tracer.start_span(span_obj.name, context=context)
+        span_obj.otel_span.set_attribute("rag.trace_id", span_obj.trace_id)
+
+    # span 结束时调用
+    def on_end(self, span_obj: Span):
+        """输出已结束的 span"""
+        if self._file_logger is not None:
+            self._file_logger.info(
+                json.dumps(span_obj.to_dict(), ensure_ascii=False, default=str)
+            )
+        if span_obj.otel_span is not None:
+            for key, value in span_obj.attributes.items():
+                if isinstance(value, (str, bool, int, float)):
+                    span_obj.otel_span.set_attribute(key, value)
+            if span_obj.error:
+                span_obj.otel_span.set_attribute("error", span_obj.error)
+            span_obj.otel_span.end()
+
+
+# 模块级别的输出器实例
+exporter = SpanExporter()
+
+
+# 获取当前 span
+def current_span() -> Optional[Span]:
+    """获取当前上下文中的 span"""
+    return _current_span.get()
+
+
+# 获取当前 trace_id
+def current_trace_id() -> Optional[str]:
+    """获取当前上下文中的 trace_id，不在 trace 中时返回 None"""
+    span_obj = _current_span.get()
+    return span_obj.trace_id if span_obj else None
+
+
+# 生成新的 trace_id
+def new_trace_id() -> str:
+    """生成新的 trace_id（32 位十六进制）"""
+    return uuid.uuid4().hex
+
+
+# 开始一个 span
+def begin_span(name: str, trace_id: Optional[str] = None, **attributes) -> Span:
+    """
+    创建 span 并设为当前 span，需与 end_span 成对调用
+    （适用于无法使用 with 语句的场景，如 Flask 的请求钩子）
+    Args:
+        name: span 名称
+        trace_id: 指定 trace_id（仅在没有父 span 时生效），为空时自动生成
+        **attributes: span 属性
+
+    Returns:
+        Span 对象
+    """
+    parent = _current_span.get()
+    if parent is not None:
+        trace_id = parent.trace_id
+    span_obj = Span(name, trace_id or new_trace_id(), parent)
+    span_obj.attributes.update(attributes)
+    if exporter.enabled:
+        exporter.on_start(span_obj, parent)
+    _current_span.set(span_obj)
+    return span_obj
+
+
+# 结束一个 span
+def end_span(span_obj: Span, error: Optional[BaseException] = None):
+    """结束 span，恢复父 span 为当前 span 并输出"""
+    span_obj.finish(error)
+    # 用 set 而不是 reset，流式响应的生成器可能在不同的上下文中结束
+    _current_span.set(span_obj._parent)
+    if exporter.enabled:
+        exporter.on_end(span_obj)
+
+
+# span 上下文管理器
+@contextmanager
+def span(name: str, trace_id: Optional[str] = None, **attributes):
+    """
+    记录一个嵌套 span，不在 trace 中时自动开启新的 trace（可通过 trace_id 指定）
+    使用示例:
+        with span("vectordb.search", k=10) as s:
+            results = ...
+            s.set("results", len(results))
+    """
+    span_obj = begin_span(name, trace_id=trace_id, **attributes)
+    try:
+        yield span_obj
+    except BaseException as e:
+        # 生成器被提前关闭不算错误
+        end_span(span_obj, None if isinstance(e, GeneratorExit) else e)
+        raise
+    else:
+        end_span(span_obj)
+
+
+# 开始一个新 trace
+@contextmanager
+def start_trace(name: str, trace_id: Optional[str] = None, **attributes):
+    """
+    开始一个根 span（已在 trace 中时作为子 span）
+    Args:
+        name: span 名称
+        trace_id: 外部传入的 trace_id（如请求头 X-Request-ID）
+    """
+    with span(name, trace_id=trace_id, **attributes) as span_obj:
+        yield span_obj
+
+
+# span 装饰器
+def traced(name: str):
+    """记录函数调用为一个 span 的装饰器"""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# 日志过滤器：为日志记录注入 trace_id
+class TraceIdFilter(logging.Filter):
+    """为每条日志记录添加 trace_id 字段，不在 trace 中时为 '-'"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = current_trace_id() or "-"
+        return True
@@ -0,0 +1,7 @@
+"""
+基准测试模块
+离线运行的检索质量、延迟与吞吐基准，输出机器可读的 JSON 报告
+
+使用示例:
+    python -m benchmarks.retrieval_bench --output retrieval.json
+"""
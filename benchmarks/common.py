@@ -0,0 +1,276 @@
+"""
+基准测试公共工具
+负责隔离的运行环境、桩 LLM、延迟统计和 JSON 报告输出
+
+注意：bootstrap() 必须在导入任何 app.* 模块之前调用，
+因为 Config 在导入时读取环境变量，各服务单例也在导入时创建
+"""
+
+# 导入操作系统相关模块
+import os
+
+# 导入 JSON 模块
+import json
+
+# 导入时间模块
+import time
+
+# 导入数学模块
+import math
+
+# 导入平台信息模块
+import platform
+
+# 导入子进程模块，用于读取 git 提交号
+import subprocess
+
+# 导入临时目录工具
+import tempfile
+
+# 导入上下文管理器装饰器
+from contextlib import contextmanager
+
+# 导入 Path 处理路径
+from pathlib import Path
+
+# 导入类型注解
+from typing import Dict, List, Optional
+
+# 项目根目录
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# 桩 LLM 的固定回答
+STUB_ANSWER = "这是基准测试使用的桩回答，用于在离线环境下驱动完整的问答流程。"
+
+
+# 准备隔离的运行环境
+def bootstrap(workdir: Optional[str] = None, offline: bool = True, **env) -> Path:
+    """
+    准备隔离的基准测试环境：本地存储、本地 Chroma、SQLite 数据库，关闭文件日志
+    Args:
+        workdir: 工作目录，为 None 时创建临时目录
+        offline: 是否禁止访问 HuggingFace Hub（要求模型已在本地缓存）
+        **env: 额外需要覆盖的环境变量
+
+    Returns:
+        工作目录路径
+    """
+    # 创建或使用指定的工作目录
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix="rag_lite_bench_")
+    workdir = Path(workdir).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    # 基准测试默认环境，显式设置的环境变量会覆盖 .env 中的配置
+    defaults = {
+        "DATABASE_URL": f"sqlite:///{workdir / 'bench.db'}",
+        "STORAGE_TYPE": "local",
+        "STORAGE_DIR": str(workdir / "storage"),
+        "VECTORDB_TYPE": "chroma",
+        "CHROMA_PERSIST_DIRECTORY": str(workdir / "chroma_db"),
+        "LOCAL_VECTORDB_DIR": str(workdir / "local_vectordb"),
+        "VECTOR_COMPRESSION_DIR": str(workdir / "vector_compression"),
+        "LOG_ENABLE_FILE": "false",
+        "LOG_LEVEL": "WARNING",
+        "TRACE_ENABLE_FILE": "false",
+        "ANONYMIZED_TELEMETRY": "false",
+    }
+    if offline:
+        defaults["HF_HUB_OFFLINE"] = "1"
+        defaults["TRANSFORMERS_OFFLINE"] = "1"
+    defaults.update({key: str(value) for key, value in env.items()})
+    os.environ.update(defaults)
+
+    # 导入全部模型并建表（必须在导入服务之前，服务单例在导入时会查询设置表）
+    import app.models  # noqa: F401
+    from app.utils.db import init_db
+
+    init_db()
+    return workdir
+
+
+# 注册桩 LLM 提供者
+def register_stub_llm(answer: str = STUB_ANSWER) -> str:
+    """
+    注册离线使用的桩 LLM 提供者，逐字符流式返回固定回答
+    Args:
+        answer: 固定回答内容
+
+    Returns:
+        提供者名称
+    """
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from app.utils.llm_factory import LLMFactory
+
+    # 签名与 LLMFactory 的提供者函数约定一致
+    def _create_stub(settings, temperature, max_tokens, streaming):
+        return FakeListChatModel(responses=[answer])
+
+    LLMFactory.register_provider("stub", _create_stub)
+    return "stub"
+
+
+# 创建基准测试用的用户和知识库
+def create_benchmark_kb(name: str, chunk_size: int, chunk_overlap: int) -> dict:
+    """
+    创建基准测试用户和知识库
+    Args:
+        name: 知识库名称
+        chunk_size: 分块大小
+        chunk_overlap: 分块重叠
+
+    Returns:
+        知识库字典
+    """
+    from app.services.user_service import user_service
+    from app.services.knowledgebase_service import kb_service
+
+    user = user_service.register(f"bench_{int(time.time() * 1000)}", "benchmark")
+    return kb_service.create(
+        name=name,
+        user_id=user["id"],
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+    )
+
+
+# 计时上下文管理器：把耗时（毫秒）追加到 samples[stage]
+@contextmanager
+def timed(samples: Dict[str, List[float]], stage: str):
+    """记录一个阶段的耗时（毫秒）"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        samples.setdefault(stage, []).append((time.perf_counter() - start) * 1000)
+
+
+# 计算延迟分位数
+def summarize(values: List[float]) -> Dict[str, float]:
+    """
+    计算样本的 p50/p95/p99/均值/最大值（最近秩法）
+    Args:
+        values: 样本列表
+
+    Returns:
+        统计字典
+    """
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def pct(p: float) -> float:
+        # 最近秩法，保证结果一定是某个真实样本
+        index = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+        return round(ordered[index], 3)
+
+    return {
+        "count": len(ordered),
+        "p50": pct(50),
+        "p95": pct(95),
+        "p99": pct(99),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+# 读取当前 git 提交号，便于跨提交比较
+def git_revision() -> Optional[str]:
+    """返回当前 git 提交号，失败时返回 None"""
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=ROOT_DIR,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except Exception:
+        return None
+
+
+# 运行环境信息
+def environment_info() -> dict:
+    """返回运行环境信息，写入报告便于对比"""
+    return {
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+# 输出 JSON 报告
+def write_report(report: dict, output: Optional[str] = None) -> None:
+    """
+    输出 JSON 报告
+    Args:
+        report: 报告字典
+        output: 输出文件路径，为 None 时打印到标准输出
+    """
+    text = json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True)
+    if output:
+        Path(output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+# 读取进程峰值常驻内存
+def peak_rss_mb() -> float:
+    """
+    返回当前进程自启动以来的峰值常驻内存（MB），不支持的平台返回 0
+    该值只增不减，需要分用例统计时应把每个用例放到独立子进程中运行
+    """
+    try:
+        import resource
+        import sys
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 单位为 KB，macOS 单位为字节
+        divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+        return round(peak / divisor, 1)
+    except Exception:
+        return 0.0
+
+
+# 与基线报告对比吞吐指标
+def compare_throughput(
+    current: Dict[str, dict],
+    baseline: Dict[str, dict],
+    metrics: List[str],
+    tolerance: float,
+) -> List[dict]:
+    """
+    对比两次运行中同名用例的吞吐指标（越大越好），返回下降超过容忍度的项
+    Args:
+        current: 本次运行的 {用例: 指标字典}
+        baseline: 基线运行的 {用例: 指标字典}
+        metrics: 需要对比的指标名
+        tolerance: 允许的相对下降比例，例如 0.1 表示 10%
+
+    Returns:
+        回退列表
+    """
+    regressions = []
+    for case, values in current.items():
+        base = baseline.get(case)
+        if not base:
+            continue
+        for metric in metrics:
+            old, new = base.get(metric), values.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if change < -tolerance:
+                regressions.append(
+                    {
+                        "case": case,
+                        "metric": metric,
+                        "baseline": old,
+                        "current": new,
+                        "change": round(change, 4),
+                    }
+                )
+    return regressions
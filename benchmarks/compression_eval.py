@@ -0,0 +1,115 @@
+"""
+向量压缩评估
+以全精度精确检索为基准，对比各压缩模式（降维 + 量化）的内存占用和 recall@k（仅压缩分数 / 全精度重排后）
+
+默认使用带簇结构的合成向量；指定 --kb-id 时读取当前配置（.env）下该知识库集合中的真实向量，
+并附带该知识库已开启的压缩索引的统计信息
+
+使用示例:
+    python -m benchmarks.compression_eval
+    python -m benchmarks.compression_eval --vectors 50000 --dim 768 --specs int8,pca:128+int8,binary
+    python -m benchmarks.compression_eval --kb-id <知识库ID> --k 10 --rescore-factor 8
+"""
+
+# 导入命令行参数解析模块
+import argparse
+
+# 导入基准测试公共工具
+from benchmarks import common
+
+# 默认评估的压缩模式
+DEFAULT_SPECS = "int8,binary,pca:128,pca:128+int8,pca:64+int8,mrl:128+int8"
+
+
+# 生成带簇结构的合成向量
+def build_vectors(count: int, dim: int, clusters: int, seed: int):
+    """
+    生成低内在维度、带簇结构的合成向量，近似真实 Embedding 的分布
+    Args:
+        count: 向量数量
+        dim: 向量维度
+        clusters: 簇数量
+        seed: 随机种子
+
+    Returns:
+        float32 矩阵
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    latent_dim = max(8, dim // 6)
+    basis = rng.normal(size=(latent_dim, dim))
+    centers = rng.normal(size=(clusters, latent_dim))
+    latent = centers[rng.integers(0, clusters, count)] + 0.5 * rng.normal(size=(count, latent_dim))
+    return (latent @ basis + 0.3 * rng.normal(size=(count, dim))).astype(np.float32)
+
+
+# 读取知识库中的真实向量
+def load_kb_vectors(kb_id: str):
+    """从当前配置的向量库读取知识库集合中的全部向量"""
+    import numpy as np
+    from app.services.vector_service import vector_service
+
+    vectors = []
+    for _, embeddings, _ in vector_service.iter_embeddings(f"kb_{kb_id}"):
+        vectors.extend(embeddings)
+    if not vectors:
+        raise SystemExit(f"知识库 {kb_id} 中没有向量")
+    return np.asarray(vectors, dtype=np.float32)
+
+
+# 命令行入口
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RAG Lite 向量压缩评估")
+    parser.add_argument("--workdir", help="工作目录（默认临时目录，仅合成向量时使用）")
+    parser.add_argument("--output", help="JSON 报告输出路径（默认打印到标准输出）")
+    parser.add_argument("--kb-id", help="评估该知识库的真实向量（使用当前配置，不创建临时环境）")
+    parser.add_argument("--specs", default=DEFAULT_SPECS, help="逗号分隔的压缩模式")
+    parser.add_argument("--vectors", type=int, default=20000, help="合成向量数量")
+    parser.add_argument("--dim", type=int, default=384, help="合成向量维度")
+    parser.add_argument("--clusters", type=int, default=200, help="合成向量的簇数量")
+    parser.add_argument("--k", type=int, default=10, help="recall@k 的 k")
+    parser.add_argument("--queries", type=int, default=200, help="查询数量")
+    parser.add_argument("--rescore-factor", type=int, help="候选倍数（默认 VECTOR_COMPRESSION_RESCORE_FACTOR）")
+    parser.add_argument("--seed", type=int, default=7, help="随机种子")
+    args = parser.parse_args(argv)
+
+    if args.kb_id:
+        workdir = None
+        vectors = load_kb_vectors(args.kb_id)
+    else:
+        workdir = common.bootstrap(args.workdir)
+        vectors = build_vectors(args.vectors, args.dim, args.clusters, args.seed)
+
+    from app.services.vector_compression import evaluate, vector_compression_service
+
+    specs = [spec.strip() for spec in args.specs.split(",") if spec.strip()]
+    result = evaluate(
+        vectors,
+        specs,
+        k=args.k,
+        queries=args.queries,
+        rescore_factor=args.rescore_factor,
+        seed=args.seed,
+    )
+    report = {
+        "benchmark": "compression",
+        "environment": common.environment_info(),
+        "config": {
+            "source": f"kb_{args.kb_id}" if args.kb_id else "synthetic",
+            "specs": specs,
+            "seed": args.seed,
+        },
+        "workdir": str(workdir) if workdir else None,
+        **result,
+        "peak_rss_mb": common.peak_rss_mb(),
+    }
+    # 知识库已开启压缩时附带索引的实际占用
+    if args.kb_id:
+        index = vector_compression_service.get_index(args.kb_id)
+        report["index"] = index.stats() if index else None
+    common.write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Embedding 吞吐与一致性基准
+比较同一模型的 PyTorch（HuggingFaceEmbeddings）与 ONNX Runtime（OnnxEmbeddings）实现：
+统计文档批量向量化的 texts/s、单条查询的延迟分位数，以及两者向量的余弦相似度
+
+使用示例:
+    python -m benchmarks.embedding_bench --export --online
+    python -m benchmarks.embedding_bench --model sentence-transformers/all-MiniLM-L6-v2 --threads 4 --texts 512
+    python -m benchmarks.embedding_bench --no-quantized --min-cosine 0.999
+"""
+
+# 导入命令行参数解析模块
+import argparse
+
+# 导入随机数模块，用于生成可复现的样例文本
+import random
+
+# 导入系统模块
+import sys
+
+# 导入时间模块
+import time
+
+# 导入类型注解
+from typing import List
+
+# 导入基准测试公共工具
+from benchmarks import common
+
+# 样例文本的词表
+WORDS = [
+    "检索", "向量", "知识库", "文档", "分块", "模型", "查询", "相似度", "部署", "缓存",
+    "retrieval", "vector", "document", "chunk", "latency", "throughput", "index",
+    "cluster", "replica", "storage", "policy", "release", "service", "capacity",
+]
+
+
+# 生成样例文本
+def build_texts(count: int, seed: int) -> List[str]:
+    """生成长度不一（5~200 个词）的样例文本"""
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 200))) for _ in range(count)
+    ]
+
+
+# 测量一个 Embeddings 实现
+def measure(embeddings, texts: List[str], queries: int) -> dict:
+    """
+    测量文档批量向量化吞吐和单条查询延迟
+    Args:
+        embeddings: Embeddings 对象
+        texts: 样例文本
+        queries: 查询次数
+
+    Returns:
+        统计字典
+    """
+    # 预热：首次推理包含图优化和内存分配
+    embeddings.embed_documents(texts[:8])
+    start = time.perf_counter()
+    embeddings.embed_documents(texts)
+    seconds = time.perf_counter() - start
+    samples = {}
+    for text in texts[:queries]:
+        with common.timed(samples, "query"):
+            embeddings.embed_query(text[:200])
+    return {
+        "texts_per_s": round(len(texts) / seconds, 2),
+        "documents_seconds": round(seconds, 3),
+        "query_ms": common.summarize(samples.get("query", [])),
+    }
+
+
+# 命令行入口
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RAG Lite Embedding 吞吐与一致性基准")
+    parser.add_argument("--workdir", help="工作目录（默认临时目录）")
+    parser.add_argument("--output", help="JSON 报告输出路径（默认打印到标准输出）")
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2", help="模型名称")
+    parser.add_argument("--model-dir", help="ONNX 模型目录（默认 EMBEDDING_ONNX_MODEL_DIR/<模型名称>）")
+    parser.add_argument("--export", action="store_true", help="先导出（并量化）ONNX 模型")
+    parser.add_argument("--no-quantized", action="store_true", help="使用未量化的 model.onnx")
+    parser.add_argument("--threads", type=int, default=0, help="ONNX Runtime 推理线程数")
+    parser.add_argument("--batch-size", type=int, default=32, help="ONNX 每批文本数")
+    parser.add_argument("--texts", type=int, default=256, help="样例文本数量")
+    parser.add_argument("--queries", type=int, default=50, help="单条查询次数")
+    parser.add_argument("--seed", type=int, default=11, help="随机种子")
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="一致性要求的最小余弦相似度")
+    parser.add_argument("--online", action="store_true", help="允许访问 HuggingFace Hub")
+    args = parser.parse_args(argv)
+
+    workdir = common.bootstrap(args.workdir, offline=not args.online)
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+    from app.utils.onnx_embeddings import (
+        OnnxEmbeddings,
+        export_model,
+        parity_check,
+        resolve_model_dir,
+    )
+
+    model_dir = args.model_dir or resolve_model_dir(args.model)
+    if args.export:
+        export_model(args.model, model_dir, quantize=not args.no_quantized)
+
+    texts = build_texts(args.texts, args.seed)
+    reference = HuggingFaceEmbeddings(
+        model_name=args.model,
+        model_kwargs={"device": "cpu"},
+        encode_kwargs={"normalize_embeddings": True},
+    )
+    onnx = OnnxEmbeddings(
+        model_dir,
+        threads=args.threads,
+        batch_size=args.batch_size,
+        quantized=not args.no_quantized,
+    )
+    pytorch_result = measure(reference, texts, args.queries)
+    onnx_result = measure(onnx, texts, args.queries)
+    parity = parity_check(onnx, reference, texts[:64])
+
+    report = {
+        "benchmark": "embedding",
+        "environment": common.environment_info(),
+        "config": {
+            "model": args.model,
+            "model_path": onnx.model_path,
+            "threads": args.threads,
+            "batch_size": args.batch_size,
+            "texts": args.texts,
+            "seed": args.seed,
+        },
+        "workdir": str(workdir),
+        "pytorch": pytorch_result,
+        "onnx": onnx_result,
+        "speedup": round(onnx_result["texts_per_s"] / pytorch_result["texts_per_s"], 2),
+        "parity": parity,
+        "peak_rss_mb": common.peak_rss_mb(),
+    }
+    common.write_report(report, args.output)
+    # 一致性不足时以非零状态码退出，便于接入 CI
+    if parity["min_cosine"] < args.min_cosine:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+基准测试样例文件生成
+生成指定大小、内容可复现的 PDF / DOCX / TXT / MD 文件，不依赖额外的写文件库
+"""
+
+# 导入随机数模块
+import random
+
+# 导入内存字节流
+from io import BytesIO
+
+# 导入 zip 模块，用于生成 DOCX
+import zipfile
+
+# 导入 XML 转义工具
+from xml.sax.saxutils import escape
+
+# 导入类型注解
+from typing import List
+
+# 生成文本使用的词表（仅 ASCII，保证 PDF 标准字体可直接显示）
+WORDS = (
+    "system data index query vector chunk document storage service latency "
+    "throughput request model embedding search result cluster node shard "
+    "replica cache memory disk network batch stream parser splitter token "
+    "answer context score rank filter metadata collection segment compaction "
+    "release deploy monitor alert metric trace span worker queue schedule"
+).split()
+
+
+# 生成可复现的段落列表
+def synthetic_paragraphs(num_bytes: int, seed: int) -> List[str]:
+    """
+    生成总长度约为 num_bytes 的段落列表
+    Args:
+        num_bytes: 目标字节数
+        seed: 随机种子
+
+    Returns:
+        段落列表
+    """
+    rng = random.Random(seed)
+    paragraphs = []
+    total = 0
+    while total < num_bytes:
+        # 每段 3~8 句，每句 8~20 个词
+        sentences = []
+        for _ in range(rng.randint(3, 8)):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+            sentences.append(" ".join(words).capitalize() + ".")
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        total += len(paragraph) + 2
+    return paragraphs
+
+
+# 生成 TXT 文件
+def make_txt(paragraphs: List[str]) -> bytes:
+    """生成纯文本文件内容"""
+    return "\n\n".join(paragraphs).encode("utf-8")
+
+
+# 生成 Markdown 文件
+def make_md(paragraphs: List[str]) -> bytes:
+    """生成 Markdown 文件内容，每 5 段插入一个二级标题"""
+    lines = ["# Benchmark Document", ""]
+    for i, paragraph in enumerate(paragraphs):
+        if i % 5 == 0:
+            lines += [f"## Section {i // 5 + 1}", ""]
+        lines += [paragraph, ""]
+    return "\n".join(lines).encode("utf-8")
+
+
+# 生成 DOCX 文件
+def make_docx(paragraphs: List[str]) -> bytes:
+    """生成仅包含正文段落的最小 DOCX 文件"""
+    content_types = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+        "</Types>"
+    )
+    rels = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+        "</Relationships>"
+    )
+    body = "".join(
+        f'<w:p><w:r><w:t xml:space="preserve">{escape(p)}</w:t></w:r></w:p>'
+        for p in paragraphs
+    )
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{body}</w:body></w:document>"
+    )
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", content_types)
+        zf.writestr("_rels/.rels", rels)
+        zf.writestr("word/document.xml", document)
+    return buffer.getvalue()
+
+
+# 生成 PDF 文件
+def make_pdf(paragraphs: List[str], line_width: int = 90, lines_per_page: int = 60) -> bytes:
+    """生成使用 Helvetica 标准字体的多页文本 PDF"""
+    # 按固定宽度折行
+    lines = []
+    for paragraph in paragraphs:
+        current = ""
+        for word in paragraph.split():
+            if len(current) + len(word) + 1 > line_width:
+                lines.append(current)
+                current = word
+            else:
+                current = f"{current} {word}".strip()
+        lines += [current, ""]
+    pages = [
+        lines[i : i + lines_per_page] for i in range(0, len(lines), lines_per_page)
+    ] or [[""]]
+
+    # 对象编号：1 目录，2 页面树，3 字体，之后每页两个对象（页面 + 内容流）
+    objects = {}
+    page_ids = []
+    for index, page_lines in enumerate(pages):
+        page_id = 4 + index * 2
+        content_id = page_id + 1
+        page_ids.append(page_id)
+        text = "".join(
+            "(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") Tj T* "
+            for line in page_lines
+        )
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td {text}ET".encode("latin-1")
+        objects[content_id] = (
+            f"<< /Length {len(stream)} >>\nstream\n".encode("latin-1")
+            + stream
+            + b"\nendstream"
+        )
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode("latin-1")
+    objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    objects[2] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode("latin-1")
+    objects[3] = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+
+    # 拼接对象并记录交叉引用表偏移
+    output = BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = output.tell()
+        output.write(f"{obj_id} 0 obj\n".encode("latin-1") + objects[obj_id] + b"\nendobj\n")
+    xref_offset = output.tell()
+    size = max(objects) + 1
+    output.write(f"xref\n0 {size}\n0000000000 65535 f \n".encode("latin-1"))
+    for obj_id in range(1, size):
+        output.write(f"{offsets[obj_id]:010d} 00000 n \n".encode("latin-1"))
+    output.write(
+        f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode(
+            "latin-1"
+        )
+    )
+    return output.getvalue()
+
+
+# 文件类型到生成函数的映射
+GENERATORS = {"txt": make_txt, "md": make_md, "docx": make_docx, "pdf": make_pdf}
+
+
+# 生成指定类型和大小的文件
+def make_file(file_type: str, num_bytes: int, seed: int) -> bytes:
+    """
+    生成指定类型的样例文件
+    Args:
+        file_type: 文件类型（pdf/docx/txt/md）
+        num_bytes: 文本内容的目标字节数（不是最终文件大小）
+        seed: 随机种子
+
+    Returns:
+        文件字节内容
+    """
+    return GENERATORS[file_type](synthetic_paragraphs(num_bytes, seed))
@@ -0,0 +1,215 @@
+"""
+文档入库吞吐基准
+生成不同类型、不同大小的样例文件，驱动 DocumentService.upload + _process_document 的完整流程
+（存储写入、解析、分块、向量化、向量写入、数据库状态更新），
+统计 docs/s、chunks/s、峰值内存和各阶段耗时占比
+每个用例在独立子进程中运行，峰值内存只反映该用例本身
+
+使用示例:
+    python -m benchmarks.ingestion_bench --types pdf,docx,txt,md --sizes 10k,100k --chunk-sizes 256,512
+    python -m benchmarks.ingestion_bench --output current.json --baseline baseline.json --tolerance 0.1
+"""
+
+# 导入命令行参数解析模块
+import argparse
+
+# 导入 JSON 模块
+import json
+
+# 导入子进程模块，每个用例在独立进程中运行
+import subprocess
+
+# 导入系统模块
+import sys
+
+# 导入时间模块
+import time
+
+# 导入 Path 处理路径
+from pathlib import Path
+
+# 导入类型注解
+from typing import Dict, List
+
+# 导入基准测试公共工具
+from benchmarks import common
+
+# 导入样例文件生成工具
+from benchmarks import fixtures
+
+
+# 解析 10k / 2m 这类大小描述
+def parse_size(text: str) -> int:
+    """将 10k、2m 之类的大小描述转换为字节数"""
+    text = text.strip().lower()
+    units = {"k": 1024, "m": 1024 * 1024}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+# 运行一个用例
+def run_case(
+    file_type: str, num_bytes: int, chunk_size: int, chunk_overlap: int, docs: int, seed: int
+) -> dict:
+    """
+    在独立知识库中入库 docs 个同类文件并统计
+    Returns:
+        用例结果字典
+    """
+    from app.models.document import Document as DocumentModel
+    from app.services.document_service import document_service
+
+    kb = common.create_benchmark_kb(
+        f"ingest-{file_type}-{num_bytes}-{chunk_size}", chunk_size, chunk_overlap
+    )
+    # 预先生成文件，排除生成耗时
+    files = [fixtures.make_file(file_type, num_bytes, seed + i) for i in range(docs)]
+    stage_seconds: Dict[str, float] = {}
+    chunks = 0
+    failed = 0
+    start = time.perf_counter()
+    for i, data in enumerate(files):
+        doc = document_service.upload(
+            kb["id"], data, f"bench_{i}.{file_type}", stage_timings=stage_seconds
+        )
+        document_service._process_document(doc["id"], stage_timings=stage_seconds)
+        # 读取处理结果
+        processed = document_service.get_by_id(DocumentModel, doc["id"])
+        if processed is None or processed.status != "completed":
+            failed += 1
+        else:
+            chunks += processed.chunk_count or 0
+    wall = time.perf_counter() - start
+    total_stage = sum(stage_seconds.values()) or 1.0
+    return {
+        "file_type": file_type,
+        "content_bytes": num_bytes,
+        "file_bytes": sum(len(f) for f in files) // max(1, len(files)),
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "docs": docs,
+        "failed": failed,
+        "chunks": chunks,
+        "wall_seconds": round(wall, 4),
+        "docs_per_s": round(docs / wall, 3) if wall else None,
+        "chunks_per_s": round(chunks / wall, 3) if wall else None,
+        "mb_per_s": round(sum(len(f) for f in files) / wall / 1024 / 1024, 3) if wall else None,
+        "stage_seconds": {k: round(v, 4) for k, v in sorted(stage_seconds.items())},
+        "stage_share": {
+            k: round(v / total_stage, 4) for k, v in sorted(stage_seconds.items())
+        },
+        "peak_rss_mb": common.peak_rss_mb(),
+    }
+
+
+# 在子进程中运行一个用例
+def spawn(args, workdir: Path, file_type: str, num_bytes: int, chunk_size: int) -> dict:
+    """以子进程运行 --case，返回其 JSON 结果；失败时返回错误信息，超时时返回 {"status": "timeout"}"""
+    result_file = workdir / f"case_{file_type}_{num_bytes}_{chunk_size}.json"
+    command = [
+        sys.executable, "-m", "benchmarks.ingestion_bench",
+        "--case", f"{file_type}/{num_bytes}/{chunk_size}",
+        "--workdir", str(workdir),
+        "--result-file", str(result_file),
+        "--chunk-overlap", str(args.chunk_overlap),
+        "--docs", str(args.docs),
+        "--seed", str(args.seed),
+    ]
+    if args.online:
+        command.append("--online")
+    try:
+        completed = subprocess.run(
+            command, cwd=common.ROOT_DIR, capture_output=True, text=True, timeout=args.timeout
+        )
+    except subprocess.TimeoutExpired:
+        # 单个用例卡住时只记录超时，继续运行其余用例
+        return {"status": "timeout", "timeout_seconds": args.timeout}
+    if completed.returncode != 0 or not result_file.exists():
+        return {"error": (completed.stderr or completed.stdout).strip().splitlines()[-5:]}
+    return json.loads(result_file.read_text(encoding="utf-8"))
+
+
+# 命令行入口
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RAG Lite 文档入库吞吐基准")
+    parser.add_argument("--workdir", help="工作目录（默认临时目录）")
+    parser.add_argument("--output", help="JSON 报告输出路径（默认打印到标准输出）")
+    parser.add_argument("--types", default="pdf,docx,txt,md", help="逗号分隔的文件类型")
+    parser.add_argument("--sizes", default="10k,100k,1m", help="逗号分隔的文本大小")
+    parser.add_argument("--chunk-sizes", default="512", help="逗号分隔的分块大小")
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument("--docs", type=int, default=3, help="每个用例入库的文件数")
+    parser.add_argument("--seed", type=int, default=7, help="随机种子")
+    parser.add_argument("--baseline", help="基线 JSON 报告，用于检测吞吐回退")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="允许的吞吐下降比例")
+    parser.add_argument("--online", action="store_true", help="允许访问 HuggingFace Hub")
+    parser.add_argument("--timeout", type=int, default=3600, help="单个用例子进程的超时（秒）")
+    # 子进程内部使用的参数
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    # 子进程：预热后只运行一个用例，结果写入文件
+    if args.case:
+        common.bootstrap(args.workdir, offline=not args.online)
+        # 预热：加载 Embedding 模型、创建数据库连接，不计入结果
+        run_case("txt", 2048, 512, 50, 1, args.seed)
+        file_type, num_bytes, chunk_size = args.case.split("/")
+        result = run_case(
+            file_type, int(num_bytes), int(chunk_size), args.chunk_overlap, args.docs, args.seed
+        )
+        Path(args.result_file).write_text(json.dumps(result, ensure_ascii=False), encoding="utf-8")
+        return
+
+    types = [t.strip().lower() for t in args.types.split(",") if t.strip()]
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    chunk_sizes = [int(c) for c in args.chunk_sizes.split(",") if c.strip()]
+    for file_type in types:
+        if file_type not in fixtures.GENERATORS:
+            parser.error(f"不支持的文件类型: {file_type}")
+
+    workdir = common.bootstrap(args.workdir, offline=not args.online)
+
+    # ru_maxrss 是进程级且只增不减的峰值，每个用例在独立子进程中运行才能得到自身的峰值
+    cases: Dict[str, dict] = {}
+    for file_type in types:
+        for num_bytes in sizes:
+            for chunk_size in chunk_sizes:
+                key = f"{file_type}/{num_bytes}/{chunk_size}"
+                cases[key] = spawn(args, workdir, file_type, num_bytes, chunk_size)
+
+    from app.services.storage_service import storage_service
+    from app.services.vector_service import vector_service
+
+    report = {
+        "benchmark": "ingestion",
+        "environment": common.environment_info(),
+        "config": {
+            "storage": type(storage_service).__name__,
+            "vectordb": type(getattr(vector_service, "inner", vector_service)).__name__,
+            "database": "sqlite",
+            "docs_per_case": args.docs,
+            "seed": args.seed,
+        },
+        "workdir": str(workdir),
+        "peak_rss_mb": max((case.get("peak_rss_mb", 0.0) for case in cases.values()), default=0.0),
+        "cases": cases,
+    }
+
+    # 与基线对比，发现回退时以非零状态码退出，便于接入 CI
+    regressions: List[dict] = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = common.compare_throughput(
+            cases, baseline.get("cases", {}), ["docs_per_s", "chunks_per_s"], args.tolerance
+        )
+        report["regressions"] = regressions
+    common.write_report(report, args.output)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
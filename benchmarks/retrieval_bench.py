@@ -0,0 +1,274 @@
+"""
+检索质量与延迟基准
+通过 DocumentService 的完整处理流程把语料写入本地 Chroma 集合，
+然后回放查询集，统计 recall@k、MRR 以及各阶段（向量化、检索、重排序、构造上下文、生成）的延迟分位数
+
+使用示例:
+    python -m benchmarks.retrieval_bench --docs 50 --chunk-size 512 --retrieval-mode vector
+    python -m benchmarks.retrieval_bench --corpus-dir ./fixtures/docs --queries ./fixtures/queries.jsonl
+"""
+
+# 导入命令行参数解析模块
+import argparse
+
+# 导入 JSON 模块
+import json
+
+# 导入随机数模块，用于生成可复现的合成语料
+import random
+
+# 导入 Path 处理路径
+from pathlib import Path
+
+# 导入类型注解
+from typing import Dict, List, Tuple
+
+# 导入基准测试公共工具
+from benchmarks import common
+
+# 合成语料中的实体名称，每个实体对应一篇文档
+ENTITIES = [
+    "aurora", "basalt", "cobalt", "dahlia", "ember", "fjord", "granite", "harbor",
+    "indigo", "juniper", "kestrel", "lagoon", "meridian", "nimbus", "obsidian",
+    "pelican", "quartz", "redwood", "saffron", "tundra", "umber", "vortex",
+    "willow", "xenon", "yarrow", "zephyr", "acorn", "bramble", "cypress", "drift",
+    "falcon", "glacier", "heron", "iris", "jasper", "kelp", "lotus", "marble",
+    "nectar", "orchid", "pebble", "quill", "raven", "sable", "thistle", "topaz",
+    "valley", "walnut", "yonder", "zinnia",
+]
+
+# 合成事实的取值
+STORES = ["PostgreSQL", "Cassandra", "Redis", "S3 buckets", "Elasticsearch", "SQLite"]
+TOOLS = ["Kubernetes", "Ansible", "Terraform", "Nomad", "Helm", "bare metal scripts"]
+CADENCES = ["Monday", "Wednesday", "Friday", "night", "sprint", "quarter"]
+CITIES = ["Berlin", "Shanghai", "Toronto", "Nairobi", "Lima", "Osaka"]
+LANGUAGES = ["Rust", "Go", "Java", "Python", "Kotlin", "Elixir"]
+
+# 所有文档共享的干扰段落，用于拉长文档并制造相似内容
+FILLER = [
+    "All services follow the company incident policy and publish weekly status notes.",
+    "Changes are reviewed by two engineers before they are merged into the main branch.",
+    "Dashboards track request volume, error rate and saturation for every component.",
+    "Documentation lives next to the code and is updated together with each release.",
+    "Capacity reviews happen twice a year and are based on the previous peak traffic.",
+]
+
+
+# 生成合成语料
+def build_synthetic_corpus(
+    num_docs: int, filler_paragraphs: int, seed: int
+) -> Tuple[Dict[str, str], List[dict]]:
+    """
+    生成合成语料与查询集
+    Args:
+        num_docs: 文档数量（最多与实体数量相同）
+        filler_paragraphs: 每篇文档附加的干扰段落数量
+        seed: 随机种子
+
+    Returns:
+        ({文件名: 文本}, [{"question": ..., "relevant": [文件名]}])
+    """
+    rng = random.Random(seed)
+    docs = {}
+    queries = []
+    for entity in ENTITIES[:num_docs]:
+        # 为每个实体随机挑选一组事实
+        facts = {
+            "store": rng.choice(STORES),
+            "tool": rng.choice(TOOLS),
+            "cadence": rng.choice(CADENCES),
+            "city": rng.choice(CITIES),
+            "language": rng.choice(LANGUAGES),
+        }
+        paragraphs = [
+            f"The {entity} service keeps its primary data in {facts['store']}.",
+            f"The {entity} team deploys every {facts['cadence']} using {facts['tool']}.",
+            f"On-call engineers for {entity} are located in {facts['city']}.",
+            f"Most of the {entity} codebase is written in {facts['language']}.",
+        ]
+        # 追加干扰段落并打乱顺序
+        paragraphs += [rng.choice(FILLER) for _ in range(filler_paragraphs)]
+        rng.shuffle(paragraphs)
+        filename = f"{entity}.txt"
+        docs[filename] = "\n\n".join(paragraphs)
+        queries += [
+            {"question": f"Where does the {entity} service keep its data?", "relevant": [filename]},
+            {"question": f"How often is {entity} deployed and with which tool?", "relevant": [filename]},
+            {"question": f"Which programming language is {entity} written in?", "relevant": [filename]},
+        ]
+    return docs, queries
+
+
+# 读取目录中的语料与查询集
+def load_fixture_corpus(corpus_dir: str, queries_file: str) -> Tuple[Dict[str, bytes], List[dict]]:
+    """
+    读取目录中的文档和 JSONL 查询集
+    查询集每行格式: {"question": "...", "relevant": ["文件名", ...]}
+    """
+    docs = {
+        path.name: path.read_bytes()
+        for path in sorted(Path(corpus_dir).iterdir())
+        if path.is_file()
+    }
+    with open(queries_file, encoding="utf-8") as f:
+        queries = [json.loads(line) for line in f if line.strip()]
+    return docs, queries
+
+
+# 通过 DocumentService 的完整流程写入语料
+def ingest(kb_id: str, docs: Dict[str, object]) -> Dict[str, str]:
+    """
+    上传并同步处理所有文档
+    Returns:
+        {doc_id: 文件名}
+    """
+    from app.services.document_service import document_service
+
+    doc_names = {}
+    for filename, content in docs.items():
+        data = content.encode("utf-8") if isinstance(content, str) else content
+        doc = document_service.upload(kb_id, data, filename)
+        # 直接调用处理方法，在当前线程同步完成，便于计时与统计
+        document_service._process_document(doc["id"])
+        doc_names[doc["id"]] = filename
+    return doc_names
+
+
+# 回放查询集
+def replay(rag, kb_id: str, queries: List[dict], ks: List[int], answer: bool) -> dict:
+    """
+    逐条回放查询，按阶段计时并计算 recall@k 与 MRR
+    Args:
+        rag: RAGService 实例
+        kb_id: 知识库ID
+        queries: 查询集
+        ks: 需要统计的 k 值
+        answer: 是否同时驱动桩 LLM 生成答案
+
+    Returns:
+        {"quality": {...}, "latency_ms": {...}}
+    """
+    samples: Dict[str, List[float]] = {}
+    hits_at_k = {k: 0 for k in ks}
+    reciprocal_ranks = []
+    for query in queries:
+        question = query["question"]
+        relevant = set(query["relevant"])
+        with common.timed(samples, "total"):
+            with common.timed(samples, "embed"):
+                vector = rag.embed_query(question, kb_id)
+            with common.timed(samples, "search"):
+                candidates = rag.search(kb_id, vector, k=max(ks) * 3)
+            with common.timed(samples, "rerank"):
+                hits = rag.rerank(question, candidates)
+            with common.timed(samples, "context_build"):
+                rag.build_context(hits)
+        if answer:
+            with common.timed(samples, "answer"):
+                for _ in rag.ask_stream(kb_id, question):
+                    pass
+        # 按命中顺序取出文档名
+        ranked = [hit["document"].metadata.get("doc_name") for hit in hits]
+        first_rank = next(
+            (rank for rank, name in enumerate(ranked, 1) if name in relevant), None
+        )
+        reciprocal_ranks.append(1.0 / first_rank if first_rank else 0.0)
+        for k in ks:
+            if first_rank and first_rank <= k:
+                hits_at_k[k] += 1
+    total = max(1, len(queries))
+    quality = {f"recall@{k}": round(hits_at_k[k] / total, 4) for k in ks}
+    quality["mrr"] = round(sum(reciprocal_ranks) / total, 4)
+    return {
+        "quality": quality,
+        "latency_ms": {stage: common.summarize(v) for stage, v in samples.items()},
+    }
+
+
+# 命令行入口
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RAG Lite 检索质量与延迟基准")
+    parser.add_argument("--workdir", help="工作目录（默认临时目录）")
+    parser.add_argument("--output", help="JSON 报告输出路径（默认打印到标准输出）")
+    parser.add_argument("--docs", type=int, default=len(ENTITIES), help="合成文档数量")
+    parser.add_argument("--filler", type=int, default=20, help="每篇文档的干扰段落数量")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--corpus-dir", help="使用目录中的文档代替合成语料")
+    parser.add_argument("--queries", help="与 --corpus-dir 配套的 JSONL 查询集")
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument(
+        "--retrieval-mode", default="vector", choices=["vector", "keyword", "hybrid"]
+    )
+    parser.add_argument("--vector-threshold", type=float, default=0.0)
+    parser.add_argument("--keyword-threshold", type=float, default=0.0)
+    parser.add_argument("--vector-weight", type=float, default=0.7)
+    parser.add_argument("--k", default="1,3,5,10", help="逗号分隔的 recall@k 取值")
+    parser.add_argument("--repeat", type=int, default=1, help="查询集回放次数")
+    parser.add_argument("--no-answer", action="store_true", help="不驱动桩 LLM 生成答案")
+    parser.add_argument("--online", action="store_true", help="允许访问 HuggingFace Hub")
+    args = parser.parse_args(argv)
+
+    ks = sorted({int(k) for k in args.k.split(",") if k.strip()})
+    workdir = common.bootstrap(args.workdir, offline=not args.online)
+    llm_provider = common.register_stub_llm()
+
+    # 准备语料
+    if args.corpus_dir:
+        if not args.queries:
+            parser.error("--corpus-dir 需要同时指定 --queries")
+        docs, queries = load_fixture_corpus(args.corpus_dir, args.queries)
+    else:
+        docs, queries = build_synthetic_corpus(args.docs, args.filler, args.seed)
+
+    # 通过文档服务写入语料
+    kb = common.create_benchmark_kb("retrieval-bench", args.chunk_size, args.chunk_overlap)
+    doc_names = ingest(kb["id"], docs)
+
+    # 构造使用桩 LLM 和指定检索参数的 RAG 服务
+    from app.services.rag_service import RAGService
+    from app.services.vector_service import vector_service
+
+    rag = RAGService()
+    rag.settings.update(
+        {
+            "llm_provider": llm_provider,
+            "retrieval_mode": args.retrieval_mode,
+            "vector_threshold": args.vector_threshold,
+            "keyword_threshold": args.keyword_threshold,
+            "vector_weight": args.vector_weight,
+            "top_n": max(ks),
+        }
+    )
+    # 预热一次，排除模型首次加载对延迟统计的影响
+    rag.retrieve(kb["id"], queries[0]["question"])
+    result = replay(rag, kb["id"], queries * args.repeat, ks, not args.no_answer)
+
+    report = {
+        "benchmark": "retrieval",
+        "environment": common.environment_info(),
+        "config": {
+            "chunk_size": args.chunk_size,
+            "chunk_overlap": args.chunk_overlap,
+            "retrieval_mode": args.retrieval_mode,
+            "vector_threshold": args.vector_threshold,
+            "keyword_threshold": args.keyword_threshold,
+            "vector_weight": args.vector_weight,
+            "k": ks,
+            "vectordb": type(getattr(vector_service, "inner", vector_service)).__name__,
+            "embedding_model": rag.settings.get("embedding_model_name"),
+            "llm_provider": llm_provider,
+        },
+        "corpus": {
+            "documents": len(doc_names),
+            "queries": len(queries) * args.repeat,
+            "source": args.corpus_dir or f"synthetic(seed={args.seed})",
+        },
+        "workdir": str(workdir),
+        **result,
+    }
+    common.write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+"""
+向量数据库后端基准测试
+把同一份 N 个分块的合成语料分别写入每个可用的 VectorDBInterface 实现（chroma / local / milvus），测量：
+写入吞吐、按 doc_id 删除的延迟、多个 k 下无过滤 / 按 doc_id 过滤检索的 p50/p99 与 recall@k、
+内存与磁盘占用、冷启动耗时（新进程打开已有数据并完成第一次检索）
+
+每个后端在独立的子进程中运行，内存互不影响；冷启动在另一个新进程中测量。
+只测向量库本身：向量为固定种子生成的带簇结构合成向量，不经过 Embedding 模型。
+Milvus 默认使用 Milvus Lite（本地文件，需要安装 milvus-lite），也可以通过 --milvus-uri 指向独立部署的 Milvus；
+两者都不可用时跳过并在报告中注明原因
+
+JSON 报告输出到 --output（默认标准输出），对比表格（Markdown）输出到 --markdown（默认标准错误）
+
+使用示例:
+    python -m benchmarks.vectordb_bench
+    python -m benchmarks.vectordb_bench --chunks 100000 --dim 768 --k 1,10,50 --markdown capacity.md
+    python -m benchmarks.vectordb_bench --backends chroma,milvus --milvus-uri http://localhost:19530
+"""
+
+# 导入命令行参数解析模块
+import argparse
+
+# 导入 JSON 模块
+import json
+
+# 导入操作系统相关模块
+import os
+
+# 导入子进程模块
+import subprocess
+
+# 导入系统模块
+import sys
+
+# 导入时间模块
+import time
+
+# 导入 uuid 模块，用于生成远程 Milvus 的临时集合名
+import uuid
+
+# 导入 Path 处理路径
+from pathlib import Path
+
+# 导入类型注解
+from typing import List, Optional
+
+# 导入基准测试公共工具
+from benchmarks import common
+
+# 导入合成向量生成函数
+from benchmarks.compression_eval import build_vectors
+
+# 支持的后端
+BACKENDS = ["chroma", "local", "milvus"]
+
+# 基准集合名
+COLLECTION = "bench_vectors"
+
+
+# 只返回固定维度零向量的 Embeddings，后端初始化时需要但基准不会调用
+def _install_null_embeddings(dim: int):
+    """替换 EmbeddingFactory，避免后端初始化时加载真实模型"""
+    from langchain_core.embeddings import Embeddings
+    from app.utils.embedding_factory import EmbeddingFactory
+
+    class _NullEmbeddings(Embeddings):
+        def embed_documents(self, texts):
+            return [[0.0] * dim for _ in texts]
+
+        def embed_query(self, text):
+            return [0.0] * dim
+
+    EmbeddingFactory.create_embeddings = staticmethod(lambda: _NullEmbeddings())
+
+
+# 生成语料
+def build_corpus(chunks: int, dim: int, chunks_per_doc: int, text_bytes: int, seed: int):
+    """
+    生成合成语料：归一化向量、分块文本和 doc_id/chunk_index 元数据
+    Args:
+        chunks: 分块数量
+        dim: 向量维度
+        chunks_per_doc: 每个文档的分块数
+        text_bytes: 每个分块文本的长度
+        seed: 随机种子
+
+    Returns:
+        (ids, texts, vectors, metadatas)
+    """
+    import numpy as np
+
+    vectors = build_vectors(chunks, dim, max(1, chunks // 100), seed)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids, texts, metadatas = [], [], []
+    filler = "向量数据库基准测试分块内容。" * (text_bytes // 14 + 1)
+    for i in range(chunks):
+        doc_id = f"doc_{i // chunks_per_doc:06d}"
+        chunk_index = i % chunks_per_doc
+        ids.append(f"{doc_id}_{chunk_index}")
+        texts.append(f"{doc_id}#{chunk_index} {filler[:text_bytes]}")
+        metadatas.append({"doc_id": doc_id, "chunk_index": chunk_index, "kb_id": "bench"})
+    return ids, texts, vectors, metadatas
+
+
+# 生成查询向量
+def build_queries(vectors, count: int, seed: int):
+    """在语料向量上叠加噪声生成查询向量（归一化）"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed + 1)
+    picked = vectors[rng.integers(0, len(vectors), count)]
+    queries = picked + 0.05 * rng.normal(size=picked.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+# 进程及其子进程的当前常驻内存
+def tree_rss_mb(pid: Optional[int] = None) -> float:
+    """
+    返回进程树（含 Milvus Lite 等子进程）的当前常驻内存（MB），
+    没有 /proc 的平台退化为当前进程的峰值内存
+    """
+    pid = pid or os.getpid()
+    if not os.path.exists(f"/proc/{pid}/status"):
+        return common.peak_rss_mb()
+    total_kb = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+                        break
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return round(total_kb / 1024, 1)
+
+
+# 目录或文件的磁盘占用
+def disk_usage_mb(path: Optional[str]) -> Optional[float]:
+    """统计路径下全部文件的实际占用（MB），远程后端返回 None"""
+    if not path or not os.path.exists(path):
+        return None
+    paths = [Path(path)] if os.path.isfile(path) else Path(path).rglob("*")
+    total = 0
+    for item in paths:
+        try:
+            if item.is_file():
+                stat = item.stat()
+                # 稀疏文件按实际分配的块计算
+                total += min(stat.st_size, getattr(stat, "st_blocks", 0) * 512 or stat.st_size)
+        except OSError:
+            continue
+    return round(total / 1024 / 1024, 1)
+
+
+# 按后端名称创建实例
+def open_backend(name: str, workdir: Path, milvus_uri: Optional[str]):
+    """
+    创建后端实例
+    Returns:
+        (后端实例, 数据路径)，远程 Milvus 的数据路径为 None
+    """
+    if name == "chroma":
+        from app.services.vectordb.chroma import ChromaVectorDB
+
+        path = str(workdir / "chroma_db")
+        return ChromaVectorDB(persist_directory=path), path
+    if name == "local":
+        from app.services.vectordb.local import LocalVectorDB
+
+        path = str(workdir / "local_vectordb")
+        return LocalVectorDB(persist_directory=path), path
+    if name == "milvus":
+        from app.services.vectordb.milvus import MilvusVectorDB
+
+        if milvus_uri:
+            return MilvusVectorDB({"uri": milvus_uri}), None
+        path = str(workdir / "milvus.db")
+        return MilvusVectorDB({"uri": path}), path
+    raise ValueError(f"不支持的向量数据库类型: {name}")
+
+
+# 检查后端是否可用
+def unavailable_reason(name: str, milvus_uri: Optional[str]) -> Optional[str]:
+    """返回后端不可用的原因，可用时返回 None"""
+    if name == "milvus" and not milvus_uri:
+        try:
+            import milvus_lite  # noqa: F401
+        except ImportError:
+            return "未安装 milvus-lite 且未指定 --milvus-uri"
+    return None
+
+
+# 暴力检索的真实近邻
+def exact_neighbors(vectors, alive, queries, k: int):
+    """在未删除的向量上计算精确 top-k（内积），返回每个查询的行号集合"""
+    import numpy as np
+
+    scores = queries @ vectors[alive].T
+    rows = np.flatnonzero(alive)
+    top = np.argsort(-scores, axis=1)[:, :k]
+    return [set(rows[line].tolist()) for line in top]
+
+
+# 子进程：写入、检索、删除
+def run_load(args) -> dict:
+    """在当前进程中对一个后端执行写入、检索、删除测量"""
+    import numpy as np
+
+    workdir = common.bootstrap(args.workdir)
+    _install_null_embeddings(args.dim)
+    ids, texts, vectors, metadatas = build_corpus(
+        args.chunks, args.dim, args.chunks_per_doc, args.text_bytes, args.seed
+    )
+    queries = build_queries(vectors, args.queries, args.seed)
+    ks = [int(k) for k in args.k.split(",")]
+    rng = np.random.default_rng(args.seed + 2)
+    doc_ids = sorted({metadata["doc_id"] for metadata in metadatas})
+    rss_before = tree_rss_mb()
+
+    samples = {}
+    db, path = open_backend(args.backend, workdir, args.milvus_uri)
+
+    # 写入：按批调用 add_embeddings
+    start = time.perf_counter()
+    for offset in range(0, len(ids), args.batch_size):
+        end = offset + args.batch_size
+        with common.timed(samples, "insert_batch"):
+            db.add_embeddings(
+                args.collection,
+                texts[offset:end],
+                vectors[offset:end].tolist(),
+                metadatas[offset:end],
+                ids[offset:end],
+            )
+    insert_seconds = time.perf_counter() - start
+    result = {
+        "chunks": len(ids),
+        "insert_seconds": round(insert_seconds, 3),
+        "insert_chunks_per_second": round(len(ids) / insert_seconds, 1),
+        "insert_batch_ms": common.summarize(samples.pop("insert_batch")),
+    }
+    # 本地后端的 HNSW 由后台合并线程构建，这里显式执行一次，保证检索测的是稳态
+    if args.backend == "local":
+        with common.timed(samples, "index_build"):
+            db.compact(args.collection)
+        result["index_build_ms"] = round(samples.pop("index_build")[0], 1)
+        result["local_stats"] = db.stats(args.collection)
+
+    # 检索：无过滤与按 doc_id 过滤，每个 k 单独统计
+    alive = np.ones(len(ids), dtype=bool)
+    result["query"] = {}
+    for k in ks:
+        truth = exact_neighbors(vectors, alive, queries, k)
+        hits = 0
+        for line, query in enumerate(queries.tolist()):
+            with common.timed(samples, "unfiltered"):
+                found = db.similarity_search_by_vector_with_score(args.collection, query, k=k)
+            # 文档 ID 在各后端的存放位置不同，这里通过元数据还原行号
+            rows = {
+                int(metadata["chunk_index"]) + int(metadata["doc_id"][4:]) * args.chunks_per_doc
+                for metadata in (doc.metadata for doc, _ in found)
+            }
+            hits += len(rows & truth[line])
+        for query in queries.tolist():
+            doc_filter = {"doc_id": doc_ids[int(rng.integers(0, len(doc_ids)))]}
+            with common.timed(samples, "filtered"):
+                db.similarity_search_by_vector_with_score(
+                    args.collection, query, k=k, filter=doc_filter
+                )
+        result["query"][str(k)] = {
+            "unfiltered_ms": common.summarize(samples.pop("unfiltered")),
+            "filtered_ms": common.summarize(samples.pop("filtered")),
+            "recall": round(hits / (len(queries) * k), 4),
+        }
+    result["rss_mb"] = tree_rss_mb()
+    result["rss_delta_mb"] = round(result["rss_mb"] - rss_before, 1)
+
+    # 删除：按 doc_id 删除末尾的若干文档，并确认删除后不可见
+    deleted = doc_ids[-min(args.deletes, len(doc_ids) - 1):] if len(doc_ids) > 1 else []
+    leaked = 0
+    for doc_id in deleted:
+        with common.timed(samples, "delete"):
+            db.delete_documents(args.collection, filter={"doc_id": doc_id})
+        leaked += len(
+            db.similarity_search_by_vector_with_score(
+                args.collection, queries[0].tolist(), k=1, filter={"doc_id": doc_id}
+            )
+        )
+    result["delete_by_doc_id_ms"] = common.summarize(samples.pop("delete", []))
+    result["deleted_docs"] = len(deleted)
+    result["deleted_still_visible"] = leaked
+    result["disk_mb"] = disk_usage_mb(path)
+    return result
+
+
+# 子进程：冷启动
+def run_cold(args) -> dict:
+    """新进程打开已有数据，测量初始化与第一次检索的耗时"""
+    workdir = common.bootstrap(args.workdir)
+    _install_null_embeddings(args.dim)
+    _, _, vectors, _ = build_corpus(1, args.dim, 1, 1, args.seed)
+    query = build_queries(vectors, 1, args.seed)[0].tolist()
+    samples = {}
+    with common.timed(samples, "open"):
+        db, _ = open_backend(args.backend, workdir, args.milvus_uri)
+    with common.timed(samples, "first_query"):
+        db.similarity_search_by_vector_with_score(args.collection, query, k=10)
+    for _ in range(20):
+        with common.timed(samples, "warm_query"):
+            db.similarity_search_by_vector_with_score(args.collection, query, k=10)
+    result = {
+        "open_ms": round(samples["open"][0], 1),
+        "first_query_ms": round(samples["first_query"][0], 1),
+        "warm_query_p50_ms": common.summarize(samples["warm_query"])["p50"],
+    }
+    result["cold_start_ms"] = round(result["open_ms"] + result["first_query_ms"], 1)
+    # 远程 Milvus 的临时集合用完即删
+    if args.backend == "milvus" and args.milvus_uri:
+        try:
+            from pymilvus import MilvusClient
+
+            MilvusClient(uri=args.milvus_uri).drop_collection(args.collection)
+        except Exception as e:
+            result["cleanup_error"] = str(e)
+    return result
+
+
+# 在子进程中运行一个阶段
+def spawn(args, backend: str, phase: str, workdir: Path, collection: str) -> dict:
+    """以子进程运行 --phase，返回其 JSON 结果；失败时返回错误信息"""
+    result_file = workdir / f"{backend}_{phase}.json"
+    command = [
+        sys.executable, "-m", "benchmarks.vectordb_bench",
+        "--phase", phase,
+        "--backend", backend,
+        "--workdir", str(workdir / backend),
+        "--collection", collection,
+        "--result-file", str(result_file),
+        "--chunks", str(args.chunks),
+        "--chunks-per-doc", str(args.chunks_per_doc),
+        "--text-bytes", str(args.text_bytes),
+        "--dim", str(args.dim),
+        "--batch-size", str(args.batch_size),
+        "--k", args.k,
+        "--queries", str(args.queries),
+        "--deletes", str(args.deletes),
+        "--seed", str(args.seed),
+    ]
+    if args.milvus_uri:
+        command += ["--milvus-uri", args.milvus_uri]
+    completed = subprocess.run(
+        command, cwd=common.ROOT_DIR, capture_output=True, text=True, timeout=args.timeout
+    )
+    if completed.returncode != 0 or not result_file.exists():
+        return {"error": (completed.stderr or completed.stdout).strip().splitlines()[-5:]}
+    return json.loads(result_file.read_text(encoding="utf-8"))
+
+
+# 生成对比表格
+def render_markdown(report: dict) -> str:
+    """把报告整理成可直接贴到容量规划文档中的 Markdown 表格"""
+    config = report["config"]
+    lines = [
+        f"向量数据库后端对比：{config['chunks']} 个分块，{config['dim']} 维，"
+        f"每文档 {config['chunks_per_doc']} 块，{config['queries']} 次查询",
+        "",
+        "| 后端 | 写入 (块/秒) | 删除 doc p50/p99 (ms) | 内存 (MB) | 磁盘 (MB) | 冷启动 (ms) | 备注 |",
+        "| --- | ---: | ---: | ---: | ---: | ---: | --- |",
+    ]
+    details = [
+        "",
+        "| 后端 | k | 无过滤 p50/p99 (ms) | 过滤 p50/p99 (ms) | recall@k |",
+        "| --- | ---: | ---: | ---: | ---: |",
+    ]
+    for backend, result in report["results"].items():
+        if "skipped" in result or "error" in result:
+            note = result.get("skipped") or "失败: " + " ".join(result["error"])[-200:]
+            lines.append(f"| {backend} | - | - | - | - | - | {note} |")
+            continue
+        delete = result["delete_by_doc_id_ms"]
+        cold = result.get("cold_start", {})
+        notes = []
+        if result.get("local_stats", {}).get("hnsw_upto_seq") is not None:
+            notes.append(f"HNSW 构建 {result['index_build_ms']} ms")
+        elif "local_stats" in result:
+            notes.append("低于 HNSW 阈值，精确检索")
+        if result["deleted_still_visible"]:
+            notes.append(f"删除后仍可见 {result['deleted_still_visible']} 条")
+        if "error" in cold:
+            notes.append("冷启动失败")
+        lines.append(
+            f"| {backend} | {result['insert_chunks_per_second']} "
+            f"| {delete.get('p50', '-')}/{delete.get('p99', '-')} "
+            f"| {result['rss_delta_mb']} | {result['disk_mb'] if result['disk_mb'] is not None else '-'} "
+            f"| {cold.get('cold_start_ms', '-')} | {'; '.join(notes)} |"
+        )
+        for k, query in result["query"].items():
+            details.append(
+                f"| {backend} | {k} "
+                f"| {query['unfiltered_ms']['p50']}/{query['unfiltered_ms']['p99']} "
+                f"| {query['filtered_ms']['p50']}/{query['filtered_ms']['p99']} "
+                f"| {query['recall']} |"
+            )
+    return "\n".join(lines + details) + "\n"
+
+
+# 命令行入口
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RAG Lite 向量数据库后端基准测试")
+    parser.add_argument("--workdir", help="工作目录（默认临时目录）")
+    parser.add_argument("--output", help="JSON 报告输出路径（默认打印到标准输出）")
+    parser.add_argument("--markdown", help="Markdown 对比表格输出路径（默认打印到标准错误）")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="逗号分隔的后端列表")
+    parser.add_argument("--chunks", type=int, default=20000, help="语料分块数量")
+    parser.add_argument("--chunks-per-doc", type=int, default=50, help="每个文档的分块数")
+    parser.add_argument("--text-bytes", type=int, default=500, help="每个分块文本的长度")
+    parser.add_argument("--dim", type=int, default=384, help="向量维度")
+    parser.add_argument("--batch-size", type=int, default=500, help="每次 add_embeddings 的分块数")
+    parser.add_argument("--k", default="1,10,50", help="逗号分隔的检索 top-k")
+    parser.add_argument("--queries", type=int, default=200, help="每个 k 的查询次数")
+    parser.add_argument("--deletes", type=int, default=20, help="按 doc_id 删除的文档数")
+    parser.add_argument("--milvus-uri", help="独立部署的 Milvus 地址（默认使用 Milvus Lite 本地文件）")
+    parser.add_argument("--seed", type=int, default=7, help="随机种子")
+    parser.add_argument("--timeout", type=int, default=3600, help="单个后端子进程的超时（秒）")
+    # 以下参数供子进程使用
+    parser.add_argument("--phase", choices=["load", "cold"], help=argparse.SUPPRESS)
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    parser.add_argument("--collection", default=COLLECTION, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    # 子进程：执行单个阶段并把结果写入文件
+    if args.phase:
+        result = run_load(args) if args.phase == "load" else run_cold(args)
+        Path(args.result_file).write_text(json.dumps(result, ensure_ascii=False), encoding="utf-8")
+        return
+
+    workdir = common.bootstrap(args.workdir)
+    backends: List[str] = [name.strip() for name in args.backends.split(",") if name.strip()]
+    results = {}
+    for backend in backends:
+        if backend not in BACKENDS:
+            raise SystemExit(f"不支持的后端: {backend}（可选 {', '.join(BACKENDS)}）")
+        reason = unavailable_reason(backend, args.milvus_uri)
+        if reason:
+            results[backend] = {"skipped": reason}
+            continue
+        # 远程 Milvus 使用一次性集合名，避免覆盖已有数据
+        collection = COLLECTION
+        if backend == "milvus" and args.milvus_uri:
+            collection = f"{COLLECTION}_{uuid.uuid4().hex[:8]}"
+        print(f"[vectordb_bench] {backend}: 写入与检索 ...", file=sys.stderr)
+        results[backend] = spawn(args, backend, "load", workdir, collection)
+        if "error" not in results[backend]:
+            print(f"[vectordb_bench] {backend}: 冷启动 ...", file=sys.stderr)
+            results[backend]["cold_start"] = spawn(args, backend, "cold", workdir, collection)
+
+    report = {
+        "benchmark": "vectordb",
+        "environment": common.environment_info(),
+        "config": {
+            "backends": backends,
+            "chunks": args.chunks,
+            "chunks_per_doc": args.chunks_per_doc,
+            "text_bytes": args.text_bytes,
+            "dim": args.dim,
+            "batch_size": args.batch_size,
+            "k": [int(k) for k in args.k.split(",")],
+            "queries": args.queries,
+            "deletes": args.deletes,
+            "milvus": args.milvus_uri or "milvus-lite",
+            "seed": args.seed,
+        },
+        "workdir": str(workdir),
+        "results": results,
+    }
+    common.write_report(report, args.output)
+    table = render_markdown(report)
+    if args.markdown:
+        Path(args.markdown).write_text(table, encoding="utf-8")
+    else:
+        print(table, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+gunicorn 配置
+多 worker 部署时启用 Prometheus 多进程指标聚合
+
+使用示例:
+    rm -rf /tmp/rag_lite_metrics && mkdir -p /tmp/rag_lite_metrics
+    PROMETHEUS_MULTIPROC_DIR=/tmp/rag_lite_metrics gunicorn -c gunicorn.conf.py "app:create_app()"
+"""
+
+# 导入操作系统模块
+import os
+
+# 监听地址
+bind = f"{os.environ.get('APP_HOST', '0.0.0.0')}:{os.environ.get('APP_PORT', 5000)}"
+# worker 数量
+workers = int(os.environ.get("GUNICORN_WORKERS", 4))
+# 使用线程 worker，保证 SSE 流式响应不阻塞其他请求
+worker_class = "gthread"
+# 每个 worker 的线程数
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+# 流式问答可能持续较长时间
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 300))
+
+
+# worker 退出时清理其多进程指标
+def child_exit(server, worker):
+    from app.utils.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)